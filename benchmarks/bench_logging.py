@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+''' Per call cost of the log calls on a disabled level.
+
+    Usage: python benchmarks/bench_logging.py [-n CALLS]
+'''
+import argparse
+import inspect
+import logging
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from binaryaudit import util  # noqa: E402
+
+
+class eager_logger:
+    ''' The previous wrapper, caller lookup and formatting done on every call.
+    '''
+    def __init__(self, name):
+        self.logger = logging.getLogger(name)
+
+    def debug(self, *args):
+        frameinfo = inspect.getouterframes(inspect.currentframe())
+        (frame, source, lineno, func, lines, index) = frameinfo[1]
+        caller_log = "%s:%s::" % (func, lineno)
+        self.logger.debug(caller_log + "".join(args))
+
+
+def bench(label, stmt, number):
+    usec = min(timeit.repeat(stmt, number=number, repeat=5)) / number * 1000000
+    print("{:<40} {:10.3f} usec/call".format(label, usec))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("-n", type=int, default=100000, help="calls per round")
+    args = parser.parse_args()
+    number = args.n
+
+    logging.basicConfig()
+    util.setup_log()
+    util.set_verbosity(False)
+    eager = eager_logger("binaryaudit.bench")
+    eager.logger.setLevel(logging.WARN)
+    cmd = ["abidiff", "--drop-private-types", "a.xml", "b.xml"]
+
+    print("DEBUG disabled, {} calls per round".format(number))
+    bench("eager, inspect + format()", lambda: eager.debug("command: {}".format(cmd)), number // 10)
+    bench("lazy, level guard + %-args", lambda: util.debug("command: %s", cmd), number)
+    bench("lazy, guarded by util.is_debug()", lambda: util.is_debug() and util.debug("command: %s", cmd), number)
+
+
+if __name__ == "__main__":
+    main()
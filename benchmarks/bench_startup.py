@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+''' Startup cost of the ELF checks run from the build hooks.
+
+    Measures the import time of "binaryaudit --is-elf" with python -X importtime
+    against a budget, and the per file cost of one process per file versus the
+    batch mode. Exits non-zero if the budget is exceeded.
+
+    Usage: python benchmarks/bench_startup.py [--budget MSEC] [-n FILES]
+'''
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+BIN = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "bin", "binaryaudit"))
+# Imported by the interpreter itself, not part of the budget.
+INTERPRETER_MODULES = ("site", "encodings", "_frozen_importlib_external", "zipimport", "codecs", "io", "abc")
+# Only the binaryaudit imports and what they pull in count.
+BUDGET_MSEC_DEFAULT = 60
+
+
+def import_times(cmd):
+    ''' Returns the cumulative import time in microseconds of each top level import.
+    '''
+    p = subprocess.run([sys.executable, "-X", "importtime"] + cmd, stdout=subprocess.DEVNULL,
+                       stderr=subprocess.PIPE, check=True)
+    times = {}
+    for ln in p.stderr.decode("utf-8").splitlines():
+        if not ln.startswith("import time:") or "cumulative" in ln:
+            continue
+        self_us, cumulative, name = ln[len("import time:"):].split("|")
+        # Nested imports are indented.
+        if name.startswith("  ") or name.strip() in INTERPRETER_MODULES:
+            continue
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def bench_processes(fn, n):
+    t0 = time.monotonic()
+    for i in range(n):
+        subprocess.run([sys.executable, BIN, "--is-elf", fn], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return (time.monotonic() - t0) / n
+
+
+def bench_batch(fn, n):
+    t0 = time.monotonic()
+    subprocess.run([sys.executable, BIN, "elf"], input=(fn + "\n") * n, stdout=subprocess.DEVNULL,
+                   check=True, universal_newlines=True)
+    return (time.monotonic() - t0) / n
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--budget", type=float, default=BUDGET_MSEC_DEFAULT, help="import budget in milliseconds")
+    parser.add_argument("-n", type=int, default=200, help="files to classify")
+    args = parser.parse_args()
+
+    # The best of a few runs, the first one warms the page cache.
+    runs = [import_times([BIN, "--is-elf", sys.executable]) for i in range(5)]
+    best = min(runs, key=lambda t: sum(t.values()))
+    total = sum(best.values()) / 1000
+    for name, us in sorted(best.items(), key=lambda i: -i[1])[:8]:
+        print("{:<40} {:8.1f} msec".format(name, us / 1000))
+    print("{:<40} {:8.1f} msec, budget {:.1f} msec".format("total", total, args.budget))
+
+    per_process = bench_processes(sys.executable, min(args.n, 50))
+    per_line = bench_batch(sys.executable, args.n)
+    print("{:<40} {:8.3f} msec/file".format("--is-elf, one process per file", per_process * 1000))
+    print("{:<40} {:8.3f} msec/file".format("elf, batch", per_line * 1000))
+    return 0 if total <= args.budget else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
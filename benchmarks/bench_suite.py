@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+''' Stage timings of binaryaudit on synthetic inputs, checked against stored baselines.
+
+    The libabigail tools and dnf are stubs with a configurable latency, the
+    packages are fetched from a local HTTP repo and the DB is SQLite, so the
+    timings are the overhead of binaryaudit itself plus the configured tool
+    latency. The time spent in the tool runs and the repo queries is taken
+    from the trace spans and reported apart.
+
+    A stage regresses when it's slower than its baseline by more than the
+    tolerance, or when it runs a tool more often. The timings of a baseline
+    only hold for the machine it was recorded on, save one there with
+    --save-baseline. The tool call counts hold everywhere.
+
+    Usage: python benchmarks/bench_suite.py [--stage NAME]... [--scale F] [--save-baseline]
+'''
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from binaryaudit import abicheck  # noqa: E402
+from binaryaudit import cli  # noqa: E402
+from binaryaudit import db  # noqa: E402
+from binaryaudit import dnf  # noqa: E402
+from binaryaudit import poky  # noqa: E402
+from binaryaudit import trace  # noqa: E402
+from binaryaudit import util  # noqa: E402
+import synth  # noqa: E402
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_FN = os.path.join(BENCH_DIR, "baselines.json")
+BASELINE_VERSION = 1
+DB_SCHEMA_FN = os.path.join(BENCH_DIR, "..", "tests", "data", "db_schema.sql")
+# Slower than the baseline by this fraction is a regression.
+TOLERANCE_DEFAULT = 0.25
+
+# The input sizes at scale 1.
+SIZES = {
+    "image_dsos": 200,
+    "rpm_groups": 40,
+    "rpm_payload": 64 * 1024,
+    "rpm_changed": 4,
+    "recipes": 100,
+    "recipe_dsos": 4,
+    "recipes_changed": 10,
+    "functions": 50,
+    "db_rows": 500,
+}
+# The sizes of an item, not scaled.
+ITEM_SIZES = ("rpm_payload", "recipe_dsos", "functions")
+# The trace categories of the time spent outside of binaryaudit.
+EXTERNAL_CATEGORIES = ("tool", "repo")
+
+
+class context:
+    ''' The generated inputs and the environment of the stages.
+    '''
+    def __init__(self, work_dir, scale, latency, jobs):
+        self.work_dir = work_dir
+        self.jobs = jobs
+        self.sizes = dict((k, v if k in ITEM_SIZES else max(1, int(v * scale))) for k, v in SIZES.items())
+        self.image_dir = os.path.join(work_dir, "image")
+        self.rpm_dir = os.path.join(work_dir, "rpms")
+        self.repo_dir = os.path.join(work_dir, "repo")
+        self.bh_base = os.path.join(work_dir, "buildhistory-base")
+        self.bh_cur = os.path.join(work_dir, "buildhistory-cur")
+        self.tool_log = os.path.join(work_dir, "tools.log")
+        self.repo = None
+        self.db_conn = None
+        self.env = {
+            "PATH": synth.write_tools(os.path.join(work_dir, "bin")) + os.pathsep + os.environ["PATH"],
+            # The history and the caches go into the work dir, every run starts cold.
+            "HOME": os.path.join(work_dir, "home"),
+            "BENCH_TOOL_LATENCY": str(latency),
+            "BENCH_TOOL_LOG": self.tool_log,
+            "BENCH_ABI_CHANGES": os.path.join(work_dir, "abi_changes"),
+            "BENCH_REPO_DIR": self.repo_dir,
+        }
+        os.environ.update(self.env)
+
+    def path(self, *names):
+        return os.path.join(self.work_dir, *names)
+
+    def fresh_dir(self, name):
+        d = self.path(name)
+        shutil.rmtree(d, ignore_errors=True)
+        os.makedirs(d)
+        return d
+
+    def close(self):
+        if self.repo is not None:
+            self.repo.close()
+        if self.db_conn is not None:
+            self.db_conn.close()
+
+
+def setup_serialize(ctx):
+    if not os.path.isdir(ctx.image_dir):
+        synth.image_tree(ctx.image_dir, ctx.sizes["image_dsos"], ctx.sizes["functions"])
+
+
+def stage_serialize(ctx):
+    adir = ctx.fresh_dir("abixml")
+    count = 0
+    for out, out_fn in abicheck.serialize_artifacts(adir, ctx.image_dir):
+        with open(out_fn, "w") as f:
+            f.write(out)
+        count += 1
+    return count
+
+
+def setup_rpms(ctx):
+    if os.path.isdir(ctx.rpm_dir):
+        return
+    s = ctx.sizes
+    synth.rpm_set(ctx.repo_dir, s["rpm_groups"], s["rpm_payload"], "1.0", seed=1)
+    changes = synth.rpm_set(ctx.rpm_dir, s["rpm_groups"], s["rpm_payload"], "1.1", s["rpm_changed"], seed=2)
+    with open(ctx.env["BENCH_ABI_CHANGES"], "w") as f:
+        f.write("".join(fn + "\n" for fn in changes))
+
+
+def stage_rpm_index(ctx):
+    return abicheck.generate_package_json(ctx.rpm_dir, ctx.path("new.json"))
+
+
+def setup_downloads(ctx):
+    setup_rpms(ctx)
+    if ctx.repo is None:
+        ctx.repo = synth.http_repo(ctx.repo_dir)
+        os.environ["BENCH_REPO_URL"] = ctx.repo.url
+    ctx.remaining = abicheck.generate_package_json(ctx.rpm_dir, ctx.path("new.json"))
+
+
+def stage_downloads(ctx):
+    out_dir = ctx.fresh_dir("abipkgdiff")
+    dnf.process_downloads(ctx.rpm_dir + "/", ctx.path("new.json"), ctx.path("old.json"), out_dir, "bench", 1, None,
+                          ctx.remaining, [], ctx.jobs)
+    with open(ctx.path("new.json"), "r") as f:
+        return len(json.load(f))
+
+
+def setup_poky(ctx):
+    if os.path.isdir(ctx.bh_cur):
+        return
+    s = ctx.sizes
+    synth.buildhistory(ctx.bh_base, s["recipes"], s["recipe_dsos"], s["functions"])
+    synth.buildhistory(ctx.bh_cur, s["recipes"], s["recipe_dsos"], s["functions"], s["recipes_changed"])
+
+
+def stage_poky(ctx):
+    out_dir = ctx.fresh_dir("poky-out")
+    poky.args = cli.arg_parser.parse_args(["poky", "--compare-buildhistory", "--buildhistory-baseline", ctx.bh_base,
+                                           "--buildhistory-current", ctx.bh_cur, "-o", out_dir,
+                                           "-j", str(ctx.jobs)])
+    try:
+        poky.compare_buildhistory([], None)
+    except SystemExit:
+        # The exit status is the ABI verdict of the run.
+        pass
+    return ctx.sizes["recipes"]
+
+
+def setup_db(ctx):
+    if ctx.db_conn is not None:
+        return
+    db_fn = ctx.path("binaryaudit.sqlite")
+    with open(DB_SCHEMA_FN, "r") as f:
+        schema = f.read()
+    conn = sqlite3.connect(db_fn)
+    conn.executescript(schema)
+    conn.close()
+    config_fn = ctx.path("db_config")
+    with open(config_fn, "w") as f:
+        f.write("DriverName=sqlite\nDatabase={}\n".format(db_fn))
+    ctx.db_conn = db.wrapper(config_fn, util.logger)
+    ctx.db_conn.initialize_db()
+    ctx.db_runs = 0
+
+
+def stage_db(ctx):
+    ''' A run's worth of DB traffic: the results, their reports and the verdicts.
+    '''
+    c = ctx.db_conn
+    ctx.db_runs += 1
+    build_id = "bench-{}".format(ctx.db_runs)
+    prod_id = c.get_product_id("bench", "synthetic")
+    c.insert_main_transaction(build_id, prod_id)
+    rows = ctx.sizes["db_rows"]
+    report = "Functions changes summary: 0 Removed, 1 Changed, 0 Added function\n" * 32
+    for i in range(rows):
+        changed = 0 == i % 8
+        c.insert_ba_transaction_details(build_id, prod_id, "item{}".format(i), "1.0", "1.1", 1000,
+                                        "CHANGE" if changed else "OK", report if changed else "")
+        key = "{}-{}".format(build_id, i)
+        c.insert_verdict(key, "b{}".format(i), "c{}".format(i), "s", "bench", 4 if changed else 0,
+                         report if changed else "")
+    c.get_verdicts(["{}-{}".format(build_id, i) for i in range(rows)])
+    c.get_ba_transaction_details(build_id, prod_id)
+    c.update_ba_test_result(build_id, prod_id, "passed")
+    return rows
+
+
+# name -> (setup, stage, what an item is)
+STAGES = {
+    "serialize": (setup_serialize, stage_serialize, "DSO"),
+    "rpm_index": (setup_rpms, stage_rpm_index, "package"),
+    "downloads": (setup_downloads, stage_downloads, "group"),
+    "poky": (setup_poky, stage_poky, "recipe"),
+    "db": (setup_db, stage_db, "row"),
+}
+
+
+def run_stage(ctx, name, repeat):
+    ''' Runs a stage repeat times and returns the result of the fastest run.
+    '''
+    setup, stage, unit = STAGES[name]
+    setup(ctx)
+    best = None
+    for i in range(repeat):
+        open(ctx.tool_log, "w").close()
+        tracer = trace.enable()
+        t0 = time.monotonic()
+        items = stage(ctx)
+        msec = (time.monotonic() - t0) * 1000
+        trace.disable()
+        spans = {}
+        external_msec = .0
+        for ev in tracer.drain()[0]:
+            cats = ev["cat"].split(",")
+            # The scheduler names the job spans after their items.
+            span = "jobs" if "job" in cats else ev["name"]
+            spans[span] = spans.get(span, 0) + ev["dur"] / 1000
+            if any(c in EXTERNAL_CATEGORIES for c in cats):
+                external_msec += ev["dur"] / 1000
+        res = {"msec": msec, "items": items, "external_msec": external_msec, "spans": spans,
+               "calls": synth.count_tool_calls(ctx.tool_log)}
+        if best is None or msec < best["msec"]:
+            best = res
+    best["unit"] = unit
+    return best
+
+
+def compare(results, baseline, tolerance):
+    ''' Returns the regressions of the results against the baseline stages.
+    '''
+    regressions = []
+    for name, res in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print("{:<10} no baseline".format(name))
+            continue
+        limit = base["msec"] * (1 + tolerance)
+        change = (res["msec"] / base["msec"] - 1) * 100 if base["msec"] else .0
+        print("{:<10} {:10.1f} msec, baseline {:.1f} msec, {:+.1f}%".format(name, res["msec"], base["msec"], change))
+        if res["msec"] > limit:
+            regressions.append("{}: {:.1f} msec exceeds {:.1f} msec".format(name, res["msec"], limit))
+        for tool, n in sorted(res["calls"].items()):
+            expected = base["calls"].get(tool, 0)
+            if n > expected:
+                regressions.append("{}: {} {} calls, {} in the baseline".format(name, n, tool, expected))
+    return regressions
+
+
+def load_baseline(fn):
+    try:
+        with open(fn, "r") as f:
+            data = json.load(f)
+    except OSError:
+        return None
+    if BASELINE_VERSION != data.get("version"):
+        return None
+    return data
+
+
+def save_baseline(fn, config, results):
+    stages = dict((name, {"msec": round(res["msec"], 1), "calls": res["calls"]}) for name, res in results.items())
+    data = load_baseline(fn)
+    if data is None or data["config"] != config:
+        data = {"version": BASELINE_VERSION, "config": config, "stages": {}}
+    data["stages"].update(stages)
+    with open(fn, "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def print_result(name, res, verbose):
+    per_item = res["msec"] / res["items"] if res["items"] else .0
+    calls = " ".join("{}={}".format(k, v) for k, v in sorted(res["calls"].items()))
+    print("{:<10} {:10.1f} msec {:8.3f} msec/{:<8} external {:8.1f} msec  {}".format(
+        name, res["msec"], per_item, res["unit"], res["external_msec"], calls))
+    if verbose:
+        for span, msec in sorted(res["spans"].items(), key=lambda s: -s[1]):
+            print("{:>14} {:10.1f} msec".format(span, msec))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--stage", action="append", choices=list(STAGES), help="stage to run, all by default")
+    parser.add_argument("--scale", type=float, default=1.0, help="input size factor")
+    parser.add_argument("--latency", type=float, default=0, help="seconds each tool call takes")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="jobs of the parallel stages")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per stage, the fastest counts")
+    parser.add_argument("--baseline", default=BASELINE_FN, help="baseline file")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE_DEFAULT,
+                        help="slowdown over the baseline tolerated, as a fraction")
+    parser.add_argument("--work-dir", help="keep the generated inputs there, reused by later runs")
+    parser.add_argument("-v", "--verbose", action="store_true", help="show the time per trace span")
+    args = parser.parse_args()
+
+    util.setup_log()
+    util.set_verbosity(False)
+    config = {"scale": args.scale, "latency": args.latency, "jobs": args.jobs}
+    tmp_dir = None
+    work_dir = args.work_dir
+    if work_dir is None:
+        tmp_dir = tempfile.TemporaryDirectory(prefix="binaryaudit-bench-")
+        work_dir = tmp_dir.name
+    ctx = context(os.path.abspath(work_dir), args.scale, args.latency, args.jobs)
+    results = {}
+    try:
+        for name in args.stage or list(STAGES):
+            results[name] = run_stage(ctx, name, args.repeat)
+            print_result(name, results[name], args.verbose)
+    finally:
+        ctx.close()
+        if tmp_dir is not None:
+            tmp_dir.cleanup()
+
+    if args.save_baseline:
+        save_baseline(args.baseline, config, results)
+        print("Baseline saved to '{}'".format(args.baseline))
+        return 0
+    baseline = load_baseline(args.baseline)
+    if baseline is None:
+        print("No baseline in '{}', save one with --save-baseline".format(args.baseline))
+        return 0
+    if baseline["config"] != config:
+        print("The baseline was recorded with {}, not comparing".format(baseline["config"]))
+        return 0
+    regressions = compare(results, baseline["stages"], args.tolerance)
+    for r in regressions:
+        print("REGRESSION " + r)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
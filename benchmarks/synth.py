@@ -0,0 +1,329 @@
+''' Synthetic inputs for the benchmarks: image trees, abixml corpora,
+    buildhistories and RPM sets, the stub libabigail and dnf tools, and a
+    local HTTP package repo.
+
+    The stub tools are shell scripts with a configurable latency, each call
+    is appended to a log so the benchmarks can count them. The environment
+    they read:
+
+        BENCH_TOOL_LATENCY  Seconds each tool call sleeps, "0" for none
+        BENCH_TOOL_LOG      File each call appends the tool name to
+        BENCH_ABI_CHANGES   Package files abipkgdiff reports a change for, one per line
+        BENCH_REPO_DIR      The directory served as the package repo
+        BENCH_REPO_URL      Its URL
+'''
+import gzip
+import http.server
+import io
+import os
+import random
+import stat
+import struct
+import threading
+
+from binaryaudit import abiindex
+
+# Marks the stub ELF files, the corpus abidw prints follows the header.
+_ELF_HEADER_SIZE = 64
+
+_TOOL_PROLOGUE = '''#!/bin/sh
+echo {name} >> "${{BENCH_TOOL_LOG:-/dev/null}}"
+[ "${{BENCH_TOOL_LATENCY:-0}}" = 0 ] || sleep "$BENCH_TOOL_LATENCY"
+'''
+
+TOOLS = {
+    # abidw [options] FILE: the corpus embedded in the stub ELF file.
+    "abidw": '''for f; do :; done
+tail -c +{offset} "$f"
+'''.format(offset=_ELF_HEADER_SIZE + 1),
+    # abidiff [--suppr FILE]... REF CUR
+    "abidiff": '''while [ $# -gt 2 ]; do shift; done
+cmp -s "$1" "$2" && exit 0
+echo "Functions changes summary: 0 Removed, 1 Changed, 0 Added function"
+exit 4
+''',
+    # abipkgdiff [--suppr|--d1|--d2|--devel1|--devel2 FILE]... OLD NEW
+    "abipkgdiff": '''pos=""
+while [ $# -gt 0 ]; do
+    case "$1" in
+        --*) shift 2;;
+        *) pos="$pos $1"; shift;;
+    esac
+done
+set -- $pos
+grep -qxF "$(basename "$2")" "${BENCH_ABI_CHANGES:-/dev/null}" || exit 0
+echo "Functions changes summary: 0 Removed, 1 Changed, 0 Added function"
+exit 4
+''',
+    # dnf repoquery --quiet [--location] --latest-limit=1 NAME
+    "dnf": '''loc=""
+for a; do
+    case "$a" in
+        --location) loc=1;;
+        -*|repoquery) ;;
+        *) name="$a";;
+    esac
+done
+fn=$(ls "$BENCH_REPO_DIR" | grep "^$name-[0-9]" | sort | tail -n 1)
+[ -n "$fn" ] || exit 0
+if [ -n "$loc" ]; then echo "$BENCH_REPO_URL/$fn"; else echo "$fn"; fi
+''',
+    # sudo docker run --rm IMAGE /usr/bin/dnf ARGS: the container is the host.
+    "sudo": '''exec "$@"
+''',
+    "docker": '''shift 3
+cmd=$(basename "$1")
+shift
+exec "$cmd" "$@"
+''',
+}
+
+
+def write_tools(bin_dir):
+    ''' Writes the stub tools, to be put first in PATH.
+    '''
+    os.makedirs(bin_dir, exist_ok=True)
+    for name, body in TOOLS.items():
+        fn = os.path.join(bin_dir, name)
+        # The log and the latency are for the tools the benchmarks measure, not the wrappers.
+        prologue = _TOOL_PROLOGUE.format(name=name) if name not in ("sudo", "docker") else "#!/bin/sh\n"
+        with open(fn, "w") as f:
+            f.write(prologue + body)
+        os.chmod(fn, os.stat(fn).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return bin_dir
+
+
+def count_tool_calls(log_fn):
+    ''' Returns the number of calls per tool recorded in the log.
+    '''
+    counts = {}
+    try:
+        with open(log_fn, "r") as f:
+            for ln in f:
+                counts[ln.strip()] = counts.get(ln.strip(), 0) + 1
+    except OSError:
+        pass
+    return counts
+
+
+def abixml(soname, functions, changed=0, seed=0):
+    ''' Returns an abixml corpus of a DSO.
+
+        Parameters:
+            soname (str): The soname of the DSO
+            functions (int): The number of exported functions, there's a struct per 4 of them
+            changed (int): The number of functions returning a different type, an ABI change
+            seed (int): Varies the declaration lines
+    '''
+    rnd = random.Random(seed)
+    prefix = soname.split(".")[0]
+    out = ["<abi-corpus version='2.1' path='/usr/lib/{}' architecture='elf-amd-x86_64' soname='{}'>".format(
+        soname, soname)]
+    out.append("  <elf-needed>\n    <dependency name='libc.so.6'/>\n  </elf-needed>")
+    out.append("  <elf-function-symbols>")
+    for i in range(functions):
+        out.append("    <elf-symbol name='{}_fn{}' type='func-type' binding='global-binding' "
+                   "visibility='default-visibility' is-defined='yes'/>".format(prefix, i))
+    out.append("  </elf-function-symbols>")
+    out.append("  <abi-instr address-size='64' path='{}.c' language='LANG_C11'>".format(prefix))
+    out.append("    <type-decl name='int' size-in-bits='32' id='type-id-1'/>")
+    out.append("    <type-decl name='long int' size-in-bits='64' id='type-id-2'/>")
+    structs = max(1, functions // 4)
+    for s in range(structs):
+        tid = 3 + 2 * s
+        out.append("    <class-decl name='{}_s{}' size-in-bits='128' is-struct='yes' visibility='default' "
+                   "filepath='{}.h' line='{}' column='1' id='type-id-{}'>".format(prefix, s, prefix, s * 10 + 1, tid))
+        for m, mtype in enumerate(("type-id-1", "type-id-2")):
+            out.append("      <data-member access='public' layout-offset-in-bits='{}'>\n"
+                       "        <var-decl name='m{}' type-id='{}' visibility='default'/>\n"
+                       "      </data-member>".format(m * 64, m, mtype))
+        out.append("    </class-decl>")
+        out.append("    <pointer-type-def type-id='type-id-{}' size-in-bits='64' id='type-id-{}'/>".format(tid, tid + 1))
+    for i in range(functions):
+        ret = "type-id-2" if i < changed else "type-id-1"
+        out.append("    <function-decl name='{p}_fn{i}' mangled-name='{p}_fn{i}' filepath='{p}.c' line='{ln}' "
+                   "column='1' visibility='default' binding='global' size-in-bits='64' "
+                   "elf-symbol-id='{p}_fn{i}'>".format(p=prefix, i=i, ln=rnd.randint(1, 5000)))
+        out.append("      <parameter type-id='type-id-{}'/>".format(4 + 2 * (i % structs)))
+        out.append("      <return type-id='{}'/>".format(ret))
+        out.append("    </function-decl>")
+    out.append("  </abi-instr>")
+    out.append("</abi-corpus>")
+    return "\n".join(out) + "\n"
+
+
+def elf_stub(xml):
+    ''' Returns an ELF shared object header followed by the corpus the stub abidw prints for it.
+    '''
+    # ELFCLASS64, ELFDATA2LSB, EV_CURRENT, ET_DYN, EM_X86_64
+    ident = b"\177ELF" + bytes([2, 1, 1]) + bytes(9)
+    header = ident + struct.pack("<HHI", 3, 62, 1)
+    return header.ljust(_ELF_HEADER_SIZE, b"\0") + xml.encode("utf-8")
+
+
+def image_tree(image_dir, dsos, functions, noise=2):
+    ''' Writes an image tree with stub DSOs among other files.
+
+        Parameters:
+            dsos (int): The number of ELF shared objects
+            functions (int): The functions per DSO
+            noise (int): Non-ELF files and symlinks per DSO
+
+        Returns:
+            count (int): The number of ELF files written
+    '''
+    lib_dir = os.path.join(image_dir, "usr", "lib")
+    share_dir = os.path.join(image_dir, "usr", "share", "doc")
+    os.makedirs(lib_dir, exist_ok=True)
+    os.makedirs(share_dir, exist_ok=True)
+    for i in range(dsos):
+        soname = "libimg{}.so.1".format(i)
+        with open(os.path.join(lib_dir, soname + ".0"), "wb") as f:
+            f.write(elf_stub(abixml(soname, functions, seed=i)))
+        os.symlink(soname + ".0", os.path.join(lib_dir, soname))
+        for n in range(noise):
+            with open(os.path.join(share_dir, "img{}-{}.txt".format(i, n)), "w") as f:
+                f.write("not an ELF file\n" * 64)
+    return dsos
+
+
+def buildhistory(bh_dir, recipes, dsos, functions, changed=0, version="1.0"):
+    ''' Writes a serialized buildhistory, the layout the build hooks produce.
+
+        Parameters:
+            recipes (int): The number of recipes
+            dsos (int): The DSOs per recipe
+            functions (int): The functions per DSO
+            changed (int): The recipes, the first ones, with an ABI change in each DSO
+            version (str): The PV of the recipes, the changed ones get a ".1" appended
+    '''
+    for r in range(recipes):
+        recipe_dir = os.path.join(bh_dir, "packages", "x86_64", "recipe{}".format(r))
+        adir = os.path.join(recipe_dir, "binaryaudit", "abixml")
+        os.makedirs(adir, exist_ok=True)
+        pv = version + ".1" if r < changed else version
+        with open(os.path.join(recipe_dir, "latest"), "w") as f:
+            f.write("PV = {}\nPR = r0\n".format(pv))
+        manifest = abiindex.manifest_writer(adir)
+        for d in range(dsos):
+            soname = "librcp{}_{}.so.1".format(r, d)
+            xml = abixml(soname, functions, changed=1 if r < changed else 0, seed=r * dsos + d)
+            out_fn = os.path.join(adir, soname + ".xml")
+            with open(out_fn, "w") as f:
+                f.write(xml)
+            manifest.add(soname, out_fn, xml)
+        manifest.write(pv, 1000.0)
+
+
+def _cpio(members):
+    # newc format, the one rpm uses.
+    out = io.BytesIO()
+
+    def add(name, data, mode):
+        name = name.encode("utf-8") + b"\0"
+        fields = [0, mode, 0, 0, 1, 0, len(data), 0, 0, 0, 0, len(name), 0]
+        out.write(b"070701" + "".join("{:08X}".format(v) for v in fields).encode("ascii") + name)
+        out.write(b"\0" * (-out.tell() % 4))
+        out.write(data)
+        out.write(b"\0" * (-out.tell() % 4))
+    for name, data in members:
+        add(name, data, stat.S_IFREG | 0o755)
+    add("TRAILER!!!", b"", 0)
+    return out.getvalue()
+
+
+def _header(entries):
+    ''' Returns an rpm header structure, entries is a list of (tag, value), a
+        value being a str or an int.
+    '''
+    index = []
+    store = io.BytesIO()
+    for tag, value in sorted(entries):
+        if isinstance(value, int):
+            store.write(b"\0" * (-store.tell() % 4))
+            index.append(struct.pack("!iiii", tag, 4, store.tell(), 1))
+            store.write(struct.pack("!I", value))
+        else:
+            index.append(struct.pack("!iiii", tag, 6, store.tell(), 1))
+            store.write(value.encode("utf-8") + b"\0")
+    data = store.getvalue()
+    return b"\x8e\xad\xe8\x01\0\0\0\0" + struct.pack("!ii", len(index), len(data)) + b"".join(index) + data
+
+
+def rpm(fn, name, version, release, sourcerpm, members):
+    ''' Writes a minimal RPM package: lead, signature, header and a gzip compressed cpio payload.
+
+        Parameters:
+            members (list): (path, data) of the payload files
+    '''
+    payload = gzip.compress(_cpio(members), compresslevel=1)
+    lead = struct.pack("!4sBBhh66shh16s", b"\xed\xab\xee\xdb", 3, 0, 0, 1,
+                       "{}-{}-{}".format(name, version, release).encode("utf-8")[:65], 1, 5, b"")
+    sig = _header([(1000, len(payload))])
+    sig += b"\0" * (-len(sig) % 8)
+    header = _header([(1000, name), (1001, version), (1002, release), (1022, "x86_64"), (1044, sourcerpm),
+                      (1124, "cpio"), (1125, "gzip")])
+    with open(fn, "wb") as f:
+        f.write(lead + sig + header + payload)
+
+
+def rpm_filename(name, version, release="1"):
+    return "{}-{}-{}.x86_64.rpm".format(name, version, release)
+
+
+def rpm_set(rpm_dir, groups, payload_size, version="1.0", changed=0, seed=0):
+    ''' Writes the packages of source groups, each with a main package
+        shipping a DSO, its -devel- and -debuginfo- packages, and a -doc-
+        package the filter drops. Every 4th group adds a package without
+        a DSO, dropped too.
+
+        Parameters:
+            groups (int): The number of source groups
+            payload_size (int): Bytes of the DSO, the debuginfo is twice as big
+            changed (int): The groups, the first ones, listed as ABI changes
+
+        Returns:
+            changes (list): The file names of the main packages with an ABI change
+    '''
+    rnd = random.Random(seed)
+    os.makedirs(rpm_dir, exist_ok=True)
+    changes = []
+    for g in range(groups):
+        name = "pkg{}".format(g)
+        src = "{}-{}-1.src.rpm".format(name, version)
+        lib = "./usr/lib64/lib{}.so.1".format(name)
+        packages = [
+            (name, [(lib, rnd.randbytes(payload_size))]),
+            (name + "-devel", [("./usr/include/{}.h".format(name), b"int f(void);\n" * 16),
+                               ("./usr/lib64/lib{}.a".format(name), rnd.randbytes(64))]),
+            (name + "-debuginfo", [("./usr/lib/debug" + lib[1:] + ".debug", rnd.randbytes(payload_size * 2))]),
+            (name + "-doc", [("./usr/share/doc/{}/README".format(name), b"docs\n" * 64)]),
+        ]
+        if 0 == g % 4:
+            packages.append((name + "-tools", [("./usr/bin/{}".format(name), rnd.randbytes(256))]))
+        for pname, members in packages:
+            rpm(os.path.join(rpm_dir, rpm_filename(pname, version)), pname, version, "1", src, members)
+        if g < changed:
+            changes.append(rpm_filename(name, version))
+    return changes
+
+
+class _quiet_handler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class http_repo:
+    ''' Serves a directory over HTTP on localhost, in a thread.
+    '''
+    def __init__(self, repo_dir):
+        def handler(*args, **kwargs):
+            return _quiet_handler(*args, directory=repo_dir, **kwargs)
+        self.httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.url = "http://127.0.0.1:{}".format(self.httpd.server_address[1])
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
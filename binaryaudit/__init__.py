@@ -1,11 +1,20 @@
 from . import util
+
+
+def _bb_log(fn, *prefix):
+    # The BitBake loggers join their arguments, format the lazy ones first.
+    def log(msg, *args):
+        fn(*prefix, msg % args if args else msg)
+    return log
+
+
 try:
     # Reverence Poky
     import bb
-    util.debug = bb.debug  # noqa: F821
-    util.note = bb.note  # noqa: F821
-    util.warn = bb.warn  # noqa: F821
-    util.error = bb.error  # noqa: F821
-    util.fatal = bb.fatal  # noqa: F821
+    util.debug = _bb_log(bb.debug, 1)  # noqa: F821
+    util.note = _bb_log(bb.note)  # noqa: F821
+    util.warn = _bb_log(bb.warn)  # noqa: F821
+    util.error = _bb_log(bb.error)  # noqa: F821
+    util.fatal = _bb_log(bb.fatal)  # noqa: F821
 except BaseException:
     util.setup_log()
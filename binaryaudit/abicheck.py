@@ -3,21 +3,29 @@ import json
 import os
 import rpmfile
 import subprocess
+import time
 
+from binaryaudit import abiindex
+from binaryaudit import abixml
 from binaryaudit import conf
+from binaryaudit import elf
+from binaryaudit import fingerprint
+from binaryaudit import governor
+from binaryaudit import metrics
+from binaryaudit import trace
 from xml.etree import ElementTree
 import glob
 from binaryaudit import util
 
 
+@trace.traced("elf.classify", "elf")
 def is_elf(fn):
-    with open(fn, "rb") as fd:
-        exp = b"\177ELF"
-        head = fd.read(4)
-    return head == exp
+    return elf.is_elf(fn)
 
 
 def get_soname_from_xml(xml):
+    if isinstance(xml, bytes):
+        xml = abixml.decompress(xml)
     r = ElementTree.fromstring(xml)
     try:
         return r.attrib["soname"]
@@ -28,15 +36,16 @@ def get_soname_from_xml(xml):
 def _serialize(cmd):
     sout = subprocess.PIPE
     serr = subprocess.STDOUT
-    shell = False
     try:
-        process = subprocess.Popen(cmd, stdout=sout,
-                                   stderr=serr, shell=shell)
-        sout, serr = process.communicate()
+        t0 = time.monotonic()
+        with trace.span("abidw", "tool", file=cmd[-1]):
+            ret, sout, serr = governor.run_tool(cmd, "abidw", os.path.basename(cmd[-1]), [cmd[-1]],
+                                                stdout=sout, stderr=serr)
+        metrics.observe("binaryaudit_tool_duration_seconds", time.monotonic() - t0, tool="abidw")
         out = "".join([out.decode('utf-8') for out in [sout, serr] if out])
     except OSError:
         raise
-    return process.returncode, out
+    return ret, out
 
 
 def serialize(fn):
@@ -59,7 +68,7 @@ def serialize_kernel_artifacts(abixml_dir, tree, vmlinux=None, whitelist=None):
         util.error(out)
         return out, None
     if not out:
-        util.warn("Empty dump output for '{}'".format(tree))
+        util.warn("Empty dump output for '%s'", tree)
         return None, None
 
     sn = get_soname_from_xml(out)
@@ -69,39 +78,61 @@ def serialize_kernel_artifacts(abixml_dir, tree, vmlinux=None, whitelist=None):
     return out, out_fn
 
 
-def compare(ref, cur, suppr=[]):
+def compare(ref, cur, suppr=[], ref_fp=None, cur_fp=None):
     cmd = ["abidiff"]
     for sup_fn in suppr:
         cmd += ["--suppr", sup_fn]
-    cmd += [ref, cur]
-    util.note(str(cmd))
+    # Identical fingerprints prove there's no ABI change, abidiff has nothing to report.
+    if fingerprint.same_abi(ref_fp, cur_fp):
+        util.debug("Same ABI fingerprint, skipping %s", str(cmd + [ref, cur]))
+        return DIFF_OK, "", cmd + [ref, cur]
+    util.note("%s", cmd + [ref, cur])
     sout = subprocess.PIPE
     serr = subprocess.STDOUT
-    shell = False
     try:
-        process = subprocess.Popen(cmd, stdout=sout,
-                                   stderr=serr, shell=shell)
-        sout, serr = process.communicate()
+        t0 = time.monotonic()
+        # abidiff reads plain XML, the compressed inputs are decompressed for it.
+        with trace.span("abidiff", "tool", file=cur) as sp, abixml.plain_path(ref) as ref_fn, \
+                abixml.plain_path(cur) as cur_fn:
+            ret, sout, serr = governor.run_tool(cmd + [ref_fn, cur_fn], "abidiff", os.path.basename(cur),
+                                                [ref_fn, cur_fn], stdout=sout, stderr=serr)
+            sp.set(ret=ret)
+        metrics.observe("binaryaudit_tool_duration_seconds", time.monotonic() - t0, tool="abidiff")
         out = "".join([out.decode('utf-8') for out in [sout, serr] if out])
     except OSError:
         raise
     # return cmd for logging purposes
-    return process.returncode, out, cmd
+    return ret, out, cmd + [ref, cur]
 
 
-def serialize_artifacts(adir, id):
+def serialize_artifacts(adir, id, manifest=None, compression=None, pv=None):
     ''' Recursively serialize binary artifacts starting at the given image directory(id), yields serialized output and filename
+
+    Once all the artifacts are yielded, the manifest of the recipe is written
+    next to adir, the comparison then doesn't need to read the XML files. A
+    failed serialization leaves no manifest, the files are scanned instead.
+
     Parameters:
         adir (str): path to abixml directory
         id (str): image directory- result of calling d.getVar("IMG_DIR")
+        manifest (abiindex.manifest_writer): Optional manifest to record the yielded artifacts into,
+            one of its own is written if omitted
+        compression (str): Optional compression of the files, "gz" or "zst", the filenames get its suffix.
+            The output is the plain XML, abixml.write() compresses it by the suffix
+        pv (str): Optional recipe version to record in the manifest
     '''
-    for fn in glob.iglob(id + "/**/**", recursive=True):
+    if manifest is None:
+        manifest = abiindex.manifest_writer(adir)
+    manifest.discard()
+    t0 = time.monotonic()
+    # "/**" matches every file under id once, "/**/**" matched them again at each level.
+    for fn in glob.iglob(id + "/**", recursive=True):
         if os.path.isfile(fn) and not os.path.islink(fn):
             is_elf_artifact = False
             try:
                 is_elf_artifact = is_elf(fn)
             except Exception as e:
-                util.warn(str(e))
+                util.warn("%s", e)
             if not is_elf_artifact:
                 continue
 
@@ -112,14 +143,17 @@ def serialize_artifacts(adir, id):
                 util.error(out)
                 return
             if not out:
-                util.warn("Empty dump output for '{}'".format(fn))
+                util.warn("Empty dump output for '%s'", fn)
                 return
 
             sn = get_soname_from_xml(out)
 
-            out_fn = util.create_path_to_xml(sn, adir, fn)
+            out_fn = abixml.with_suffix(util.create_path_to_xml(sn, adir, fn), compression)
+            manifest.add(sn, out_fn, out)
 
             yield out, out_fn
+    # In microseconds as abixml.duration, the time of the caller writing the files included.
+    manifest.write(pv, (time.monotonic() - t0) * 1000000)
 
 
 DIFF_OK = 0
@@ -128,6 +162,14 @@ DIFF_USAGE_ERROR = 2
 DIFF_CHANGE = 4
 DIFF_INCOMPATIBLE_CHANGE = 8
 
+_DIFF_BITS = {
+    "OK": DIFF_OK,
+    "ERROR": DIFF_ERROR,
+    "USAGE_ERROR": DIFF_USAGE_ERROR,
+    "CHANGE": DIFF_CHANGE,
+    "INCOMPATIBLE_CHANGE": DIFF_INCOMPATIBLE_CHANGE,
+}
+
 
 def diff_is_ok(c):
     return 0 == c
@@ -202,6 +244,21 @@ def diff_get_bit(c):
     raise ValueError("Value '{}' can't be interpreted as a libabigail return status.".format(c))
 
 
+def diff_from_bit(s):
+    ''' Reverse of diff_get_bit().
+
+        Parameters:
+            s (str) - Text representation of a return status bit.
+
+        Returns:
+            The return value with that bit set.
+    '''
+    try:
+        return _DIFF_BITS[s]
+    except KeyError:
+        raise ValueError("Value '{}' isn't a libabigail return status.".format(s))
+
+
 def filter_rpm(filename, filter_list, rpm, drop_count):
     ''' Filters out packages with specified words in name and packages not conatining a .so file.
 
@@ -217,7 +274,7 @@ def filter_rpm(filename, filter_list, rpm, drop_count):
     '''
     filtered_out = False
     if any(word in filename for word in filter_list):
-        util.note("Dropping " + filename + " because it contains a filter word")
+        util.note("Dropping %s because it contains a filter word", filename)
         drop_count += 1
         filtered_out = True
     elif "-debuginfo-" not in filename and "-devel-" not in filename:
@@ -229,7 +286,7 @@ def filter_rpm(filename, filter_list, rpm, drop_count):
             if has_so is True:
                 break
         if has_so is False:
-            util.note("Dropping " + filename + " RPM because it has no shared object file")
+            util.note("Dropping %s RPM because it has no shared object file", filename)
             drop_count += 1
             filtered_out = True
     return filtered_out, drop_count
@@ -254,8 +311,8 @@ def filter_dictionary(rpm_dict, drop_count):
                     kernel_has_debuginfo = True
                     break
             if kernel_has_debuginfo is False:
-                util.note("Dropping files with {} source name because "
-                          "kernel packages must be accompanied by debuginfo package".format(key))
+                util.note("Dropping files with %s source name because "
+                          "kernel packages must be accompanied by debuginfo package", key)
                 drop_count += len(rpm_dict[key])
                 del rpm_dict[key]
                 continue
@@ -265,7 +322,7 @@ def filter_dictionary(rpm_dict, drop_count):
                 debug_devel_only = False
                 break
         if debug_devel_only is True:
-            util.note("Dropping files with {} source name because there are only debuginfo and/or devel files".format(key))
+            util.note("Dropping files with %s source name because there are only debuginfo and/or devel files", key)
             drop_count += len(rpm_dict[key])
             del rpm_dict[key]
     return drop_count
@@ -290,7 +347,7 @@ def generate_package_json(source_dir, out_filename):
         f = os.path.join(source_dir, filename)
         if os.path.isfile(f):
             if f.endswith(".rpm"):
-                with rpmfile.open(f) as rpm:
+                with trace.span("rpm.headers", "rpm", file=filename), rpmfile.open(f) as rpm:
                     source = rpm.headers.get("sourcerpm")
                     ret_filter_rpm, drop_count = filter_rpm(filename, filter_list, rpm, drop_count)
                     if ret_filter_rpm is True:
@@ -298,7 +355,7 @@ def generate_package_json(source_dir, out_filename):
                 rpm_dict.setdefault(source.decode('utf-8'), []).append(filename)
     drop_count = filter_dictionary(rpm_dict, drop_count)
     total_files = len(os.listdir(source_dir))
-    util.note("Dropped {} of {} files".format(drop_count, total_files))
+    util.note("Dropped %s of %s files", drop_count, total_files)
     remaining_files = total_files - drop_count
     with open(out_filename, "w") as output_file:
         json.dump(rpm_dict, output_file, indent=2)
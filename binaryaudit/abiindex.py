@@ -0,0 +1,202 @@
+import glob
+import hashlib
+import json
+import os
+
+from binaryaudit import abixml
+from binaryaudit import fingerprint
+from binaryaudit import trace
+from binaryaudit import util
+
+# Written next to abixml.duration by the serialization, one per recipe.
+MANIFEST_FN = "abixml.manifest"
+MANIFEST_VERSION = 1
+# Index of a whole buildhistory, persisted only for immutable trees like
+# an extracted baseline.
+INDEX_FN = "binaryaudit.index"
+INDEX_VERSION = 2
+
+
+def hash_xml(xml):
+    if isinstance(xml, str):
+        xml = xml.encode("utf-8")
+    return hashlib.sha256(xml).hexdigest()
+
+
+class manifest_writer:
+    ''' Records the artifacts serialized for a recipe, see serialize_artifacts().
+
+        Parameters:
+            adir (str): path to abixml directory
+    '''
+    def __init__(self, adir):
+        self.adir = adir
+        self.dsos = []
+        self.path = os.path.join(os.path.dirname(os.path.normpath(adir)), MANIFEST_FN)
+
+    def add(self, sn, out_fn, xml):
+        data = xml.encode("utf-8") if isinstance(xml, str) else xml
+        self.dsos.append({"file": os.path.relpath(out_fn, self.adir), "soname": sn,
+                          "size": len(data), "hash": hash_xml(data),
+                          "fingerprint": fingerprint.fingerprint(data) if sn else None})
+
+    def write(self, pv=None, duration=None):
+        ''' Writes the manifest into the parent of the abixml directory.
+
+            Parameters:
+                pv (str): The recipe version
+                duration (float): The serialization time in microseconds
+        '''
+        manifest = {"version": MANIFEST_VERSION, "pv": pv, "duration": duration,
+                    "dsos": sorted(self.dsos, key=lambda d: d["file"])}
+        tmp_fn = self.path + ".tmp"
+        with open(tmp_fn, "w") as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        os.replace(tmp_fn, self.path)
+        return self.path
+
+    def discard(self):
+        ''' Removes the manifest of a previous serialization, it doesn't describe the new one.
+        '''
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def _read_pv(recipe_dir):
+    version = None
+    try:
+        with open(os.path.join(recipe_dir, "latest"), "r") as f:
+            for ln in f.readlines():
+                a = ln.split("=")
+                if "PV" == a[0].strip():
+                    version = a[1].strip()
+    except OSError:
+        pass
+    return version
+
+
+def _read_duration(recipe_binaudit_path):
+    try:
+        with open(os.path.join(recipe_binaudit_path, "abixml.duration"), "r") as f:
+            return float(f.read())
+    except (OSError, ValueError):
+        return .0
+
+
+def _scan_recipe(recipe_binaudit_path):
+    # Fallback for the trees serialized before the manifests existed.
+    from binaryaudit import abicheck
+    adir = os.path.join(recipe_binaudit_path, "abixml")
+    writer = manifest_writer(adir)
+    fns = sorted(os.listdir(adir)) if os.path.isdir(adir) else []
+    for fn in [os.path.join(adir, fn) for fn in fns if abixml.is_abixml(fn)]:
+        xml = abixml.read(fn)
+        writer.add(abicheck.get_soname_from_xml(xml), fn, xml)
+    return {"pv": None, "duration": None, "dsos": writer.dsos}
+
+
+def get_fingerprints(recipe):
+    ''' Returns the known ABI fingerprints of the DSOs of a recipe, keyed by soname.
+    '''
+    return dict((d["soname"], d["fingerprint"]) for d in recipe["dsos"].values()
+                if d["soname"] and d.get("fingerprint"))
+
+
+def load_recipe(recipe_binaudit_path):
+    ''' Returns the manifest of a recipe, scanning its abixml directory if there is none.
+
+        The versions in the manifest are completed from the buildhistory,
+        the buildhistory is authoritative on them.
+    '''
+    manifest = None
+    try:
+        with open(os.path.join(recipe_binaudit_path, MANIFEST_FN), "r") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        pass
+    if not manifest or MANIFEST_VERSION != manifest.get("version"):
+        util.debug("No manifest in '%s', scanning the abixml files", recipe_binaudit_path)
+        manifest = _scan_recipe(recipe_binaudit_path)
+    pv = _read_pv(os.path.dirname(recipe_binaudit_path))
+    if pv is not None or manifest.get("pv") is None:
+        manifest["pv"] = pv
+    if manifest.get("duration") is None:
+        manifest["duration"] = _read_duration(recipe_binaudit_path)
+    # Keyed by the name without the compression suffix, the DSOs join whatever the sides are stored as.
+    manifest["dsos"] = dict((abixml.strip_suffix(d["file"]), d) for d in manifest["dsos"])
+    return manifest
+
+
+@trace.traced("walk", "fs")
+def build_index(buildhistory_dir):
+    ''' Builds the index of the recipe manifests of a whole buildhistory.
+
+        Returns:
+            index (dict): Recipe path relative to the buildhistory -> manifest
+    '''
+    index = {}
+    for fn in glob.glob(buildhistory_dir + "/packages/*/*/binaryaudit", recursive=False):
+        index[os.path.relpath(fn, buildhistory_dir)] = load_recipe(fn)
+    return index
+
+
+def dump_index(index):
+    ''' Returns the persisted form of an index, see get_index().
+    '''
+    return json.dumps({"version": INDEX_VERSION, "recipes": index})
+
+
+def get_index(buildhistory_dir, persist=False):
+    ''' Returns the index of a buildhistory, loading it from the tree if persisted there.
+
+        Parameters:
+            buildhistory_dir (str): The buildhistory directory
+            persist (bool): Store the index in the tree, only for trees that don't change anymore
+    '''
+    fn = os.path.join(buildhistory_dir, INDEX_FN)
+    if persist and os.path.isfile(fn):
+        try:
+            with open(fn, "r") as f:
+                data = json.load(f)
+            if INDEX_VERSION == data.get("version"):
+                return data["recipes"]
+        except (OSError, ValueError, KeyError):
+            pass
+    index = build_index(buildhistory_dir)
+    if persist:
+        try:
+            tmp_fn = fn + ".tmp.{}".format(os.getpid())
+            with open(tmp_fn, "w") as f:
+                f.write(dump_index(index))
+            os.replace(tmp_fn, fn)
+        except OSError as e:
+            util.warn("Couldn't store the index '%s': %s", fn, e)
+    return index
+
+
+def join(base_recipe, cur_recipe):
+    ''' Joins the DSOs of a recipe with the ones of its baseline.
+
+        Only DSOs, that is serializations with a soname, present on both
+        sides take part. Pairs with identical content or ABI fingerprint
+        count as unchanged.
+
+        Returns:
+            changed (list): (file, base entry, current entry) with differing content, ordered by file
+            unchanged (int): The number of identical pairs
+    '''
+    changed = []
+    unchanged = 0
+    base_dsos = base_recipe["dsos"] if base_recipe else {}
+    for fn in sorted(cur_recipe["dsos"]):
+        cur = cur_recipe["dsos"][fn]
+        base = base_dsos.get(fn)
+        if not cur["soname"] or base is None:
+            continue
+        if base["hash"] == cur["hash"] or fingerprint.same_abi(base.get("fingerprint"), cur.get("fingerprint")):
+            unchanged += 1
+        else:
+            changed.append((fn, base, cur))
+    return changed, unchanged
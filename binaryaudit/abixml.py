@@ -0,0 +1,163 @@
+import contextlib
+import gzip
+import os
+import shutil
+import subprocess
+
+from binaryaudit import conf
+from binaryaudit import workspace
+
+COMPRESSIONS = ("gz", "zst")
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+GZIP_LEVEL = 6
+COPY_SIZE = 1024 * 1024
+
+
+def get_compression():
+    ''' Returns the configured compression of the serialized abixml, None for plain XML.
+    '''
+    try:
+        compression = conf.get_config("Abixml", "compression")
+    except KeyError:
+        compression = ""
+    return check_compression(compression or None)
+
+
+def check_compression(compression):
+    if compression is not None and compression not in COMPRESSIONS:
+        raise ValueError("Unknown abixml compression '{}', use one of {}".format(compression, ", ".join(COMPRESSIONS)))
+    return compression
+
+
+def is_abixml(fn):
+    return fn.endswith(".xml") or any(fn.endswith(".xml." + c) for c in COMPRESSIONS)
+
+
+def with_suffix(fn, compression):
+    ''' Returns the name of an abixml file stored with the compression.
+    '''
+    return fn + "." + compression if compression else fn
+
+
+def strip_suffix(fn):
+    ''' Returns the name of an abixml file without the compression suffix.
+    '''
+    for c in COMPRESSIONS:
+        if fn.endswith(".xml." + c):
+            return fn[:-len(c) - 1]
+    return fn
+
+
+def _get_suffix_compression(fn):
+    for c in COMPRESSIONS:
+        if fn.endswith("." + c):
+            return c
+    return None
+
+
+def sniff(data):
+    ''' Returns the compression of data by its magic, None for plain data.
+    '''
+    if data.startswith(GZIP_MAGIC):
+        return "gz"
+    if data.startswith(ZSTD_MAGIC):
+        return "zst"
+    return None
+
+
+def _sniff_file(fn):
+    with open(fn, "rb") as f:
+        return sniff(f.read(len(ZSTD_MAGIC)))
+
+
+def _zstd(args, data):
+    p = subprocess.run(["zstd", "-q"] + args, input=data, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if 0 != p.returncode:
+        raise OSError("zstd failed: {}".format(p.stderr.decode("utf-8", "replace").strip()))
+    return p.stdout
+
+
+def compress(data, compression):
+    if "gz" == compression:
+        # No timestamp, the same XML compresses to the same file.
+        return gzip.compress(data, GZIP_LEVEL, mtime=0)
+    if "zst" == compression:
+        return _zstd(["-c", "-T0"], data)
+    return data
+
+
+def decompress(data):
+    ''' Returns the XML of abixml data, compressed or not.
+    '''
+    compression = sniff(data)
+    if "gz" == compression:
+        return gzip.decompress(data)
+    if "zst" == compression:
+        return _zstd(["-dc"], data)
+    return data
+
+
+def write(fn, xml):
+    ''' Writes the XML to an abixml file, compressed as its suffix tells.
+    '''
+    data = xml.encode("utf-8") if isinstance(xml, str) else xml
+    with open(fn, "wb") as f:
+        f.write(compress(data, _get_suffix_compression(fn)))
+
+
+def read(fn):
+    ''' Returns the XML of an abixml file, compressed or not, as bytes.
+    '''
+    with open_plain(fn) as f:
+        return f.read()
+
+
+@contextlib.contextmanager
+def open_plain(fn):
+    ''' Yields a binary file object reading the XML of an abixml file, decompressed as it's read.
+    '''
+    compression = _sniff_file(fn)
+    if compression is None:
+        with open(fn, "rb") as f:
+            yield f
+        return
+    if "gz" == compression:
+        with gzip.open(fn, "rb") as f:
+            yield f
+        return
+    p = subprocess.Popen(["zstd", "-q", "-dc", fn], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        yield p.stdout
+    finally:
+        p.stdout.close()
+        ret = p.wait()
+    if 0 != ret:
+        raise OSError("zstd couldn't decompress '{}'".format(fn))
+
+
+@contextlib.contextmanager
+def plain_path(fn):
+    ''' Yields the path of a plain XML file with the content of an abixml file.
+
+        That's the file itself if it isn't compressed. Otherwise it's
+        decompressed into a temporary file, removed on the way out. Not a
+        FIFO, the libabigail tools open their inputs twice.
+    '''
+    try:
+        compression = _sniff_file(fn)
+    except OSError:
+        # Left for the tool to report.
+        compression = None
+    if compression is None:
+        yield fn
+        return
+    fd, tmp_fn = workspace.mkstemp("abixml", ".xml")
+    try:
+        # The fd is kept open while the file is in use, it holds the lock against pruning.
+        with os.fdopen(fd, "wb", closefd=False) as out, open_plain(fn) as f:
+            shutil.copyfileobj(f, out, COPY_SIZE)
+        yield tmp_fn
+    finally:
+        os.unlink(tmp_fn)
+        os.close(fd)
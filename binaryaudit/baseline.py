@@ -0,0 +1,423 @@
+import fcntl
+import hashlib
+import io
+import json
+import os
+import shutil
+import stat
+import tarfile
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from binaryaudit import abiindex
+from binaryaudit import abixml
+from binaryaudit import conf
+from binaryaudit import metrics
+from binaryaudit import trace
+from binaryaudit import util
+
+# Baselines published by the chunked storage carry a manifest instead of
+# a tarball in the PackageData column, the magic tells them apart.
+MANIFEST_MAGIC = b"BAMANIFEST1\n"
+MANIFEST_VERSION = 1
+
+CHUNK_SIZE_DEFAULT = 1024 * 1024
+# Upper limit of the not yet uploaded chunk data kept in memory.
+UPLOAD_BATCH_BYTES = 16 * 1024 * 1024
+
+CACHE_DIR_DEFAULT = "~/.cache/binaryaudit/baselines"
+CACHE_KEEP_DEFAULT = 3
+# Marks a fully extracted baseline in the cache.
+CACHE_COMPLETE_MARKER = ".complete"
+# Where supported, tarfile refuses by itself to write out of the destination.
+_EXTRACT_ARGS = {"filter": "data"} if hasattr(tarfile, "data_filter") else {}
+
+# The shared locks on the cached baselines this process uses, by directory.
+_in_use = {}
+_in_use_lock = threading.Lock()
+# The top directory of the baseline members, the fetching runs look it up.
+BUILDHISTORY_DIR = "buildhistory"
+
+
+def get_chunk_size():
+    try:
+        return int(conf.get_config("Baseline", "chunk_size"))
+    except KeyError:
+        return CHUNK_SIZE_DEFAULT
+
+
+def get_cache_dir():
+    try:
+        d = conf.get_config("Baseline", "cache_dir")
+    except KeyError:
+        d = CACHE_DIR_DEFAULT
+    return os.path.expanduser(d)
+
+
+def get_cache_keep():
+    try:
+        return int(conf.get_config("Baseline", "cache_keep"))
+    except KeyError:
+        return CACHE_KEEP_DEFAULT
+
+
+def is_needed_member(path):
+    ''' Tells whether a buildhistory member is read by the ABI comparison.
+    '''
+    if path.endswith("/latest") or path.endswith("/binaryaudit/abixml.duration") or \
+            path.endswith("/binaryaudit/abixml.manifest") or path.endswith("/" + abiindex.INDEX_FN):
+        return True
+    return "/binaryaudit/abixml/" in path and abixml.is_abixml(path)
+
+
+def is_manifest(data):
+    ''' Tells whether the baseline data is a chunk manifest or a legacy tarball.
+    '''
+    return data is not None and bytes(data[:len(MANIFEST_MAGIC)]) == MANIFEST_MAGIC
+
+
+def pack_manifest(manifest):
+    return MANIFEST_MAGIC + zlib.compress(json.dumps(manifest, sort_keys=True).encode("utf-8"))
+
+
+def unpack_manifest(data):
+    if not is_manifest(data):
+        raise ValueError("Baseline data is not a chunk manifest")
+    return json.loads(zlib.decompress(bytes(data[len(MANIFEST_MAGIC):])).decode("utf-8"))
+
+
+def is_safe_member_path(path):
+    return not os.path.isabs(path) and ".." not in path.split("/")
+
+
+class chunk_uploader:
+    ''' Collects chunks of a baseline being published and uploads only
+        the ones the DB doesn't know yet, in batches of bounded size.
+        The chunks of a batch are compressed on workers threads.
+    '''
+    def __init__(self, db_conn, batch_bytes=UPLOAD_BATCH_BYTES, workers=1):
+        self.db_conn = db_conn
+        self.batch_bytes = batch_bytes
+        self.workers = workers
+        self._executor = None
+        self._pending = {}
+        self._pending_bytes = 0
+        self._seen = set()
+        self.total_bytes = 0
+        self.uploaded_bytes = 0
+        self.uploaded_chunks = 0
+
+    def add(self, data):
+        h = hashlib.sha256(data).hexdigest()
+        self.total_bytes += len(data)
+        if h not in self._seen:
+            self._seen.add(h)
+            self._pending[h] = data
+            self._pending_bytes += len(data)
+            if self._pending_bytes >= self.batch_bytes:
+                self.flush()
+        return h
+
+    def flush(self):
+        if not self._pending:
+            return
+        existing = self.db_conn.get_existing_baseline_chunks(self._pending.keys())
+        new = [(h, data) for h, data in self._pending.items() if h not in existing]
+        new_chunks = {}
+        for (h, data), compressed in zip(new, self._compress([data for h, data in new])):
+            new_chunks[h] = (len(data), compressed)
+            self.uploaded_bytes += len(data)
+        if new_chunks:
+            self.db_conn.insert_baseline_chunks(new_chunks)
+            self.uploaded_chunks += len(new_chunks)
+        self._pending = {}
+        self._pending_bytes = 0
+
+    def _compress(self, chunks):
+        # zlib releases the GIL, the threads compress in parallel.
+        if self.workers <= 1 or len(chunks) <= 1:
+            return [zlib.compress(data) for data in chunks]
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        return list(self._executor.map(zlib.compress, chunks))
+
+    def close(self):
+        ''' Uploads the pending chunks.
+        '''
+        try:
+            self.flush()
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+
+def _add_file(manifest, path, f, mode, size, uploader, chunk_size):
+    file_hash = hashlib.sha256()
+    chunks = []
+    while True:
+        data = f.read(chunk_size)
+        if not data:
+            break
+        file_hash.update(data)
+        chunks.append(uploader.add(data))
+    manifest["files"].append({"path": path, "mode": mode, "size": size,
+                              "hash": file_hash.hexdigest(), "chunks": chunks})
+
+
+def _add_member(manifest, tgz, member, uploader, chunk_size):
+    if not is_safe_member_path(member.name):
+        util.warn("Skipping unsafe baseline member '%s'", member.name)
+        return
+    if member.issym():
+        manifest["files"].append({"path": member.name, "link": member.linkname})
+        return
+    if not member.isfile():
+        return
+    _add_file(manifest, member.name, tgz.extractfile(member), member.mode, member.size, uploader, chunk_size)
+
+
+def _insert_manifest(db_conn, build_id, product_id, manifest, uploader):
+    uploader.close()
+    db_conn.insert_ba_baseline_data(build_id, product_id, pack_manifest(manifest))
+    util.note("Baseline: %d files, %d bytes, %d bytes in %d new chunks uploaded",
+              len(manifest["files"]), uploader.total_bytes, uploader.uploaded_bytes, uploader.uploaded_chunks)
+    return uploader
+
+
+@trace.traced("baseline.publish", "baseline")
+def publish_baseline(db_conn, build_id, product_id, tar_fn, chunk_size=None, workers=1):
+    ''' Stores a buildhistory tarball as a manifest plus deduplicated chunks.
+
+        Parameters:
+            db_conn: The db connection
+            build_id (str): The build id
+            product_id (int): The product id
+            tar_fn (str): Path to the buildhistory tarball
+            chunk_size (int): Chunk size in bytes, read from the config if omitted
+            workers (int): The number of threads compressing the chunks
+
+        Returns:
+            uploader (chunk_uploader): The uploader holding the transfer statistics
+    '''
+    if not chunk_size:
+        chunk_size = get_chunk_size()
+    manifest = {"version": MANIFEST_VERSION, "chunk_size": chunk_size, "files": []}
+    uploader = chunk_uploader(db_conn, workers=workers)
+    # Stream mode, the tarball is never held in memory as a whole.
+    with tarfile.open(tar_fn, "r|*") as tgz:
+        for member in tgz:
+            _add_member(manifest, tgz, member, uploader, chunk_size)
+    return _insert_manifest(db_conn, build_id, product_id, manifest, uploader)
+
+
+def iter_needed_files(buildhistory_dir):
+    ''' Yields the member path and the file path of the buildhistory files the comparison reads, in a stable order.
+    '''
+    index_member = "/".join([BUILDHISTORY_DIR, abiindex.INDEX_FN])
+    for dirpath, dirnames, filenames in os.walk(buildhistory_dir):
+        dirnames.sort()
+        for fn in sorted(filenames):
+            path = os.path.join(dirpath, fn)
+            name = "/".join([BUILDHISTORY_DIR, os.path.relpath(path, buildhistory_dir).replace(os.sep, "/")])
+            # An index left in the tree may be stale, a fresh one is packed.
+            if is_needed_member(name) and index_member != name:
+                yield name, path
+
+
+@trace.traced("baseline.pack", "baseline")
+def pack_baseline(db_conn, build_id, product_id, buildhistory_dir, chunk_size=None, workers=1):
+    ''' Stores the files of a buildhistory the comparison reads as a manifest plus deduplicated chunks.
+
+        Unlike with publish_baseline(), no tarball of the whole tree is
+        made first. The index of the buildhistory is stored along, the
+        runs fetching the baseline load it instead of scanning the abixml.
+
+        Parameters:
+            db_conn: The db connection
+            build_id (str): The build id
+            product_id (int): The product id
+            buildhistory_dir (str): Path to the buildhistory directory
+            chunk_size (int): Chunk size in bytes, read from the config if omitted
+            workers (int): The number of threads compressing the chunks
+
+        Returns:
+            uploader (chunk_uploader): The uploader holding the transfer statistics
+    '''
+    if not chunk_size:
+        chunk_size = get_chunk_size()
+    manifest = {"version": MANIFEST_VERSION, "chunk_size": chunk_size, "files": []}
+    uploader = chunk_uploader(db_conn, workers=workers)
+    for name, path in iter_needed_files(buildhistory_dir):
+        if os.path.islink(path):
+            manifest["files"].append({"path": name, "link": os.readlink(path)})
+            continue
+        st = os.stat(path)
+        with open(path, "rb") as f:
+            _add_file(manifest, name, f, stat.S_IMODE(st.st_mode), st.st_size, uploader, chunk_size)
+    index = abiindex.dump_index(abiindex.build_index(buildhistory_dir)).encode("utf-8")
+    _add_file(manifest, "/".join([BUILDHISTORY_DIR, abiindex.INDEX_FN]), io.BytesIO(index), 0o644, len(index),
+              uploader, chunk_size)
+    return _insert_manifest(db_conn, build_id, product_id, manifest, uploader)
+
+
+@trace.traced("baseline.extract", "baseline")
+def extract_manifest(db_conn, manifest, dest_dir, select=None):
+    ''' Materializes the files of a baseline manifest, fetching the chunks lazily.
+
+        Parameters:
+            db_conn: The db connection
+            manifest (dict): Unpacked baseline manifest
+            dest_dir (str): Directory to extract into
+            select (callable): Optional predicate on the member path
+
+        Returns:
+            count (int): The number of files written
+    '''
+    count = 0
+    for entry in manifest["files"]:
+        path = entry["path"]
+        if not is_safe_member_path(path) or (select and not select(path)):
+            continue
+        # A link out of dest_dir would have the members below it written there too.
+        if "link" in entry and not is_safe_member_path(entry["link"]):
+            util.warn("Skipping unsafe baseline link '%s' to '%s'", path, entry["link"])
+            continue
+        out_fn = os.path.join(dest_dir, path)
+        os.makedirs(os.path.dirname(out_fn), exist_ok=True)
+        if "link" in entry:
+            os.symlink(entry["link"], out_fn)
+        else:
+            with open(out_fn, "wb") as f:
+                for data in db_conn.iter_baseline_chunks(entry["chunks"]):
+                    f.write(zlib.decompress(data))
+            os.chmod(out_fn, entry["mode"] & 0o777)
+        count += 1
+    return count
+
+
+@trace.traced("baseline.extract", "baseline")
+def extract_tarball(data, dest_dir, select=None):
+    ''' Extracts a legacy baseline tarball straight from the blob.
+
+        Parameters:
+            data (bytes): The tarball data
+            dest_dir (str): Directory to extract into
+            select (callable): Optional predicate on the member path
+
+        Returns:
+            count (int): The number of members extracted
+    '''
+    count = 0
+    with tarfile.open(fileobj=io.BytesIO(data), mode="r|*") as tgz:
+        for member in tgz:
+            if not (member.isfile() or member.issym()):
+                continue
+            if not is_safe_member_path(member.name) or (select and not select(member.name)):
+                continue
+            if member.issym() and not is_safe_member_path(member.linkname):
+                util.warn("Skipping unsafe baseline link '%s' to '%s'", member.name, member.linkname)
+                continue
+            tgz.extract(member, dest_dir, set_attrs=False, **_EXTRACT_ARGS)
+            count += 1
+    return count
+
+
+def _get_lock_fn(entry_dir, kind):
+    # The extraction of an entry serializes on its "lock" file, the runs
+    # using it hold a shared lock on its "use" file.
+    return "{}.{}".format(entry_dir, kind)
+
+
+def _prune_cache(cache_dir, keep):
+    entries = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if os.path.isfile(os.path.join(path, CACHE_COMPLETE_MARKER)):
+            entries.append((os.path.getmtime(path), path))
+    for mtime, path in sorted(entries, reverse=True)[keep:]:
+        with open(_get_lock_fn(path, "use"), "w") as use_fl:
+            try:
+                fcntl.flock(use_fl, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                util.debug("Not evicting cached baseline '%s', it's in use", path)
+                continue
+            util.debug("Evicting cached baseline '%s'", path)
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def _extract_into_cache(db_conn, baseline_id, entry_dir):
+    tmp_dir = "{}.tmp-{}".format(entry_dir, os.getpid())
+    if os.path.isdir(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+    try:
+        data = db_conn.get_ba_baseline_data(baseline_id)
+        if is_manifest(data):
+            count = extract_manifest(db_conn, unpack_manifest(data), tmp_dir, is_needed_member)
+        else:
+            count = extract_tarball(data, tmp_dir, is_needed_member)
+        with open(os.path.join(tmp_dir, CACHE_COMPLETE_MARKER), "w"):
+            pass
+        os.rename(tmp_dir, entry_dir)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    util.note("Extracted %s baseline files into '%s'", count, entry_dir)
+
+
+def get_cached_baseline(db_conn, baseline_id, cache_dir=None):
+    ''' Returns the directory with the files of a baseline the comparison needs,
+        extracting them only if the baseline isn't in the local cache yet.
+
+        Concurrent runs on the same host serialize on a lock per baseline,
+        the extraction goes to a temporary directory renamed when complete.
+        The process holds a shared lock on the baseline until
+        release_cached_baseline() is called or it exits, the baseline
+        isn't evicted while in use.
+
+        Parameters:
+            db_conn: The db connection
+            baseline_id (int): Baseline ID from DB
+            cache_dir (str): Cache directory, read from the config if omitted
+
+        Returns:
+            entry_dir (str): The extracted baseline directory
+    '''
+    if not cache_dir:
+        cache_dir = get_cache_dir()
+    os.makedirs(cache_dir, exist_ok=True)
+    entry_dir = os.path.join(cache_dir, str(baseline_id))
+    _hold(entry_dir)
+    with open(_get_lock_fn(entry_dir, "lock"), "w") as lock_fl:
+        fcntl.flock(lock_fl, fcntl.LOCK_EX)
+        if os.path.isfile(os.path.join(entry_dir, CACHE_COMPLETE_MARKER)):
+            util.debug("Using cached baseline '%s'", entry_dir)
+            # Keep the recently used ones from being evicted.
+            os.utime(entry_dir)
+            metrics.inc("binaryaudit_cache_lookups", cache="baseline", result="hit")
+            return entry_dir
+        metrics.inc("binaryaudit_cache_lookups", cache="baseline", result="miss")
+        _extract_into_cache(db_conn, baseline_id, entry_dir)
+    _prune_cache(cache_dir, get_cache_keep())
+    return entry_dir
+
+
+def _hold(entry_dir):
+    with _in_use_lock:
+        if entry_dir in _in_use:
+            return
+        use_fl = open(_get_lock_fn(entry_dir, "use"), "w")
+        # Waits while another run evicts the entry, it's extracted again then.
+        fcntl.flock(use_fl, fcntl.LOCK_SH)
+        _in_use[entry_dir] = use_fl
+
+
+def release_cached_baseline(entry_dir):
+    ''' Releases the shared lock get_cached_baseline() took on the baseline, it can be evicted again.
+    '''
+    with _in_use_lock:
+        use_fl = _in_use.pop(entry_dir, None)
+    if use_fl is not None:
+        use_fl.close()
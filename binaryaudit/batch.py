@@ -0,0 +1,285 @@
+import json
+import os
+import sys
+import threading
+
+from binaryaudit import abicheck
+from binaryaudit import abixml
+from binaryaudit import cli
+from binaryaudit import governor
+from binaryaudit import scheduler
+from binaryaudit import util
+from xml.etree import ElementTree
+
+
+def load_manifest(fn, fields):
+    ''' Reads the items of a batch, the paths of an item per line.
+
+        The paths are separated by a tab, or by white space if the line has
+        no tab. Empty lines and the ones starting with '#' are skipped.
+
+        Parameters:
+            fn (str): The manifest file, '-' for stdin
+            fields (int): The number of paths per item
+        Returns:
+            items (list): The (line number, paths) of each item
+        Raises:
+            ValueError: A line doesn't have the expected number of paths
+    '''
+    if "-" == fn:
+        return _read_manifest(sys.stdin, fields, "stdin")
+    with open(fn, "r") as f:
+        return _read_manifest(f, fields, fn)
+
+
+def _read_manifest(f, fields, name):
+    items = []
+    for n, line in enumerate(f, 1):
+        line = line.rstrip("\n")
+        if not line.strip() or line.startswith("#"):
+            continue
+        paths = line.split("\t") if "\t" in line else line.split()
+        if fields != len(paths):
+            raise ValueError("{}:{}: expected {} paths, got {}".format(name, n, fields, len(paths)))
+        items.append((n, paths))
+    return items
+
+
+def _get_size(paths):
+    try:
+        return sum(os.path.getsize(p) for p in paths)
+    except OSError:
+        return 0
+
+
+class _forwarder:
+    ''' Forwards the items to the daemon, over a connection per pool thread.
+    '''
+    def __init__(self):
+        self._local = threading.local()
+        self._clients = []
+        self._lock = threading.Lock()
+
+    def _request(self, op, **args):
+        ''' Returns the "result" event of the request, without its name.
+
+            Raises:
+                daemon_error: The request failed or the daemon isn't listening anymore
+        '''
+        from binaryaudit import daemon
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = daemon.connect()
+            if client is None:
+                raise daemon.daemon_error("The daemon isn't listening anymore")
+            self._local.client = client
+            with self._lock:
+                self._clients.append(client)
+        res = None
+        for ev in client.request(op, **args):
+            if "result" == ev["event"]:
+                res = {k: v for k, v in ev.items() if "event" != k}
+        return res
+
+    def close(self):
+        for client in self._clients:
+            client.close()
+
+
+class serializer(_forwarder):
+    ''' Serializes an ELF file into the abixml directory, named by its soname.
+
+        Parameters:
+            out_dir (str): The abixml directory
+            compression (str): Optional compression of the files, "gz" or "zst"
+            coord (workqueue.coordinator): Run abidw on the workers of the coordinator,
+                the files are written here
+            remote (bool): Forward the files to the daemon, which writes the abixml
+    '''
+    fields = 1
+    keys = ("path",)
+
+    def __init__(self, out_dir, compression=None, coord=None, remote=False):
+        _forwarder.__init__(self)
+        self.out_dir = os.path.abspath(out_dir) if remote else out_dir
+        self.compression = compression
+        self.coord = coord
+        self.remote = remote
+        os.makedirs(out_dir, exist_ok=True)
+
+    def _dump(self, fn):
+        if self.coord is None:
+            ret, out, cmd = abicheck.serialize(fn)
+            return ret, out
+        res = self.coord.submit("serialize", file=os.path.abspath(fn)).result()
+        return res["ret"], res["out"]
+
+    def _forward(self, fn):
+        from binaryaudit import daemon
+        try:
+            return self._request("serialize-file", file=os.path.abspath(fn), out_dir=self.out_dir,
+                                 compression=self.compression)
+        except daemon.daemon_error as e:
+            return {"ret": abicheck.DIFF_ERROR, "error": str(e)}
+
+    def __call__(self, fn):
+        from binaryaudit import workqueue
+        if self.remote:
+            return self._forward(fn)
+        try:
+            ret, out = self._dump(fn)
+        except (OSError, workqueue.workqueue_error) as e:
+            return {"ret": abicheck.DIFF_ERROR, "error": str(e)}
+        if 0 != ret:
+            return {"ret": abicheck.DIFF_ERROR, "out": out}
+        if not out:
+            return {"ret": abicheck.DIFF_ERROR, "error": "Empty dump output"}
+        try:
+            sn = abicheck.get_soname_from_xml(out)
+        except ElementTree.ParseError as e:
+            return {"ret": abicheck.DIFF_ERROR, "error": "Bad dump output: {}".format(e)}
+        out_fn = abixml.with_suffix(util.create_path_to_xml(sn, self.out_dir, fn), self.compression)
+        try:
+            abixml.write(out_fn, out)
+        except OSError as e:
+            return {"ret": abicheck.DIFF_ERROR, "error": str(e)}
+        return {"ret": abicheck.DIFF_OK, "soname": sn, "file": out_fn}
+
+    def close(self):
+        _forwarder.close(self)
+        if self.coord is not None:
+            self.coord.close()
+
+
+class comparer(_forwarder):
+    ''' Compares an abixml pair, through the verdict cache or the daemon.
+
+        Parameters:
+            suppr (list): The suppression files
+            cache (verdict.verdict_cache): Optional cache of the verdicts
+            remote (bool): Forward the comparisons to the daemon, over a connection per pool thread
+    '''
+    fields = 2
+    keys = ("ref", "cur")
+
+    def __init__(self, suppr, cache=None, remote=False):
+        _forwarder.__init__(self)
+        self.suppr = [os.path.abspath(fn) for fn in suppr] if remote else suppr
+        self.cache = cache
+        self.remote = remote
+
+    def _forward(self, ref, cur):
+        from binaryaudit import daemon
+        try:
+            res = self._request("compare", ref=os.path.abspath(ref), cur=os.path.abspath(cur),
+                                suppressions=self.suppr)
+        except daemon.daemon_error as e:
+            return {"ret": abicheck.DIFF_ERROR, "error": str(e)}
+        return {"ret": res["ret"], "out": res["out"], "cached": res["cached"]}
+
+    def __call__(self, ref, cur):
+        from binaryaudit import verdict
+        if self.remote:
+            return self._forward(ref, cur)
+        try:
+            ret, out, cmd = verdict.cached_compare(self.cache, ref, cur, self.suppr)
+        except OSError as e:
+            return {"ret": abicheck.DIFF_ERROR, "error": str(e)}
+        return {"ret": ret, "out": out, "cached": cmd is None}
+
+    def close(self):
+        _forwarder.close(self)
+        if self.cache is not None:
+            self.cache.log()
+
+
+def run(items, fn, workers, stream):
+    ''' Runs fn on the paths of each item and writes a JSON line per result, as they complete.
+
+        The items are dispatched largest first. Each line has the manifest
+        line number, the paths, the status and its bits, and what fn returned.
+
+        Parameters:
+            items (list): The (line number, paths) of each item, see load_manifest()
+            fn (serializer or comparer): The operation
+            workers (int): The number of items to process in parallel
+            stream: The file object to write the results to
+        Returns:
+            status (int): The highest status of the items
+    '''
+    governor.setup()
+    workers = governor.limit_workers(workers)
+    jobs = [scheduler.job("{}:{}".format(n, paths[-1]), (n, paths), _get_size(paths)) for n, paths in items]
+    scheduler.estimate(jobs, scheduler.history())
+    status = abicheck.DIFF_OK
+    for j, res in scheduler.dispatch(jobs, lambda n, paths: fn(*paths), workers):
+        n, paths = j.args
+        rec = {"line": n}
+        rec.update(zip(fn.keys, paths))
+        rec.update(res)
+        try:
+            rec["bits"] = abicheck.diff_get_bits(res["ret"])
+        except ValueError:
+            rec["bits"] = ["ERROR"]
+        stream.write(json.dumps(rec) + "\n")
+        stream.flush()
+        # A negative status is a tool killed by a signal.
+        status = max(status, res["ret"] if res["ret"] >= 0 else abicheck.DIFF_ERROR)
+    util.note("Processed %s items, status %s", len(jobs), status)
+    return status
+
+
+def _get_serializer(args):
+    from binaryaudit import daemon
+    compression = args.compress or abixml.get_compression()
+    if args.coordinator:
+        from binaryaudit import workqueue
+        # The workers run abidw, the files are written here.
+        return serializer(args.output_dir, compression, workqueue.start_coordinator(args.coordinator))
+    client = daemon.get_client(args)
+    if client is not None:
+        client.close()
+    return serializer(args.output_dir, compression, remote=client is not None)
+
+
+def _get_comparer(args):
+    ''' Returns the comparer and the db connection of its shared verdicts, if any.
+    '''
+    from binaryaudit import daemon
+    from binaryaudit import verdict
+    suppr = cli.get_suppressions(args)
+    client = daemon.get_client(args)
+    if client is not None:
+        client.close()
+        return comparer(suppr, remote=True), None
+    if args.no_verdict_cache:
+        return comparer(suppr), None
+    db_conn = None
+    if args.shared_verdicts:
+        from binaryaudit.db import wrapper as db_wrapper
+        db_conn = db_wrapper(args.db_config, util.logger)
+        db_conn.initialize_db()
+    cache = verdict.verdict_cache(db_conn, suppr)
+    return comparer(suppr, cache if cache.enabled() else None), db_conn
+
+
+def main(args):
+    ''' Runs "binaryaudit abi", returns the exit status.
+    '''
+    fn = None
+    db_conn = None
+    try:
+        items = load_manifest(args.manifest, (serializer if "serialize" == args.abi_cmd else comparer).fields)
+        if "serialize" == args.abi_cmd:
+            fn = _get_serializer(args)
+    except (OSError, ValueError) as e:
+        util.error("%s", e)
+        return 2
+    if fn is None:
+        fn, db_conn = _get_comparer(args)
+    try:
+        return run(items, fn, args.jobs, sys.stdout)
+    finally:
+        fn.close()
+        if db_conn:
+            db_conn.close()
@@ -1,21 +1,80 @@
 
 import argparse
+import os
+
+from binaryaudit import conf
 
 
 # Common, reusable.
 arg_parser_common = argparse.ArgumentParser(add_help=False)
 arg_parser_common.add_argument('-v', '--verbose', action='store_true',
                                help="Verbose output.")
+arg_parser_common.add_argument('--trace', action='store', metavar="/path/to/out.json",
+                               help="Write a trace of the run stages in the Chrome trace-event format, "
+                                    "to be loaded into Perfetto.")
+arg_parser_common.add_argument('--metrics-file', action='store', metavar="/path/to/file.prom",
+                               help="Write the run metrics as an OpenMetrics textfile, e.g. for the node_exporter "
+                                    "textfile collector. If omitted, the path from the config is used.")
+arg_parser_common.add_argument('--no-daemon', action='store_true',
+                               help="Do the work in this process even if a 'binaryaudit serve' daemon is listening.")
 
 # Database, reusable
 arg_parser_db = argparse.ArgumentParser(add_help=False)
 arg_parser_db.add_argument("--db-config", action="store", default="db_config", metavar="/path/to/file",
                            help="Path to the config file in the env format. If omited, default is 'db_config' in CWD.")
+arg_parser_db.add_argument("--spool", action="store", metavar="/path/to/file",
+                           help="Local spool file the telemetry is written to before the upload. "
+                                "If omitted, the path from the config is used.")
+arg_parser_db.add_argument("--no-spool", action="store_true",
+                           help="Write the telemetry directly to the database.")
+arg_parser_db.add_argument("--no-verdict-cache", action="store_true",
+                           help="Neither look up nor publish the diff verdicts shared through the database.")
 # Suppressions, reusable
 arg_parser_supressions = argparse.ArgumentParser(add_help=False)
 arg_parser_supressions.add_argument("--no-default-suppressions", action="store_true", help="Disable any default suppressions")
 arg_parser_supressions.add_argument("--global-suppression", action="store", help="Path to suppression file")
 
+# Parallelism, reusable
+arg_parser_jobs = argparse.ArgumentParser(add_help=False)
+arg_parser_jobs.add_argument("-j", "--jobs", action="store", type=int, default=1,
+                             help="Number of items to process in parallel (default: 1)")
+
+# Gating, reusable
+arg_parser_gating = argparse.ArgumentParser(add_help=False)
+arg_parser_gating.add_argument("--fail-fast", action="store_true",
+                               help="Check the riskiest items first and stop at the first incompatible change. "
+                                    "The build is recorded as aborted, a later full run reuses the partial results.")
+
+
+# Sharding, reusable
+def shard_arg(s):
+    ''' Parses a shard as I/N, the shard I of N counted from 1.
+    '''
+    try:
+        index, count = [int(v) for v in s.split("/")]
+    except ValueError:
+        raise argparse.ArgumentTypeError("Invalid shard '{}', expected I/N".format(s))
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError("Invalid shard '{}', I must be from 1 to N".format(s))
+    return index, count
+
+
+arg_parser_shard = argparse.ArgumentParser(add_help=False)
+arg_parser_shard.add_argument("--shard", action="store", type=shard_arg, metavar="I/N",
+                              help="Audit only the share I of N of the items, for splitting a run across agents. "
+                                   "The results are written to a file for 'binaryaudit merge', which records "
+                                   "the run in the database.")
+arg_parser_shard.add_argument("--shard-results", action="store", metavar="/path/to/file.json",
+                              help="Results file of the shard. If omitted, binaryaudit-shard-I-of-N.json "
+                                   "in the output directory.")
+
+# Work queue, reusable
+arg_parser_queue = argparse.ArgumentParser(add_help=False)
+arg_parser_queue.add_argument("--coordinator", action="store", metavar="[HOST]:PORT",
+                              help="Listen on the address and hand the tool runs out to 'binaryaudit worker' "
+                                   "processes instead of running them here. The workers read the inputs from the same paths, "
+                                   "the results are recorded here. There's no authentication, listen on trusted "
+                                   "networks only.")
 
 # Telemetry, reusable.
 arg_parser_telemetry = argparse.ArgumentParser(add_help=False)
@@ -46,9 +105,125 @@ arg_parser_subs = arg_parser.add_subparsers(help="Subcommands", dest="cmd")
 
 
 # binaryaudit abi ...
-# arg_parser_abi = arg_parser_subs.add_parser("abi", help="ABI tools.")
+arg_parser_abi = arg_parser_subs.add_parser("abi", help="Serialize or compare ABIs in bulk.",
+                                            description="Run abidw or abidiff on all the items of a manifest in a "
+                                                        "single process, and print a JSON line per result as they "
+                                                        "complete. The exit status is the highest one of the items.")
+arg_parser_abi_subs = arg_parser_abi.add_subparsers(help="ABI commands", dest="abi_cmd", required=True)
+arg_parser_abi_serialize = arg_parser_abi_subs.add_parser("serialize", help="Serialize ELF files into abixml.",
+                                                          description="The manifest lists an ELF file per line. "
+                                                                      "The files are forwarded to the daemon if one "
+                                                                      "is listening and no --coordinator is given.",
+                                                          parents=[arg_parser_common, arg_parser_jobs, arg_parser_queue])
+arg_parser_abi_serialize.add_argument("manifest", nargs="?", default="-", metavar="MANIFEST",
+                                      help="File listing the items, stdin if omitted or '-'.")
+arg_parser_abi_serialize.add_argument("-o", "--output-dir", action="store", required=True, metavar="/path/to/dir",
+                                      help="Directory to write the abixml files to, named by soname.")
+arg_parser_abi_serialize.add_argument("--compress", action="store", choices=["gz", "zst"], default=None,
+                                      help="Compress the abixml files, the configured compression if omitted.")
+arg_parser_abi_compare = arg_parser_abi_subs.add_parser("compare", help="Compare abixml pairs.",
+                                                        description="The manifest lists a reference and a current "
+                                                                    "abixml file per line, separated by a tab or "
+                                                                    "white space. The comparisons are forwarded to "
+                                                                    "the daemon if one is listening.",
+                                                        parents=[arg_parser_common, arg_parser_db,
+                                                                 arg_parser_supressions, arg_parser_jobs])
+arg_parser_abi_compare.add_argument("manifest", nargs="?", default="-", metavar="MANIFEST",
+                                    help="File listing the items, stdin if omitted or '-'.")
+arg_parser_abi_compare.add_argument("--shared-verdicts", action="store_true",
+                                    help="Look up and publish the diff verdicts in the database from --db-config.")
+
+
+# binaryaudit elf ...
+arg_parser_elf = arg_parser_subs.add_parser("elf", help="Classify files by ELF type.",
+                                            description="Print a '<type>\\t<path>' line per file, the type being "
+                                                        "rel, exec, dyn, core, none, other, not-elf or error. "
+                                                        "The paths are read line by line from stdin if none are passed.",
+                                            parents=[arg_parser_common])
+arg_parser_elf.add_argument("paths", nargs="*", metavar="PATH", help="Files to classify.")
+
+
+# binaryaudit serve ...
+arg_parser_serve = arg_parser_subs.add_parser("serve", help="Serve jobs to the local clients over a UNIX socket.",
+                                              description="Serialize, compare, rpm-index and classify jobs are "
+                                                          "read as JSON lines and run on a shared worker pool, "
+                                                          "their results are streamed back.",
+                                              parents=[arg_parser_common, arg_parser_db, arg_parser_supressions,
+                                                       arg_parser_jobs])
+arg_parser_serve.add_argument("--socket", action="store", metavar="/path/to/socket",
+                              help="Socket to listen on. If omitted, the path from the config is used, "
+                                   "or binaryaudit.sock in $XDG_RUNTIME_DIR.")
+arg_parser_serve.add_argument("--idle-timeout", action="store", type=float, metavar="SECONDS",
+                              help="Exit after no request came in for that long.")
+arg_parser_serve.add_argument("--shared-verdicts", action="store_true",
+                              help="Look up and publish the diff verdicts in the database from --db-config, "
+                                   "over a connection pool kept open while serving. Implied if the file exists, "
+                                   "unless --no-verdict-cache is given.")
+arg_parser_serve.add_argument("--stop", action="store_true", help="Stop the daemon listening on the socket.")
 
 
+# binaryaudit worker ...
+arg_parser_worker = arg_parser_subs.add_parser("worker", help="Run the tools of a coordinated run.",
+                                               description="Pull the work units of a mariner, poky or abi serialize "
+                                                           "run started with --coordinator and run them, until the "
+                                                           "run is done.",
+                                               parents=[arg_parser_common, arg_parser_jobs])
+arg_parser_worker.add_argument("address", metavar="[HOST]:PORT", help="Address of the coordinator.")
+arg_parser_worker.add_argument("--wait", action="store", type=float, default=30, metavar="SECONDS",
+                               help="Keep trying to connect for that long, the coordinator may start later "
+                                    "(default: 30)")
+
+
+# binaryaudit simulate ...
+def comma_list(conv):
+    ''' Returns an argparse type converting a comma separated list.
+    '''
+    def parse(s):
+        return [conv(v) for v in s.split(",") if v.strip()]
+    return parse
+
+
+def count_arg(s):
+    ''' Parses a count of 1 or more.
+    '''
+    try:
+        n = int(s)
+    except ValueError:
+        raise argparse.ArgumentTypeError("Invalid count '{}', expected a number".format(s))
+    if n < 1:
+        raise argparse.ArgumentTypeError("Invalid count '{}', expected 1 or more".format(s))
+    return n
+
+
+arg_parser_simulate = arg_parser_subs.add_parser("simulate", help="Replay a recorded run on simulated worker pools.",
+                                                 description="Predict the makespan, utilization and critical path of "
+                                                             "a run for other job counts, orderings, cache hit rates "
+                                                             "and memory budgets. The jobs and their durations come "
+                                                             "from a trace written with --trace, from the telemetry "
+                                                             "details table with -t y, or from the local history.",
+                                                 parents=[arg_parser_common, arg_parser_db, arg_parser_telemetry])
+arg_parser_simulate.add_argument("--from-trace", action="store", metavar="/path/to/trace.json",
+                                 help="Replay the jobs of a trace written with --trace.")
+arg_parser_simulate.add_argument("--history", action="store", metavar="/path/to/history.json",
+                                 help="History with the durations and the peak RSS of the items. "
+                                      "If omitted, the path from the config is used.")
+arg_parser_simulate.add_argument("-j", "--jobs", action="store", type=comma_list(count_arg), default=[1, 2, 4, 8],
+                                 metavar="N[,N...]", help="Worker counts to simulate (default: 1,2,4,8)")
+arg_parser_simulate.add_argument("--order", action="store", type=comma_list(str), default=["lpt"],
+                                 metavar="ORDER[,ORDER...]",
+                                 help="Job orderings to simulate: lpt, spt, fifo or risk (default: lpt)")
+arg_parser_simulate.add_argument("--cache-hit-rate", action="store", type=comma_list(float), default=[0],
+                                 metavar="RATE[,RATE...]",
+                                 help="Shares of the jobs served by the verdict cache, from 0 to 1 (default: 0)")
+arg_parser_simulate.add_argument("--cache-hit-time", action="store", type=float, default=0, metavar="SECONDS",
+                                 help="Duration of a job served by the verdict cache (default: 0)")
+arg_parser_simulate.add_argument("--memory", action="store", type=comma_list(str), default=[None],
+                                 metavar="SIZE[,SIZE...]",
+                                 help="Memory budgets of the tools, e.g. 8G. Unlimited if omitted.")
+arg_parser_simulate.add_argument("--fail-fast", action="store_true",
+                                 help="Stop at the first job with an incompatible change.")
+arg_parser_simulate.add_argument("--json", action="store_true", help="Print a JSON line per simulation.")
+
 # binaryaudit rpm ...
 arg_parser_rpm = arg_parser_subs.add_parser("rpm", help="RPM tools frontend.",
                                             parents=[arg_parser_common, arg_parser_db, arg_parser_telemetry])
@@ -63,11 +238,18 @@ arg_parser_db_cmd = arg_parser_subs.add_parser("db", help="Database CLI wrapper.
                                                parents=[arg_parser_common, arg_parser_db])
 arg_parser_db_cmd.add_argument('--check-connection', action='store_true', required=False,
                                help="Test DB connection. Exit with 0 if connection could be established.")
+arg_parser_db_cmd.add_argument('--show-details', action='store', required=False, metavar="BUILD_ID",
+                               help="Print the recorded results of a build as JSON lines, requires --product-id.")
+arg_parser_db_cmd.add_argument('--product-id', action='store', type=int, required=False,
+                               help="Product ID for the queries.")
+arg_parser_db_cmd.add_argument('--drain', action='store_true', required=False,
+                               help="Upload the telemetry left in the spool. Exit with 0 if the spool is empty afterwards.")
 
 # binaryaudit mariner
 arg_parser_mariner = arg_parser_subs.add_parser("mariner", help="Mariner Abipkgdiff Wrapper.",
                                                 parents=[arg_parser_common, arg_parser_db, arg_parser_telemetry,
-                                                         arg_parser_supressions])
+                                                         arg_parser_supressions, arg_parser_jobs,
+                                                         arg_parser_gating, arg_parser_shard, arg_parser_queue])
 
 required_args = arg_parser_mariner.add_argument_group('mandatory arguments')
 required_args.add_argument('-i', '--source-dir', action='store', required=True,
@@ -81,10 +263,14 @@ optional_args.add_argument('-c', '--cleanup', action="store", default=True, requ
 # binaryaudit poky ...
 arg_parser_poky = arg_parser_subs.add_parser("poky", help="RPM tools frontend.",
                                              parents=[arg_parser_common, arg_parser_db, arg_parser_telemetry,
-                                                      arg_parser_supressions])
+                                                      arg_parser_supressions, arg_parser_jobs, arg_parser_gating,
+                                                      arg_parser_shard, arg_parser_queue])
 arg_parser_poky.add_argument("--compare-buildhistory", action="store_true", help="Run abicompat on two buildhistory dirs.")
 arg_parser_poky.add_argument('--insert-baseline', action='store', required=False,
                              help="Insert baseline data into DB.")
+arg_parser_poky.add_argument("--pack-baseline", action="store", metavar="/path/to/buildhistory",
+                             help="Insert the files of a buildhistory directory the comparison reads into DB as "
+                                  "the baseline, compressed on --jobs threads.")
 arg_parser_poky.add_argument("--buildhistory-baseline", action="store", help="Baseline buildhistory directory.")
 arg_parser_poky.add_argument("--buildhistory-current", action="store",
                              help="Current buildhistory directory to be compared against the baseline.")
@@ -93,6 +279,18 @@ arg_parser_poky.add_argument('-o', '--output-dir', action='store', required=Fals
                              help="Path to local dir with output of abipkgdiff.")
 
 
+# binaryaudit merge ...
+arg_parser_merge = arg_parser_subs.add_parser("merge", help="Combine the results of the shards of a run.",
+                                              description="Check that the results files of all the shards of a "
+                                                          "mariner or poky run split with --shard are there, "
+                                                          "compute the overall result and record the run in the "
+                                                          "database with -t y. The exit status is the highest "
+                                                          "libabigail status of the items, 0 if passed.",
+                                              parents=[arg_parser_common, arg_parser_db, arg_parser_telemetry])
+arg_parser_merge.add_argument("results", nargs="+", metavar="RESULTS", help="Results files of the shards.")
+arg_parser_merge.add_argument("-o", "--output-dir", action="store", required=False,
+                              help="Write the reports of the items with changes to this directory.")
+
 # ##### functions #####
 
 
@@ -100,3 +298,14 @@ def validate_telemetry_args(args):
     if args.enable_telemetry:
         if not args.build_id or not args.product_name or not args.derivative:
             raise argparse.ArgumentError(None, "Options --build-id, --product-name and --derivative are required")
+
+
+def get_suppressions(args):
+    ''' Returns the suppression files, only the subcommands running the diffs take the options.
+    '''
+    suppr = []
+    if getattr(args, "global_suppression", None) is not None:
+        suppr.append(args.global_suppression)
+    if not getattr(args, "no_default_suppressions", True):
+        suppr.append(os.path.join(conf.get_config_dir(), "suppressions.conf"))
+    return suppr
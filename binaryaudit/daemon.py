@@ -0,0 +1,394 @@
+import json
+import os
+import queue
+import signal
+import socket
+import socketserver
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from binaryaudit import cli
+from binaryaudit import conf
+from binaryaudit import util
+
+# Answers stream back as JSON lines: "artifact" and "result" events per item,
+# then a single "done" event with the request's status, or an "error" one.
+EVENT_DONE = "done"
+EVENT_ERROR = "error"
+# Stops the daemon once the running requests are answered.
+OP_SHUTDOWN = "shutdown"
+
+
+class daemon_error(Exception):
+    pass
+
+
+def get_socket_path():
+    ''' Returns the path of the daemon socket, from the config or in the runtime dir.
+    '''
+    try:
+        path = conf.get_config("Daemon", "socket")
+    except KeyError:
+        path = None
+    if path:
+        return os.path.expanduser(path)
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR") or os.path.expanduser("~/.cache/binaryaudit")
+    return os.path.join(runtime_dir, "binaryaudit.sock")
+
+
+def _path_arg(args, key):
+    # The daemon runs in a different directory than its clients.
+    path = args[key]
+    if not os.path.isabs(path):
+        raise daemon_error("'{}' must be an absolute path: '{}'".format(key, path))
+    return path
+
+
+def _op_serialize(state, args, emit):
+    ''' Serializes the ELF artifacts of an image directory into an abixml directory,
+        with the manifest and the duration file the comparison reads.
+    '''
+    from binaryaudit import abicheck
+    from binaryaudit import abiindex
+    from binaryaudit import abixml
+    adir = _path_arg(args, "abixml_dir")
+    image_dir = _path_arg(args, "image_dir")
+    os.makedirs(adir, exist_ok=True)
+    manifest = abiindex.manifest_writer(adir)
+    t0 = time.monotonic()
+    compression = abixml.check_compression(args.get("compression") or abixml.get_compression())
+    for out, out_fn in abicheck.serialize_artifacts(adir, image_dir, manifest, compression, args.get("pv")):
+        abixml.write(out_fn, out)
+        emit({"event": "artifact", "file": out_fn})
+    duration = (time.monotonic() - t0) * 1000000
+    with open(os.path.join(os.path.dirname(os.path.normpath(adir)), "abixml.duration"), "w") as f:
+        f.write(str(duration))
+    return {"count": len(manifest.dsos)}
+
+
+def _op_serialize_file(state, args, emit):
+    ''' Serializes an ELF file into an abixml directory, for "binaryaudit abi serialize".
+    '''
+    from binaryaudit import abixml
+    from binaryaudit import batch
+    compression = abixml.check_compression(args.get("compression"))
+    res = batch.serializer(_path_arg(args, "out_dir"), compression)(_path_arg(args, "file"))
+    emit(dict(res, event="result"))
+    return {"status": res["ret"]}
+
+
+def _op_compare(state, args, emit):
+    from binaryaudit import abicheck
+    from binaryaudit import verdict
+    suppr = args.get("suppressions")
+    if suppr is None:
+        suppr = state.suppressions
+    ret, out, cmd = verdict.cached_compare(state.get_verdict_cache(suppr), _path_arg(args, "ref"),
+                                           _path_arg(args, "cur"), suppr)
+    emit({"event": "result", "ret": ret, "bits": abicheck.diff_get_bits(ret), "out": out, "cached": cmd is None})
+    return {"status": ret}
+
+
+def _op_rpm_index(state, args, emit):
+    from binaryaudit import abicheck
+    remaining = abicheck.generate_package_json(_path_arg(args, "source_dir"), _path_arg(args, "out_filename"))
+    return {"remaining": remaining}
+
+
+def _op_classify(state, args, emit):
+    from binaryaudit import elf
+    for path in args["paths"]:
+        emit({"event": "result", "path": path, "type": elf.classify(path)})
+    return {"count": len(args["paths"])}
+
+
+OPS = {
+    "serialize": _op_serialize,
+    "serialize-file": _op_serialize_file,
+    "compare": _op_compare,
+    "rpm-index": _op_rpm_index,
+    "classify": _op_classify,
+}
+
+
+class _state:
+    ''' What the requests share for the lifetime of the daemon.
+    '''
+    def __init__(self, executor, suppressions, db_conn=None):
+        self.executor = executor
+        self.suppressions = suppressions
+        self.db_conn = db_conn
+        self._caches = {}
+        self._lock = threading.Lock()
+
+    def get_verdict_cache(self, suppr):
+        ''' Returns the verdict cache of a suppression set, kept warm across the requests.
+        '''
+        from binaryaudit import verdict
+        key = tuple(suppr)
+        with self._lock:
+            if key not in self._caches:
+                cache = verdict.verdict_cache(self.db_conn, suppr)
+                self._caches[key] = cache if cache.enabled() else None
+            return self._caches[key]
+
+
+def _run_op(op, state, args, emit):
+    try:
+        res = op(state, args, emit)
+        res["event"] = EVENT_DONE
+        emit(res)
+    except Exception as e:
+        util.debug("Request failed: %s", e)
+        emit({"event": EVENT_ERROR, "error": "{}: {}".format(type(e).__name__, e)})
+    finally:
+        emit(None)
+
+
+class _handler(socketserver.StreamRequestHandler):
+    ''' Reads a request per line and streams its events back, until the client disconnects.
+    '''
+    def _send(self, ev):
+        self.wfile.write(json.dumps(ev).encode("utf-8") + b"\n")
+        self.wfile.flush()
+
+    def handle(self):
+        server = self.server
+        for line in self.rfile:
+            server.touch()
+            try:
+                req = json.loads(line)
+                name = req["op"]
+                op = OPS[name] if OP_SHUTDOWN != name else None
+                args = req.get("args", {})
+            except (ValueError, KeyError, TypeError) as e:
+                self._send({"event": EVENT_ERROR, "error": "Bad request: {}".format(e)})
+                continue
+            if op is None:
+                self._send({"event": EVENT_DONE})
+                # Not from this thread, shutdown() waits for serve_forever() to return.
+                threading.Thread(target=server.shutdown).start()
+                return
+            events = queue.SimpleQueue()
+            server.begin()
+            # Ended once the op returns, even if the client is gone by then.
+            fut = server.state.executor.submit(_run_op, op, server.state, args, events.put)
+            fut.add_done_callback(lambda f: server.end())
+            for ev in iter(events.get, None):
+                self._send(ev)
+
+
+class server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    ''' Serves the jobs of the clients over a UNIX socket, on a shared worker pool.
+
+        Parameters:
+            path (str): The socket path
+            state (_state): The shared state of the requests
+    '''
+    daemon_threads = True
+
+    def __init__(self, path, state):
+        self.path = path
+        self.state = state
+        self.last_active = time.monotonic()
+        self._running = 0
+        self._lock = threading.Lock()
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, mode=0o700, exist_ok=True)
+        if os.path.exists(path):
+            c = connect(path)
+            if c is not None:
+                c.close()
+                raise daemon_error("A daemon is already listening on '{}'".format(path))
+            # Left over by a daemon that didn't shut down cleanly.
+            os.unlink(path)
+        socketserver.UnixStreamServer.__init__(self, path, _handler)
+        os.chmod(path, 0o600)
+
+    def touch(self):
+        self.last_active = time.monotonic()
+
+    def begin(self):
+        with self._lock:
+            self._running += 1
+            self.touch()
+
+    def end(self):
+        with self._lock:
+            self._running -= 1
+            self.touch()
+
+    def is_idle(self, timeout):
+        with self._lock:
+            return 0 == self._running and time.monotonic() - self.last_active >= timeout
+
+    def watch_idle(self, timeout):
+        ''' Shuts the server down once no request ran nor came in for timeout seconds.
+        '''
+        def watch():
+            while not self.is_idle(timeout):
+                time.sleep(min(timeout, 1))
+            util.note("Idle for %s seconds, shutting down", timeout)
+            self.shutdown()
+        threading.Thread(target=watch, daemon=True).start()
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+def serve(path, workers, suppressions, db_conn=None, idle_timeout=None):
+    ''' Runs the daemon until interrupted or idle for idle_timeout seconds.
+
+        Parameters:
+            path (str): The socket path
+            workers (int): The number of jobs to run in parallel
+            suppressions (list): The suppression files of the compare requests not passing their own
+            db_conn: Optional db connection for the shared verdicts, kept open while serving
+            idle_timeout (float): Optional idle time in seconds after which the daemon exits
+    '''
+    from binaryaudit import governor
+    governor.setup()
+    executor = ThreadPoolExecutor(max_workers=governor.limit_workers(workers))
+    srv = server(path, _state(executor, suppressions, db_conn))
+    if idle_timeout:
+        srv.watch_idle(idle_timeout)
+    util.note("Listening on '%s'", path)
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, _interrupt)
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        srv.server_close()
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt()
+
+
+class client:
+    ''' Connection to a running daemon.
+
+        Parameters:
+            sock (socket.socket): The connected socket
+    '''
+    def __init__(self, sock):
+        self.sock = sock
+        self.rfile = sock.makefile("rb")
+
+    def request(self, op, **args):
+        ''' Sends a request and yields its events, the last one being the "done" one.
+
+            Raises:
+                daemon_error: The request failed in the daemon
+        '''
+        self.sock.sendall(json.dumps({"op": op, "args": args}).encode("utf-8") + b"\n")
+        for line in self.rfile:
+            ev = json.loads(line)
+            if EVENT_ERROR == ev["event"]:
+                raise daemon_error(ev["error"])
+            yield ev
+            if EVENT_DONE == ev["event"]:
+                return
+        raise daemon_error("The daemon closed the connection")
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
+
+
+def get_client(args):
+    ''' Returns a client of the running daemon to forward the work to, None to do it here.
+    '''
+    if args.no_daemon:
+        return None
+    return connect()
+
+
+def connect(path=None):
+    ''' Returns a client connected to the daemon, None if no daemon is listening.
+    '''
+    if path is None:
+        path = get_socket_path()
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        return None
+    return client(sock)
+
+
+def _stop(path):
+    client = connect(path)
+    if client is None:
+        util.note("No daemon is listening on '%s'", path)
+        return 1
+    for ev in client.request(OP_SHUTDOWN):
+        pass
+    client.close()
+    return 0
+
+
+def _open_db(args):
+    # The pool is kept open whenever the telemetry DB is configured, --shared-verdicts requires it.
+    if not args.shared_verdicts and (args.no_verdict_cache or not os.path.isfile(args.db_config)):
+        return None
+    from binaryaudit.db import wrapper as db_wrapper
+    db_conn = db_wrapper(args.db_config, util.logger)
+    try:
+        db_conn.initialize_db()
+    except Exception as e:
+        if args.shared_verdicts:
+            raise
+        util.warn("Serving without the shared verdicts, the DB is unavailable: %s", e)
+        return None
+    return db_conn
+
+
+def index_packages(args):
+    ''' Runs "binaryaudit rpm --list" through the daemon if one is listening, returns the exit status.
+    '''
+    client = get_client(args)
+    if client is None:
+        from binaryaudit import abicheck
+        abicheck.generate_package_json(args.source_dir, args.out_filename)
+        return 0
+    # The daemon runs elsewhere, hand it absolute paths.
+    try:
+        for ev in client.request("rpm-index", source_dir=os.path.abspath(args.source_dir),
+                                 out_filename=os.path.abspath(args.out_filename)):
+            pass
+    except daemon_error as e:
+        util.error("%s", e)
+        return 1
+    finally:
+        client.close()
+    return 0
+
+
+def main(args):
+    ''' Runs "binaryaudit serve", returns the exit status.
+    '''
+    path = args.socket or get_socket_path()
+    if args.stop:
+        return _stop(path)
+    db_conn = _open_db(args)
+    try:
+        serve(path, args.jobs, cli.get_suppressions(args), db_conn, args.idle_timeout)
+    except daemon_error as e:
+        util.error("%s", e)
+        return 1
+    finally:
+        if db_conn:
+            db_conn.close()
+            db_conn.log_pool_stats()
+    return 0
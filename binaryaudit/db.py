@@ -1,20 +1,199 @@
 #!/usr/bin/python3
 
 from sqlalchemy.engine.url import URL
-from sqlalchemy import MetaData, create_engine
+from sqlalchemy import MetaData, create_engine, event
+from sqlalchemy import Table, Column, String, Integer, LargeBinary, DateTime
 from sqlalchemy.ext.automap import automap_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.exc import IntegrityError, DBAPIError, OperationalError, InterfaceError, TimeoutError as PoolTimeoutError
 from sqlalchemy.sql import func
 from sqlalchemy import desc
 from envparse import env
 from datetime import datetime
+from contextlib import contextmanager
+import hashlib
+import lzma
+import threading
+import time
+import zlib
+
+from binaryaudit import metrics
+from binaryaudit import trace
 
 TRANSACTION_MAIN_RESULT_FAILED = "FAILED"
 TRANSACTION_MAIN_RESULT_PASSED = "PASSED"
 TRANSACTION_MAIN_RESULT_PENDING = "PENDING"
+TRANSACTION_MAIN_RESULT_ABORTED = "ABORTED"
+
+# Result of a details row considered a failure for the risk based ordering.
+DETAILS_RESULT_FAILURE = "INCOMPATIBLE_CHANGE"
 
 VERSION_NOT_AVAILABLE = "n/a"
 
+POOL_SIZE_DEFAULT = 5
+POOL_MAX_OVERFLOW_DEFAULT = 10
+POOL_TIMEOUT_DEFAULT = 30
+POOL_RECYCLE_DEFAULT = 600
+
+# Write calls which can be deferred and replayed through apply_ops().
+SPOOLABLE_OPS = ("insert_main_transaction", "insert_ba_transaction_details", "update_ba_test_result",
+                 "insert_fingerprints", "insert_verdict")
+
+# ResultDetails holds a reference into the report table instead of the
+# report text itself.
+REPORT_REF_PREFIX = "report:sha256:"
+REPORT_COMPRESSION_ZLIB = "zlib"
+REPORT_COMPRESSION_LZMA = "lzma"
+
+# Number of the most recent details rows scanned for the execution history.
+HISTORY_ROWS_LIMIT = 20000
+
+# Number of keys per query when looking up content addressed rows.
+LOOKUP_BATCH_SIZE = 64
+
+
+def _define_tables(metadata) -> list:
+    '''
+    defines the tables managed by binaryaudit itself, these are
+    created on demand unlike the reflected ones
+    '''
+    return [
+        Table(
+            "binaryaudit_baseline_chunk_tbl", metadata,
+            Column("Hash", String(64), primary_key=True),
+            Column("Size", Integer, nullable=False),
+            Column("Data", LargeBinary, nullable=False)
+        ),
+        Table(
+            "binaryaudit_report_tbl", metadata,
+            Column("Hash", String(64), primary_key=True),
+            Column("Compression", String(16), nullable=False),
+            Column("Size", Integer, nullable=False),
+            Column("Data", LargeBinary, nullable=False)
+        ),
+        Table(
+            "binaryaudit_fingerprint_tbl", metadata,
+            Column("BuildID", String(255), primary_key=True),
+            Column("ProductID", Integer, primary_key=True),
+            Column("ItemName", String(255), primary_key=True),
+            Column("SoName", String(255), primary_key=True),
+            Column("Fingerprint", String(64), nullable=False, index=True)
+        ),
+        Table(
+            "binaryaudit_verdict_tbl", metadata,
+            Column("Key", String(64), primary_key=True),
+            Column("BaseHash", String(64), nullable=False),
+            Column("CurHash", String(64), nullable=False),
+            Column("SupprHash", String(64), nullable=False),
+            Column("ToolVersion", String(255), nullable=False),
+            Column("Result", Integer, nullable=False),
+            Column("Report", String(255), nullable=False),
+            Column("DateCreated", DateTime)
+        ),
+    ]
+
+
+def compress_report(text, compression):
+    '''
+    returns the compressed utf-8 representation of a report text
+    '''
+    data = text.encode("utf-8")
+    if REPORT_COMPRESSION_LZMA == compression:
+        return lzma.compress(data)
+    if REPORT_COMPRESSION_ZLIB == compression:
+        return zlib.compress(data, 9)
+    raise ValueError("Unknown report compression '{}'".format(compression))
+
+
+def decompress_report(data, compression):
+    '''
+    '''
+    data = bytes(data)
+    if REPORT_COMPRESSION_LZMA == compression:
+        return lzma.decompress(data).decode("utf-8")
+    if REPORT_COMPRESSION_ZLIB == compression:
+        return zlib.decompress(data).decode("utf-8")
+    raise ValueError("Unknown report compression '{}'".format(compression))
+
+
+def is_transient_error(e) -> bool:
+    '''
+    tells whether a failed write may succeed when retried as is, the
+    connection or the server failing rather than the written data
+    '''
+    if isinstance(e, DBAPIError) and e.connection_invalidated:
+        return True
+    return isinstance(e, (OperationalError, InterfaceError, PoolTimeoutError, OSError))
+
+
+class missing_row_error(LookupError):
+    '''
+    a write refers to a row not written yet, as a spooled result update
+    uploaded before the main row of its run, it may succeed later
+    '''
+    pass
+
+
+def is_report_ref(res_details) -> bool:
+    '''
+    tells whether a ResultDetails value refers to the [report table]
+    '''
+    return bool(res_details) and res_details.startswith(REPORT_REF_PREFIX)
+
+
+class pool_stats:
+    '''
+    Connection pool instrumentation. Counters are updated from the
+    pool events and from the session acquisition, so they're safe
+    to be touched by several threads.
+    '''
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.wait_time = .0
+        self.max_wait_time = .0
+
+    def on_connect(self, dbapi_connection, connection_record) -> None:
+        with self._lock:
+            self.connects += 1
+
+    def on_checkout(self, dbapi_connection, connection_record, connection_proxy) -> None:
+        with self._lock:
+            self.checkouts += 1
+            self.in_use += 1
+            if self.in_use > self.peak_in_use:
+                self.peak_in_use = self.in_use
+
+    def on_checkin(self, dbapi_connection, connection_record) -> None:
+        with self._lock:
+            self.checkins += 1
+            self.in_use -= 1
+
+    def add_wait(self, t) -> None:
+        with self._lock:
+            self.wait_time += t
+            if t > self.max_wait_time:
+                self.max_wait_time = t
+
+    def as_dict(self) -> dict:
+        '''
+        returns a snapshot of the counters, wait times are in seconds
+        '''
+        with self._lock:
+            return {
+                "connects": self.connects,
+                "checkouts": self.checkouts,
+                "checkins": self.checkins,
+                "in_use": self.in_use,
+                "peak_in_use": self.peak_in_use,
+                "wait_time": self.wait_time,
+                "max_wait_time": self.max_wait_time,
+            }
+
 
 class wrapper:
     '''
@@ -26,13 +205,27 @@ class wrapper:
         '''
         '''
         self.logger = logger
-        self._connection_timeout = 600
+        self._session = None
+        self._engine = None
         env.read_envfile(dbconfig)
+        self._pool_size = env.int('PoolSize', default=POOL_SIZE_DEFAULT)
+        self._pool_max_overflow = env.int('PoolMaxOverflow', default=POOL_MAX_OVERFLOW_DEFAULT)
+        self._pool_timeout = env.int('PoolTimeout', default=POOL_TIMEOUT_DEFAULT)
+        self._pool_pre_ping = env.bool('PoolPrePing', default=True)
+        self._connection_timeout = env.int('PoolRecycle', default=POOL_RECYCLE_DEFAULT)
+        self._report_compression = env.str('ReportCompression', default=REPORT_COMPRESSION_ZLIB)
+        self.pool_stats = pool_stats()
 
     def _acquire_session(self):
         '''
+        creates a session and checks out its connection, the time
+        spent waiting on the pool is accounted in pool_stats
         '''
-        return self._session()
+        session = self._session()
+        t0 = time.monotonic()
+        session.connection()
+        self.pool_stats.add_wait(time.monotonic() - t0)
+        return session
 
     def _flush_session(self, session) -> None:
         '''
@@ -44,24 +237,81 @@ class wrapper:
         '''
         session.close()
 
-    def _initialize_db_connection(self) -> None:
+    @contextmanager
+    def _session_scope(self, commit=True):
+        '''
+        yields a session which is committed on success, rolled back
+        on error and always returned to the pool
+        '''
+        session = self._acquire_session()
+        try:
+            with trace.span("db.write" if commit else "db.read", "db"):
+                t0 = time.monotonic()
+                yield session
+                if commit:
+                    self._flush_session(session)
+                    metrics.observe("binaryaudit_db_write_duration_seconds", time.monotonic() - t0)
+        except BaseException:
+            session.rollback()
+            raise
+        finally:
+            self._release_session(session)
+
+    def get_identity(self) -> str:
         '''
+        returns the connection URL without the credentials, telling the
+        DBs apart, e.g. the writes spooled for each
         '''
-        connection_url = URL(
+        url = self._build_connection_url().set(username=None, password=None)
+        return url.render_as_string(hide_password=True)
+
+    def _build_connection_url(self):
+        '''
+        '''
+        url_args = dict(
                 drivername=env.str('DriverName'),
-                host=env.str('Server'),
+                host=env.str('Server', default=None),
                 database=env.str('Database'),
-                username=env.str('User'),
-                password=env.str('Password'),
-                query={"driver": env.str('Driver')}
+                username=env.str('User', default=None),
+                password=env.str('Password', default=None)
+        )
+        driver = env.str('Driver', default=None)
+        if driver:
+            url_args["query"] = {"driver": driver}
+        return URL.create(**url_args)
+
+    def _build_engine_args(self, connection_url) -> dict:
+        '''
+        '''
+        engine_args = dict(
+                pool_recycle=self._connection_timeout,
+                pool_pre_ping=self._pool_pre_ping
         )
+        # SQLite pools aren't sized, it's only used for local testing.
+        if not connection_url.drivername.startswith("sqlite"):
+            engine_args.update(
+                    pool_size=self._pool_size,
+                    max_overflow=self._pool_max_overflow,
+                    pool_timeout=self._pool_timeout
+            )
+        return engine_args
+
+    def _initialize_db_connection(self) -> None:
+        '''
+        '''
+        connection_url = self._build_connection_url()
         db_engine = create_engine(
                 connection_url,
-                pool_recycle=self._connection_timeout
+                **self._build_engine_args(connection_url)
         )
+        event.listen(db_engine, "connect", self.pool_stats.on_connect)
+        event.listen(db_engine, "checkout", self.pool_stats.on_checkout)
+        event.listen(db_engine, "checkin", self.pool_stats.on_checkin)
 
         self.logger.note("Initializing database connection")
         metadata = MetaData()
+        own_tables = _define_tables(metadata)
+        metadata.create_all(db_engine, tables=own_tables, checkfirst=True)
         metadata.reflect(
                 db_engine,
                 only=[
@@ -78,7 +328,12 @@ class wrapper:
         self.binaryaudit_product_tbl = db_map.classes.binaryaudit_product_tbl
         self.binaryaudit_abi_checker_transaction_details_tbl = db_map.classes.binaryaudit_abi_checker_transaction_details_tbl
         self.binaryaudit_transaction_main_tbl = db_map.classes.binaryaudit_transaction_main_tbl
+        self.binaryaudit_baseline_chunk_tbl = db_map.classes.binaryaudit_baseline_chunk_tbl
+        self.binaryaudit_report_tbl = db_map.classes.binaryaudit_report_tbl
+        self.binaryaudit_fingerprint_tbl = db_map.classes.binaryaudit_fingerprint_tbl
+        self.binaryaudit_verdict_tbl = db_map.classes.binaryaudit_verdict_tbl
 
+        self._engine = db_engine
         self._session = sessionmaker(bind=db_engine, expire_on_commit=False)
 
     def initialize_db(self) -> None:
@@ -86,6 +341,29 @@ class wrapper:
         '''
         self._initialize_db_connection()
 
+    def close(self) -> None:
+        '''
+        releases all the pooled connections
+        '''
+        if self._engine:
+            self._engine.dispose()
+
+    def get_pool_stats(self) -> dict:
+        '''
+        returns the connection pool counters
+        '''
+        return self.pool_stats.as_dict()
+
+    def log_pool_stats(self) -> None:
+        '''
+        exports the connection pool counters into the log, meant to
+        be called at the end of a run
+        '''
+        st = self.get_pool_stats()
+        self.logger.note("DB pool: checkouts: %d, connects: %d, in use: %d, peak in use: %d, "
+                         "wait: %.3fs, max wait: %.3fs", st["checkouts"], st["connects"], st["in_use"],
+                         st["peak_in_use"], st["wait_time"], st["max_wait_time"])
+
     def is_db_connected(self) -> bool:
         '''
         checks database connection
@@ -101,42 +379,40 @@ class wrapper:
         '''
         product_id = 0
 
-        session = self._acquire_session()
-        record = (
-                session.query(
-                    self.binaryaudit_product_tbl).filter_by(
-                        ProductName=productname,
-                        DerivativeName=derivativename
-                    ).one_or_none()
-        )
-
-        if record is None:
-            prd_record = self.binaryaudit_product_tbl(
-                    ProductName=productname,
-                    DerivativeName=derivativename
-            )
-            session.add(prd_record)
-            self._flush_session(session)
-
+        with self._session_scope() as session:
             record = (
                     session.query(
                         self.binaryaudit_product_tbl).filter_by(
                             ProductName=productname,
                             DerivativeName=derivativename
-                    ).one_or_none())
+                        ).one_or_none()
+            )
+
+            if record is None:
+                prd_record = self.binaryaudit_product_tbl(
+                        ProductName=productname,
+                        DerivativeName=derivativename
+                )
+                session.add(prd_record)
+                self._flush_session(session)
+
+                record = (
+                        session.query(
+                            self.binaryaudit_product_tbl).filter_by(
+                                ProductName=productname,
+                                DerivativeName=derivativename
+                        ).one_or_none())
 
-        self._release_session(session)
-        product_id = record.ProductID
+            product_id = record.ProductID
 
         return product_id
 
-    def insert_main_transaction(self, build_id, product_id, buildurl="", logurl="",
-                                result=TRANSACTION_MAIN_RESULT_PENDING, baseline_id=None) -> None:
+    def _add_main_transaction(self, session, build_id, product_id, buildurl="", logurl="",
+                              result=TRANSACTION_MAIN_RESULT_PENDING, baseline_id=None, date=None) -> None:
         '''
-        inserts new object to the [main table]
         '''
-        session = self._acquire_session()
-        date = datetime.utcnow()
+        if not date:
+            date = datetime.utcnow()
         new_tbl_entry = self.binaryaudit_transaction_main_tbl(
                         BuildID=build_id,
                         DateTimeUTC=date,
@@ -147,7 +423,14 @@ class wrapper:
                         Result=result
         )
         session.add(new_tbl_entry)
-        self._flush_session(session)
+
+    def insert_main_transaction(self, build_id, product_id, buildurl="", logurl="",
+                                result=TRANSACTION_MAIN_RESULT_PENDING, baseline_id=None, date=None) -> None:
+        '''
+        inserts new object to the [main table]
+        '''
+        with self._session_scope() as session:
+            self._add_main_transaction(session, build_id, product_id, buildurl, logurl, result, baseline_id, date)
 
     def insert_ba_baseline_data(self, build_id, product_id, pkg_data, date=None) -> None:
         '''
@@ -155,16 +438,151 @@ class wrapper:
         '''
         if not date:
             date = func.now()
-        session = self._acquire_session()
-        new_tbl_entry = self.binaryaudit_checker_baseline_tbl(
+        with self._session_scope() as session:
+            new_tbl_entry = self.binaryaudit_checker_baseline_tbl(
+                            BuildID=build_id,
+                            ProductID=product_id,
+                            PackageData=pkg_data,
+                            DateCreated=date
+
+            )
+            session.add(new_tbl_entry)
+
+    def _add_ba_transaction_details(self, session, build_id, product_id, item_name, base_version,
+                                    new_version, exec_time, result, res_details, date=None) -> None:
+        '''
+        '''
+        if not date:
+            date = datetime.utcnow()
+        if res_details and not is_report_ref(res_details):
+            res_details = self._store_report(session, res_details)
+        new_tbl_entry = self.binaryaudit_abi_checker_transaction_details_tbl(
+                        DateTimeUTC=date,
                         BuildID=build_id,
                         ProductID=product_id,
-                        PackageData=pkg_data,
-                        DateCreated=date
+                        ItemName=item_name,
+                        BaseVersion=base_version,
+                        NewVersion=new_version,
+                        ExecTimeInMicroSec=exec_time,
+                        Result=result,
+                        ResultDetails=res_details
 
         )
         session.add(new_tbl_entry)
-        self._flush_session(session)
+
+    def _add_fingerprints(self, session, build_id, product_id, item_name, fingerprints) -> None:
+        '''
+        '''
+        for soname, fp in fingerprints.items():
+            session.merge(self.binaryaudit_fingerprint_tbl(
+                    BuildID=build_id,
+                    ProductID=product_id,
+                    ItemName=item_name,
+                    SoName=soname,
+                    Fingerprint=fp
+            ))
+
+    def insert_fingerprints(self, build_id, product_id, item_name, fingerprints) -> None:
+        '''
+        inserts the ABI fingerprints of the DSOs of an item to the
+        [fingerprint table], fingerprints is a dict of soname -> fingerprint
+        '''
+        with self._session_scope() as session:
+            self._add_fingerprints(session, build_id, product_id, item_name, fingerprints)
+
+    def get_fingerprints(self, build_id, product_id, item_name) -> dict:
+        '''
+        returns the ABI fingerprints recorded for an item of the build
+        as a dict of soname -> fingerprint
+        '''
+        tbl = self.binaryaudit_fingerprint_tbl
+        with self._session_scope(commit=False) as session:
+            rows = session.query(tbl.SoName, tbl.Fingerprint).filter_by(
+                    BuildID=build_id, ProductID=product_id, ItemName=item_name)
+            return dict(rows)
+
+    def _add_verdict(self, session, key, base_hash, cur_hash, suppr_hash, tool_version, result, report,
+                     date=None) -> None:
+        '''
+        '''
+        if session.get(self.binaryaudit_verdict_tbl, key) is not None:
+            return
+        if not date:
+            date = datetime.utcnow()
+        if report and not is_report_ref(report):
+            report = self._store_report(session, report)
+        # Agents auditing the same pair race to publish the same verdict.
+        try:
+            with session.begin_nested():
+                session.add(self.binaryaudit_verdict_tbl(
+                        Key=key,
+                        BaseHash=base_hash,
+                        CurHash=cur_hash,
+                        SupprHash=suppr_hash,
+                        ToolVersion=tool_version,
+                        Result=result,
+                        Report=report,
+                        DateCreated=date
+                ))
+        except IntegrityError:
+            pass
+
+    def insert_verdict(self, key, base_hash, cur_hash, suppr_hash, tool_version, result, report) -> None:
+        '''
+        inserts a diff verdict to the [verdict table] unless the key
+        is known already
+        '''
+        with self._session_scope() as session:
+            self._add_verdict(session, key, base_hash, cur_hash, suppr_hash, tool_version, result, report)
+
+    def get_verdicts(self, keys) -> dict:
+        '''
+        returns the known verdicts of the passed keys as a dict of
+        key -> (result, report text)
+        '''
+        keys = list(keys)
+        tbl = self.binaryaudit_verdict_tbl
+        found = {}
+        with self._session_scope(commit=False) as session:
+            for i in range(0, len(keys), LOOKUP_BATCH_SIZE):
+                batch = keys[i:i + LOOKUP_BATCH_SIZE]
+                for row in session.query(tbl.Key, tbl.Result, tbl.Report).filter(tbl.Key.in_(batch)):
+                    found[row.Key] = (row.Result, row.Report)
+        return dict((k, (res, self.get_report(report))) for k, (res, report) in found.items())
+
+    def _store_report(self, session, text) -> str:
+        '''
+        stores a report text once per content hash in the [report
+        table] and returns the reference to be put into ResultDetails
+        '''
+        h = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        if session.get(self.binaryaudit_report_tbl, h) is None:
+            # Another writer might store the same report meanwhile.
+            try:
+                with session.begin_nested():
+                    session.add(self.binaryaudit_report_tbl(
+                            Hash=h,
+                            Compression=self._report_compression,
+                            Size=len(text),
+                            Data=compress_report(text, self._report_compression)
+                    ))
+            except IntegrityError:
+                pass
+        return REPORT_REF_PREFIX + h
+
+    def get_report(self, res_details) -> str:
+        '''
+        returns the report text for a ResultDetails value, resolving
+        references into the [report table]
+        '''
+        if not is_report_ref(res_details):
+            return res_details
+        h = res_details[len(REPORT_REF_PREFIX):]
+        with self._session_scope(commit=False) as session:
+            record = session.get(self.binaryaudit_report_tbl, h)
+            if record is None:
+                raise KeyError("Report '{}' is missing".format(h))
+            return decompress_report(record.Data, record.Compression)
 
     def insert_ba_transaction_details(self,
                                       build_id,
@@ -174,49 +592,191 @@ class wrapper:
                                       new_version,
                                       exec_time,
                                       result,
-                                      res_details) -> None:
+                                      res_details,
+                                      date=None) -> None:
         '''
         inserts new object to the [details table]
         '''
-        session = self._acquire_session()
-        date = datetime.utcnow()
-        new_tbl_entry = self.binaryaudit_abi_checker_transaction_details_tbl(
-                        DateTimeUTC=date,
-                        BuildID=build_id,
-                        ProductID=product_id,
-                        ItemName=item_name,
-                        BaseVersion=base_version,
-                        NewVersion=new_version,
-                        ExecTimeInMicroSec=exec_time,
-                        Result=result,
-                        ResultDetails=res_details
+        with self._session_scope() as session:
+            self._add_ba_transaction_details(session, build_id, product_id, item_name, base_version,
+                                             new_version, exec_time, result, res_details, date)
 
-        )
-        session.add(new_tbl_entry)
-        self._flush_session(session)
+    def _set_ba_test_result(self, session, build_id, product_id, result) -> None:
+        '''
+        '''
+        entry = session.get(self.binaryaudit_transaction_main_tbl, (build_id, product_id))
+        if entry is None:
+            raise missing_row_error("No main row of build '{}' of product {}".format(build_id, product_id))
+        entry.Result = result
 
     def update_ba_test_result(self, build_id, product_id, result) -> None:
         '''
         locates object with corresponding Build ID in the [main table]
         updates the object's Result entity with test outcome
         '''
-        session = self._acquire_session()
-        entry = session.query(self.binaryaudit_transaction_main_tbl).get((build_id, product_id))
-        entry.Result = result
-        self._flush_session(session)
+        with self._session_scope() as session:
+            self._set_ba_test_result(session, build_id, product_id, result)
+
+    def apply_ops(self, ops) -> None:
+        '''
+        applies a batch of deferred write calls within a single
+        transaction, ops is a list of (name, kwargs) with the name
+        being one of SPOOLABLE_OPS
+        '''
+        handlers = {
+            "insert_main_transaction": self._add_main_transaction,
+            "insert_ba_transaction_details": self._add_ba_transaction_details,
+            "update_ba_test_result": self._set_ba_test_result,
+            "insert_fingerprints": self._add_fingerprints,
+            "insert_verdict": self._add_verdict,
+        }
+        with self._session_scope() as session:
+            for name, kwargs in ops:
+                handlers[name](session, **kwargs)
+                # Later ops in the batch may refer to the rows added here.
+                session.flush()
 
     def get_ba_latest_baseline(self, product_id):
         '''
         locates and returns the latest baseline object data
         '''
-        session = self._acquire_session()
-        record = (
-                session.query(
-                    self.binaryaudit_checker_baseline_tbl
-                ).filter_by(
-                    ProductID=product_id,
-                ).order_by(desc("DateCreated"))
-                .first())
-        self._release_session(session)
+        with self._session_scope(commit=False) as session:
+            record = (
+                    session.query(
+                        self.binaryaudit_checker_baseline_tbl
+                    ).filter_by(
+                        ProductID=product_id,
+                    ).order_by(desc("DateCreated"), desc("ID"))
+                    .first())
 
+        if record is None:
+            return None, None
         return record.ID, record.PackageData
+
+    def get_ba_latest_baseline_id(self, product_id):
+        '''
+        locates the latest baseline object and returns its ID only,
+        None if there's no baseline for the product
+        '''
+        tbl = self.binaryaudit_checker_baseline_tbl
+        with self._session_scope(commit=False) as session:
+            record = (
+                    session.query(tbl.ID)
+                    .filter_by(ProductID=product_id)
+                    .order_by(desc("DateCreated"), desc("ID"))
+                    .first())
+        if record is None:
+            return None
+        return record.ID
+
+    def get_ba_baseline_data(self, baseline_id):
+        '''
+        returns the data of a baseline object
+        '''
+        tbl = self.binaryaudit_checker_baseline_tbl
+        with self._session_scope(commit=False) as session:
+            record = session.query(tbl.PackageData).filter_by(ID=baseline_id).one()
+        return record.PackageData
+
+    def get_item_exec_times(self, product_id, limit=HISTORY_ROWS_LIMIT) -> dict:
+        '''
+        returns the most recent execution time in microseconds per
+        item name recorded in the [details table] for the product
+        '''
+        tbl = self.binaryaudit_abi_checker_transaction_details_tbl
+        times = {}
+        with self._session_scope(commit=False) as session:
+            rows = (
+                    session.query(tbl.ItemName, tbl.ExecTimeInMicroSec)
+                    .filter_by(ProductID=product_id)
+                    .order_by(desc("DateTimeUTC"))
+                    .limit(limit))
+            for name, exec_time in rows:
+                if name not in times and exec_time is not None:
+                    times[name] = int(exec_time)
+        return times
+
+    def get_item_failure_counts(self, product_id) -> dict:
+        '''
+        returns the number of incompatible results per item name
+        recorded in the [details table] for the product
+        '''
+        tbl = self.binaryaudit_abi_checker_transaction_details_tbl
+        with self._session_scope(commit=False) as session:
+            rows = (
+                    session.query(tbl.ItemName, func.count(tbl.ItemName))
+                    .filter_by(ProductID=product_id, Result=DETAILS_RESULT_FAILURE)
+                    .group_by(tbl.ItemName))
+            return dict((name, count) for name, count in rows)
+
+    def get_main_transaction_result(self, build_id, product_id):
+        '''
+        returns the Result of the [main table] object for the build,
+        None if the build wasn't recorded
+        '''
+        with self._session_scope(commit=False) as session:
+            entry = session.get(self.binaryaudit_transaction_main_tbl, (build_id, product_id))
+            if entry is None:
+                return None
+            return entry.Result
+
+    def get_ba_transaction_details(self, build_id, product_id, resolve_reports=True) -> list:
+        '''
+        returns the [details table] objects of a build as a list of dicts,
+        the report texts are read back from the [report table] unless
+        resolve_reports is False
+        '''
+        tbl = self.binaryaudit_abi_checker_transaction_details_tbl
+        cols = ["ItemName", "BaseVersion", "NewVersion", "ExecTimeInMicroSec", "Result", "ResultDetails"]
+        with self._session_scope(commit=False) as session:
+            rows = session.query(*[getattr(tbl, c) for c in cols]).filter_by(BuildID=build_id, ProductID=product_id)
+            details = [dict(zip(cols, row)) for row in rows]
+        if resolve_reports:
+            for d in details:
+                d["ResultDetails"] = self.get_report(d["ResultDetails"])
+        return details
+
+    def get_existing_baseline_chunks(self, hashes) -> set:
+        '''
+        returns the subset of the passed chunk hashes already
+        present in the [chunk table]
+        '''
+        hashes = list(hashes)
+        found = set()
+        tbl = self.binaryaudit_baseline_chunk_tbl
+        with self._session_scope(commit=False) as session:
+            for i in range(0, len(hashes), LOOKUP_BATCH_SIZE):
+                batch = hashes[i:i + LOOKUP_BATCH_SIZE]
+                for row in session.query(tbl.Hash).filter(tbl.Hash.in_(batch)):
+                    found.add(row.Hash)
+        return found
+
+    def insert_baseline_chunks(self, chunks) -> None:
+        '''
+        inserts new objects to the [chunk table], chunks is a dict
+        of hash -> (raw size, stored data)
+        '''
+        with self._session_scope() as session:
+            for h, (size, data) in chunks.items():
+                # Publishers missing the same chunk race to upload it, the content is the same.
+                try:
+                    with session.begin_nested():
+                        session.add(self.binaryaudit_baseline_chunk_tbl(Hash=h, Size=size, Data=data))
+                except IntegrityError:
+                    pass
+
+    def iter_baseline_chunks(self, hashes):
+        '''
+        yields the stored data of the requested chunks in the passed
+        order, fetching only a small batch at a time
+        '''
+        hashes = list(hashes)
+        tbl = self.binaryaudit_baseline_chunk_tbl
+        for i in range(0, len(hashes), LOOKUP_BATCH_SIZE):
+            batch = hashes[i:i + LOOKUP_BATCH_SIZE]
+            with self._session_scope(commit=False) as session:
+                rows = dict(session.query(tbl.Hash, tbl.Data).filter(tbl.Hash.in_(set(batch))))
+            for h in batch:
+                if h not in rows:
+                    raise KeyError("Baseline chunk '{}' is missing".format(h))
+                yield rows[h]
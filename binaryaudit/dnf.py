@@ -1,17 +1,27 @@
+import functools
 import json
 import os
 import rpmfile
 import subprocess
+import tempfile
+import threading
 import time
 import urllib.request
 
 from binaryaudit import abicheck
+from binaryaudit import gating
+from binaryaudit import governor
+from binaryaudit import metrics
 from binaryaudit import run
+from binaryaudit import scheduler
+from binaryaudit import trace
 from binaryaudit import util
+from binaryaudit import workspace
 
 
 def process_downloads(source_dir, new_json_file, old_json_file, output_dir,
-                      build_id, product_id, db_conn, remaining_files, all_suppressions):
+                      build_id, product_id, db_conn, remaining_files, all_suppressions, jobs=1,
+                      fail_fast=False, reuse=None, sp=None, coord=None, ws=None):
     ''' Finds and downloads older versions of RPMs.
 
         Parameters:
@@ -23,39 +33,223 @@ def process_downloads(source_dir, new_json_file, old_json_file, output_dir,
             product_id (str): The product id
             db_conn: The db connection
             remianing_files (int): The number of files left after filtering
+            all_suppressions (list): a list of the filepaths to suppression files used
+            jobs (int): The number of source groups to process in parallel
+            fail_fast (bool): Stop at the first incompatible change, riskiest groups first
+            reuse (dict): Package name -> details recorded by a previously aborted run
+            sp (shard.spec): Process only the source groups of this shard
+            coord (workqueue.coordinator): Run the groups on the workers of the coordinator
+            ws (workspace.workspace): The workspace of the run, each group downloads the older versions into it
         Returns:
             overall_status (str): Returns "fail" if an incompatibility is found in at least 1 RPM, otherwise returns "pass"
     '''
     processed_files = 0
-    overall_status = "PASSED"
-    conf_dir = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "conf"))
-    # TODO: move old dir to tmpdir for mariner
-    if not os.path.exists(os.path.join(source_dir, "old")):
-        os.mkdir(os.path.join(source_dir, "old"))
+    if not os.path.exists(output_dir):
+        os.mkdir(output_dir)
     old_rpm_dict = {}
     with open(new_json_file, "r") as file:
         data = json.load(file)
-    for key, values in data.items():
+    hist = scheduler.load_history(db_conn, product_id)
+    governor.setup(hist)
+    jobs = governor.limit_workers(jobs)
+    group_jobs = plan_groups(source_dir, data, all_suppressions, hist, ws)
+    if sp is not None:
+        sp.load_db(db_conn, product_id)
+        group_jobs = sp.select(group_jobs)
+        remaining_files = sum(len(data[j.name]) for j in group_jobs)
+    group_jobs, failed = _reuse_results(group_jobs, reuse)
+
+    order, stop = _get_order(fail_fast, hist)
+    report = scheduler.schedule_report(group_jobs, jobs)
+    fn, on_stop, dispatch_hist, units = _setup_dispatch(coord, group_jobs, order, all_suppressions, hist)
+    for j, (key, ret_status, group_old_rpms, rows) in scheduler.dispatch(group_jobs, fn, jobs, dispatch_hist,
+                                                                         report=report, order=order, stop=stop,
+                                                                         on_stop=on_stop):
+        if coord is not None:
+            scheduler.record_duration(hist, j, _get_unit_usec(units[key]))
         processed_files += len(data[key])
+        if ret_status is not None:
+            # Recorded here rather than in the group, the groups interrupted by a fail fast stop aren't.
+            record_rows(rows, output_dir, build_id, product_id, db_conn)
+            old_rpm_dict[key] = group_old_rpms
+            util.note("Status: %s", ret_status)
+            if ret_status != 0:
+                failed = True
+            if gating.is_fatal(ret_status):
+                for n in j.names:
+                    hist.record_failure(n)
+        util.note("Processed %s of %s files", processed_files, remaining_files)
+    governor.save(hist)
+    hist.save()
+    with open(old_json_file, "w") as outputFile:
+        json.dump(old_rpm_dict, outputFile, indent=2)
+    return gating.get_build_result(failed, report.aborted)
+
+
+def _get_order(fail_fast, hist):
+    ''' Returns the dispatch order of the groups and the check stopping it, riskiest first with fail_fast.
+    '''
+    if fail_fast:
+        return gating.risk_order(hist), _is_fatal_group_result
+    return scheduler.lpt_order, None
+
+
+def _setup_dispatch(coord, group_jobs, order, all_suppressions, hist):
+    ''' Returns the group function, the stop hook and the history of the dispatch, and the units of a coordinated run.
+    '''
+    if coord is None:
+        stopped = threading.Event()
+
+        def on_stop():
+            # The groups in flight don't start any more tools, the ones running are interrupted.
+            stopped.set()
+            run.terminate_children()
+        return functools.partial(process_group, stopped=stopped), on_stop, hist, None
+    # The groups run on the workers, they're collected here as their units complete.
+    units = submit_groups(coord, order(group_jobs), all_suppressions)
+    return _remote_group(units), coord.cancel_pending, None, units
+
+
+def _reuse_results(group_jobs, reuse):
+    ''' Drops the groups whose packages all have a result recorded by a previously aborted run.
+    '''
+    failed = False
+    if not reuse:
+        return group_jobs, failed
+    remaining = []
+    for j in group_jobs:
+        if not all(n in reuse for n in j.names):
+            remaining.append(j)
+            continue
+        for n in j.names:
+            if abicheck.DIFF_OK != gating.get_reused_status(reuse[n]):
+                failed = True
+    return remaining, failed
+
+
+def _is_fatal_group_result(res):
+    key, ret_status, group_old_rpms, rows = res
+    return ret_status is not None and gating.is_fatal(ret_status)
+
+
+def plan_groups(source_dir, data, all_suppressions, hist, ws=None):
+    ''' Creates a job per source group with an estimated duration.
+
+        The history is looked up by the names of the packages abipkgdiff
+        is run on, the group size is used for the estimate otherwise.
+    '''
+    group_jobs = []
+    for key, values in data.items():
+        names = []
+        hist_names = []
+        size = 0
         for value in values:
-            with rpmfile.open(os.path.join(source_dir, value)) as rpm:
+            fn = os.path.join(source_dir, value)
+            with trace.span("rpm.headers", "rpm", file=value), rpmfile.open(fn) as rpm:
                 name = rpm.headers.get("name")
-            old_rpm_name = download(key, source_dir, name, old_rpm_dict)
-        if old_rpm_name == "":
-            util.note("Processed {} of {} files".format(processed_files, remaining_files))
-            continue
-        with open(old_json_file, "w") as outputFile:
-            json.dump(old_rpm_dict, outputFile, indent=2)
-        ret_status = generate_abidiffs(key, source_dir, new_json_file, old_json_file, output_dir,
-                                       conf_dir, build_id, product_id, db_conn, all_suppressions)
-        util.note("Status: {}".format(ret_status))
-        if ret_status != 0:
-            overall_status = "FAILED"
-        util.note("Processed {} of {} files".format(processed_files, remaining_files))
-    return overall_status
-
-
-def download(key, source_dir, name, old_rpm_dict):
+            names.append(name)
+            if "-debuginfo-" not in value and "-devel-" not in value:
+                hist_names.append(name.decode('utf-8'))
+            size += os.path.getsize(fn)
+        args = (key, names, source_dir, data, all_suppressions, ws)
+        group_jobs.append(scheduler.job(key, args, size, hist_names))
+    return scheduler.estimate(group_jobs, hist)
+
+
+def process_group(key, names, source_dir, new_data, all_suppressions, ws=None, stopped=None):
+    ''' Downloads the older versions of a source group and runs abipkgdiff on them.
+
+        The older versions go to a scratch directory of the group in the
+        workspace, removed once compared. The results are returned for the
+        caller to record, see record_rows(). Once the stopped event is set,
+        the group is left unfinished.
+
+        Returns:
+            key (str): The source name for the group of RPMs
+            ret_status (int): The abipkgdiff exit code, None if nothing could be downloaded
+            old_rpms (list): The downloaded older packages
+            rows (list): [name, old VR, new VR, exec time, status, report] per package pair
+    '''
+    old_rpm_dict = {}
+    with workspace.use(ws, "dnf") as ws, ws.scratch(key) as old_dir:
+        try:
+            with run.stoppable(stopped):
+                for name in names:
+                    old_rpm_name = download(key, source_dir, name, old_rpm_dict, old_dir)
+                if old_rpm_name == "":
+                    return key, None, [], []
+                ret_status, rows = _generate_abidiffs(key, source_dir, new_data, old_rpm_dict, old_dir,
+                                                      all_suppressions, old_dir)
+        except run.stopped_error:
+            return key, None, [], []
+    return key, ret_status, old_rpm_dict[key], rows
+
+
+def submit_groups(coord, group_jobs, all_suppressions):
+    ''' Queues an abipkgdiff unit per source group, in the order of the jobs.
+
+        The workers read the packages from the same paths, e.g. on a
+        shared filesystem.
+
+        Returns:
+            units (dict): Source name -> future of the unit
+    '''
+    units = {}
+    for j in group_jobs:
+        key, names, source_dir, data = j.args[:4]
+        units[key] = coord.submit("abipkgdiff", key=key, names=[n.decode("utf-8") for n in names],
+                                  source_dir=os.path.join(os.path.abspath(source_dir), ""),
+                                  new_data={key: data[key]}, suppressions=[os.path.abspath(s) for s in all_suppressions])
+    return units
+
+
+def _get_unit_usec(unit):
+    try:
+        return unit.result()["usec"]
+    except Exception:
+        return 0
+
+
+def _remote_group(units):
+    def collect(key, names, source_dir, new_data, all_suppressions, ws=None):
+        ''' Returns the results of a group run by a worker, the way process_group() does.
+        '''
+        try:
+            res = units[key].result()
+        except Exception as e:
+            util.error("Couldn't process '%s': %s", key, e)
+            return key, abicheck.DIFF_ERROR, [], []
+        return key, res["ret"], res["old_rpms"], res["rows"]
+    return collect
+
+
+def run_group(key, names, source_dir, new_data, all_suppressions):
+    ''' Worker side of process_group().
+
+        Returns:
+            ret_status (int): The abipkgdiff exit code, None if nothing could be downloaded
+            old_rpms (list): The downloaded older packages
+            rows (list): [name, old VR, new VR, exec time, status, report] per package pair
+    '''
+    with workspace.workspace("abipkgdiff") as ws:
+        key, ret_status, old_rpms, rows = process_group(key, [n.encode("utf-8") for n in names], source_dir, new_data,
+                                                        all_suppressions, ws)
+    return ret_status, old_rpms, rows
+
+
+def record_rows(rows, output_dir, build_id, product_id, db_conn):
+    ''' Writes the reports and the DB rows of a group.
+    '''
+    for name, old_VR, new_VR, exec_time, status, out in rows:
+        metrics.inc("binaryaudit_packages", kind="rpm")
+        if "OK" != status:
+            util.note("Incompatibility found between %s - %s and %s - %s", name, old_VR, name, new_VR)
+            with open(os.path.join(output_dir, util.build_diff_filename(name, old_VR, new_VR)), "w") as f:
+                f.write(out)
+        insert_db(db_conn, build_id, product_id, name, old_VR, new_VR, exec_time, status, out)
+
+
+def download(key, source_dir, name, old_rpm_dict, old_dir=None):
     ''' Finds and downloads older versions of RPMs.
 
         Parameters:
@@ -63,26 +257,33 @@ def download(key, source_dir, name, old_rpm_dict):
             source_dir (str): The path to the input directory of RPMs
             name: The name of the RPM
             old_rpm_dict: The dictionary containing the older set of packages
+            old_dir (str): The directory to download into, 'old' in source_dir by default
     '''
-    docker, docker_exit_code = run.run_command_docker(["/usr/bin/dnf", "repoquery", "--quiet", "--latest-limit=1", name],
-                                                      None, subprocess.PIPE)
-    old_rpm_name = docker.stdout.read().decode('utf-8')
+    old_dir = _get_old_dir(source_dir, old_dir)
+    # The span's own name is taken, the package goes by another key.
+    with trace.span("repoquery", "repo", package=name.decode("utf-8")):
+        docker, docker_exit_code = run.run_command_docker(["/usr/bin/dnf", "repoquery", "--quiet", "--latest-limit=1", name],
+                                                          None, subprocess.PIPE)
+        old_rpm_name = docker.stdout.read().decode('utf-8')
     if old_rpm_name == "":
         return old_rpm_name
     old_rpm_name = old_rpm_name.rstrip("\n")
     for i in range(3):
-        docker_loc, docker_loc_exit_code = run.run_command_docker(["/usr/bin/dnf", "repoquery", "--quiet", "--location",
-                                                                  "--latest-limit=1", name], None, subprocess.PIPE)
-        url = docker_loc.stdout.read().decode('utf-8')
+        with trace.span("repoquery", "repo", package=name.decode("utf-8"), location=True):
+            docker_loc, docker_loc_exit_code = run.run_command_docker(["/usr/bin/dnf", "repoquery", "--quiet", "--location",
+                                                                      "--latest-limit=1", name], None, subprocess.PIPE)
+            url = docker_loc.stdout.read().decode('utf-8')
         if url != "":
             break
     url = url.rstrip("\n")
-    util.debug("url: {}".format(url))
+    util.debug("url: %s", url)
     if i == 2:
         return ""
     for j in range(3):
         try:
-            urllib.request.urlretrieve(url, source_dir + "old/" + old_rpm_name)
+            with trace.span("download", "repo", url=url):
+                urllib.request.urlretrieve(url, os.path.join(old_dir, old_rpm_name))
+            metrics.inc("binaryaudit_download_bytes", os.path.getsize(os.path.join(old_dir, old_rpm_name)))
             break
         except Exception:
             pass
@@ -92,6 +293,13 @@ def download(key, source_dir, name, old_rpm_dict):
     return old_rpm_name
 
 
+def _get_old_dir(source_dir, old_dir):
+    if old_dir is None:
+        old_dir = os.path.join(source_dir, "old")
+        os.makedirs(old_dir, exist_ok=True)
+    return old_dir
+
+
 def generate_abidiffs(key, source_dir, new_json_file, old_json_file, output_dir,
                       conf_dir, build_id, product_id, db_conn, all_suppressions):
     ''' Runs abipkgdiff against the grouped packages.
@@ -111,15 +319,23 @@ def generate_abidiffs(key, source_dir, new_json_file, old_json_file, output_dir,
         Returns:
             abipkgdiff_exit_code (int): Returns non-zero if an incompatibility found
     '''
-    # new_... handles the newer set of packages
-    # old_... handles the older set of packages
-    if not os.path.exists(output_dir):
-        os.mkdir(output_dir)
     with open(new_json_file, "r") as new_file:
         new_data = json.load(new_file)
     with open(old_json_file, "r") as old_file:
         old_data = json.load(old_file)
-    rpms_with_so, cmd_supporting_args = sortRPMs(key, source_dir, new_data, old_data)
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir, exist_ok=True)
+    abipkgdiff_exit_code, rows = _generate_abidiffs(key, source_dir, new_data, old_data, output_dir, all_suppressions)
+    record_rows(rows, output_dir, build_id, product_id, db_conn)
+    return abipkgdiff_exit_code
+
+
+def _generate_abidiffs(key, source_dir, new_data, old_data, tmp_dir, all_suppressions, old_dir=None):
+    # new_... handles the newer set of packages
+    # old_... handles the older set of packages
+    # Returns the exit code of the last abipkgdiff run and a row per package pair, see process_group().
+    rows = []
+    rpms_with_so, cmd_supporting_args = sortRPMs(key, source_dir, new_data, old_data, old_dir)
     i = 0
     for rpm in rpms_with_so:
         if i % 2 == 0:
@@ -134,34 +350,43 @@ def generate_abidiffs(key, source_dir, new_json_file, old_json_file, output_dir,
         new_main_rpm = rpm
         for arg in cmd_supporting_args:
             command_list.append(arg)
-        with open("output_file", "w") as output_file:
+        # Per call output file, several groups can be processed at the same time.
+        fd, tmp_out_fn = tempfile.mkstemp(prefix=".abipkgdiff-", dir=tmp_dir)
+        with os.fdopen(fd, "w") as output_file:
             start_time = time.monotonic()
-            abipkgdiff, abipkgdiff_exit_code = run.run_command(command_list, None, output_file)
+            with trace.span("abipkgdiff", "tool", group=key):
+                abipkgdiff_exit_code, sout, serr = governor.run_tool(command_list, "abipkgdiff", key,
+                                                                     [old_main_rpm, new_main_rpm],
+                                                                     stdout=output_file, stderr=None)
+            util.debug("command: %s, exit_code: %s", command_list, abipkgdiff_exit_code)
             end_time = time.monotonic()
-            exec_time = (end_time-start_time)*1000000
-            with rpmfile.open(old_main_rpm) as rpm:
-                name = rpm.headers.get('name').decode('utf-8')
-                old_version = rpm.headers.get('version').decode('utf-8')
-                old_release = rpm.headers.get('release').decode('utf-8')
-            with rpmfile.open(new_main_rpm) as rpm:
-                new_version = rpm.headers.get('version').decode('utf-8')
-                new_release = rpm.headers.get('release').decode('utf-8')
-            old_VR = old_version + "-" + old_release
-            new_VR = new_version + "-" + new_release
-            out = ""
-            if abipkgdiff_exit_code != 0:
-                util.note("Incompatibility found between {} - {} and {} - {}".format(name, old_VR, name, new_VR))
-                fileName = util.build_diff_filename(name, old_VR, new_VR)
-                outFilePath = os.path.join(output_dir, fileName)
-                os.rename("output_file", outFilePath)
-                with open(outFilePath) as f:
-                    out = f.read()
-        status = abicheck.diff_get_bit(abipkgdiff_exit_code)
-        insert_db(db_conn, build_id, product_id, name, old_VR, new_VR, exec_time, status, out)
-    return abipkgdiff_exit_code
+        exec_time = (end_time-start_time)*1000000
+        metrics.observe("binaryaudit_tool_duration_seconds", end_time - start_time, tool="abipkgdiff")
+        name, old_VR, new_VR = _get_name_and_versions(old_main_rpm, new_main_rpm)
+        out = ""
+        if abipkgdiff_exit_code != 0:
+            with open(tmp_out_fn) as f:
+                out = f.read()
+        os.unlink(tmp_out_fn)
+        rows.append([name, old_VR, new_VR, exec_time, abicheck.diff_get_bit(abipkgdiff_exit_code), out])
+    return abipkgdiff_exit_code, rows
 
 
-def sortRPMs(key, source_dir, new_data, old_data):
+@trace.traced("rpm.headers", "rpm")
+def _get_name_and_versions(old_main_rpm, new_main_rpm):
+    with rpmfile.open(old_main_rpm) as rpm:
+        name = rpm.headers.get('name').decode('utf-8')
+        old_version = rpm.headers.get('version').decode('utf-8')
+        old_release = rpm.headers.get('release').decode('utf-8')
+    with rpmfile.open(new_main_rpm) as rpm:
+        new_version = rpm.headers.get('version').decode('utf-8')
+        new_release = rpm.headers.get('release').decode('utf-8')
+    old_VR = old_version + "-" + old_release
+    new_VR = new_version + "-" + new_release
+    return name, old_VR, new_VR
+
+
+def sortRPMs(key, source_dir, new_data, old_data, old_dir=None):
     ''' Sorts the RPMs depnding on whether or not they have
         "debuginfo" or "devel" in their name.
 
@@ -170,11 +395,13 @@ def sortRPMs(key, source_dir, new_data, old_data):
             source_dir (str): The path to the input directory of RPMs
             new_data (dict): The dictionary containing the newer set of packages
             old_data (dict): The dictionary containing the older set of packages
+            old_dir (str): The directory of the older packages, 'old' in source_dir by default
 
     Returns:
             rpms_with_so (list): The list of RPMs not containing "debuginfo" or "devel" in their name
             cmd_supporting_args (list): The list of RPMs containing "debuginfo" or "devel" in their name
     '''
+    old_dir = _get_old_dir(source_dir, old_dir)
     rpms_with_so = []
     cmd_supporting_args = []
     count = -1
@@ -182,16 +409,16 @@ def sortRPMs(key, source_dir, new_data, old_data):
         count += 1
         if "-debuginfo-" in value:
             cmd_supporting_args.append("--d1")
-            cmd_supporting_args.append(source_dir + "old/" + value)
+            cmd_supporting_args.append(os.path.join(old_dir, value))
             cmd_supporting_args.append("--d2")
             cmd_supporting_args.append(source_dir + new_data[key][count])
         elif "-devel-" in value:
             cmd_supporting_args.append("--devel1")
-            cmd_supporting_args.append(source_dir + "old/" + value)
+            cmd_supporting_args.append(os.path.join(old_dir, value))
             cmd_supporting_args.append("--devel2")
             cmd_supporting_args.append(source_dir + new_data[key][count])
         else:
-            rpms_with_so.append(source_dir + "old/" + value)
+            rpms_with_so.append(os.path.join(old_dir, value))
             rpms_with_so.append(source_dir + new_data[key][count])
     return rpms_with_so, cmd_supporting_args
 
@@ -210,11 +437,11 @@ def insert_db(db_conn, build_id, product_id, name, old_VR, new_VR, exec_time, st
             status (str): The status output of abipkgdiff
             out (str): The output of abipkgdiff
     '''
+    if not db_conn:
+        util.debug("Not connected")
+        return
     try:
-        if db_conn.is_db_connected:
-            db_conn.insert_ba_transaction_details(build_id, product_id, name, old_VR, new_VR, exec_time, status, out)
-            util.debug("Inserted into database: {}".format(name))
-        else:
-            util.debug("Not connected")
-    except Exception:
-        pass
+        db_conn.insert_ba_transaction_details(build_id, product_id, name, old_VR, new_VR, exec_time, status, out)
+        util.debug("Inserted into database: %s", name)
+    except Exception as e:
+        util.error("Couldn't record the result for '%s': %s", name, e)
@@ -0,0 +1,83 @@
+# Standard library only, this is imported by the ELF checks run once per file
+# from the build hooks, where the startup time adds up.
+import sys
+
+ELF_MAGIC = b"\177ELF"
+# e_ident plus e_type
+_HEADER_SIZE = 18
+
+# e_type values
+ELF_TYPES = {
+    0: "none",
+    1: "rel",
+    2: "exec",
+    3: "dyn",
+    4: "core",
+}
+# Classification of a file that isn't an ELF artifact, or couldn't be read.
+NOT_ELF = "not-elf"
+UNREADABLE = "error"
+
+
+def is_elf(fn):
+    with open(fn, "rb") as fd:
+        head = fd.read(4)
+    return head == ELF_MAGIC
+
+
+def classify(fn):
+    ''' Returns the ELF type of a file by its header.
+
+        Parameters:
+            fn (str): The path to the file
+
+        Returns:
+            type (str): One of ELF_TYPES, "other" for a processor or OS specific type,
+                NOT_ELF or UNREADABLE
+    '''
+    try:
+        with open(fn, "rb") as fd:
+            head = fd.read(_HEADER_SIZE)
+    except OSError:
+        return UNREADABLE
+    if head[:4] != ELF_MAGIC:
+        return NOT_ELF
+    if len(head) < _HEADER_SIZE:
+        return UNREADABLE
+    # EI_DATA, 2 is big endian
+    e_type = int.from_bytes(head[16:18], "big" if 2 == head[5] else "little")
+    return ELF_TYPES.get(e_type, "other")
+
+
+def classify_stream(paths, out=sys.stdout, flush=False):
+    ''' Writes a "<type>\\t<path>" line per path.
+
+        Parameters:
+            paths: Iterable of paths, e.g. the lines read from stdin
+            out: The stream to write to
+            flush (bool): Flush after each line, for a caller waiting on the answers one by one
+
+        Returns:
+            count (int): The number of files classified
+    '''
+    count = 0
+    for fn in paths:
+        fn = fn.rstrip("\n")
+        if not fn:
+            continue
+        out.write("{}\t{}\n".format(classify(fn), fn))
+        if flush:
+            out.flush()
+        count += 1
+    return count
+
+
+def main(args):
+    ''' Runs "binaryaudit elf", returns the exit status.
+    '''
+    if args.paths:
+        classify_stream(args.paths)
+    else:
+        # Answer line by line, the caller may be waiting on each before sending the next.
+        classify_stream(sys.stdin, flush=True)
+    return 0
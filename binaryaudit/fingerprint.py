@@ -0,0 +1,150 @@
+import hashlib
+import io
+import re
+from xml.etree import ElementTree
+
+# Bumped whenever the canonical form changes, fingerprints of different
+# versions never compare equal.
+FINGERPRINT_VERSION = "2"
+
+# Where the entity was declared, not what it is.
+LOCATION_ATTRS = frozenset(["path", "comp-dir-path", "filepath", "line", "column", "language"])
+# Per corpus and per translation unit data that isn't part of the ABI.
+CORPUS_IGNORED_ATTRS = frozenset(["path", "version", "tracking-non-reachable-types"])
+# The elements whose children are the entries of the ABI, hashed as a multiset.
+CONTAINER_TAGS = frozenset(["abi-corpus", "abi-instr", "elf-function-symbols", "elf-variable-symbols",
+                            "elf-needed", "namespace-decl"])
+
+# The elements qualifying the names of the types declared within.
+SCOPE_TAGS = frozenset(["namespace-decl", "class-decl", "union-decl"])
+
+_TYPE_ID_RE = re.compile(r"^type-id-\d+$")
+
+
+def _open(source):
+    if isinstance(source, str) and not source.lstrip().startswith("<"):
+        return open(source, "rb")
+    if isinstance(source, str):
+        source = source.encode("utf-8")
+    return io.BytesIO(source)
+
+
+def _is_ref(value):
+    return _TYPE_ID_RE.match(value) is not None
+
+
+def _attrs(el):
+    ignored = CORPUS_IGNORED_ATTRS if el.tag in ("abi-corpus", "abi-instr") else LOCATION_ATTRS
+    return sorted((k, v) for k, v in el.attrib.items() if k != "id" and k not in ignored)
+
+
+def _shape(el):
+    ''' Canonical text of an element with the type references left in place,
+        the children are kept in document order as it's significant for
+        members and parameters.
+    '''
+    parts = [el.tag]
+    for k, v in _attrs(el):
+        parts.append("{}={}".format(k, v))
+    for child in el:
+        parts.append("(" + _shape(child) + ")")
+    return " ".join(parts)
+
+
+def _substitute(shape, labels):
+    def repl(m):
+        return labels.get(m.group(0), m.group(0))
+    return re.sub(r"type-id-\d+", repl, shape)
+
+
+def _digest(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class canonicalizer:
+    ''' Streams an abixml document and reduces it to its ABI fingerprint.
+
+        The type ids are replaced by labels independent of the numbering:
+        a type starts out labeled by its name, if it has one, and the labels
+        are refined by the structure of the types until that tells no more
+        of them apart, so two types of the same name stay distinct. The
+        entries of the corpus are hashed individually and combined as a
+        sorted multiset, so neither the element order nor the grouping into
+        translation units matters.
+    '''
+    def __init__(self):
+        self.soname = ""
+        self.corpus_attrs = []
+        self._shapes = {}
+        self._entries = []
+
+    def feed(self, f):
+        stack = []
+        for event, el in ElementTree.iterparse(f, events=("start", "end")):
+            if "start" == event:
+                stack.append(el)
+                continue
+            stack.pop()
+            if "abi-corpus" == el.tag:
+                self.soname = el.attrib.get("soname", "")
+                self.corpus_attrs = _attrs(el)
+            elif el.tag not in CONTAINER_TAGS:
+                self._end(el, stack)
+
+    def _end(self, el, stack):
+        scope = "::".join(a.attrib.get("name", "") for a in stack if a.tag in SCOPE_TAGS)
+        type_id = el.attrib.get("id")
+        if type_id is not None and _is_ref(type_id):
+            name = el.attrib.get("name")
+            self._shapes[type_id] = (scope + "::" + name if name else None, scope + " " + _shape(el))
+        if stack and stack[-1].tag in CONTAINER_TAGS:
+            self._entries.append(scope + " " + _shape(el))
+            # The entry is consumed, drop its subtree.
+            el.clear()
+            stack[-1].remove(el)
+
+    def _labels(self):
+        labels = {}
+        for type_id, (name, shape) in self._shapes.items():
+            labels[type_id] = "named:" + name if name else "anon"
+        # Each round splits the types whose structure differs, it's done once
+        # a round splits none. That can take as many rounds as there are types.
+        classes = len(set(labels.values()))
+        for _ in range(len(self._shapes)):
+            labels = {type_id: _digest(labels[type_id] + " " + _substitute(shape, labels))
+                      for type_id, (name, shape) in self._shapes.items()}
+            refined = len(set(labels.values()))
+            if refined == classes:
+                break
+            classes = refined
+        return labels
+
+    def digest(self):
+        labels = self._labels()
+        entries = sorted(_digest(_substitute(shape, labels)) for shape in self._entries)
+        h = hashlib.sha256()
+        h.update("{}\n{}\n".format(FINGERPRINT_VERSION, self.corpus_attrs).encode("utf-8"))
+        for e in entries:
+            h.update(e.encode("ascii"))
+        return h.hexdigest()
+
+
+def fingerprint(source):
+    ''' Computes the ABI fingerprint of an abixml document.
+
+        Parameters:
+            source: Path to an abixml file, or the XML itself as str or bytes
+
+        Returns:
+            fingerprint (str): Hex digest, equal for documents describing the same ABI
+    '''
+    c = canonicalizer()
+    with _open(source) as f:
+        c.feed(f)
+    return c.digest()
+
+
+def same_abi(fp_a, fp_b):
+    ''' Tells whether two fingerprints prove the ABIs identical, an unknown fingerprint proves nothing.
+    '''
+    return fp_a is not None and fp_a == fp_b
@@ -0,0 +1,72 @@
+from binaryaudit import abicheck
+from binaryaudit import util
+from binaryaudit.db import TRANSACTION_MAIN_RESULT_ABORTED, TRANSACTION_MAIN_RESULT_FAILED
+from binaryaudit.db import TRANSACTION_MAIN_RESULT_PASSED, TRANSACTION_MAIN_RESULT_PENDING
+
+
+def risk_order(hist, changed=None):
+    ''' Returns a job ordering for the fail fast mode.
+
+        Jobs of items which failed most often come first, then the ones
+        changed since the baseline. Within the same risk the shorter jobs
+        go first, so more items are checked early.
+
+        Parameters:
+            hist (history): History with the failure counts
+            changed (dict): Job name -> whether the item changed since the baseline
+    '''
+    if changed is None:
+        changed = {}
+
+    def order(jobs):
+        def key(j):
+            failures = max([hist.get_failures(n) for n in j.names])
+            return (-failures, not changed.get(j.name, True), j.estimate, j.name)
+        return sorted(jobs, key=key)
+    return order
+
+
+def is_fatal(ret):
+    ''' Tells whether a libabigail return status is a gating failure.
+    '''
+    return abicheck.diff_is_incompatible_change(ret)
+
+
+def get_build_result(failed, aborted):
+    if aborted:
+        return TRANSACTION_MAIN_RESULT_ABORTED
+    if failed:
+        return TRANSACTION_MAIN_RESULT_FAILED
+    return TRANSACTION_MAIN_RESULT_PASSED
+
+
+def begin_run(db_conn, build_id, product_id, buildurl="", logurl="", baseline_id=None):
+    ''' Records the start of a run in the main table.
+
+        A build previously aborted in the fail fast mode is resumed
+        instead, its already recorded details can be reused.
+
+        Returns:
+            reuse (dict): Item name -> recorded details of the aborted run
+    '''
+    prior = db_conn.get_main_transaction_result(build_id, product_id)
+    if prior is None:
+        db_conn.insert_main_transaction(build_id, product_id, buildurl, logurl,
+                                        TRANSACTION_MAIN_RESULT_PENDING, baseline_id)
+        return {}
+
+    reuse = {}
+    if TRANSACTION_MAIN_RESULT_ABORTED == prior:
+        for row in db_conn.get_ba_transaction_details(build_id, product_id, False):
+            reuse[row["ItemName"]] = row
+        util.note("Resuming aborted build '%s', reusing %s results", build_id, len(reuse))
+    else:
+        util.warn("Build '%s' is already recorded as '%s', running it again", build_id, prior)
+    db_conn.update_ba_test_result(build_id, product_id, TRANSACTION_MAIN_RESULT_PENDING)
+    return reuse
+
+
+def get_reused_status(row):
+    ''' Returns the libabigail return status of a reused details row.
+    '''
+    return abicheck.diff_from_bit(row["Result"])
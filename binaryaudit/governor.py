@@ -0,0 +1,365 @@
+import math
+import multiprocessing
+import os
+import resource
+import signal
+import subprocess
+import threading
+
+from binaryaudit import conf
+from binaryaudit import metrics
+from binaryaudit import run
+from binaryaudit import util
+
+# Share of the available memory the tool processes may reserve together.
+MEMORY_FRACTION_DEFAULT = 0.8
+# Fallback peak RSS prediction of a tool run without history, per input byte.
+RSS_PER_BYTE_DEFAULT = 8
+# Smallest reservation, the tools need some memory even for tiny inputs.
+RSS_MIN_DEFAULT = 256 * 1024 * 1024
+# The address space limit of a tool process relative to its reservation, 0
+# disables the limit. The address space is well above the RSS with all the
+# mappings, the limit is there to stop a run far off its prediction. Off by
+# default, thread stacks and malloc arenas make a tool hit it far below
+# its RSS prediction.
+ADDRESS_SPACE_FACTOR_DEFAULT = 0
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+
+# The error bit of the libabigail tools' exit status.
+_TOOL_ERROR = 1
+
+
+def _get_governor_config(key, default):
+    try:
+        return conf.get_config("Governor", key)
+    except KeyError:
+        return default
+
+
+def _cgroup_dirs():
+    ''' Returns the cgroup v2 directories of this process, innermost first.
+    '''
+    try:
+        with open("/proc/self/cgroup", "r") as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return []
+    path = None
+    for ln in lines:
+        if ln.startswith("0::"):
+            path = ln[3:].strip("/")
+    if path is None:
+        return []
+    dirs = []
+    parts = path.split("/") if path else []
+    while parts:
+        dirs.append(os.path.join(CGROUP_ROOT, *parts))
+        parts.pop()
+    return dirs
+
+
+def _read_cgroup_file(d, name):
+    try:
+        with open(os.path.join(d, name), "r") as f:
+            return f.read().split()
+    except OSError:
+        return None
+
+
+def get_memory_available():
+    ''' Returns the memory in bytes available to this process, taking the
+        cgroup v2 limits into account.
+    '''
+    available = None
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for ln in f:
+                if ln.startswith("MemAvailable:"):
+                    available = int(ln.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    if available is None:
+        available = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_AVPHYS_PAGES")
+    for d in _cgroup_dirs():
+        limit = _read_cgroup_file(d, "memory.max")
+        current = _read_cgroup_file(d, "memory.current")
+        if limit and current and "max" != limit[0]:
+            available = min(available, max(0, int(limit[0]) - int(current[0])))
+    return available
+
+
+def get_cpu_limit():
+    ''' Returns the number of CPUs the cgroup v2 CPU quotas allow, None if unlimited.
+    '''
+    cpus = None
+    for d in _cgroup_dirs():
+        quota = _read_cgroup_file(d, "cpu.max")
+        if quota and "max" != quota[0]:
+            allowed = max(1, math.ceil(int(quota[0]) / int(quota[1])))
+            cpus = allowed if cpus is None else min(cpus, allowed)
+    return cpus
+
+
+def limit_workers(workers):
+    ''' Caps the number of workers to the CPU quota of the cgroup.
+
+        The CPUs of the host aren't a limit, -j is up to the user there.
+    '''
+    cpus = get_cpu_limit()
+    if cpus is not None and workers > cpus:
+        util.note("Limiting the jobs from %d to the CPU quota of %d", workers, cpus)
+        return cpus
+    return workers
+
+
+class budget:
+    ''' Memory reserved by the tool processes running, shared by the pool workers.
+
+        A reservation larger than the whole budget is cut down to it, the
+        tool then runs alone.
+
+        Parameters:
+            total (int): The memory in bytes the tools may use together
+            ctx: The multiprocessing context of the pool
+    '''
+    def __init__(self, total, ctx=None):
+        if ctx is None:
+            ctx = multiprocessing.get_context()
+        self.total = total
+        self._used = ctx.Value("q", 0, lock=False)
+        self._running = ctx.Value("i", 0, lock=False)
+        self._exclusive = ctx.Value("i", 0, lock=False)
+        self._cond = ctx.Condition()
+
+    def acquire(self, size, exclusive=False):
+        ''' Waits until the memory is available and reserves it.
+
+            Parameters:
+                size (int): The predicted peak RSS in bytes
+                exclusive (bool): Wait for all the other tools to finish and reserve the whole budget
+
+            Returns:
+                reserved (int): The bytes reserved, to pass to release()
+        '''
+        size = self.total if exclusive else min(size, self.total)
+        with self._cond:
+            if exclusive:
+                # Keep new runs from starting meanwhile.
+                self._exclusive.value += 1
+                self._cond.wait_for(lambda: 0 == self._running.value)
+                self._exclusive.value -= 1
+            else:
+                self._cond.wait_for(lambda: 0 == self._running.value or
+                                    (0 == self._exclusive.value and self._used.value + size <= self.total))
+            self._used.value += size
+            self._running.value += 1
+        return size
+
+    def release(self, reserved):
+        with self._cond:
+            self._used.value -= reserved
+            self._running.value -= 1
+            self._cond.notify_all()
+
+
+class governor:
+    ''' Runs the tool processes within a memory budget.
+
+        The peak RSS of a run is predicted from its history, or from its
+        input size if there's none, and reserved from the budget for the
+        run's duration. The run's address space is optionally limited to a
+        multiple of the reservation. A run killed, likely by the OOM killer,
+        or failing under the limit is retried alone, without the limit.
+
+        Parameters:
+            budget (budget): The budget shared with the other workers
+            peak_rss (dict): Peak RSS in bytes recorded by the previous runs, by "tool:key"
+            worker (bool): The governor of a pool worker process, its measurements
+                are handed back to the parent with drain_worker()
+    '''
+    def __init__(self, budget, peak_rss=None, worker=False):
+        self.budget = budget
+        self.peak_rss = dict(peak_rss) if peak_rss else {}
+        self.worker = worker
+        self.rss_per_byte = float(_get_governor_config("rss_per_byte", RSS_PER_BYTE_DEFAULT))
+        self.rss_min = int(_get_governor_config("rss_min", RSS_MIN_DEFAULT))
+        self.as_factor = float(_get_governor_config("address_space_factor", ADDRESS_SPACE_FACTOR_DEFAULT))
+        self._observed = {}
+        self._lock = threading.Lock()
+
+    def predict(self, name, inputs):
+        ''' Returns the predicted peak RSS in bytes of a tool run.
+        '''
+        with self._lock:
+            known = self._observed.get(name, self.peak_rss.get(name))
+        if known is not None:
+            return max(self.rss_min, known)
+        size = 0
+        for fn in inputs:
+            try:
+                size += os.path.getsize(fn)
+            except OSError:
+                pass
+        return max(self.rss_min, int(size * self.rss_per_byte))
+
+    def _limit(self, reserved):
+        if self.as_factor <= 0:
+            return None
+        return int(reserved * self.as_factor)
+
+    def _run_once(self, cmd, reserved, stdout, stderr, limited=True):
+        limit = self._limit(reserved) if limited else None
+        process = run.popen(cmd, rusage=True, stdout=stdout, stderr=stderr)
+        if limit is not None:
+            # Set from here rather than in a preexec_fn, which isn't safe to run in a threaded process.
+            try:
+                resource.prlimit(process.pid, resource.RLIMIT_AS, (limit, limit))
+            except ProcessLookupError:
+                pass
+        sout, serr = run.wait_child(process)
+        return process, sout, serr, limit
+
+    def _retry_reason(self, process, limit):
+        ''' Tells why a tool run is worth a retry alone, None if it isn't.
+
+            A tool hitting the address space limit usually fails with an
+            error status, or aborts with its RSS still low, so any failure
+            under the limit may be the governor's doing.
+        '''
+        if signal.SIGKILL == -process.returncode:
+            return "ran out of memory"
+        if limit is not None and (process.returncode < 0 or process.returncode & _TOOL_ERROR):
+            return "failed under its address space limit"
+        return None
+
+    def run(self, cmd, tool, key, inputs, stdout=subprocess.PIPE, stderr=subprocess.STDOUT):
+        ''' Runs a tool process within the budget.
+
+            Parameters:
+                cmd (list): The command
+                tool (str): The tool name
+                key (str): Identifies the input across runs, for the history
+                inputs (list): The input files, to predict from their size
+                stdout, stderr: As for subprocess.Popen, a file is rewound when the run is retried
+
+            Returns:
+                returncode (int), sout, serr
+        '''
+        name = "{}:{}".format(tool, key)
+        reserved = self.budget.acquire(self.predict(name, inputs))
+        try:
+            process, sout, serr, limit = self._run_once(cmd, reserved, stdout, stderr)
+        finally:
+            self.budget.release(reserved)
+        reason = self._retry_reason(process, limit)
+        if reason is not None:
+            util.warn("%s on '%s' %s, retrying it alone", tool, key, reason)
+            metrics.inc("binaryaudit_tool_oom_retries", tool=tool)
+            _rewind(stdout)
+            _rewind(stderr)
+            reserved = self.budget.acquire(0, exclusive=True)
+            try:
+                process, sout, serr, limit = self._run_once(cmd, reserved, stdout, stderr, limited=False)
+            finally:
+                self.budget.release(reserved)
+        if process.rusage is not None:
+            with self._lock:
+                self._observed[name] = process.rusage.ru_maxrss * 1024
+        return process.returncode, sout, serr
+
+    def drain(self):
+        with self._lock:
+            observed, self._observed = self._observed, {}
+            self.peak_rss.update(observed)
+        return observed
+
+    def merge(self, observed):
+        with self._lock:
+            self._observed.update(observed)
+
+
+def _rewind(f):
+    if hasattr(f, "seek"):
+        f.seek(0)
+        f.truncate()
+
+
+_governor = None
+
+
+def setup(hist=None, ctx=None):
+    ''' Sets the governor of this process up, with a budget from the memory
+        available now.
+
+        Parameters:
+            hist (scheduler.history): Optional history with the peak RSS of the previous runs
+            ctx: The multiprocessing context of the pool workers sharing the budget
+
+        Returns:
+            governor (governor): None if disabled in the config
+    '''
+    global _governor
+    fraction = float(_get_governor_config("memory_fraction", MEMORY_FRACTION_DEFAULT))
+    if fraction <= 0:
+        _governor = None
+        return None
+    total = int(get_memory_available() * fraction)
+    util.debug("Memory budget of the tools: %d bytes", total)
+    _governor = governor(budget(total, ctx), hist.peak_rss if hist is not None else None)
+    return _governor
+
+
+def get_state():
+    ''' Returns what a pool worker needs to run with the governor of this process.
+    '''
+    if _governor is None:
+        return None
+    return _governor.budget, _governor.peak_rss
+
+
+def install(state, worker=False):
+    ''' Sets the governor of a pool worker up from get_state() of the parent.
+    '''
+    global _governor
+    _governor = governor(*state, worker=worker) if state is not None else None
+
+
+def run_tool(cmd, tool, key, inputs, stdout=subprocess.PIPE, stderr=subprocess.STDOUT):
+    ''' Runs a tool process through the governor if set up, directly otherwise.
+
+        Returns:
+            returncode (int), sout, serr
+    '''
+    g = _governor
+    if g is not None:
+        return g.run(cmd, tool, key, inputs, stdout, stderr)
+    process = run.popen(cmd, stdout=stdout, stderr=stderr)
+    sout, serr = run.wait_child(process)
+    return process.returncode, sout, serr
+
+
+def drain_worker():
+    ''' Returns the peak RSS measured in a pool worker since the last call,
+        None outside of a worker.
+    '''
+    g = _governor
+    if g is None or not g.worker:
+        return None
+    return g.drain()
+
+
+def merge(observed):
+    g = _governor
+    if g is not None and observed:
+        g.merge(observed)
+
+
+def save(hist):
+    ''' Records the peak RSS measured during the run into the history.
+    '''
+    g = _governor
+    if g is None:
+        return
+    for name, rss in g.drain().items():
+        hist.record_peak_rss(name, rss)
@@ -1,29 +1,16 @@
-import os
-import shutil
-
 from binaryaudit import conf
 from binaryaudit import abicheck
 from binaryaudit import dnf
+from binaryaudit import workspace
 
 
-def binary_audit(source_dir, output_dir, build_id, product_id, db_conn, use_suppressions, cleanup):
-    new_json_file = conf.get_config("Mariner", "new_json_file_name")
-    old_json_file = conf.get_config("Mariner", "old_json_file_name")
-    try:
+def binary_audit(source_dir, output_dir, build_id, product_id, db_conn, use_suppressions, cleanup, jobs=1,
+                 fail_fast=False, reuse=None, sp=None, coord=None):
+    # The package lists and the older versions go to the workspace of the run, kept if cleanup is disabled.
+    with workspace.workspace("mariner", keep=cleanup is not True) as ws:
+        new_json_file = ws.path(conf.get_config("Mariner", "new_json_file_name"))
+        old_json_file = ws.path(conf.get_config("Mariner", "old_json_file_name"))
         remaining_files = abicheck.generate_package_json(source_dir, new_json_file)
-        result = dnf.process_downloads(source_dir, new_json_file, old_json_file, output_dir,
-                                       build_id, product_id, db_conn, remaining_files, use_suppressions)
-    finally:
-        cleanup_temp(cleanup, source_dir, new_json_file, old_json_file)
-    return result
-
-
-def cleanup_temp(cleanup, source_dir, new_json_file, old_json_file):
-    if cleanup is True:
-        try:
-            shutil.rmtree(os.path.join(source_dir, "old"))
-            os.remove(new_json_file)
-            os.remove(old_json_file)
-            os.remove("output_file")
-        except OSError:
-            pass
+        return dnf.process_downloads(source_dir, new_json_file, old_json_file, output_dir,
+                                     build_id, product_id, db_conn, remaining_files, use_suppressions, jobs,
+                                     fail_fast, reuse, sp, coord, ws)
@@ -0,0 +1,235 @@
+import math
+import os
+import resource
+import threading
+import time
+
+from binaryaudit import conf
+
+# Upper bounds in seconds, tool runs range from milliseconds for small
+# libraries to many minutes for big packages.
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+COUNTER = "counter"
+GAUGE = "gauge"
+HISTOGRAM = "histogram"
+
+# name -> (type, help)
+METRICS = {
+    "binaryaudit_runs": (COUNTER, "Audit runs by build result."),
+    "binaryaudit_packages": (COUNTER, "Packages or recipes audited."),
+    "binaryaudit_packages_per_second": (GAUGE, "Audited packages per second of the last run."),
+    "binaryaudit_run_duration_seconds": (GAUGE, "Wall clock duration of the last run."),
+    "binaryaudit_tool_duration_seconds": (HISTOGRAM, "Latency of the abidw, abidiff and abipkgdiff runs."),
+    "binaryaudit_tool_oom_retries": (COUNTER, "Tool runs retried alone, out of memory or failed under the limit."),
+    "binaryaudit_cache_lookups": (COUNTER, "Cache lookups by cache and result."),
+    "binaryaudit_download_bytes": (COUNTER, "Bytes of packages downloaded."),
+    "binaryaudit_db_write_duration_seconds": (HISTOGRAM, "Latency of the DB write transactions."),
+    "binaryaudit_peak_rss_bytes": (GAUGE, "Peak resident set size of the process and of its children."),
+}
+
+
+def get_textfile():
+    try:
+        return conf.get_config("Metrics", "textfile") or None
+    except KeyError:
+        return None
+
+
+class _histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = .0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+    def merge(self, other):
+        for i, c in enumerate(other.counts):
+            self.counts[i] += c
+        self.count += other.count
+        self.sum += other.sum
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+class registry:
+    ''' Process wide store of the run metrics, written out in the Prometheus text format.
+
+        Parameters:
+            worker (bool): The registry of a pool worker process, its values are
+                handed back to the parent with drain_worker()
+    '''
+    def __init__(self, worker=False):
+        self.worker = worker
+        self.started = time.monotonic()
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        k = _key(name, labels)
+        with self._lock:
+            self._values[k] = self._values.get(k, 0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._values[_key(name, labels)] = value
+
+    def observe(self, name, value, **labels):
+        k = _key(name, labels)
+        with self._lock:
+            h = self._values.get(k)
+            if h is None:
+                h = self._values[k] = _histogram(DURATION_BUCKETS)
+            h.observe(value)
+
+    def get(self, name, **labels):
+        with self._lock:
+            return self._values.get(_key(name, labels))
+
+    def drain(self):
+        with self._lock:
+            values, self._values = self._values, {}
+        return values
+
+    def merge(self, values):
+        ''' Adds up the values drained from another registry, gauges are overwritten.
+        '''
+        with self._lock:
+            for k, v in values.items():
+                mine = self._values.get(k)
+                if isinstance(v, _histogram):
+                    if mine is None:
+                        mine = self._values[k] = _histogram(v.buckets)
+                    mine.merge(v)
+                elif GAUGE == METRICS[k[0]][0] or mine is None:
+                    self._values[k] = v
+                else:
+                    self._values[k] = mine + v
+
+    def finish_run(self):
+        ''' Sets the gauges describing the whole run.
+        '''
+        duration = time.monotonic() - self.started
+        self.set("binaryaudit_run_duration_seconds", duration)
+        packages = sum(v for (name, labels), v in self._values.items() if "binaryaudit_packages" == name)
+        if duration > 0:
+            self.set("binaryaudit_packages_per_second", packages / duration)
+        self.set("binaryaudit_peak_rss_bytes", resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024, scope="self")
+        self.set("binaryaudit_peak_rss_bytes", resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024,
+                 scope="children")
+
+    def _lines(self, name, mtype, samples):
+        lines = []
+        for labels, v in sorted(samples, key=lambda s: s[0]):
+            if HISTOGRAM == mtype:
+                cumulative = 0
+                for bound, c in zip(v.buckets, v.counts):
+                    cumulative += c
+                    lines.append(_sample(name + "_bucket", labels + (("le", _format(bound)),), cumulative))
+                lines.append(_sample(name + "_bucket", labels + (("le", "+Inf"),), v.count))
+                lines.append(_sample(name + "_count", labels, v.count))
+                lines.append(_sample(name + "_sum", labels, v.sum))
+            elif COUNTER == mtype:
+                lines.append(_sample(name + "_total", labels, v))
+            else:
+                lines.append(_sample(name, labels, v))
+        return lines
+
+    def render(self):
+        with self._lock:
+            by_name = {}
+            for (name, labels), v in self._values.items():
+                by_name.setdefault(name, []).append((labels, v))
+            out = []
+            for name in sorted(by_name):
+                mtype, help_text = METRICS[name]
+                # The text format 0.0.4 of the textfile collector: a counter
+                # family is named as its samples, with the _total suffix.
+                family = name + "_total" if COUNTER == mtype else name
+                out.append("# HELP {} {}".format(family, help_text))
+                out.append("# TYPE {} {}".format(family, mtype))
+                out.extend(self._lines(name, mtype, by_name[name]))
+        return "\n".join(out) + "\n"
+
+    def write_textfile(self, fn):
+        ''' Writes the metrics atomically, the textfile collector never sees a partial file.
+        '''
+        d = os.path.dirname(fn)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        tmp_fn = "{}.tmp.{}".format(fn, os.getpid())
+        with open(tmp_fn, "w") as f:
+            f.write(self.render())
+        os.replace(tmp_fn, fn)
+
+
+def _format(v):
+    if isinstance(v, float):
+        if math.isinf(v):
+            return "+Inf"
+        return repr(v)
+    return str(v)
+
+
+def _escape(v):
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _sample(name, labels, value):
+    if labels:
+        name += "{" + ",".join('{}="{}"'.format(k, _escape(v)) for k, v in labels) + "}"
+    return "{} {}".format(name, _format(value))
+
+
+_registry = registry()
+
+
+def get_registry():
+    return _registry
+
+
+def reset(worker=False):
+    global _registry
+    _registry = registry(worker)
+    return _registry
+
+
+def inc(name, value=1, **labels):
+    _registry.inc(name, value, **labels)
+
+
+def set_gauge(name, value, **labels):
+    _registry.set(name, value, **labels)
+
+
+def observe(name, value, **labels):
+    _registry.observe(name, value, **labels)
+
+
+def drain_worker():
+    ''' Returns the values recorded in a pool worker since the last call,
+        None outside of a worker.
+    '''
+    if not _registry.worker:
+        return None
+    return _registry.drain()
+
+
+def merge(values):
+    if values:
+        _registry.merge(values)
+
+
+def write_textfile(fn):
+    _registry.finish_run()
+    _registry.write_textfile(fn)
@@ -1,8 +1,6 @@
 #!/usr/bin/python3
 
-from binaryaudit.db import wrapper as db_wrapper
-from binaryaudit.mariner import binary_audit as mariner_binary_audit
-from binaryaudit.poky import poky_binaryaudit
+from binaryaudit import metrics
 
 
 class ba_orchestrator:
@@ -11,7 +9,7 @@ class ba_orchestrator:
     to execute the workflow of the abi binary checker.
     '''
 
-    def __init__(self, productname, derivative, build_id, telemetery, logger, db_config="db_config"):
+    def __init__(self, productname, derivative, build_id, telemetery, logger, db_config="db_config", spool_file=None):
         '''
         '''
         self.logger = logger
@@ -21,35 +19,57 @@ class ba_orchestrator:
         self.product_id = 0
         self.enable_telemetry = telemetery
         self.db_config = db_config
+        self.db_conn = None
 
-        # Instantiate the db connection to upload results to DB
+        # Instantiate the db connection to upload results to DB. The audit
+        # writes land in the local spool and are uploaded in the background.
         if self.enable_telemetry == 'y':
-            self.db_conn = db_wrapper(self.db_config, self.logger)
-            self.db_conn.initialize_db()
+            # Imported on use, SQLAlchemy takes a while to load.
+            from binaryaudit.db import wrapper as db_wrapper
+            from binaryaudit import spool
+            db_conn = db_wrapper(self.db_config, self.logger)
+            db_conn.initialize_db()
+            self.db_conn = spool.wrap(db_conn, spool_file)
 
     def get_product_id(self) -> None:
         '''
         initialize the Product ID based on the entities
         assigns existing Product ID or new Product ID
         '''
-        if self.db_conn.is_db_connected:
+        if self.db_conn and self.db_conn.is_db_connected():
             self.product_id = self.db_conn.get_product_id(
                     self.productname,
                     self.derivative
             )
-            self.logger.note("Product_id: %s" % self.product_id)
+            self.logger.note("Product_id: %s", self.product_id)
         else:
             self.logger.debug("Not connected")
 
-    def perform_binary_audit(self, buildurl, logurl, source_dir, output_dir, all_suppressions, cleanup, name) -> None:
+    def perform_binary_audit(self, buildurl, logurl, source_dir, output_dir, all_suppressions, cleanup, name,
+                             jobs=1, fail_fast=False, args=None, shard=None, shard_results=None,
+                             coordinator=None) -> None:
         '''
         inserts product and build id into db
         calls mariner model test and waits for test result
         updates db to record the test result
+
+        with a shard (index, count) passed, the results of the
+        shard are written to the shard results file instead, with
+        a coordinator address the groups run on its workers
         '''
         if name == "mariner":
-            if self.db_conn.is_db_connected:
-                self.db_conn.insert_main_transaction(
+            from binaryaudit.gating import begin_run
+            from binaryaudit.mariner import binary_audit as mariner_binary_audit
+            db_conn = self.db_conn
+            sp = None
+            if shard:
+                from binaryaudit import shard as shard_mod
+                sp = shard_mod.spec(*shard)
+                db_conn = shard_mod.wrap(self.db_conn, sp, shard_mod.get_results_file(sp, shard_results, output_dir))
+            reuse = {}
+            if self.db_conn:
+                reuse = begin_run(
+                        db_conn,
                         self.build_id,
                         self.product_id,
                         buildurl,
@@ -57,15 +77,36 @@ class ba_orchestrator:
                 )
             else:
                 self.logger.debug("Not connected")
+            coord = None
+            if coordinator:
+                from binaryaudit import workqueue
+                coord = workqueue.start_coordinator(coordinator)
+            try:
                 result = mariner_binary_audit(source_dir, output_dir, self.build_id, self.product_id,
-                                              self.db_conn, all_suppressions, cleanup)
-            if self.db_conn.is_db_connected:
-                self.db_conn.update_ba_test_result(
+                                              db_conn, all_suppressions, cleanup, jobs, fail_fast, reuse, sp, coord)
+            finally:
+                if coord is not None:
+                    coord.close()
+            metrics.inc("binaryaudit_runs", result=result)
+            if db_conn:
+                db_conn.update_ba_test_result(
                     self.build_id,
                     self.product_id,
                     result
                 )
             else:
                 self.logger.debug("Not connected")
+            if sp is not None:
+                # Closes the wrapped connection, too.
+                db_conn.close()
+                db_conn.log_pool_stats()
+                return
         else:
-            result = poky_binaryaudit(all_suppressions)
+            from binaryaudit.poky import poky_binaryaudit
+            # A single spooled connection per run, poky releases it once done.
+            db_conn, self.db_conn = self.db_conn, None
+            result = poky_binaryaudit(all_suppressions, args, db_conn)
+
+        if self.db_conn:
+            self.db_conn.close()
+            self.db_conn.log_pool_stats()
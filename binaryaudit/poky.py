@@ -1,160 +1,303 @@
 
 import os
 import time
-import tempfile
-import shutil
-import tarfile
-import glob
 import argparse
+import multiprocessing
+import queue
+import signal
+import threading
+from concurrent.futures import ProcessPoolExecutor
 from binaryaudit import util
 from binaryaudit import abicheck
+from binaryaudit import abiindex
+from binaryaudit import baseline
 from binaryaudit import cli
+from binaryaudit import gating
+from binaryaudit import governor
+from binaryaudit import metrics
+from binaryaudit import run
+from binaryaudit import scheduler
+from binaryaudit import shard
+from binaryaudit import spool
+from binaryaudit import trace
+from binaryaudit import verdict
 from binaryaudit.db import VERSION_NOT_AVAILABLE
-from binaryaudit.db import TRANSACTION_MAIN_RESULT_FAILED, TRANSACTION_MAIN_RESULT_PASSED, TRANSACTION_MAIN_RESULT_PENDING
+from binaryaudit.db import TRANSACTION_MAIN_RESULT_PASSED
 import sys
 
-args = cli.arg_parser.parse_args()
+# The parsed command line, set by poky_binaryaudit(). Not parsed on import,
+# the pool workers and the tests import the module, too.
+args = None
 
 
 def retrieve_baseline(db_conn, prod_id):
     ''' Fetch buildhistory baseline data from the db and extract for the further usage.
 
+        Only the files the comparison reads are extracted, into a local
+        cache keyed by the baseline ID. Subsequent runs against the same
+        baseline don't fetch the data at all.
+
         Parameters:
 
         Returns:
             baseline_id (int): Baseline ID from DB.
             baseline_dir (str): Path to the extracted buildhistory baseline directory.
     '''
-    baseline_id, baseline_data = db_conn.get_ba_latest_baseline(prod_id)
+    baseline_id = db_conn.get_ba_latest_baseline_id(prod_id)
     if not baseline_id:
         util.error("Couldn't find a matching product ID.")
         return None, None
-    util.debug("baseline_id: '{}'\n".format(baseline_id))
-
-    data_fl = tempfile.NamedTemporaryFile(delete=False)
-    data_fl.write(baseline_data)
-    data_fl.flush()
-    data_fl.close()
-
-    # TODO Perhaps use a better random path.
-    extractdir = "/tmp/binaryaudit_base"
-    if os.path.isdir(extractdir):
-        shutil.rmtree(extractdir)
-    os.makedirs(extractdir)
-
-    with tarfile.open(data_fl.name, "r:gz") as tgz:
-        tgz.extractall(extractdir)
-        tgz.close()
-    os.unlink(data_fl.name)
+    util.debug("baseline_id: '%s'\n", baseline_id)
+
+    extractdir = baseline.get_cached_baseline(db_conn, baseline_id)
     # Depends on how we pack, but the first sibling named "buildhistory" should be it.
     buildhistory_baseline_dir = None
     for root, dirs, files in os.walk(extractdir):
         if "buildhistory" in dirs:
             buildhistory_baseline_dir = os.path.join(root, "buildhistory")
             break
-    if not buildhistory_baseline_dir and not os.path.isdir(buildhistory_baseline_dir):
+    if not buildhistory_baseline_dir or not os.path.isdir(buildhistory_baseline_dir):
         util.error("Couldn't setup buildhistory baseline.")
 
     return baseline_id, buildhistory_baseline_dir
 
 
-def _get_dump_duration(recipe_binaudit_path):
-    ret = .0
-    fl = recipe_binaudit_path + "/abixml.duration"
-    try:
-        with open(fl, "r") as f:
-            ret = float(f.read())
-            f.close()
-    except Exception:
-        pass
-    return ret
+# Spare compare slots of the worker pool, released by the collector as pool
+# workers run out of recipes. A recipe worker borrows them to compare its
+# DSOs in parallel, so a few big recipes don't leave the rest of the pool idle
+# at the end of a run.
+_dso_slots = None
 
 
-def _get_version_from_buildhistory(d):
-    latest_fl = os.path.join(d, "latest")
-    version = VERSION_NOT_AVAILABLE
-    try:
-        with open(latest_fl, "r") as f:
-            for ln in f.readlines():
-                a = ln.split("=")
-                if "PV" == a[0].rstrip().lstrip():
-                    version = a[1].rstrip().lstrip()
-    except Exception:
-        pass
-    return version
+def _init_recipe_worker(slots, tracing, governor_state):
+    global _dso_slots
+    _dso_slots = slots
+    # A forked worker inherits the parent's tracer and metrics, start from clean ones.
+    if tracing:
+        trace.enable(worker=True)
+    else:
+        trace.disable()
+    metrics.reset(worker=True)
+    governor.install(governor_state, worker=True)
+    # Take the running abidiff processes down when the pool is torn down.
+    signal.signal(signal.SIGTERM, _terminate_recipe_worker)
+
+
+def _terminate_recipe_worker(signum, frame):
+    run.terminate_children()
+    os._exit(128 + signum)
+
+
+class _dso_compare:
+    ''' Compares the DSO pairs of a recipe, on the spare slots of the pool as
+        far as there are any.
+    '''
+    def __init__(self, pairs, suppressions):
+        self.suppressions = suppressions
+        self.todo = queue.SimpleQueue()
+        for i, pair in enumerate(pairs):
+            self.todo.put((i, pair))
+        self.results = [None] * len(pairs)
+
+    def _next(self):
+        try:
+            i, pair = self.todo.get_nowait()
+        except queue.Empty:
+            return False
+        try:
+            ret, out, cmd = abicheck.compare(pair[0], pair[1], self.suppressions)
+        except Exception as e:
+            # Raised in a borrowed thread it'd be lost, a failed comparison is a libabigail error.
+            ret, out = abicheck.DIFF_ERROR, "{}\n".format(e)
+        self.results[i] = (ret, out)
+        return True
+
+    def _work_borrowed(self):
+        try:
+            while self._next():
+                pass
+        finally:
+            _dso_slots.release()
+
+    def _borrow(self, helpers):
+        while _dso_slots is not None and self.todo.qsize() > 1 and _dso_slots.acquire(False):
+            t = threading.Thread(target=self._work_borrowed, daemon=True)
+            t.start()
+            helpers.append(t)
+
+    def run(self):
+        ''' Returns:
+                results (list): (ret, out) per pair, in the order of the pairs
+        '''
+        helpers = []
+        self._borrow(helpers)
+        while self._next():
+            self._borrow(helpers)
+        for t in helpers:
+            t.join()
+        return self.results
+
+
+def _get_version(recipe):
+    if recipe is None or recipe["pv"] is None:
+        return VERSION_NOT_AVAILABLE
+    return recipe["pv"]
+
+
+def _plan_recipe(rel, base, cur, buildhistory_baseline_dir, bulidhistory_current_dir):
+    ''' Computes the comparison plan of a recipe from the index entries of both sides.
+    '''
+    changed, unchanged = abiindex.join(base, cur)
+    pairs = [(os.path.join(buildhistory_baseline_dir, rel, "abixml", b["file"]),
+              os.path.join(bulidhistory_current_dir, rel, "abixml", c["file"]), b["hash"], c["hash"])
+             for fn, b, c in changed]
+    # Verdicts known from the cache, by pair index.
+    return {"pairs": pairs, "verdicts": {}, "unchanged": unchanged, "dump_duration": cur["duration"],
+            "base_version": _get_version(base), "new_version": _get_version(cur),
+            "fingerprints": abiindex.get_fingerprints(cur)}
+
+
+def recipe_abicheck(recipe_binaudit_path, buildhistory_baseline_dir, bulidhistory_current_dir, suppressions, plan=None):
+    ''' Compares the DSOs of a recipe against the baseline and aggregates the result.
 
+        Only the DSOs whose serialization and ABI fingerprint differ from the
+        baseline are compared.
 
-def recipe_abicheck(recipe_binaudit_path, buildhistory_baseline_dir, bulidhistory_current_dir, suppressions):
+        Parameters:
+            plan (dict): The comparison plan from plan_recipes(), computed from the manifests if omitted
+
+        Returns:
+            item_name, base_version, new_version, exec_time, result, res_details, ret_acc
+    '''
+    return _audit_recipe(recipe_binaudit_path, buildhistory_baseline_dir, bulidhistory_current_dir,
+                         suppressions, plan)[0]
+
+
+def _audit_recipe(recipe_binaudit_path, buildhistory_baseline_dir, bulidhistory_current_dir, suppressions, plan=None):
+    # Runs in a pool worker, the result is plain data for the collector:
+    # the recipe result and the verdicts to publish to the cache as a list
+    # of (base hash, current hash, ret, out).
     t0 = time.monotonic()
     ret_acc = abicheck.DIFF_OK
-    dump_duration = _get_dump_duration(recipe_binaudit_path)
-
-    for cur_xml_fl in glob.glob(recipe_binaudit_path + "/abixml/*.xml", recursive=False):
-        with open(cur_xml_fl) as f:
-            xml = f.read()
-            f.close()
-
-        # Care only about DSO for now
-        sn = abicheck.get_soname_from_xml(xml)
-        # XXX Handle error cases, eg xml file was garbage, etc.
-        if len(sn) > 0:
-            ref_xml_fl = cur_xml_fl.replace(bulidhistory_current_dir, buildhistory_baseline_dir)
-            if not os.path.isfile(ref_xml_fl):
-                continue
-            ret, out, cmd = abicheck.compare(ref_xml_fl, cur_xml_fl, suppressions)
-            if ret > ret_acc:
-                # just get the highest score
-                ret_acc = ret
+    if plan is None:
+        rel = os.path.relpath(recipe_binaudit_path, bulidhistory_current_dir)
+        base_path = os.path.join(buildhistory_baseline_dir, rel)
+        base = abiindex.load_recipe(base_path) if os.path.isdir(base_path) else None
+        plan = _plan_recipe(rel, base, abiindex.load_recipe(recipe_binaudit_path),
+                            buildhistory_baseline_dir, bulidhistory_current_dir)
+
+    verdicts = plan.get("verdicts", {})
+    if "units" in plan:
+        # Compared by the workers of a coordinator, only their time counts.
+        results, compare_usec = _get_unit_results(plan["units"])
+        computed = iter(results)
+    else:
+        computed = iter(_dso_compare([p for i, p in enumerate(plan["pairs"]) if i not in verdicts], suppressions).run())
+    published = []
+    details = []
+    for i, pair in enumerate(plan["pairs"]):
+        if i in verdicts:
+            ret, out = verdicts[i]
+        else:
+            ret, out = next(computed)
+            published.append((pair[2], pair[3], ret, out))
+        if ret > ret_acc:
+            # just get the highest score
+            ret_acc = ret
+        if abicheck.DIFF_OK != ret:
+            details.append(out)
 
     t1 = time.monotonic()
 
-    new_base = os.path.dirname(recipe_binaudit_path)
-    old_base = new_base.replace(bulidhistory_current_dir, buildhistory_baseline_dir)
+    item_name = os.path.basename(os.path.dirname(recipe_binaudit_path))
 
-    item_name = os.path.basename(new_base)
-
-    new_version = _get_version_from_buildhistory(new_base)
-    base_version = _get_version_from_buildhistory(old_base)
+    if "units" not in plan:
+        compare_usec = (t1-t0)*1000000
 
     # Take into account the time spent for serialization during the build, too.
-    exec_time = int(dump_duration + (t1-t0)*1000000)  # usec
+    exec_time = int(plan["dump_duration"] + compare_usec)  # usec
 
     result = abicheck.diff_get_bit(ret_acc)
-    if 0 == ret_acc:
-        res_details = ""
-    else:
-        res_details = out
+    # The reports of all the DSOs with changes, in the order of the file names.
+    res_details = "".join(details)
+
+    res = (item_name, plan["base_version"], plan["new_version"], exec_time, result, res_details, ret_acc)
+    return res, published
+
+
+def _submit_units(coord, jobs, suppressions):
+    ''' Queues a compare unit per DSO pair without a known verdict, in the order of the jobs.
+    '''
+    suppressions = [os.path.abspath(s) for s in suppressions]
+    for j in jobs:
+        plan = j.args[4]
+        plan["units"] = [coord.submit("compare", ref=os.path.abspath(p[0]), cur=os.path.abspath(p[1]),
+                                      suppressions=suppressions)
+                         for i, p in enumerate(plan["pairs"]) if i not in plan["verdicts"]]
 
-    return item_name, base_version, new_version, exec_time, result, res_details, ret_acc
 
+def _get_unit_results(units):
+    ''' Returns the (ret, out) of the compare units and their total duration in microseconds.
 
-def poky_binaryaudit(all_suppressions):
-    db_conn = None
+        A unit the workers failed on counts as a libabigail error.
+    '''
+    results = []
+    usec = 0
+    for u in units:
+        try:
+            res = u.result()
+        except Exception as e:
+            results.append((abicheck.DIFF_ERROR, "{}\n".format(e)))
+            continue
+        results.append((res["ret"], res["out"]))
+        usec += res["usec"]
+    return results, usec
+
+
+def poky_binaryaudit(all_suppressions, cli_args=None, db_conn=None):
+    ''' Runs the poky audit, with db_conn the telemetry connection to use, connected here if omitted.
+
+        The connection is released once done.
+    '''
+    global args
+    args = cli_args if cli_args is not None else cli.arg_parser.parse_args()
     if 'y' == args.enable_telemetry:
-        db_conn = connect_database()
+        validate_telemetry_args()
+        if db_conn is None:
+            db_conn = connect_database()
 
     if args.compare_buildhistory:
         compare_buildhistory(all_suppressions, db_conn)
 
-    elif args.insert_baseline:
+    elif args.insert_baseline or args.pack_baseline:
         insert_baseline(db_conn)
 
 
-def connect_database():
+def validate_telemetry_args():
     try:
         cli.validate_telemetry_args(args)
     except argparse.ArgumentError as e:
-        util.fatal(str(e))
+        util.fatal("%s", e)
         sys.exit(3)
 
+
+def connect_database():
+    validate_telemetry_args()
+
     from binaryaudit.db import wrapper as db_wrapper
     try:
         db_conn = db_wrapper(args.db_config, util.logger)
         db_conn.initialize_db()
     except Exception as e:
-        util.error(str(e))
+        util.error("%s", e)
+
+    return spool.wrap(db_conn, spool.get_spool_file(args))
 
-    return db_conn
+
+def release_database(db_conn):
+    if db_conn:
+        db_conn.close()
+        db_conn.log_pool_stats()
 
 
 def compare_buildhistory(all_suppressions, db_conn):
@@ -167,20 +310,28 @@ def compare_buildhistory(all_suppressions, db_conn):
         os.makedirs(out_dir)
 
     if not 'y' == args.enable_telemetry and not os.path.isdir(d1):
-        util.warn("Directory '{}' doesn't exist.".format(d1))
+        util.warn("Directory '%s' doesn't exist.", d1)
         sys.exit(1)
     # Either need the baseline directory passed or telemetry enabled
     # to fetch the baseline.
     if not os.path.isdir(d2):
-        util.warn("Directory '{}' doesn't exist.".format(d2))
+        util.warn("Directory '%s' doesn't exist.", d2)
         sys.exit(1)
 
+    sp = None
+    if args.shard:
+        # The results go to the shard results file, 'binaryaudit merge' records the run.
+        sp = shard.spec(*args.shard)
+        db_conn = shard.wrap(db_conn, sp, shard.get_results_file(sp, args.shard_results, out_dir))
+
+    prod_id = None
+    reuse = {}
     if 'y' == args.enable_telemetry:
         prod_id = db_conn.get_product_id(args.product_name, args.derivative)
         if not prod_id:
             util.error("Couldn't find a matching product ID.")
-            sys.exti(1)
-        util.debug("product_id: '{}'".format(prod_id))
+            sys.exit(1)
+        util.debug("product_id: '%s'", prod_id)
 
         if d1:
             util.warn("Telemetry is enabled, ignoring the supplied buildhistory baseline.")
@@ -188,12 +339,12 @@ def compare_buildhistory(all_suppressions, db_conn):
         if not baseline_id or not d1:
             sys.exit(1)
 
-        db_conn.insert_main_transaction(args.build_id, prod_id, args.buildurl,
-                                        args.logurl, TRANSACTION_MAIN_RESULT_PENDING, baseline_id)
+        reuse = gating.begin_run(db_conn, args.build_id, prod_id, args.buildurl, args.logurl, baseline_id)
 
     build_ret_acc = abicheck.DIFF_OK
     build_result = TRANSACTION_MAIN_RESULT_PASSED
-    iterate_through_packages(db_conn, prod_id, out_dir, d1, d2, all_suppressions, build_ret_acc, build_result)
+    iterate_through_packages(db_conn, prod_id, out_dir, d1, d2, all_suppressions, build_ret_acc, build_result, reuse,
+                             sp)
 
 
 def insert_baseline(db_conn):
@@ -201,47 +352,220 @@ def insert_baseline(db_conn):
         # Another way would be to implicitly enable telemetry
         util.error("Telemetry is not anabled")
         sys.exit(1)
+    if args.pack_baseline and not os.path.isdir(args.pack_baseline):
+        util.error("Directory '%s' doesn't exist.", args.pack_baseline)
+        sys.exit(1)
 
     product_id = db_conn.get_product_id(args.product_name, args.derivative)
 
     db_conn.insert_main_transaction(args.build_id, product_id, args.buildurl, args.logurl, TRANSACTION_MAIN_RESULT_PASSED)
 
-    data = None
-    with open(args.insert_baseline, "rb") as f:
-        data = f.read()
-        f.close
-    db_conn.insert_ba_baseline_data(args.build_id, product_id, data)
+    if args.pack_baseline:
+        baseline.pack_baseline(db_conn, args.build_id, product_id, args.pack_baseline, workers=args.jobs)
+    else:
+        baseline.publish_baseline(db_conn, args.build_id, product_id, args.insert_baseline, workers=args.jobs)
+    release_database(db_conn)
+
 
+def plan_recipes(d1, d2, all_suppressions, hist, persist_baseline_index=False, cache=None, sp=None):
+    ''' Creates a job per recipe of the current buildhistory with an estimated duration.
 
-def iterate_through_packages(db_conn, prod_id, out_dir, d1, d2, all_suppressions, build_ret_acc, build_result):
-    import glob
+        The plan is a join of the indexes of both buildhistories, no XML is read
+        unless a recipe lacks its manifest. The verdicts of the pairs known to
+        the cache are resolved in a single lookup. With a shard spec passed,
+        only the recipes of the shard are planned.
+    '''
+    base_index = abiindex.get_index(d1, persist_baseline_index)
+    cur_index = abiindex.get_index(d2)
+    jobs = []
     # Only iterate through packages for now.
     # Only iterate through d2 now. Reverse iteration might bake sense, too.
-    for fn in glob.glob(d2 + "/packages/*/*/binaryaudit", recursive=False):
-        item_name, base_version, new_version, exec_time, result, res_details, ret_acc = recipe_abicheck(fn,
-                                                                                                        d1,
-                                                                                                        d2,
-                                                                                                        all_suppressions)
+    for rel in sorted(cur_index):
+        cur = cur_index[rel]
+        plan = _plan_recipe(rel, base_index.get(rel), cur, d1, d2)
+        item_name = os.path.basename(os.path.dirname(rel))
+        size = sum(dso["size"] for dso in cur["dsos"].values())
+        jobs.append(scheduler.job(item_name, (os.path.join(d2, rel), d1, d2, all_suppressions, plan), size))
+    if sp is not None:
+        jobs = sp.select(jobs)
+    if cache is not None:
+        _resolve_verdicts(jobs, cache)
+    return scheduler.estimate(jobs, hist)
+
+
+def _resolve_verdicts(jobs, cache):
+    found = cache.lookup_many([(p[2], p[3]) for j in jobs for p in j.args[4]["pairs"]])
+    for j in jobs:
+        plan = j.args[4]
+        for i, p in enumerate(plan["pairs"]):
+            if (p[2], p[3]) in found:
+                plan["verdicts"][i] = found[(p[2], p[3])]
+
+
+def _get_verdict_cache(db_conn, all_suppressions):
+    if 'y' != args.enable_telemetry or args.no_verdict_cache:
+        return None
+    cache = verdict.verdict_cache(db_conn, all_suppressions)
+    if not cache.enabled():
+        util.warn("Couldn't determine the abidiff version, not using the verdict cache.")
+        return None
+    return cache
+
+
+def _publish_verdicts(cache, published):
+    if cache is None:
+        return
+    for base_hash, cur_hash, ret, out in published:
+        cache.publish(base_hash, cur_hash, ret, out)
+
+
+def _recipe_changed(plan):
+    ''' Tells whether a recipe changed since the baseline, by its version or DSO content.
+    '''
+    return plan["base_version"] != plan["new_version"] or len(plan["pairs"]) > 0
 
-        # Set the build accumulated value to the highest found score.
-        if ret_acc > build_ret_acc:
-            build_ret_acc = ret_acc
 
-        util.debug("item: '{}', base: '{}', new: '{}', duration: '{}', res: '{}'".format(item_name, base_version, new_version,
-                                                                                         exec_time, result))
+def _reuse_results(jobs, reuse, build_ret_acc):
+    ''' Drops the jobs with a result recorded by a previously aborted run.
+    '''
+    if not reuse:
+        return jobs, build_ret_acc
+    remaining = []
+    for j in jobs:
+        if j.name not in reuse:
+            remaining.append(j)
+            continue
+        build_ret_acc = max(build_ret_acc, gating.get_reused_status(reuse[j.name]))
+    return remaining, build_ret_acc
+
+
+def _collect_recipe_result(db_conn, prod_id, out_dir, hist, res, fingerprints=None):
+    item_name, base_version, new_version, exec_time, result, res_details, ret_acc = res
+
+    util.debug("item: '%s', base: '%s', new: '%s', duration: '%s', res: '%s'", item_name, base_version, new_version,
+               exec_time, result)
+    metrics.inc("binaryaudit_packages", kind="recipe")
+    if gating.is_fatal(ret_acc):
+        hist.record_failure(item_name)
+
+    if db_conn is not None:
+        db_conn.insert_ba_transaction_details(args.build_id, prod_id, item_name, base_version,
+                                              new_version, exec_time, result, res_details)
+        if fingerprints:
+            db_conn.insert_fingerprints(args.build_id, prod_id, item_name, fingerprints)
+
+    if out_dir and abicheck.DIFF_OK != ret_acc:
+        fname = util.build_diff_filename(item_name, base_version, new_version)
+        out_fpath = os.path.join(out_dir, fname)
+        with open(out_fpath, "w") as f:
+            f.write(res_details)
+
+
+def _is_fatal_recipe_result(ret):
+    res, published = ret
+    return gating.is_fatal(res[6])
+
+
+class _slot_lender:
+    ''' Releases a compare slot to the recipe workers for each pool worker
+        left without a recipe to compare.
+    '''
+    def __init__(self, slots, count, workers):
+        self.slots = slots
+        self.count = count
+        self.workers = workers
+        self.lent = 0
 
-        if 'y' == args.enable_telemetry:
-            db_conn.insert_ba_transaction_details(args.build_id, prod_id, item_name, base_version,
-                                                  new_version, exec_time, result, res_details)
+    def update(self, completed):
+        idle = self.workers - (self.count - completed)
+        while self.lent < idle:
+            self.slots.release()
+            self.lent += 1
 
-        if out_dir and abicheck.DIFF_OK != ret_acc:
-            fname = util.build_diff_filename(item_name, base_version, new_version)
-            out_fpath = os.path.join(out_dir, fname)
-            with open(out_fpath, "w") as f:
-                f.write(res_details)
 
-    if 'y' == args.enable_telemetry:
-        if abicheck.DIFF_OK != build_ret_acc:
-            build_result = TRANSACTION_MAIN_RESULT_FAILED
+def _create_recipe_pool(workers):
+    ''' Returns the process pool comparing the recipes and the semaphore of its spare slots.
+    '''
+    ctx = multiprocessing.get_context()
+    slots = ctx.Semaphore(0)
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_recipe_worker,
+                                   initargs=(slots, trace.is_enabled(), governor.get_state()))
+    return executor, slots
+
+
+def _terminate_recipe_pool():
+    # The workers take their abidiff processes down with them.
+    for p in multiprocessing.active_children():
+        p.terminate()
+
+
+def _setup_dispatch(jobs, order, workers, hist, all_suppressions):
+    ''' Returns the recipe pool and its slot lender, the coordinator, the stop hook, the history
+        and the worker count of the dispatch.
+    '''
+    if args.coordinator:
+        from binaryaudit import workqueue
+        coord = workqueue.start_coordinator(args.coordinator)
+        # The diffs run on the workers, the recipes are collected here as their units complete.
+        _submit_units(coord, (order or scheduler.lpt_order)(jobs), all_suppressions)
+        return None, None, coord, coord.cancel_pending, None, 1
+    if workers > 1:
+        executor, slots = _create_recipe_pool(workers)
+        return executor, _slot_lender(slots, len(jobs), workers), None, _terminate_recipe_pool, hist, workers
+    return None, None, None, run.terminate_children, hist, workers
+
+
+def iterate_through_packages(db_conn, prod_id, out_dir, d1, d2, all_suppressions, build_ret_acc, build_result, reuse=None,
+                             sp=None):
+    hist = scheduler.load_history(db_conn, prod_id)
+    if sp is not None:
+        sp.load_db(db_conn, prod_id)
+    # The tools of all the pool workers share the memory budget.
+    governor.setup(hist, multiprocessing.get_context())
+    workers = governor.limit_workers(args.jobs)
+    cache = _get_verdict_cache(db_conn, all_suppressions)
+    # A fetched baseline lives in the cache and doesn't change, its index is kept there.
+    jobs = plan_recipes(d1, d2, all_suppressions, hist, 'y' == args.enable_telemetry, cache, sp)
+    jobs, build_ret_acc = _reuse_results(jobs, reuse, build_ret_acc)
+
+    order = None
+    stop = None
+    if args.fail_fast:
+        changed = dict((j.name, _recipe_changed(j.args[4])) for j in jobs)
+        order = gating.risk_order(hist, changed)
+        stop = _is_fatal_recipe_result
+    report = scheduler.schedule_report(jobs, workers)
+
+    setup = _setup_dispatch(jobs, order, workers, hist, all_suppressions)
+    executor, lender, coord, on_stop, dispatch_hist, workers = setup
+    try:
+        # The results are collected in the dispatch order, so the DB rows
+        # and the report files are written the same way on every run.
+        for j, (res, published) in scheduler.dispatch(jobs, _audit_recipe, workers, dispatch_hist, executor=executor,
+                                                      report=report, order=order, stop=stop, on_stop=on_stop,
+                                                      ordered=True):
+            if executor is not None:
+                lender.update(report.completed)
+            if coord is not None:
+                scheduler.record_duration(hist, j, _get_unit_results(j.args[4]["units"])[1])
+            _collect_recipe_result(db_conn, prod_id, out_dir, hist, res, j.args[4]["fingerprints"])
+            _publish_verdicts(cache, published)
+            # Set the build accumulated value to the highest found score.
+            if res[6] > build_ret_acc:
+                build_ret_acc = res[6]
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+        if coord is not None:
+            coord.close()
+    governor.save(hist)
+    hist.save()
+    if cache is not None:
+        cache.log()
+
+    build_result = gating.get_build_result(abicheck.DIFF_OK != build_ret_acc, report.aborted)
+    metrics.inc("binaryaudit_runs", result=build_result)
+    if db_conn is not None:
         db_conn.update_ba_test_result(args.build_id, prod_id, build_result)
+    release_database(db_conn)
     sys.exit(build_ret_acc)
@@ -1,6 +1,106 @@
 from binaryaudit import conf
 from binaryaudit import util
+import contextlib
+import os
 import subprocess
+import threading
+
+# Child processes currently running, so they can be interrupted when a run
+# is cut short.
+_children = set()
+_children_lock = threading.Lock()
+# The stop event of the job running in the thread, see stoppable().
+_local = threading.local()
+
+
+class stopped_error(OSError):
+    ''' A child wasn't started, the job starting it was stopped.
+    '''
+
+
+class _rusage_popen(subprocess.Popen):
+    ''' Popen keeping the resource usage of the child once it's reaped.
+    '''
+    rusage = None
+
+    def _try_wait(self, wait_flags):
+        # Same as the Popen one, with wait4() in place of waitpid().
+        try:
+            (pid, sts, rusage) = os.wait4(self.pid, wait_flags)
+        except ChildProcessError:
+            return (self.pid, 0)
+        if pid == self.pid:
+            self.rusage = rusage
+        return (pid, sts)
+
+
+def popen(cmd, rusage=False, **kwargs):
+    ''' Starts a child process tracked until wait_child() is called on it.
+
+    Parameters:
+        rusage (bool): Keep the resource usage of the child in the rusage
+            attribute, set once waited for
+    '''
+    cls = _rusage_popen if rusage else subprocess.Popen
+    stopped = getattr(_local, "stopped", None)
+    if stopped is None:
+        p = cls(cmd, **kwargs)
+        with _children_lock:
+            _children.add(p)
+        return p
+    # Started under the lock, either terminate_children() sees the child or the child sees the stop.
+    with _children_lock:
+        if stopped.is_set():
+            raise stopped_error("Stopped, not starting '{}'".format(cmd[0]))
+        p = cls(cmd, **kwargs)
+        _children.add(p)
+    return p
+
+
+@contextlib.contextmanager
+def stoppable(stopped):
+    ''' Makes popen() raise stopped_error in this thread once the stopped event is set.
+
+        Set the event before calling terminate_children(), no child of the
+        thread outlives the stop then.
+    '''
+    prev = getattr(_local, "stopped", None)
+    _local.stopped = stopped
+    try:
+        yield
+    finally:
+        _local.stopped = prev
+
+
+def wait_child(p, input=None):
+    ''' Waits for a child started with popen() and collects its output.
+
+    Returns:
+        sout: The stdout data, if it was piped.
+        serr: The stderr data, if it was piped.
+    '''
+    try:
+        sout, serr = p.communicate(input)
+    finally:
+        _forget(p)
+    return sout, serr
+
+
+def _forget(p):
+    with _children_lock:
+        _children.discard(p)
+
+
+def terminate_children():
+    ''' Terminates all the child processes started with popen() still running.
+    '''
+    with _children_lock:
+        children = list(_children)
+    for p in children:
+        try:
+            p.terminate()
+        except OSError:
+            pass
 
 
 def run_command(cmd, input, output):
@@ -14,11 +114,11 @@ def run_command(cmd, input, output):
         poen_output: The output of cmd
         exit_code: The exit code of cmd.
     '''
-    popen_output = subprocess.Popen(cmd, stdin=input, stdout=output)
-    popen_output.wait()
+    popen_output = popen(cmd, stdin=input, stdout=output)
+    wait_child(popen_output)
     exit_code = popen_output.returncode
-    util.debug("command: {}".format(cmd))
-    util.debug("exit_code: {}".format(exit_code))
+    util.debug("command: %s", cmd)
+    util.debug("exit_code: %s", exit_code)
     return popen_output, exit_code
 
 
@@ -36,9 +136,11 @@ def run_command_docker(cmd, input, output):
     docker_cmd_list = ["sudo", "docker", "run", "--rm"]
     docker_cmd_list.append(docker_img)
     docker_cmd_list.extend(cmd)
-    popen_output = subprocess.Popen(docker_cmd_list, stdin=input, stdout=output)
+    popen_output = popen(docker_cmd_list, stdin=input, stdout=output)
+    # The caller reads the piped output, only wait here.
     popen_output.wait()
+    _forget(popen_output)
     exit_code = popen_output.returncode
-    util.debug("command: {}".format(docker_cmd_list))
-    util.debug("exit_code: {}".format(exit_code))
+    util.debug("command: %s", docker_cmd_list)
+    util.debug("exit_code: %s", exit_code)
     return popen_output, exit_code
@@ -0,0 +1,314 @@
+import heapq
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from binaryaudit import conf
+from binaryaudit import governor
+from binaryaudit import metrics
+from binaryaudit import trace
+from binaryaudit import util
+
+# Fallback cost of an item without history, in microseconds per input byte.
+USEC_PER_BYTE_DEFAULT = 0.5
+
+
+def _get_scheduler_config(key, default):
+    try:
+        return conf.get_config("Scheduler", key)
+    except KeyError:
+        return default
+
+
+def get_history_file():
+    fn = _get_scheduler_config("history_file", None)
+    if fn:
+        fn = os.path.expanduser(fn)
+    return fn
+
+
+class history:
+    ''' Per item execution times in microseconds and failure counts, keyed by item name.
+
+        Times recorded locally take precedence over the ones from the
+        telemetry DB, the local ones reflect only the compare phase. The
+        peak RSS of the tool runs, keyed by "tool:input", is kept locally only.
+    '''
+    def __init__(self, cache_file=None):
+        self.cache_file = cache_file
+        self.durations = {}
+        self.failures = {}
+        self._local = {}
+        self._local_failures = {}
+        self.peak_rss = {}
+        if cache_file and os.path.isfile(cache_file):
+            try:
+                with open(cache_file, "r") as f:
+                    self._load_cache(json.load(f))
+            except (OSError, ValueError) as e:
+                util.warn("Ignoring history cache '%s': %s", cache_file, e)
+
+    def _load_cache(self, data):
+        if "durations" not in data:
+            # Plain name -> duration map from older versions.
+            self._local = data
+            return
+        self._local = data["durations"]
+        self._local_failures = data.get("failures", {})
+        self.peak_rss = data.get("peak_rss", {})
+
+    def load_db(self, db_conn, product_id):
+        if not db_conn or not product_id:
+            return
+        try:
+            self.durations.update(db_conn.get_item_exec_times(product_id))
+            self.failures.update(db_conn.get_item_failure_counts(product_id))
+        except Exception as e:
+            util.warn("Couldn't fetch the execution history: %s", e)
+
+    def get(self, name):
+        if name in self._local:
+            return self._local[name]
+        return self.durations.get(name)
+
+    def get_durations(self):
+        ''' Returns the duration of every known item.
+        '''
+        durations = dict(self.durations)
+        durations.update(self._local)
+        return durations
+
+    def record(self, name, usec):
+        self._local[name] = int(usec)
+
+    def get_failures(self, name):
+        return max(self.failures.get(name, 0), self._local_failures.get(name, 0))
+
+    def record_failure(self, name):
+        self._local_failures[name] = self.get_failures(name) + 1
+
+    def record_peak_rss(self, name, rss):
+        self.peak_rss[name] = int(rss)
+
+    def save(self):
+        if not self.cache_file:
+            return
+        d = os.path.dirname(self.cache_file)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        tmp_fn = self.cache_file + ".tmp.{}".format(os.getpid())
+        with open(tmp_fn, "w") as f:
+            json.dump({"durations": self._local, "failures": self._local_failures, "peak_rss": self.peak_rss}, f,
+                      indent=2, sort_keys=True)
+        os.replace(tmp_fn, self.cache_file)
+
+
+def load_history(db_conn=None, product_id=None):
+    h = history(get_history_file())
+    h.load_db(db_conn, product_id)
+    return h
+
+
+class job:
+    ''' A unit of work for the worker pool.
+
+        Parameters:
+            name (str): Item name, used to look up the history
+            args (tuple): Arguments to the job function
+            size (int): Input size in bytes, used for estimates
+            names (list): History names the job consists of, defaults to [name]
+    '''
+    def __init__(self, name, args, size=0, names=None):
+        self.name = name
+        self.args = args
+        self.size = size
+        self.names = names if names else [name]
+        self.estimate = 0
+        self.known = False
+
+    def __repr__(self):
+        return "job({}, estimate={})".format(self.name, self.estimate)
+
+
+def estimate(jobs, hist):
+    ''' Assigns the predicted duration in microseconds to each job.
+
+        Jobs with history use it. The rest get a size based estimate,
+        with the per byte rate calibrated on the jobs with history.
+    '''
+    ratios = []
+    for j in jobs:
+        known = [hist.get(n) for n in j.names]
+        j.known = None not in known
+        if j.known:
+            j.estimate = sum(known)
+            if j.size > 0:
+                ratios.append(j.estimate / j.size)
+    rate = float(_get_scheduler_config("usec_per_byte", USEC_PER_BYTE_DEFAULT))
+    if ratios:
+        rate = sorted(ratios)[len(ratios) // 2]
+    for j in jobs:
+        if not j.known:
+            j.estimate = int(j.size * rate)
+    return jobs
+
+
+def lpt_order(jobs):
+    ''' Longest processing time first, ties broken by name to stay deterministic.
+    '''
+    return sorted(jobs, key=lambda j: (-j.estimate, j.name))
+
+
+def predict_makespan(durations, workers):
+    ''' Simulates a greedy list schedule of the durations in the given order.
+    '''
+    workers = max(1, workers)
+    lanes = [0] * min(workers, max(1, len(durations)))
+    heapq.heapify(lanes)
+    for d in durations:
+        heapq.heappush(lanes, heapq.heappop(lanes) + d)
+    return max(lanes)
+
+
+class schedule_report:
+    def __init__(self, jobs, workers):
+        self.workers = workers
+        self.count = len(jobs)
+        self.predicted = predict_makespan([j.estimate for j in lpt_order(jobs)], workers)
+        self.actual = 0
+        self.completed = 0
+        self.aborted = False
+        self._t0 = None
+
+    def start(self):
+        self._t0 = time.monotonic()
+
+    def finish(self):
+        self.actual = int((time.monotonic() - self._t0) * 1000000)
+
+    def as_dict(self):
+        return {"jobs": self.count, "workers": self.workers, "completed": self.completed, "aborted": self.aborted,
+                "predicted_makespan": self.predicted, "actual_makespan": self.actual}
+
+    def log(self):
+        util.note("Schedule: %s jobs on %s workers, predicted makespan %.3fs, actual %.3fs",
+                  self.count, self.workers, self.predicted / 1000000, self.actual / 1000000)
+        if self.aborted:
+            util.note("Schedule: aborted after %s of %s jobs", self.completed, self.count)
+
+
+def _timed_call(fn, args, name):
+    t0 = time.monotonic()
+    with trace.span(name, "job"):
+        ret = fn(*args)
+    # What a worker process recorded travels back with the result.
+    worker_state = (trace.drain_worker(), metrics.drain_worker(), governor.drain_worker())
+    return ret, int((time.monotonic() - t0) * 1000000), worker_state
+
+
+def _dispatch_inline(jobs, fn, hist, report, stop):
+    for j in jobs:
+        ret, usec, worker_state = _timed_call(fn, j.args, j.name)
+        record_duration(hist, j, usec)
+        report.completed += 1
+        yield j, ret
+        if stop is not None and stop(ret):
+            report.aborted = True
+            break
+
+
+class _reorder_buffer:
+    ''' Holds completed results back until all the jobs dispatched before them
+        completed, so they're emitted in the dispatch order.
+    '''
+    def __init__(self, jobs):
+        self.jobs = jobs
+        self._done = {}
+        self._next = 0
+
+    def put(self, i, ret):
+        self._done[i] = ret
+        while self._next in self._done:
+            yield self.jobs[self._next], self._done.pop(self._next)
+            self._next += 1
+
+    def flush(self):
+        for i in sorted(self._done):
+            yield self.jobs[i], self._done.pop(i)
+
+
+def _dispatch_pool(jobs, fn, executor, hist, report, stop, on_stop, ordered):
+    futures = dict((executor.submit(_timed_call, fn, j.args, j.name), i) for i, j in enumerate(jobs))
+    buf = _reorder_buffer(jobs)
+    for fut in as_completed(futures):
+        # Whatever was in flight when stopping is dropped.
+        if report.aborted or fut.cancelled():
+            continue
+        i = futures[fut]
+        ret, usec, (events, values, peak_rss) = fut.result()
+        trace.merge(events)
+        metrics.merge(values)
+        governor.merge(peak_rss)
+        record_duration(hist, jobs[i], usec)
+        report.completed += 1
+        if stop is not None and stop(ret):
+            report.aborted = True
+            for f in futures:
+                f.cancel()
+            if on_stop is not None:
+                on_stop()
+        if ordered:
+            yield from buf.put(i, ret)
+        else:
+            yield jobs[i], ret
+    # Completed out of order before an abort.
+    yield from buf.flush()
+
+
+def dispatch(jobs, fn, workers=1, hist=None, executor=None, report=None, order=None, stop=None, on_stop=None,
+             ordered=False):
+    ''' Runs fn(*job.args) for each job, longest predicted first, and yields
+        (job, result) as the jobs complete. The measured durations are
+        recorded into hist when passed.
+
+        Parameters:
+            jobs (list): The jobs
+            fn (callable): The job function
+            workers (int): Number of workers, 1 runs inline
+            hist (history): Optional history to record the durations into
+            executor: Optional concurrent.futures executor to use
+            report (schedule_report): Optional report to fill, for the caller to inspect
+            order (callable): Optional ordering of the job list, lpt_order by default
+            stop (callable): Optional predicate on a result, when true the remaining jobs are cancelled
+            on_stop (callable): Optional hook to interrupt the jobs in flight when stopping
+            ordered (bool): Yield the results in the dispatch order rather than the completion order
+    '''
+    if order is None:
+        order = lpt_order
+    jobs = order(jobs)
+    if report is None:
+        report = schedule_report(jobs, workers)
+    report.start()
+    if workers <= 1 and executor is None:
+        yield from _dispatch_inline(jobs, fn, hist, report, stop)
+    else:
+        own_executor = executor is None
+        if own_executor:
+            executor = ThreadPoolExecutor(max_workers=workers)
+        try:
+            yield from _dispatch_pool(jobs, fn, executor, hist, report, stop, on_stop, ordered)
+        finally:
+            if own_executor:
+                executor.shutdown(wait=True, cancel_futures=True)
+    report.finish()
+    report.log()
+
+
+def record_duration(hist, j, usec):
+    ''' Records the duration of a job into hist, when passed.
+    '''
+    # Split the group time evenly if a job stands for several history names.
+    if hist is not None:
+        for n in j.names:
+            hist.record(n, usec / len(j.names))
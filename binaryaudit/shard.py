@@ -0,0 +1,313 @@
+import argparse
+import hashlib
+import heapq
+import json
+import os
+
+from binaryaudit import abicheck
+from binaryaudit import cli
+from binaryaudit import gating
+from binaryaudit import scheduler
+from binaryaudit import util
+from binaryaudit.db import TRANSACTION_MAIN_RESULT_ABORTED, TRANSACTION_MAIN_RESULT_FAILED
+from binaryaudit.db import TRANSACTION_MAIN_RESULT_PASSED
+
+RESULTS_VERSION = 1
+
+# The recorded writes the merge step replays, the main table ones it does itself.
+MERGED_OPS = ("insert_ba_transaction_details", "insert_fingerprints")
+
+
+class merge_error(Exception):
+    pass
+
+
+class spec:
+    ''' A share of the jobs of a run split across several agents.
+
+        Every agent computes the split on its own, from the inputs they
+        all have: the job sizes and the durations in the telemetry DB.
+        The local history differs from agent to agent, it isn't used.
+
+        Parameters:
+            index (int): The shard, from 1 to count
+            count (int): The number of shards
+    '''
+    def __init__(self, index, count):
+        self.index = index
+        self.count = count
+        self.costs = scheduler.history()
+        self.digest = None
+        self.total = 0
+        self.names = []
+
+    def __str__(self):
+        return "{}/{}".format(self.index, self.count)
+
+    def load_db(self, db_conn, product_id):
+        self.costs.load_db(db_conn, product_id)
+
+    def select(self, jobs):
+        ''' Returns the jobs of this shard, in the order they were passed.
+        '''
+        assignment = partition(jobs, self.count, self.costs)
+        self.digest = plan_digest(jobs, assignment)
+        self.total = len(jobs)
+        selected = [j for j, s in zip(jobs, assignment) if s == self.index - 1]
+        self.names = [j.name for j in selected]
+        util.note("Shard %s: %s of %s jobs", self, len(selected), len(jobs))
+        return selected
+
+
+def _stable_hash(name):
+    return hashlib.sha256(name.encode("utf-8")).hexdigest()
+
+
+def partition(jobs, count, costs):
+    ''' Splits the jobs into count shards of about the same cost.
+
+        The costliest job goes to the least loaded shard first. Jobs of
+        the same cost are taken in the order of a hash of their names, so
+        the shards don't get alphabetical runs of similar items.
+
+        Parameters:
+            jobs (list): The jobs, in the same order on every agent
+            count (int): The number of shards
+            costs (scheduler.history): The durations to estimate the jobs by
+
+        Returns:
+            assignment (list): The shard of each job, from 0
+    '''
+    # Estimated on copies, the jobs keep the estimates the dispatch orders them by.
+    copies = scheduler.estimate([scheduler.job(j.name, None, j.size, j.names) for j in jobs], costs)
+    order = sorted(range(len(jobs)), key=lambda i: (-copies[i].estimate, _stable_hash(jobs[i].name), i))
+    loads = [(0, 0, s) for s in range(count)]
+    assignment = [None] * len(jobs)
+    for i in order:
+        load, n, s = heapq.heappop(loads)
+        assignment[i] = s
+        heapq.heappush(loads, (load + copies[i].estimate, n + 1, s))
+    return assignment
+
+
+def plan_digest(jobs, assignment):
+    ''' Returns a digest of the split, equal on all the agents which planned the same one.
+    '''
+    h = hashlib.sha256()
+    for j, s in zip(jobs, assignment):
+        h.update("{}\t{}\n".format(j.name, s).encode("utf-8"))
+    return h.hexdigest()
+
+
+def get_results_file(sp, results_file=None, output_dir=None):
+    ''' Resolves the results file of a shard, by default in the output directory.
+    '''
+    if results_file:
+        return results_file
+    return os.path.join(output_dir or ".", "binaryaudit-shard-{}-of-{}.json".format(sp.index, sp.count))
+
+
+def wrap(db_conn, sp, results_file):
+    ''' Routes the result writes of a sharded run into the shard results file.
+    '''
+    util.debug("Recording the results of shard %s to '%s'", sp, results_file)
+    return recorder(db_conn, sp, results_file)
+
+
+class recorder:
+    ''' Stands in for db.wrapper in a sharded run. The results of the shard
+        are kept for the results file, the merge step writes them to the
+        DB. Everything else is passed through to the wrapped connection,
+        None if telemetry is disabled.
+    '''
+    def __init__(self, db_conn, sp, results_file):
+        self._db_conn = db_conn
+        self.spec = sp
+        self.results_file = results_file
+        self.main = None
+        self.result = None
+        self.build_id = None
+        self.ops = []
+
+    def __getattr__(self, name):
+        if self._db_conn is None:
+            raise AttributeError("No database connection to call '{}' on".format(name))
+        return getattr(self._db_conn, name)
+
+    def is_db_connected(self):
+        return self._db_conn is not None and self._db_conn.is_db_connected()
+
+    def insert_main_transaction(self, build_id, product_id, buildurl="", logurl="", result=None, baseline_id=None):
+        self.main = {"buildurl": buildurl, "logurl": logurl, "baseline_id": baseline_id}
+
+    def insert_ba_transaction_details(self, build_id, product_id, item_name, base_version,
+                                      new_version, exec_time, result, res_details):
+        self.ops.append(("insert_ba_transaction_details",
+                         {"item_name": item_name, "base_version": base_version, "new_version": new_version,
+                          "exec_time": exec_time, "result": result, "res_details": res_details}))
+
+    def insert_fingerprints(self, build_id, product_id, item_name, fingerprints):
+        self.ops.append(("insert_fingerprints", {"item_name": item_name, "fingerprints": fingerprints}))
+
+    def update_ba_test_result(self, build_id, product_id, result):
+        self.build_id = build_id
+        self.result = result
+
+    def write(self):
+        data = {"version": RESULTS_VERSION, "shard": self.spec.index, "count": self.spec.count,
+                "plan": self.spec.digest, "jobs": self.spec.total, "items": self.spec.names,
+                "build_id": self.build_id, "main": self.main, "result": self.result, "ops": self.ops}
+        d = os.path.dirname(self.results_file)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        tmp_fn = self.results_file + ".tmp.{}".format(os.getpid())
+        with open(tmp_fn, "w") as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_fn, self.results_file)
+        util.note("Wrote the results of shard %s to '%s'", self.spec, self.results_file)
+
+    def log_pool_stats(self):
+        if self._db_conn is not None:
+            self._db_conn.log_pool_stats()
+
+    def close(self):
+        self.write()
+        if self._db_conn is not None:
+            self._db_conn.close()
+
+
+def load_results(fn):
+    with open(fn, "r") as f:
+        data = json.load(f)
+    if RESULTS_VERSION != data.get("version"):
+        raise merge_error("'{}' isn't a shard results file of version {}".format(fn, RESULTS_VERSION))
+    data["file"] = fn
+    return data
+
+
+def check_results(results):
+    ''' Checks that the results are of all the shards of the same split.
+
+        Returns:
+            results (list): The results ordered by the shard
+    '''
+    if not results:
+        raise merge_error("No shard results passed")
+    count = results[0]["count"]
+    by_index = {}
+    for r in results:
+        if r["count"] != count:
+            raise merge_error("'{}' is one of {} shards, '{}' of {}".format(
+                r["file"], r["count"], results[0]["file"], count))
+        if r["plan"] != results[0]["plan"]:
+            raise merge_error("'{}' and '{}' split different job lists".format(r["file"], results[0]["file"]))
+        if r["shard"] in by_index:
+            raise merge_error("'{}' and '{}' are both shard {}".format(
+                r["file"], by_index[r["shard"]]["file"], r["shard"]))
+        if r["result"] is None:
+            raise merge_error("Shard {} in '{}' didn't finish".format(r["shard"], r["file"]))
+        by_index[r["shard"]] = r
+    missing = [str(i) for i in range(1, count + 1) if i not in by_index]
+    if missing:
+        raise merge_error("Missing the results of shard {} of {}".format(", ".join(missing), count))
+    return [by_index[i] for i in range(1, count + 1)]
+
+
+def get_details(results):
+    ''' Yields the recorded details rows of all the shards.
+    '''
+    for r in results:
+        for name, kwargs in r["ops"]:
+            if "insert_ba_transaction_details" == name:
+                yield kwargs
+
+
+def merge_result(results):
+    ''' Returns the result of the whole run from the ones of the shards.
+    '''
+    res = [r["result"] for r in results]
+    if TRANSACTION_MAIN_RESULT_ABORTED in res:
+        return TRANSACTION_MAIN_RESULT_ABORTED
+    if TRANSACTION_MAIN_RESULT_FAILED in res:
+        return TRANSACTION_MAIN_RESULT_FAILED
+    return TRANSACTION_MAIN_RESULT_PASSED
+
+
+def merge_status(results, result):
+    ''' Returns the exit status of the merge, the highest libabigail status of the items.
+    '''
+    status = max([abicheck.diff_from_bit(d["result"]) for d in get_details(results)] or [abicheck.DIFF_OK])
+    if TRANSACTION_MAIN_RESULT_PASSED != result:
+        # Failures reused from an aborted run have no rows in the shards.
+        status = max(status, abicheck.DIFF_ERROR)
+    return status
+
+
+def write_reports(results, out_dir):
+    ''' Writes the report of each item with changes, as the shards did into their output directories.
+
+        Returns:
+            count (int): The number of reports written
+    '''
+    os.makedirs(out_dir, exist_ok=True)
+    count = 0
+    for d in get_details(results):
+        if "OK" == d["result"]:
+            continue
+        fname = util.build_diff_filename(d["item_name"], d["base_version"], d["new_version"])
+        with open(os.path.join(out_dir, fname), "w") as f:
+            f.write(d["res_details"])
+        count += 1
+    return count
+
+
+def upload(db_conn, results, result, build_id, product_id, buildurl=None, logurl=None):
+    ''' Records the merged run in the DB, as a single run would have.
+    '''
+    main = next((r["main"] for r in results if r["main"]), {})
+    gating.begin_run(db_conn, build_id, product_id, buildurl or main.get("buildurl", ""),
+                     logurl or main.get("logurl", ""), main.get("baseline_id"))
+    for r in results:
+        for name, kwargs in r["ops"]:
+            if name in MERGED_OPS:
+                getattr(db_conn, name)(build_id=build_id, product_id=product_id, **kwargs)
+    db_conn.update_ba_test_result(build_id, product_id, result)
+
+
+def _upload_merged(args, results, result):
+    from binaryaudit import spool
+    from binaryaudit.db import wrapper as db_wrapper
+    db_conn = db_wrapper(args.db_config, util.logger)
+    db_conn.initialize_db()
+    db_conn = spool.wrap(db_conn, spool.get_spool_file(args))
+    prod_id = db_conn.get_product_id(args.product_name, args.derivative)
+    upload(db_conn, results, result, args.build_id, prod_id, args.buildurl, args.logurl)
+    db_conn.close()
+    db_conn.log_pool_stats()
+
+
+def main(args):
+    ''' Runs "binaryaudit merge", returns the exit status.
+    '''
+    try:
+        results = check_results([load_results(fn) for fn in args.results])
+    except (OSError, ValueError, KeyError, merge_error) as e:
+        util.error("%s", e)
+        return 1
+
+    result = merge_result(results)
+    for r in results:
+        util.note("Shard %s/%s: %s jobs, %s", r["shard"], r["count"], len(r["items"]), r["result"])
+    util.note("Merged %s shards of %s jobs: %s", len(results), results[0]["jobs"], result)
+    if args.output_dir:
+        count = write_reports(results, args.output_dir)
+        util.note("Wrote %s reports to '%s'", count, args.output_dir)
+
+    if 'y' == args.enable_telemetry:
+        try:
+            cli.validate_telemetry_args(args)
+        except argparse.ArgumentError as e:
+            util.fatal("%s", e)
+            return 3
+        _upload_merged(args, results, result)
+    return merge_status(results, result)
@@ -0,0 +1,386 @@
+import bisect
+import hashlib
+import heapq
+import json
+import re
+import sys
+
+from binaryaudit import conf
+from binaryaudit import gating
+from binaryaudit import governor
+from binaryaudit import scheduler
+from binaryaudit import util
+
+# The job orderings a run can be replayed with.
+ORDERS = ("lpt", "spt", "fifo", "risk")
+
+_SIZE_RE = re.compile(r"^(\d+(?:\.\d+)?)([KMGT]?)$", re.IGNORECASE)
+_SIZE_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+
+def parse_size(s):
+    ''' Parses a size in bytes with an optional K, M, G or T suffix.
+    '''
+    m = _SIZE_RE.match(s.strip())
+    if m is None:
+        raise ValueError("Invalid size '{}'".format(s))
+    return int(float(m.group(1)) * _SIZE_UNITS[m.group(2).upper()])
+
+
+def get_rss_default():
+    try:
+        return int(conf.get_config("Governor", "rss_min"))
+    except KeyError:
+        return governor.RSS_MIN_DEFAULT
+
+
+class item(scheduler.job):
+    ''' A job of a recorded run, its measured duration is the estimate the orderings go by.
+
+        Parameters:
+            name (str): The item name
+            usec (int): The measured duration in microseconds
+            fatal (bool): The job found an incompatible change
+            rss (int): The peak RSS of its tools in bytes, None if unknown
+    '''
+    def __init__(self, name, usec, fatal=False, rss=None):
+        scheduler.job.__init__(self, name, None)
+        self.estimate = int(usec)
+        self.known = True
+        self.fatal = fatal
+        self.rss = rss
+
+
+class record:
+    ''' The jobs of a run to replay.
+
+        Parameters:
+            items (list): The jobs in the order they were recorded
+            source (str): Where the record comes from
+            workers (int): The number of workers the run had, None if unknown
+            makespan (int): The measured makespan in microseconds, None if unknown
+    '''
+    def __init__(self, items, source, workers=None, makespan=None):
+        self.items = items
+        self.source = source
+        self.workers = workers
+        self.makespan = makespan
+
+    def attach_peak_rss(self, peak_rss):
+        ''' Assigns the peak RSS recorded by the governor, keyed by "tool:name", to the jobs.
+        '''
+        by_name = {}
+        for key, rss in peak_rss.items():
+            name = key.split(":", 1)[-1]
+            by_name[name] = max(by_name.get(name, 0), rss)
+        for it in self.items:
+            if it.name in by_name:
+                it.rss = by_name[it.name]
+
+
+def load_trace(fn):
+    ''' Loads the jobs of a run from the trace written with --trace.
+
+        The job spans give the jobs and their durations. A job is fatal
+        if one of the tool spans within returned an incompatible change.
+    '''
+    with open(fn, "r") as f:
+        data = json.load(f)
+    events = data["traceEvents"] if isinstance(data, dict) else data
+    jobs = []
+    tools = []
+    for ev in events:
+        if "X" != ev.get("ph"):
+            continue
+        cats = ev.get("cat", "").split(",")
+        if "job" in cats:
+            jobs.append(ev)
+        elif "tool" in cats and "ret" in ev.get("args", {}):
+            tools.append(ev)
+    if not jobs:
+        return record([], fn)
+    jobs.sort(key=lambda ev: ev["ts"])
+    # A worker thread runs its jobs one after the other, the tool spans
+    # nest within the job span of the same thread.
+    lanes = {}
+    for ev in jobs:
+        lanes.setdefault((ev["pid"], ev["tid"]), []).append(ev)
+    fatal = set()
+    for ev in tools:
+        lane = lanes.get((ev["pid"], ev["tid"]), [])
+        i = bisect.bisect_right([j["ts"] for j in lane], ev["ts"]) - 1
+        if i >= 0 and gating.is_fatal(ev["args"]["ret"]):
+            fatal.add(id(lane[i]))
+    items = [item(ev["name"], ev["dur"], id(ev) in fatal) for ev in jobs]
+    makespan = max(ev["ts"] + ev["dur"] for ev in jobs) - jobs[0]["ts"]
+    return record(items, fn, len(lanes), makespan)
+
+
+def load_history(hist, source):
+    ''' Loads the jobs from the per item durations of a history, one job per item.
+    '''
+    durations = hist.get_durations()
+    items = [item(name, usec) for name, usec in sorted(durations.items())]
+    return record(items, source)
+
+
+def load_build(db_conn, build_id, product_id):
+    ''' Loads the jobs of a build from the telemetry details table.
+    '''
+    items = []
+    for row in db_conn.get_ba_transaction_details(build_id, product_id, False):
+        if row["ExecTimeInMicroSec"] is None:
+            continue
+        items.append(item(row["ItemName"], row["ExecTimeInMicroSec"], gating.is_fatal(gating.get_reused_status(row))))
+    return record(items, "build '{}'".format(build_id))
+
+
+def is_cache_hit(name, rate):
+    ''' Tells whether a job is assumed to be served by the verdict cache.
+
+        The choice hashes the name, the same jobs hit across the
+        simulations and the hits grow with the rate.
+    '''
+    if rate <= 0:
+        return False
+    h = int(hashlib.sha256(name.encode("utf-8")).hexdigest()[:8], 16)
+    return h / 0x100000000 < rate
+
+
+def order_jobs(jobs, order, hist=None):
+    if "lpt" == order:
+        return scheduler.lpt_order(jobs)
+    if "spt" == order:
+        return sorted(jobs, key=lambda j: (j.estimate, j.name))
+    if "fifo" == order:
+        return list(jobs)
+    if "risk" == order:
+        return gating.risk_order(hist if hist is not None else scheduler.history())(jobs)
+    raise ValueError("Unknown order '{}'".format(order))
+
+
+def simulate(items, workers, order="lpt", hist=None, hit_rate=0, hit_usec=0, memory=None, rss_default=None,
+             fail_fast=False):
+    ''' Replays the jobs on a simulated worker pool.
+
+        A free worker takes the next job in the order. With a memory budget
+        the job waits, holding its worker, until its peak RSS fits next to
+        the running ones, as with the governor. A job larger than the
+        budget runs alone.
+
+        Parameters:
+            items (list): The jobs
+            workers (int): The number of workers
+            order (str): One of ORDERS
+            hist (scheduler.history): The failure counts for the risk order
+            hit_rate (float): The share of the jobs assumed to hit the verdict cache
+            hit_usec (int): The duration of a job served from the cache
+            memory (int): The memory budget in bytes, None for no limit
+            rss_default (int): The peak RSS of the jobs without a recorded one
+            fail_fast (bool): Stop at the first fatal job
+
+        Returns:
+            result (dict): The makespan and busy time in microseconds, the
+                utilization, the lower bound of the makespan, the memory
+                wait and the critical path
+    '''
+    if rss_default is None:
+        rss_default = get_rss_default()
+    jobs = []
+    for it in items:
+        usec = hit_usec if is_cache_hit(it.name, hit_rate) else it.estimate
+        jobs.append(item(it.name, usec, it.fatal, it.rss))
+    jobs = order_jobs(jobs, order, hist)
+    sizes = [min(j.rss or rss_default, memory) if memory else 0 for j in jobs]
+
+    free = list(range(max(1, workers)))
+    lane_last = [None] * len(free)
+    # Per job: [lane, queued, start, end, predecessor]
+    sched = [None] * len(jobs)
+    waiting = []
+    running = []
+    used = 0
+    last_done = None
+    t = 0
+    nxt = 0
+    aborted = False
+    while True:
+        while free and nxt < len(jobs) and not aborted:
+            sched[nxt] = [heapq.heappop(free), t, None, None, None]
+            waiting.append(nxt)
+            nxt += 1
+        still = []
+        for k in waiting:
+            if memory and running and used + sizes[k] > memory:
+                still.append(k)
+                continue
+            lane, queued = sched[k][0], sched[k][1]
+            # A job is held up by the one releasing the memory or by the one before it on its worker.
+            sched[k][2] = t
+            sched[k][4] = last_done if t > queued else lane_last[lane]
+            used += sizes[k]
+            heapq.heappush(running, (t + jobs[k].estimate, k))
+        waiting = still
+        if not running:
+            break
+        t, k = heapq.heappop(running)
+        used -= sizes[k]
+        sched[k][3] = t
+        lane_last[sched[k][0]] = k
+        last_done = k
+        heapq.heappush(free, sched[k][0])
+        if fail_fast and jobs[k].fatal:
+            aborted = True
+            break
+
+    return _summarize(jobs, sched, workers, order, hit_rate, memory, t, last_done, aborted)
+
+
+def _summarize(jobs, sched, workers, order, hit_rate, memory, makespan, last_done, aborted):
+    busy = 0
+    memory_wait = 0
+    completed = 0
+    for s in sched:
+        if s is None or s[2] is None:
+            continue
+        end = s[3] if s[3] is not None else makespan
+        busy += end - s[2]
+        memory_wait += s[2] - s[1]
+        if s[3] is not None:
+            completed += 1
+    total = sum(j.estimate for j in jobs)
+    longest = max([j.estimate for j in jobs] or [0])
+    path = []
+    k = last_done
+    while k is not None:
+        lane, queued, start, end, pred = sched[k]
+        path.append({"name": jobs[k].name, "start": start, "end": end, "worker": lane,
+                     "memory_wait": start - queued})
+        k = pred
+    path.reverse()
+    return {"workers": workers, "order": order, "cache_hit_rate": hit_rate, "memory": memory,
+            "jobs": len(jobs), "completed": completed, "aborted": aborted,
+            "makespan": makespan, "busy": busy,
+            "utilization": busy / (max(1, workers) * makespan) if makespan else .0,
+            "lower_bound": max(longest, total / max(1, workers)) if not aborted else None,
+            "longest": longest, "memory_wait": memory_wait, "critical_path": path}
+
+
+def sweep(rec, workers, orders, hit_rates, memories, hist=None, hit_usec=0, rss_default=None, fail_fast=False):
+    ''' Simulates every combination of the worker counts, orders, cache hit rates and memory budgets.
+    '''
+    results = []
+    for w in workers:
+        for order in orders:
+            for rate in hit_rates:
+                for memory in memories:
+                    results.append(simulate(rec.items, w, order, hist, rate, hit_usec, memory, rss_default,
+                                            fail_fast))
+    return results
+
+
+def _sec(usec):
+    return "{:.3f}s".format(usec / 1000000)
+
+
+def _size(n):
+    if n is None:
+        return "-"
+    for unit in ("T", "G", "M", "K"):
+        if n >= _SIZE_UNITS[unit] and 0 == n % _SIZE_UNITS[unit]:
+            return "{}{}".format(n // _SIZE_UNITS[unit], unit)
+    return str(n)
+
+
+def print_results(rec, results, out, verbose=False):
+    ''' Writes a table of the results and the critical path of the fastest configuration.
+    '''
+    total = sum(it.estimate for it in rec.items)
+    out.write("Replaying {} jobs, {} of work, from {}\n".format(len(rec.items), _sec(total), rec.source))
+    if rec.makespan is not None:
+        out.write("Recorded makespan {} on {} workers\n".format(_sec(rec.makespan), rec.workers))
+    out.write("{:>7} {:<5} {:>6} {:>7} {:>11} {:>7} {:>11} {:>11}\n".format(
+        "workers", "order", "hits", "memory", "makespan", "util", "bound", "mem wait"))
+    for r in results:
+        bound = _sec(r["lower_bound"]) if r["lower_bound"] is not None else "-"
+        makespan = _sec(r["makespan"]) + ("*" if r["aborted"] else "")
+        out.write("{:>7} {:<5} {:>5.0f}% {:>7} {:>11} {:>6.1f}% {:>11} {:>11}\n".format(
+            r["workers"], r["order"], r["cache_hit_rate"] * 100, _size(r["memory"]), makespan,
+            r["utilization"] * 100, bound, _sec(r["memory_wait"])))
+    if any(r["aborted"] for r in results):
+        out.write("* stopped at the first incompatible change\n")
+    if not results:
+        return
+    best = min(results, key=lambda r: (r["makespan"], r["workers"]))
+    path = best["critical_path"]
+    out.write("Critical path of {} workers, {}: {} jobs\n".format(best["workers"], best["order"], len(path)))
+    shown = path if verbose else sorted(path, key=lambda p: p["start"] - p["end"])[:10]
+    for p in sorted(shown, key=lambda p: p["start"]):
+        wait = " after {} waiting for memory".format(_sec(p["memory_wait"])) if p["memory_wait"] else ""
+        out.write("  {:>11} {:>11}  worker {:<3} {}{}\n".format(
+            _sec(p["start"]), _sec(p["end"] - p["start"]), p["worker"], p["name"], wait))
+    if len(shown) < len(path):
+        out.write("  ... the {} longest of {} shown, -v for all\n".format(len(shown), len(path)))
+
+
+def _check_args(args):
+    ''' Returns the memory budgets.
+
+        Raises:
+            ValueError: An option is invalid or missing
+    '''
+    memories = [parse_size(m) if m else None for m in args.memory]
+    for order in args.order:
+        if order not in ORDERS:
+            raise ValueError("Unknown order '{}'".format(order))
+    if not args.from_trace and 'y' == args.enable_telemetry and (not args.product_name or not args.derivative):
+        raise ValueError("Options --product-name and --derivative are required")
+    return memories
+
+
+def _load_telemetry(args, hist):
+    from binaryaudit.db import wrapper as db_wrapper
+    db_conn = db_wrapper(args.db_config, util.logger)
+    db_conn.initialize_db()
+    prod_id = db_conn.get_product_id(args.product_name, args.derivative)
+    # The failure counts of the risk order come from the DB, too.
+    hist.load_db(db_conn, prod_id)
+    if args.build_id:
+        rec = load_build(db_conn, args.build_id, prod_id)
+    else:
+        db_hist = scheduler.history()
+        db_hist.load_db(db_conn, prod_id)
+        rec = load_history(db_hist, "the telemetry of '{}'".format(args.product_name))
+    db_conn.close()
+    return rec
+
+
+def main(args):
+    ''' Runs "binaryaudit simulate", returns the exit status.
+    '''
+    try:
+        memories = _check_args(args)
+    except ValueError as e:
+        util.error("%s", e)
+        return 2
+
+    hist = scheduler.history(args.history or scheduler.get_history_file())
+    if args.from_trace:
+        rec = load_trace(args.from_trace)
+    elif 'y' == args.enable_telemetry:
+        rec = _load_telemetry(args, hist)
+    else:
+        rec = load_history(hist, "'{}'".format(hist.cache_file))
+    rec.attach_peak_rss(hist.peak_rss)
+    if not rec.items:
+        util.error("No jobs recorded in %s", rec.source)
+        return 1
+
+    results = sweep(rec, args.jobs, args.order, args.cache_hit_rate, memories, hist,
+                    int(args.cache_hit_time * 1000000), fail_fast=args.fail_fast)
+    if args.json:
+        for r in results:
+            print(json.dumps(r))
+    else:
+        print_results(rec, results, sys.stdout, args.verbose)
+    return 0
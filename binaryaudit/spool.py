@@ -0,0 +1,404 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from binaryaudit import conf
+from binaryaudit import trace
+from binaryaudit import util
+from binaryaudit.db import SPOOLABLE_OPS, is_transient_error, missing_row_error
+
+DRAIN_BATCH_SIZE = 256
+DRAIN_INTERVAL = 2.0
+DRAIN_RETRIES = 3
+RETRY_BACKOFF_MAX = 60.0
+# Seconds an uploader owns the rows it claimed, they're claimable again
+# afterwards in case it died before acknowledging them.
+CLAIM_LEASE = 600.0
+MAX_ATTEMPTS_DEFAULT = 5
+
+
+def _get_telemetry_config(key, default):
+    try:
+        return conf.get_config("Telemetry", key)
+    except KeyError:
+        return default
+
+
+def get_default_spool_file():
+    fn = _get_telemetry_config("spool_file", None)
+    if fn:
+        fn = os.path.expanduser(fn)
+    return fn
+
+
+def get_max_attempts():
+    return int(_get_telemetry_config("max_attempts", MAX_ATTEMPTS_DEFAULT))
+
+
+def get_spool_file(args):
+    ''' Resolves the spool file from the command line, falling back to the config.
+    '''
+    if args.no_spool:
+        return None
+    if args.spool:
+        return args.spool
+    return get_default_spool_file()
+
+
+def wrap(db_conn, spool_file):
+    ''' Routes the telemetry writes of db_conn through a spool, if one is configured.
+    '''
+    if not spool_file:
+        return db_conn
+    util.debug("Spooling telemetry to '%s'", spool_file)
+    return spooled_wrapper(db_conn, spool(spool_file, db_id=db_conn.get_identity()))
+
+
+class spool:
+    ''' Durable local queue of telemetry writes backed by SQLite.
+
+        Writes are appended in a WAL journaled database, so recording
+        a row costs a local disk append. The rows stay until they've
+        been acknowledged after a successful upload.
+
+        Several uploaders, of one or several processes, can share a
+        spool. Each claims the rows it uploads for a lease. A row failing
+        max_attempts times is moved to the dead_ops table, so it doesn't
+        hold up the rows behind it.
+
+        The runs writing to different DBs can share a spool too, the rows
+        carry the identity of their DB and a spool object only sees the
+        ones of its own.
+
+        Parameters:
+            path (str): The spool file
+            max_attempts (int): Failed uploads of a row before it's moved aside, from the config if omitted
+            db_id (str): Identity of the DB the rows go to, see db.wrapper.get_identity()
+    '''
+    def __init__(self, path, max_attempts=None, db_id=""):
+        self.path = path
+        self.db_id = db_id
+        self.max_attempts = max_attempts if max_attempts is not None else get_max_attempts()
+        # Tells the claims of this spool object from the ones of others on the same file.
+        self.owner = uuid.uuid4().hex
+        self._lock = threading.Lock()
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS ops ("
+                           "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                           "op TEXT NOT NULL, "
+                           "args TEXT NOT NULL, "
+                           "created REAL NOT NULL, "
+                           "attempts INTEGER NOT NULL DEFAULT 0)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS dead_ops ("
+                           "id INTEGER PRIMARY KEY, "
+                           "op TEXT NOT NULL, "
+                           "args TEXT NOT NULL, "
+                           "created REAL NOT NULL, "
+                           "attempts INTEGER NOT NULL, "
+                           "error TEXT)")
+        # Spools written before the rows were claimed lack the claim columns.
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(ops)")]
+        if "claimed_until" not in columns:
+            self._conn.execute("ALTER TABLE ops ADD COLUMN claimed_until REAL NOT NULL DEFAULT 0")
+            self._conn.execute("ALTER TABLE ops ADD COLUMN claimed_by TEXT")
+        # Rows spooled before they carried their DB have an empty identity,
+        # whatever DB drains the spool first takes them.
+        for table in ("ops", "dead_ops"):
+            if "db_id" not in [row[1] for row in self._conn.execute("PRAGMA table_info({})".format(table))]:
+                self._conn.execute("ALTER TABLE {} ADD COLUMN db_id TEXT NOT NULL DEFAULT ''".format(table))
+
+    def put(self, op, **kwargs):
+        if op not in SPOOLABLE_OPS:
+            raise ValueError("Operation '{}' can't be spooled".format(op))
+        args = json.dumps(kwargs, default=_json_default)
+        with self._lock:
+            self._conn.execute("INSERT INTO ops (op, args, created, db_id) VALUES (?, ?, ?, ?)",
+                               (op, args, time.time(), self.db_id))
+
+    def peek(self, limit=DRAIN_BATCH_SIZE):
+        ''' Returns the oldest spooled ops as a list of (id, op, kwargs), without claiming them.
+        '''
+        with self._lock:
+            rows = self._conn.execute("SELECT id, op, args FROM ops WHERE db_id IN (?, '') ORDER BY id LIMIT ?",
+                                      (self.db_id, limit)).fetchall()
+        return _decode(rows)
+
+    def claim(self, limit=DRAIN_BATCH_SIZE, lease=CLAIM_LEASE):
+        ''' Claims the oldest ops nobody else holds for the lease, returns them as a list of (id, op, kwargs).
+        '''
+        now = time.time()
+        with self._lock:
+            # BEGIN IMMEDIATE takes the write lock of the file, the other processes claim after us.
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute("SELECT id, op, args FROM ops WHERE claimed_until < ? AND db_id IN (?, '') "
+                                          "ORDER BY id LIMIT ?", (now, self.db_id, limit)).fetchall()
+                self._conn.executemany("UPDATE ops SET claimed_until = ?, claimed_by = ? WHERE id = ?",
+                                       [(now + lease, self.owner, row[0]) for row in rows])
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return _decode(rows)
+
+    def ack(self, ids):
+        with self._lock:
+            self._conn.executemany("DELETE FROM ops WHERE id = ?", [(i,) for i in ids])
+
+    def release(self, ids):
+        ''' Gives up the claim on ops without counting an attempt, as when the DB can't be reached.
+        '''
+        with self._lock:
+            self._conn.executemany("UPDATE ops SET claimed_until = 0, claimed_by = NULL "
+                                   "WHERE id = ? AND claimed_by = ?", [(i, self.owner) for i in ids])
+
+    def nack(self, ids, error=None):
+        ''' Counts a failed attempt of ops and releases them, the ones out of attempts go to dead_ops.
+
+            Returns:
+                count (int): The number of ops moved to dead_ops
+        '''
+        params = [(i,) for i in ids]
+        in_ids = "id IN ({})".format(",".join("?" * len(ids)))
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany("UPDATE ops SET attempts = attempts + 1, claimed_until = 0, claimed_by = NULL "
+                                       "WHERE id = ?", params)
+                dead = self._conn.execute("INSERT INTO dead_ops (id, op, args, created, attempts, error, db_id) "
+                                          "SELECT id, op, args, created, attempts, ?, db_id FROM ops "
+                                          "WHERE attempts >= ? AND " + in_ids,
+                                          [error, self.max_attempts] + list(ids)).rowcount
+                self._conn.execute("DELETE FROM ops WHERE attempts >= ? AND " + in_ids,
+                                   [self.max_attempts] + list(ids))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return dead
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM ops WHERE db_id IN (?, '')", (self.db_id,)).fetchone()[0]
+
+    def dead_count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM dead_ops WHERE db_id IN (?, '')",
+                                      (self.db_id,)).fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def _decode(rows):
+    return [(row_id, op, json.loads(args, object_hook=_json_object_hook)) for row_id, op, args in rows]
+
+
+def _json_default(o):
+    if isinstance(o, datetime):
+        return {"__datetime__": o.isoformat()}
+    raise TypeError("Object of type '{}' can't be spooled".format(type(o).__name__))
+
+
+def _json_object_hook(d):
+    if "__datetime__" in d:
+        return datetime.fromisoformat(d["__datetime__"])
+    return d
+
+
+def drain_batch(sp, db_conn, batch_size=DRAIN_BATCH_SIZE):
+    ''' Uploads one batch of spooled ops in a single DB transaction.
+
+        An op the DB rejects fails the whole transaction, the batch is then
+        uploaded an op at a time to single it out. A failure of the DB
+        itself is raised, the ops stay spooled as they were. So does an op
+        referring to a row another uploader didn't upload yet.
+
+        Returns:
+            count (int): The number of ops uploaded, zero if there's nothing to claim
+    '''
+    rows = sp.claim(batch_size)
+    if not rows:
+        return 0
+    ids = [row_id for row_id, op, kwargs in rows]
+    try:
+        with trace.span("db.upload", "db", ops=len(rows)):
+            db_conn.apply_ops([(op, kwargs) for row_id, op, kwargs in rows])
+    except Exception as e:
+        if is_transient_error(e) or 1 == len(rows):
+            _fail(sp, ids, e)
+            raise
+        return _drain_singly(sp, db_conn, rows)
+    sp.ack(ids)
+    return len(rows)
+
+
+def _fail(sp, ids, e):
+    if is_transient_error(e) or isinstance(e, missing_row_error):
+        # Not the rows' fault, they're uploaded once the DB is back or the row they refer to is there.
+        sp.release(ids)
+        return
+    dead = sp.nack(ids, str(e))
+    if dead:
+        util.warn("%s telemetry rows failed %s times, moved them aside in '%s': %s", dead, sp.max_attempts,
+                  sp.path, e)
+
+
+def _drain_singly(sp, db_conn, rows):
+    uploaded = 0
+    for i, (row_id, op, kwargs) in enumerate(rows):
+        try:
+            db_conn.apply_ops([(op, kwargs)])
+        except Exception as e:
+            if is_transient_error(e):
+                sp.release([r[0] for r in rows[i:]])
+                raise
+            util.debug("Telemetry op %s '%s' rejected: %s", row_id, op, e)
+            _fail(sp, [row_id], e)
+            continue
+        sp.ack([row_id])
+        uploaded += 1
+    return uploaded
+
+
+def drain(sp, db_conn, batch_size=DRAIN_BATCH_SIZE, retries=DRAIN_RETRIES):
+    ''' Uploads everything spooled, retrying failed batches with a backoff.
+
+        Returns:
+            count (int): The number of ops uploaded
+    '''
+    total = 0
+    attempt = 0
+    while True:
+        try:
+            n = drain_batch(sp, db_conn, batch_size)
+        except Exception as e:
+            attempt += 1
+            util.warn("Telemetry upload failed (%s of %s): %s", attempt, retries, e)
+            if attempt >= retries:
+                break
+            time.sleep(min(2 ** attempt, RETRY_BACKOFF_MAX))
+            continue
+        if 0 == n:
+            break
+        total += n
+        attempt = 0
+    return total
+
+
+class uploader(threading.Thread):
+    ''' Background thread draining the spool into the DB while the audit runs.
+    '''
+    def __init__(self, sp, db_conn, interval=DRAIN_INTERVAL, batch_size=DRAIN_BATCH_SIZE):
+        super().__init__(name="binaryaudit-uploader", daemon=True)
+        self.sp = sp
+        self.db_conn = db_conn
+        self.interval = interval
+        self.batch_size = batch_size
+        self.uploaded = 0
+        self._stop_ev = threading.Event()
+
+    def run(self):
+        backoff = self.interval
+        while not self._stop_ev.wait(backoff):
+            try:
+                while not self._stop_ev.is_set():
+                    n = drain_batch(self.sp, self.db_conn, self.batch_size)
+                    self.uploaded += n
+                    if n < self.batch_size:
+                        break
+                backoff = self.interval
+            except Exception as e:
+                util.debug("Telemetry upload deferred: %s", e)
+                backoff = min(backoff * 2, RETRY_BACKOFF_MAX)
+
+    def stop(self, retries=DRAIN_RETRIES):
+        ''' Stops the thread and uploads what's left.
+
+            Returns:
+                remaining (int): The number of ops still in the spool
+        '''
+        self._stop_ev.set()
+        self.join()
+        self.uploaded += drain(self.sp, self.db_conn, self.batch_size, retries)
+        return self.sp.count()
+
+
+class spooled_wrapper:
+    ''' Stands in for db.wrapper. The write calls go to the spool and are
+        uploaded by the background uploader, everything else is passed
+        through to the wrapped connection.
+    '''
+    def __init__(self, db_conn, sp, start_uploader=True):
+        self._db_conn = db_conn
+        self.spool = sp
+        self.uploader = None
+        if start_uploader:
+            self.uploader = uploader(sp, db_conn)
+            self.uploader.start()
+
+    def __getattr__(self, name):
+        return getattr(self._db_conn, name)
+
+    def insert_main_transaction(self, build_id, product_id, buildurl="", logurl="", result=None, baseline_id=None):
+        kwargs = dict(build_id=build_id, product_id=product_id, buildurl=buildurl, logurl=logurl,
+                      baseline_id=baseline_id, date=datetime.utcnow())
+        if result:
+            kwargs["result"] = result
+        self.spool.put("insert_main_transaction", **kwargs)
+
+    def insert_ba_transaction_details(self, build_id, product_id, item_name, base_version,
+                                      new_version, exec_time, result, res_details):
+        self.spool.put("insert_ba_transaction_details", build_id=build_id, product_id=product_id,
+                       item_name=item_name, base_version=base_version, new_version=new_version,
+                       exec_time=exec_time, result=result, res_details=res_details, date=datetime.utcnow())
+
+    def update_ba_test_result(self, build_id, product_id, result):
+        self.spool.put("update_ba_test_result", build_id=build_id, product_id=product_id, result=result)
+
+    def insert_fingerprints(self, build_id, product_id, item_name, fingerprints):
+        self.spool.put("insert_fingerprints", build_id=build_id, product_id=product_id,
+                       item_name=item_name, fingerprints=fingerprints)
+
+    def insert_verdict(self, key, base_hash, cur_hash, suppr_hash, tool_version, result, report):
+        self.spool.put("insert_verdict", key=key, base_hash=base_hash, cur_hash=cur_hash, suppr_hash=suppr_hash,
+                       tool_version=tool_version, result=result, report=report, date=datetime.utcnow())
+
+    def close(self):
+        if self.uploader:
+            remaining = self.uploader.stop()
+            util.note("Uploaded %s telemetry rows", self.uploader.uploaded)
+            if remaining:
+                util.warn("%s telemetry rows are left in '%s', upload them with "
+                          "'binaryaudit db --drain'", remaining, self.spool.path)
+        dead = self.spool.dead_count()
+        if dead:
+            util.warn("%s telemetry rows the DB rejected are kept in the dead_ops table of '%s'",
+                      dead, self.spool.path)
+        self.spool.close()
+        self._db_conn.close()
+
+
+def main(args, db_conn):
+    ''' Runs "binaryaudit db --drain", returns the exit status.
+    '''
+    spool_file = get_spool_file(args)
+    if not spool_file or not os.path.isfile(spool_file):
+        util.note("Nothing to drain")
+        return 0
+    sp = spool(spool_file, db_id=db_conn.get_identity())
+    uploaded = drain(sp, db_conn)
+    remaining = sp.count()
+    sp.close()
+    util.note("Uploaded %s telemetry rows, %s left", uploaded, remaining)
+    return 0 if 0 == remaining else 1
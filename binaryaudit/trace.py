@@ -0,0 +1,181 @@
+import functools
+import json
+import os
+import threading
+import time
+
+# The active tracer, None while tracing is disabled. Checked first thing
+# by every instrumented stage so the disabled case costs a global lookup.
+_tracer = None
+
+
+class _null_span:
+    ''' Shared no-op span handed out while tracing is disabled.
+    '''
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **kwargs):
+        pass
+
+
+_NULL_SPAN = _null_span()
+
+
+def _now_us():
+    # CLOCK_MONOTONIC is system wide, the timestamps of pool worker
+    # processes line up with the ones of the parent.
+    return time.monotonic_ns() // 1000
+
+
+class _span:
+    def __init__(self, tracer, name, cat, args):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.args = args
+        self.t0 = 0
+
+    def __enter__(self):
+        self.t0 = _now_us()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        self.tracer.add(self.name, self.cat, self.t0, _now_us() - self.t0, self.args)
+        return False
+
+    def set(self, **kwargs):
+        self.args.update(kwargs)
+
+
+class tracer:
+    ''' Collects complete trace events in the Chrome trace-event format.
+
+        Parameters:
+            worker (bool): The tracer of a pool worker process, its events are
+                handed back to the parent with drain_worker()
+    '''
+    def __init__(self, worker=False):
+        self.worker = worker
+        self.origin = _now_us()
+        self._events = []
+        self._threads = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, cat, ts, dur, args):
+        tid = threading.get_native_id()
+        ev = {"name": name, "cat": cat, "ph": "X", "ts": ts, "dur": dur, "pid": os.getpid(), "tid": tid}
+        if args:
+            ev["args"] = args
+        with self._lock:
+            if tid not in self._threads:
+                self._threads[tid] = (os.getpid(), threading.current_thread().name)
+            self._events.append(ev)
+
+    def merge(self, events, threads):
+        with self._lock:
+            self._events.extend(events)
+            self._threads.update(threads)
+
+    def drain(self):
+        with self._lock:
+            events, self._events = self._events, []
+            threads, self._threads = self._threads, {}
+        return events, threads
+
+    def _metadata(self):
+        pids = set([os.getpid()])
+        meta = []
+        for tid, (pid, name) in sorted(self._threads.items()):
+            pids.add(pid)
+            meta.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}})
+        for pid in sorted(pids):
+            name = "binaryaudit" if pid == os.getpid() else "binaryaudit worker {}".format(pid)
+            meta.append({"name": "process_name", "ph": "M", "pid": pid, "tid": 0, "args": {"name": name}})
+        return meta
+
+    def write(self, fn):
+        with self._lock:
+            # The buffered events keep their absolute timestamps, the trace may be written again.
+            events = [dict(ev, ts=ev["ts"] - self.origin) for ev in sorted(self._events, key=lambda e: e["ts"])]
+            meta = self._metadata()
+        with open(fn, "w") as f:
+            json.dump({"traceEvents": meta + events, "displayTimeUnit": "ms"}, f)
+        return len(events)
+
+
+def enable(worker=False):
+    global _tracer
+    _tracer = tracer(worker)
+    return _tracer
+
+
+def disable():
+    global _tracer
+    _tracer = None
+
+
+def is_enabled():
+    return _tracer is not None
+
+
+def span(name, cat="", **kwargs):
+    ''' Times the enclosed block as a trace event.
+
+        Parameters:
+            name (str): The stage name shown in the trace viewer
+            cat (str): Comma separated categories
+            kwargs: Arguments attached to the event
+    '''
+    t = _tracer
+    if t is None:
+        return _NULL_SPAN
+    return _span(t, name, cat, kwargs)
+
+
+def traced(name, cat=""):
+    ''' Decorator tracing every call of a function as a span.
+    '''
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return fn(*args, **kwargs)
+            with _span(_tracer, name, cat, {}):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def drain_worker():
+    ''' Returns the events recorded in a pool worker since the last call,
+        None outside of a tracing worker.
+    '''
+    t = _tracer
+    if t is None or not t.worker:
+        return None
+    return t.drain()
+
+
+def merge(events):
+    ''' Adds the events handed back by a pool worker.
+    '''
+    t = _tracer
+    if t is not None and events is not None:
+        t.merge(*events)
+
+
+def write(fn):
+    ''' Writes the collected events into a JSON file loadable by Perfetto or chrome://tracing.
+
+        Returns:
+            count (int): The number of events written
+    '''
+    if _tracer is None:
+        return 0
+    return _tracer.write(fn)
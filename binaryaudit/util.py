@@ -13,53 +13,46 @@ this.debug = None
 
 
 class logger_wrapper:
+    ''' Thin layer over a logging.Logger.
+
+        The messages take lazy %-style arguments, they're only formatted
+        once the level check passed. A call on a disabled level costs the
+        level check alone.
+    '''
     def __init__(self, name="binaryaudit"):
         self.logger = logging.getLogger(name)
         self.logger.setLevel(logging.WARN)
 
-    def note(self, *args):
-        self.logger.info("".join(args))
+    def note(self, msg, *args):
+        if self.logger.isEnabledFor(logging.INFO):
+            self.logger.info(msg, *args, stacklevel=2)
 
-    def warn(self, *args):
-        self.logger.warning("".join(args))
+    def warn(self, msg, *args):
+        if self.logger.isEnabledFor(logging.WARNING):
+            self.logger.warning(msg, *args, stacklevel=2)
 
-    def error(self, *args):
-        self.logger.error("".join(args))
+    def error(self, msg, *args):
+        if self.logger.isEnabledFor(logging.ERROR):
+            self.logger.error(msg, *args, stacklevel=2)
 
-    def fatal(self, *args):
-        self.logger.critical("".join(args))
+    def fatal(self, msg, *args):
+        if self.logger.isEnabledFor(logging.CRITICAL):
+            self.logger.critical(msg, *args, stacklevel=2)
 
-    def debug(self, *args):
-        import inspect
-        frameinfo = inspect.getouterframes(inspect.currentframe())
-        (frame, source, lineno, func, lines, index) = frameinfo[1]
-        caller_log = "%s:%s::" % (func, lineno)
-        self.logger.debug(caller_log + "".join(args))
+    def debug(self, msg, *args):
+        if self.logger.isEnabledFor(logging.DEBUG):
+            # The caller is looked up only for the messages going out.
+            frame = sys._getframe(1)
+            caller_log = "%s:%s::" % (frame.f_code.co_name, frame.f_lineno)
+            self.logger.debug(caller_log + msg, *args, stacklevel=2)
+
+    def is_enabled(self, level):
+        return self.logger.isEnabledFor(level)
 
     def setLevel(self, level):
         self.logger.setLevel(level)
 
 
-def _note(*args):
-    this.logger.note("".join(args))
-
-
-def _warn(*args):
-    this.logger.warn("".join(args))
-
-
-def _error(*args):
-    this.logger.error("".join(args))
-
-
-def _fatal(*args):
-    this.logger.fatal("".join(args))
-
-
-def _debug(*args):
-    this.logger.debug("".join(args))
-
-
 def create_logger(name="binaryaudit"):
     logger = logger_wrapper(name)
     return logger
@@ -69,11 +62,12 @@ def setup_log(name="binaryaudit"):
     if None is this.logger:
         logging.basicConfig()
         this.logger = create_logger(name)
-        this.debug = _debug
-        this.note = _note
-        this.warn = _warn
-        this.error = _error
-        this.fatal = _fatal
+        # Bound directly, no extra call level on the way to the logger.
+        this.debug = this.logger.debug
+        this.note = this.logger.note
+        this.warn = this.logger.warn
+        this.error = this.logger.error
+        this.fatal = this.logger.fatal
 
 
 # TODO perhaps set the exact level instead of just up level to DEBUG
@@ -91,6 +85,12 @@ def set_verbosity(v):
         logging.getLogger().setLevel(level)
 
 
+def is_debug():
+    ''' Guard for the debug output that is expensive to gather.
+    '''
+    return this.logger is not None and this.logger.is_enabled(logging.DEBUG)
+
+
 def create_path_to_xml(sn, adir, fn):
     ''' Returns the path through adir to an xml file given its filename or soname
     Parameters:
@@ -0,0 +1,169 @@
+import collections
+import hashlib
+import subprocess
+import threading
+
+from binaryaudit import abicheck
+from binaryaudit import abixml
+from binaryaudit import conf
+from binaryaudit import metrics
+from binaryaudit import util
+
+LRU_SIZE_DEFAULT = 4096
+
+_tool_versions = {}
+_tool_versions_lock = threading.Lock()
+
+
+def get_lru_size():
+    try:
+        return int(conf.get_config("Verdicts", "lru_size"))
+    except KeyError:
+        return LRU_SIZE_DEFAULT
+
+
+def get_tool_version(tool="abidiff"):
+    ''' Returns the version string of the diff tool, None if it can't be run.
+    '''
+    with _tool_versions_lock:
+        if tool not in _tool_versions:
+            try:
+                out = subprocess.run([tool, "--version"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                     check=False).stdout
+                _tool_versions[tool] = out.decode("utf-8", "replace").strip() or None
+            except OSError:
+                _tool_versions[tool] = None
+        return _tool_versions[tool]
+
+
+def hash_suppressions(suppr):
+    ''' Hashes the content of a suppression set, independent of the file order.
+    '''
+    digests = []
+    for fn in suppr:
+        with open(fn, "rb") as f:
+            digests.append(hashlib.sha256(f.read()).hexdigest())
+    return hashlib.sha256("\n".join(sorted(digests)).encode("ascii")).hexdigest()
+
+
+def is_cacheable(ret):
+    ''' Only the verdicts of diffs that ran through depend on the inputs alone.
+    '''
+    return not (abicheck.diff_is_error(ret) or abicheck.diff_is_usage_error(ret))
+
+
+class verdict_cache:
+    ''' Memoizes the abidiff verdicts of abixml pairs across runs and agents.
+
+        The verdicts are keyed by the content hashes of both sides, the
+        suppression set and the tool version. Lookups go to an in-process
+        LRU first, then to the verdict table shared through the telemetry DB.
+
+        Parameters:
+            db_conn: The db connection, None for the local LRU only
+            suppr (list): The suppression files the diffs run with
+            tool_version (str): The abidiff version, detected if omitted
+            size (int): Capacity of the LRU, read from the config if omitted
+    '''
+    def __init__(self, db_conn, suppr, tool_version=None, size=None):
+        self.db_conn = db_conn
+        self.suppr_hash = hash_suppressions(suppr)
+        self.tool_version = tool_version if tool_version else get_tool_version()
+        self.size = size if size else get_lru_size()
+        self.hits = 0
+        self.misses = 0
+        self._lru = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def enabled(self):
+        return self.tool_version is not None
+
+    def key(self, base_hash, cur_hash):
+        return hashlib.sha256("\n".join([base_hash, cur_hash, self.suppr_hash, self.tool_version])
+                              .encode("utf-8")).hexdigest()
+
+    def _remember(self, key, verdict):
+        with self._lock:
+            self._lru[key] = verdict
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.size:
+                self._lru.popitem(last=False)
+
+    def _lookup_db(self, keys):
+        if not self.db_conn or not keys:
+            return {}
+        try:
+            return self.db_conn.get_verdicts(keys)
+        except Exception as e:
+            util.warn("Couldn't look up the shared verdicts: %s", e)
+            return {}
+
+    def lookup_many(self, hash_pairs):
+        ''' Looks up the verdicts of (base hash, current hash) pairs.
+
+            Returns:
+                verdicts (dict): (base hash, current hash) -> (ret, out) for the known ones
+        '''
+        if not self.enabled():
+            return {}
+        found = {}
+        missing = {}
+        with self._lock:
+            for pair in hash_pairs:
+                k = self.key(*pair)
+                if k in self._lru:
+                    self._lru.move_to_end(k)
+                    found[pair] = self._lru[k]
+                else:
+                    missing[k] = pair
+        for k, verdict in self._lookup_db(list(missing)).items():
+            self._remember(k, verdict)
+            found[missing[k]] = verdict
+        self.hits += len(found)
+        self.misses += len(hash_pairs) - len(found)
+        metrics.inc("binaryaudit_cache_lookups", len(found), cache="verdict", result="hit")
+        metrics.inc("binaryaudit_cache_lookups", len(hash_pairs) - len(found), cache="verdict", result="miss")
+        return found
+
+    def lookup(self, base_hash, cur_hash):
+        return self.lookup_many([(base_hash, cur_hash)]).get((base_hash, cur_hash))
+
+    def publish(self, base_hash, cur_hash, ret, out):
+        if not self.enabled() or not is_cacheable(ret):
+            return
+        k = self.key(base_hash, cur_hash)
+        self._remember(k, (ret, out))
+        if self.db_conn:
+            self.db_conn.insert_verdict(k, base_hash, cur_hash, self.suppr_hash, self.tool_version, ret, out)
+
+    def log(self):
+        util.note("Verdict cache: %s hits, %s misses", self.hits, self.misses)
+
+
+def cached_compare(cache, ref, cur, suppr=[], ref_hash=None, cur_hash=None):
+    ''' abicheck.compare() going through a verdict cache.
+
+        Returns:
+            ret, out, cmd as abicheck.compare(), cmd is None for a cached verdict
+    '''
+    if cache is None or not cache.enabled():
+        return abicheck.compare(ref, cur, suppr)
+    if ref_hash is None:
+        ref_hash = _hash_file(ref)
+    if cur_hash is None:
+        cur_hash = _hash_file(cur)
+    verdict = cache.lookup(ref_hash, cur_hash)
+    if verdict is not None:
+        return verdict[0], verdict[1], None
+    ret, out, cmd = abicheck.compare(ref, cur, suppr)
+    cache.publish(ref_hash, cur_hash, ret, out)
+    return ret, out, cmd
+
+
+def _hash_file(fn):
+    # The XML is hashed, as in the manifests, a compressed file has the hash of its content.
+    h = hashlib.sha256()
+    with abixml.open_plain(fn) as f:
+        for data in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(data)
+    return h.hexdigest()
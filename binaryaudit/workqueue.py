@@ -0,0 +1,457 @@
+import collections
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+
+from binaryaudit import conf
+from binaryaudit import util
+
+# Requests and answers are JSON lines over TCP. A worker asks for a "lease"
+# and gets a "unit", is told to "wait" and ask again, or is told the run is
+# "done". While running a unit it sends "heartbeat" requests to keep the
+# lease, then the "result" or a "fail" with the error.
+EVENT_UNIT = "unit"
+EVENT_WAIT = "wait"
+EVENT_DONE = "done"
+EVENT_OK = "ok"
+EVENT_ERROR = "error"
+
+LEASE_TIME_DEFAULT = 30.0
+MAX_ATTEMPTS_DEFAULT = 3
+# How long a lease request waits for a unit before the worker asks again.
+LEASE_WAIT = 1.0
+# Seconds between the attempts of a worker to connect to the coordinator.
+CONNECT_INTERVAL = 0.5
+CONNECT_WAIT_DEFAULT = 30.0
+
+
+class workqueue_error(Exception):
+    pass
+
+
+def _get_queue_config(key, default):
+    try:
+        return conf.get_config("Queue", key)
+    except KeyError:
+        return default
+
+
+def parse_address(s):
+    ''' Parses a HOST:PORT address, the host defaults to the loopback interface.
+
+        Returns:
+            address (tuple): (host, port)
+    '''
+    host, sep, port = s.rpartition(":")
+    try:
+        if not sep:
+            raise ValueError()
+        return host.strip("[]") or "127.0.0.1", int(port)
+    except ValueError:
+        raise ValueError("Invalid address '{}', expected HOST:PORT".format(s))
+
+
+def _unit_serialize(args):
+    from binaryaudit import abicheck
+    ret, out, cmd = abicheck.serialize(args["file"])
+    return {"ret": ret, "out": out}
+
+
+def _unit_compare(args):
+    from binaryaudit import abicheck
+    ret, out, cmd = abicheck.compare(args["ref"], args["cur"], args.get("suppressions", []))
+    return {"ret": ret, "out": out}
+
+
+def _unit_abipkgdiff(args):
+    from binaryaudit import dnf
+    ret, old_rpms, rows = dnf.run_group(args["key"], args["names"], args["source_dir"], args["new_data"],
+                                        args.get("suppressions", []))
+    return {"ret": ret, "old_rpms": old_rpms, "rows": rows}
+
+
+# The kinds of units: abidw on a file, abidiff on a pair, abipkgdiff on a source group.
+UNITS = {
+    "serialize": _unit_serialize,
+    "compare": _unit_compare,
+    "abipkgdiff": _unit_abipkgdiff,
+}
+
+
+class _unit:
+    def __init__(self, uid, kind, args):
+        self.id = uid
+        self.kind = kind
+        self.args = args
+        self.future = Future()
+        self.attempts = 0
+        self.owner = None
+        self.worker = None
+        self.expires = None
+
+
+class coordinator:
+    ''' Hands the work units out to the workers pulling them over TCP and
+        collects their results.
+
+        A leased unit goes back to the queue when the connection of its
+        worker drops, when its lease runs out without a heartbeat, or when
+        it failed, until it was tried max_attempts times.
+
+        Parameters:
+            address (tuple): The (host, port) to listen on, port 0 picks a free one
+            lease_time (float): Seconds a lease lasts without a heartbeat
+            max_attempts (int): Tries of a unit before it's failed
+    '''
+    def __init__(self, address, lease_time=None, max_attempts=None):
+        self.lease_time = float(lease_time or _get_queue_config("lease_time", LEASE_TIME_DEFAULT))
+        self.max_attempts = int(max_attempts or _get_queue_config("max_attempts", MAX_ATTEMPTS_DEFAULT))
+        self.closed = False
+        self.requeued = 0
+        self._cond = threading.Condition()
+        self._pending = collections.deque()
+        # Units not finished yet, pending or leased, by ID.
+        self._units = {}
+        self._leased = {}
+        self._next_id = 0
+        self.server = _server(address, self)
+        self.address = self.server.server_address[:2]
+
+    def start(self):
+        for target in (self.server.serve_forever, self._reap):
+            threading.Thread(target=target, daemon=True).start()
+        util.note("Coordinator listening on %s:%s", self.address[0], self.address[1])
+        return self
+
+    def submit(self, kind, **args):
+        ''' Queues a unit, the arguments must be JSON serializable.
+
+            Returns:
+                future (concurrent.futures.Future): The result dict of the unit
+        '''
+        if kind not in UNITS:
+            raise ValueError("Unknown unit kind '{}'".format(kind))
+        with self._cond:
+            u = _unit(self._next_id, kind, args)
+            self._next_id += 1
+            self._units[u.id] = u
+            self._pending.append(u)
+            self._cond.notify()
+        return u.future
+
+    def cancel_pending(self):
+        ''' Cancels the units no worker took yet.
+        '''
+        with self._cond:
+            while self._pending:
+                u = self._pending.popleft()
+                if u.future.cancel():
+                    self._units.pop(u.id, None)
+
+    def lease(self, owner, worker, timeout=LEASE_WAIT):
+        ''' Returns the next unit for a worker, None if none came within timeout.
+        '''
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while not self.closed:
+                while self._pending:
+                    u = self._pending.popleft()
+                    # Cancelled, or completed by a late result after it was re-queued.
+                    if u.id not in self._units or u.future.cancelled():
+                        continue
+                    u.attempts += 1
+                    u.owner = owner
+                    u.worker = worker
+                    u.expires = time.monotonic() + self.lease_time
+                    self._leased[u.id] = u
+                    return u
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+        return None
+
+    def renew(self, owner, uids):
+        ''' Extends the leases of the units, returns the ones the owner lost.
+        '''
+        lost = []
+        with self._cond:
+            for uid in uids:
+                u = self._leased.get(uid)
+                if u is None or u.owner is not owner:
+                    lost.append(uid)
+                    continue
+                u.expires = time.monotonic() + self.lease_time
+        return lost
+
+    def complete(self, uid, result):
+        ''' Sets the result of a unit. A late result of a unit re-queued meanwhile is taken, too.
+        '''
+        with self._cond:
+            u = self._units.pop(uid, None)
+            self._leased.pop(uid, None)
+        if u is None:
+            return
+        try:
+            u.future.set_result(result)
+        except InvalidStateError:
+            pass
+
+    def fail(self, owner, uid, error):
+        with self._cond:
+            u = self._leased.get(uid)
+            if u is not None and u.owner is owner:
+                self._retry(u, error)
+
+    def release(self, owner, uids, reason):
+        ''' Re-queues the units still leased to the owner.
+        '''
+        with self._cond:
+            for uid in uids:
+                u = self._leased.get(uid)
+                if u is not None and u.owner is owner:
+                    self._retry(u, reason)
+
+    def _retry(self, u, reason):
+        # Called with the lock held.
+        del self._leased[u.id]
+        if u.attempts >= self.max_attempts:
+            self._units.pop(u.id, None)
+            util.error("Giving up on %s unit %s after %s attempts: %s", u.kind, u.id, u.attempts, reason)
+            try:
+                u.future.set_exception(workqueue_error("The {} unit failed {} times, last on {}: {}".format(
+                    u.kind, u.attempts, u.worker, reason)))
+            except InvalidStateError:
+                pass
+            return
+        util.warn("Re-queuing %s unit %s of %s: %s", u.kind, u.id, u.worker, reason)
+        self.requeued += 1
+        # Ahead of the rest, it's late already.
+        self._pending.appendleft(u)
+        self._cond.notify()
+
+    def _reap(self):
+        while not self.closed:
+            time.sleep(min(self.lease_time / 4, 1.0))
+            now = time.monotonic()
+            with self._cond:
+                for u in [u for u in self._leased.values() if u.expires < now]:
+                    self._retry(u, "the lease expired")
+
+    def close(self):
+        ''' Tells the workers the run is done and stops listening. Units left unfinished are failed.
+        '''
+        with self._cond:
+            self.closed = True
+            left = list(self._units.values())
+            self._units.clear()
+            self._pending.clear()
+            self._leased.clear()
+            self._cond.notify_all()
+        for u in left:
+            if u.future.cancel():
+                continue
+            try:
+                u.future.set_exception(workqueue_error("The coordinator closed"))
+            except InvalidStateError:
+                pass
+        self.server.shutdown()
+        self.server.server_close()
+        if self.requeued:
+            util.note("Re-queued %s units", self.requeued)
+
+
+def start_coordinator(address):
+    ''' Returns a started coordinator listening on a HOST:PORT address.
+    '''
+    return coordinator(parse_address(address)).start()
+
+
+class _handler(socketserver.StreamRequestHandler):
+    ''' Answers the requests of a worker connection, its units are
+        re-queued if it drops before their results came in.
+    '''
+    def _send(self, ev):
+        self.wfile.write(json.dumps(ev).encode("utf-8") + b"\n")
+        self.wfile.flush()
+
+    def _answer(self, coord, req, held):
+        op = req["op"]
+        if "lease" == op:
+            u = coord.lease(self, req.get("worker"))
+            if u is not None:
+                held.add(u.id)
+                return {"event": EVENT_UNIT, "id": u.id, "kind": u.kind, "args": u.args, "lease_time": coord.lease_time}
+            return {"event": EVENT_DONE if coord.closed else EVENT_WAIT}
+        if "heartbeat" == op:
+            return {"event": EVENT_OK, "lost": coord.renew(self, req["units"])}
+        if "result" == op:
+            held.discard(req["id"])
+            coord.complete(req["id"], req["result"])
+            return {"event": EVENT_OK}
+        if "fail" == op:
+            held.discard(req["id"])
+            coord.fail(self, req["id"], req["error"])
+            return {"event": EVENT_OK}
+        raise KeyError(op)
+
+    def handle(self):
+        coord = self.server.coord
+        held = set()
+        try:
+            for line in self.rfile:
+                try:
+                    ev = self._answer(coord, json.loads(line), held)
+                except (ValueError, KeyError, TypeError) as e:
+                    ev = {"event": EVENT_ERROR, "error": "Bad request: {}".format(e)}
+                self._send(ev)
+        except OSError:
+            pass
+        finally:
+            if held:
+                coord.release(self, held, "the worker disconnected")
+
+
+class _server(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, coord):
+        self.coord = coord
+        socketserver.TCPServer.__init__(self, address, _handler)
+
+
+class _connection:
+    def __init__(self, sock):
+        self.sock = sock
+        self.rfile = sock.makefile("rb")
+
+    def call(self, req):
+        self.sock.sendall(json.dumps(req).encode("utf-8") + b"\n")
+        line = self.rfile.readline()
+        if not line:
+            raise workqueue_error("The coordinator closed the connection")
+        ev = json.loads(line)
+        if EVENT_ERROR == ev["event"]:
+            raise workqueue_error(ev["error"])
+        return ev
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
+
+
+def connect(address, wait=0):
+    ''' Connects to the coordinator, trying again for up to wait seconds.
+    '''
+    deadline = time.monotonic() + wait
+    while True:
+        try:
+            return _connection(socket.create_connection(address))
+        except OSError as e:
+            if time.monotonic() >= deadline:
+                raise workqueue_error("Couldn't connect to the coordinator at {}:{}: {}".format(
+                    address[0], address[1], e))
+        time.sleep(CONNECT_INTERVAL)
+
+
+def run_unit(kind, args):
+    ''' Runs a unit, returns its result with the duration in microseconds.
+    '''
+    t0 = time.monotonic()
+    res = UNITS[kind](args)
+    res["usec"] = int((time.monotonic() - t0) * 1000000)
+    return res
+
+
+def _run_leased(conn, ev):
+    box = {}
+
+    def target():
+        try:
+            box["result"] = run_unit(ev["kind"], ev["args"])
+        except Exception as e:
+            box["error"] = "{}: {}".format(type(e).__name__, e)
+    t = threading.Thread(target=target, daemon=True)
+    t.start()
+    # Keep the lease while the unit runs. A lost one is finished anyway,
+    # the coordinator takes the first result coming in.
+    while True:
+        t.join(ev["lease_time"] / 3)
+        if not t.is_alive():
+            break
+        if conn.call({"op": "heartbeat", "units": [ev["id"]]})["lost"]:
+            util.warn("Lost the lease of %s unit %s", ev["kind"], ev["id"])
+    if "error" in box:
+        util.error("The %s unit %s failed: %s", ev["kind"], ev["id"], box["error"])
+        conn.call({"op": "fail", "id": ev["id"], "error": box["error"]})
+    else:
+        conn.call({"op": "result", "id": ev["id"], "result": box["result"]})
+
+
+def _work_slot(address, name, wait, counts, i):
+    conn = connect(address, wait)
+    try:
+        while True:
+            ev = conn.call({"op": "lease", "worker": name})
+            if EVENT_DONE == ev["event"]:
+                return
+            if EVENT_UNIT == ev["event"]:
+                _run_leased(conn, ev)
+                counts[i] += 1
+    except (OSError, workqueue_error) as e:
+        # The run is over once the coordinator is gone.
+        util.note("Stopped working for %s:%s: %s", address[0], address[1], e)
+    finally:
+        conn.close()
+
+
+def work(address, slots=1, wait=CONNECT_WAIT_DEFAULT, name=None):
+    ''' Runs the units of a coordinator until it's done with the run.
+
+        Parameters:
+            address (tuple): The (host, port) of the coordinator
+            slots (int): The number of units to run in parallel
+            wait (float): Seconds to keep trying to connect, the coordinator may start later
+            name (str): The worker name the coordinator logs, host:pid by default
+
+        Returns:
+            count (int): The number of units run
+    '''
+    from binaryaudit import governor
+    governor.setup()
+    slots = governor.limit_workers(slots)
+    if name is None:
+        name = "{}:{}".format(socket.gethostname(), os.getpid())
+    counts = [0] * slots
+    errors = []
+
+    def slot(i):
+        try:
+            _work_slot(address, name, wait, counts, i)
+        except workqueue_error as e:
+            errors.append(e)
+    threads = [threading.Thread(target=slot, args=(i,)) for i in range(slots)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    if len(errors) == slots:
+        raise errors[0]
+    return sum(counts)
+
+
+def main(args):
+    ''' Runs "binaryaudit worker", returns the exit status.
+    '''
+    try:
+        count = work(parse_address(args.address), args.jobs, args.wait)
+    except (ValueError, workqueue_error) as e:
+        util.error("%s", e)
+        return 1
+    util.note("Ran %s units", count)
+    return 0
@@ -0,0 +1,211 @@
+import contextlib
+import fcntl
+import os
+import re
+import shutil
+import tempfile
+
+from binaryaudit import conf
+from binaryaudit import util
+
+PREFIX = "binaryaudit-"
+TMPFS_DIR = "/dev/shm"
+# Marks a workspace kept for inspection, it isn't pruned.
+KEEP_MARKER = ".keep"
+# Locked by the run for as long as its workspace is in use. The root may be
+# shared by other hosts or PID namespaces, where the pid tells nothing.
+LOCK_FN = ".lock"
+
+# binaryaudit-<pid>-<name>-<random>
+_NAME_RE = re.compile(r"^" + re.escape(PREFIX) + r"(\d+)-")
+
+
+def _get_workspace_config(key, default):
+    try:
+        return conf.get_config("Workspace", key)
+    except KeyError:
+        return default
+
+
+def get_root():
+    ''' Returns the directory the workspaces are created in.
+
+        That's the configured one if any, else the tmpfs if enabled and
+        writable, else the system temporary directory.
+    '''
+    root = _get_workspace_config("root", "")
+    if root:
+        return os.path.expanduser(root)
+    if "1" == _get_workspace_config("tmpfs", "1") and os.path.isdir(TMPFS_DIR) and \
+            os.access(TMPFS_DIR, os.W_OK | os.X_OK):
+        return TMPFS_DIR
+    return tempfile.gettempdir()
+
+
+def _hold(lock_fn, fd=None):
+    ''' Locks a file for as long as the returned fd stays open.
+
+        Returns:
+            fd (int): None if the file was pruned before it was locked
+    '''
+    if fd is None:
+        try:
+            fd = os.open(lock_fn, os.O_RDONLY | os.O_CREAT, 0o600)
+        except FileNotFoundError:
+            return None
+    fcntl.flock(fd, fcntl.LOCK_EX)
+    try:
+        st = os.stat(lock_fn)
+    except FileNotFoundError:
+        st = None
+    fst = os.fstat(fd)
+    if st is not None and (st.st_dev, st.st_ino) == (fst.st_dev, fst.st_ino):
+        return fd
+    os.close(fd)
+    return None
+
+
+def mkstemp(name, suffix="", root=None):
+    ''' Creates a temporary file in the workspace root, not pruned until its fd is closed.
+
+        Parameters:
+            name (str): What the file is, part of its name
+            suffix (str): The end of its name
+            root (str): The parent directory, see get_root() if omitted
+
+        Returns:
+            fd (int), path (str)
+    '''
+    if root is None:
+        root = get_root()
+    while True:
+        fd, fn = tempfile.mkstemp(prefix="{}{}-{}-".format(PREFIX, os.getpid(), name), suffix=suffix, dir=root)
+        if _hold(fn, fd) is not None:
+            return fd, fn
+
+
+def _prune(path):
+    is_dir = os.path.isdir(path)
+    try:
+        # A workspace locks a file within, a temporary file is locked itself.
+        fd = os.open(os.path.join(path, LOCK_FN) if is_dir else path, os.O_RDONLY | (os.O_CREAT if is_dir else 0),
+                     0o600)
+    except OSError:
+        # Gone meanwhile, or someone else's.
+        return False
+    try:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        # Kept by its run on the way out.
+        if is_dir and os.path.exists(os.path.join(path, KEEP_MARKER)):
+            return False
+        util.debug("Removing the stale workspace '%s'", os.path.basename(path))
+        if is_dir:
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(path)
+        return True
+    finally:
+        os.close(fd)
+
+
+def prune_stale(root):
+    ''' Removes the workspaces left behind by runs that didn't exit cleanly,
+        the ones whose lock no process holds.
+
+        Returns:
+            count (int): The number of workspaces removed
+    '''
+    count = 0
+    try:
+        names = os.listdir(root)
+    except OSError:
+        return count
+    for name in names:
+        path = os.path.join(root, name)
+        if _NAME_RE.match(name) is None or os.path.exists(os.path.join(path, KEEP_MARKER)):
+            continue
+        if _prune(path):
+            count += 1
+    return count
+
+
+class workspace:
+    ''' The scratch space of a run, a directory of its own removed when the run ends.
+
+        Several runs on a host and the parallel jobs of a run each get
+        their own files. Use it as a context manager, the directory goes
+        away on the way out, exceptions and sys.exit() included.
+
+        Parameters:
+            name (str): What the run is, part of the directory name
+            root (str): The parent directory, see get_root() if omitted
+            keep (bool): Leave the files behind when closed, for inspection
+    '''
+    def __init__(self, name="run", root=None, keep=False):
+        if root is None:
+            root = get_root()
+        os.makedirs(root, exist_ok=True)
+        prune_stale(root)
+        self.keep = keep
+        self._lock_fd = None
+        while self._lock_fd is None:
+            self.root = tempfile.mkdtemp(prefix="{}{}-{}-".format(PREFIX, os.getpid(), name), dir=root)
+            # Pruned by another run if not locked yet, that's a fresh one then.
+            self._lock_fd = _hold(self.path(LOCK_FN))
+        util.debug("Workspace '%s'", self.root)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def path(self, *names):
+        ''' Returns the path of a file of the run.
+        '''
+        return os.path.join(self.root, *names)
+
+    def dir(self, *names):
+        ''' Returns a directory of the run, created if needed.
+        '''
+        d = self.path(*names)
+        os.makedirs(d, exist_ok=True)
+        return d
+
+    @contextlib.contextmanager
+    def scratch(self, name):
+        ''' Yields a directory of a job of its own, removed once the job is done.
+        '''
+        d = tempfile.mkdtemp(prefix=re.sub(r"[^\w.+-]", "_", name) + "-", dir=self.dir("jobs"))
+        try:
+            yield d
+        finally:
+            if not self.keep:
+                shutil.rmtree(d, ignore_errors=True)
+
+    def close(self):
+        if self._lock_fd is None:
+            return
+        if self.keep:
+            with open(self.path(KEEP_MARKER), "w"):
+                pass
+            util.note("Kept the workspace '%s'", self.root)
+        else:
+            shutil.rmtree(self.root, ignore_errors=True)
+        os.close(self._lock_fd)
+        self._lock_fd = None
+
+
+@contextlib.contextmanager
+def use(ws, name):
+    ''' Yields ws, or a workspace of its own closed on the way out if None is passed.
+    '''
+    if ws is not None:
+        yield ws
+        return
+    with workspace(name) as ws:
+        yield ws
@@ -0,0 +1,34 @@
+CREATE TABLE binaryaudit_product_tbl (
+    ProductID INTEGER PRIMARY KEY AUTOINCREMENT,
+    ProductName VARCHAR(255),
+    DerivativeName VARCHAR(255)
+);
+CREATE TABLE binaryaudit_transaction_main_tbl (
+    BuildID VARCHAR(255) NOT NULL,
+    ProductID INTEGER NOT NULL,
+    DateTimeUTC DATETIME,
+    BaselineID INTEGER,
+    BuildUrl VARCHAR(1024),
+    LogUrl VARCHAR(1024),
+    Result VARCHAR(64),
+    PRIMARY KEY (BuildID, ProductID)
+);
+CREATE TABLE binaryaudit_checker_baseline_tbl (
+    ID INTEGER PRIMARY KEY AUTOINCREMENT,
+    BuildID VARCHAR(255),
+    ProductID INTEGER,
+    PackageData BLOB,
+    DateCreated DATETIME
+);
+CREATE TABLE binaryaudit_abi_checker_transaction_details_tbl (
+    ID INTEGER PRIMARY KEY AUTOINCREMENT,
+    DateTimeUTC DATETIME,
+    BuildID VARCHAR(255),
+    ProductID INTEGER,
+    ItemName VARCHAR(255),
+    BaseVersion VARCHAR(255),
+    NewVersion VARCHAR(255),
+    ExecTimeInMicroSec BIGINT,
+    Result VARCHAR(64),
+    ResultDetails TEXT
+);
@@ -14,6 +14,12 @@ class AbicheckTestSuite(unittest.TestCase):
     def test_is_elf(self):
         assert abicheck.is_elf("/bin/ls")
 
+    def test_compare_same_fingerprint(self):
+        # Decided without running abidiff.
+        ret, out, cmd = abicheck.compare("a.xml", "b.xml", [], "ab" * 32, "ab" * 32)
+        assert abicheck.DIFF_OK == ret
+        assert "" == out
+
     def test_get_bits(self):
         code = 8 | 4
         a = abicheck.diff_get_bits(code)
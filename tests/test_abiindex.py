@@ -0,0 +1,98 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'benchmarks')))
+from binaryaudit import util  # noqa: E402
+from binaryaudit import abicheck  # noqa: E402
+from binaryaudit import abiindex  # noqa: E402
+import synth  # noqa: E402
+
+
+def corpus(soname, *symbols):
+    return '<abi-corpus soname="{}"><elf-function-symbols>{}</elf-function-symbols></abi-corpus>'.format(
+           soname, "".join('<elf-symbol name="{}"/>'.format(sym) for sym in symbols))
+
+
+def write_recipe(bh_dir, name, pv, xmls, manifest=True):
+    recipe_dir = os.path.join(bh_dir, "packages", "x86", name)
+    adir = os.path.join(recipe_dir, "binaryaudit", "abixml")
+    os.makedirs(adir)
+    with open(os.path.join(recipe_dir, "latest"), "w") as f:
+        f.write("PV = {}\n".format(pv))
+    writer = abiindex.manifest_writer(adir)
+    for fn, xml in xmls.items():
+        out_fn = os.path.join(adir, fn)
+        with open(out_fn, "w") as f:
+            f.write(xml)
+        writer.add(fn.rsplit(".xml", 1)[0], out_fn, xml)
+    if manifest:
+        writer.write(pv, 10.0)
+
+
+class AbiindexTestSuite(unittest.TestCase):
+    def setUp(self):
+        util.setup_log()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.d1 = os.path.join(self.tmp_dir.name, "base")
+        self.d2 = os.path.join(self.tmp_dir.name, "cur")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_join(self):
+        write_recipe(self.d1, "liba", "1.0", {"liba.so.1.xml": corpus("liba.so.1", "f"),
+                                              "libb.so.1.xml": corpus("libb.so.1", "g"),
+                                              "libd.so.1.xml": corpus("libd.so.1", "h", "i")})
+        # libd.so.1 differs in the symbol order only.
+        write_recipe(self.d2, "liba", "1.1", {"liba.so.1.xml": corpus("liba.so.1", "f"),
+                                              "libb.so.1.xml": corpus("libb.so.1", "g", "g2"),
+                                              "libc.so.1.xml": corpus("libc.so.1", "c"),
+                                              "libd.so.1.xml": corpus("libd.so.1", "i", "h")})
+        base = abiindex.build_index(self.d1)
+        cur = abiindex.build_index(self.d2)
+        rel = "packages/x86/liba/binaryaudit"
+        assert "1.1" == cur[rel]["pv"]
+        assert 10.0 == cur[rel]["duration"]
+        changed, unchanged = abiindex.join(base[rel], cur[rel])
+        # libc.so.1 has no counterpart in the baseline.
+        assert ["libb.so.1.xml"] == [fn for fn, b, c in changed]
+        assert 2 == unchanged
+
+    def test_serialize_writes_manifest(self):
+        d = self.tmp_dir.name
+        path = os.environ["PATH"]
+        os.environ["PATH"] = synth.write_tools(os.path.join(d, "bin")) + os.pathsep + path
+        self.addCleanup(os.environ.__setitem__, "PATH", path)
+        synth.image_tree(os.path.join(d, "image"), 3, 5)
+        recipe_dir = os.path.join(self.d2, "packages", "x86", "liba", "binaryaudit")
+        adir = os.path.join(recipe_dir, "abixml")
+        os.makedirs(adir)
+        # What the bbclass does, only writing the files.
+        for out, out_fn in abicheck.serialize_artifacts(adir, os.path.join(d, "image"), pv="1.1"):
+            with open(out_fn, "w") as f:
+                f.write(out)
+        assert os.path.isfile(os.path.join(recipe_dir, abiindex.MANIFEST_FN))
+        recipe = abiindex.load_recipe(recipe_dir)
+        assert "1.1" == recipe["pv"]
+        assert 3 == len(recipe["dsos"])
+        assert sorted(recipe["dsos"]) == sorted(os.listdir(adir))
+
+    def test_scan_without_manifest(self):
+        write_recipe(self.d1, "liba", "1.0", {"liba.so.1.xml": corpus("liba.so.1", "f")}, False)
+        index = abiindex.build_index(self.d1)
+        recipe = index["packages/x86/liba/binaryaudit"]
+        assert "1.0" == recipe["pv"]
+        assert "liba.so.1" == recipe["dsos"]["liba.so.1.xml"]["soname"]
+        assert recipe["dsos"]["liba.so.1.xml"]["fingerprint"]
+
+    def test_persisted_index(self):
+        write_recipe(self.d1, "liba", "1.0", {"liba.so.1.xml": "<a/>"})
+        index = abiindex.get_index(self.d1, persist=True)
+        assert os.path.isfile(os.path.join(self.d1, abiindex.INDEX_FN))
+        # Served from the stored index, the tree isn't looked at anymore.
+        write_recipe(self.d1, "libb", "1.0", {"libb.so.1.xml": "<b/>"})
+        assert index == abiindex.get_index(self.d1, persist=True)
+        assert 2 == len(abiindex.get_index(self.d1))
@@ -0,0 +1,101 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'benchmarks')))
+from binaryaudit import abicheck  # noqa: E402
+from binaryaudit import abiindex  # noqa: E402
+from binaryaudit import abixml  # noqa: E402
+from binaryaudit import util  # noqa: E402
+from binaryaudit import verdict  # noqa: E402
+import synth  # noqa: E402
+
+bin_fn = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'bin', 'binaryaudit'))
+
+
+def compress_tree(bh_dir):
+    # Rewrites the abixml files of a buildhistory compressed, alternating gz and zst.
+    n = 0
+    for recipe in abiindex.build_index(bh_dir):
+        fn = os.path.join(bh_dir, recipe, abiindex.MANIFEST_FN)
+        with open(fn, "r") as f:
+            manifest = json.load(f)
+        for d in manifest["dsos"]:
+            xml_fn = os.path.join(bh_dir, recipe, "abixml", d["file"])
+            d["file"] = abixml.with_suffix(d["file"], abixml.COMPRESSIONS[n % 2])
+            with open(xml_fn, "rb") as f:
+                abixml.write(os.path.join(bh_dir, recipe, "abixml", d["file"]), f.read())
+            os.unlink(xml_fn)
+            n += 1
+        with open(fn, "w") as f:
+            json.dump(manifest, f)
+
+
+class AbixmlTestSuite(unittest.TestCase):
+    def setUp(self):
+        util.setup_log()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.xml = synth.abixml("libfoo.so.1", 50).encode("utf-8")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, name):
+        fn = os.path.join(self.tmp_dir.name, name)
+        abixml.write(fn, self.xml)
+        return fn
+
+    def test_roundtrip(self):
+        for c in abixml.COMPRESSIONS:
+            fn = self.write(abixml.with_suffix("libfoo.so.1.xml", c))
+            with open(fn, "rb") as f:
+                data = f.read()
+            assert c == abixml.sniff(data)
+            assert len(data) < len(self.xml)
+            assert self.xml == abixml.decompress(data)
+            assert self.xml == abixml.read(fn)
+            assert "libfoo.so.1" == abicheck.get_soname_from_xml(data)
+            assert "libfoo.so.1.xml" == abixml.strip_suffix(os.path.basename(fn))
+        assert self.xml == abixml.read(self.write("libfoo.so.1.xml"))
+        with self.assertRaises(ValueError):
+            abixml.check_compression("bz2")
+
+    def test_plain_path(self):
+        plain = self.write("libfoo.so.1.xml")
+        with abixml.plain_path(plain) as fn:
+            assert plain == fn
+        with abixml.plain_path(self.write("libfoo.so.1.xml.zst")) as fn:
+            with open(fn, "rb") as f:
+                assert self.xml == f.read()
+        assert not os.path.exists(fn)
+        # The cache keys don't depend on how the XML is stored.
+        assert verdict._hash_file(plain) == verdict._hash_file(self.write("libfoo.so.1.xml.gz"))
+        assert abiindex.hash_xml(self.xml) == verdict._hash_file(plain)
+
+    def test_poky_compressed(self):
+        d = self.tmp_dir.name
+        synth.buildhistory(os.path.join(d, "base"), 4, 2, 10)
+        synth.buildhistory(os.path.join(d, "cur"), 4, 2, 10, changed=2)
+        env = dict(os.environ, HOME=os.path.join(d, "home"),
+                   PATH=synth.write_tools(os.path.join(d, "bin")) + os.pathsep + os.environ["PATH"])
+
+        def run(out):
+            return subprocess.run([sys.executable, bin_fn, "poky", "--compare-buildhistory", "--buildhistory-baseline",
+                                   "base", "--buildhistory-current", "cur", "-o", out], env=env, cwd=d,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode
+
+        assert 4 == run("plain")
+        compress_tree(os.path.join(d, "cur"))
+        # The compressed current tree joins the plain baseline by the uncompressed names.
+        assert 4 == run("compressed")
+        assert sorted(os.listdir(os.path.join(d, "plain"))) == sorted(os.listdir(os.path.join(d, "compressed")))
+        index = abiindex.build_index(os.path.join(d, "cur"))
+        assert all(fn.endswith(".xml") for r in index.values() for fn in r["dsos"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,177 @@
+import io
+import json
+import os
+import sys
+import tarfile
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from binaryaudit import util  # noqa: E402
+from binaryaudit import db  # noqa: E402
+from binaryaudit import abiindex  # noqa: E402
+from binaryaudit import baseline  # noqa: E402
+from tests.test_db import create_sqlite_db  # noqa: E402
+
+
+def write_tarball(fn, files):
+    with tarfile.open(fn, "w:gz") as tgz:
+        for name, data in files.items():
+            ti = tarfile.TarInfo(name)
+            ti.size = len(data)
+            tgz.addfile(ti, io.BytesIO(data))
+
+
+class BaselineTestSuite(unittest.TestCase):
+    def setUp(self):
+        util.setup_log()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_conn = db.wrapper(create_sqlite_db(self.tmp_dir.name), util.logger)
+        self.db_conn.initialize_db()
+        self.prod_id = self.db_conn.get_product_id("prod", "deriv")
+
+    def tearDown(self):
+        self.db_conn.close()
+        self.tmp_dir.cleanup()
+
+    def test_delta_upload(self):
+        files = {
+            "buildhistory/packages/a/liba/latest": b"PV = 1.0\n",
+            "buildhistory/packages/a/liba/binaryaudit/abixml/liba.so.xml": os.urandom(10000),
+            "buildhistory/packages/a/libb/binaryaudit/abixml/libb.so.xml": os.urandom(10000),
+        }
+        tar_fn = os.path.join(self.tmp_dir.name, "b1.tar.gz")
+        write_tarball(tar_fn, files)
+        up = baseline.publish_baseline(self.db_conn, "b1", self.prod_id, tar_fn, 4096)
+        assert up.uploaded_bytes == up.total_bytes
+
+        files["buildhistory/packages/a/liba/latest"] = b"PV = 1.1\n"
+        write_tarball(tar_fn, files)
+        up = baseline.publish_baseline(self.db_conn, "b2", self.prod_id, tar_fn, 4096)
+        assert len(b"PV = 1.1\n") == up.uploaded_bytes
+        assert 1 == up.uploaded_chunks
+
+        baseline_id, data = self.db_conn.get_ba_latest_baseline(self.prod_id)
+        assert baseline.is_manifest(data)
+        out_dir = os.path.join(self.tmp_dir.name, "out")
+        baseline.extract_manifest(self.db_conn, baseline.unpack_manifest(data), out_dir)
+        for name, content in files.items():
+            with open(os.path.join(out_dir, name), "rb") as f:
+                assert content == f.read()
+
+    def test_unsafe_manifest_links(self):
+        outside = os.path.join(self.tmp_dir.name, "outside")
+        os.makedirs(outside)
+        # Written below a link out of the destination, the files would land there.
+        manifest = {"files": [{"path": "buildhistory/abs", "link": outside},
+                              {"path": "buildhistory/abs/x", "mode": 0o644, "chunks": []},
+                              {"path": "buildhistory/up", "link": "../outside"},
+                              {"path": "buildhistory/up/x", "mode": 0o644, "chunks": []}]}
+        out_dir = os.path.join(self.tmp_dir.name, "out")
+        baseline.extract_manifest(self.db_conn, manifest, out_dir)
+        assert [] == os.listdir(outside)
+        assert not os.path.islink(os.path.join(out_dir, "buildhistory", "abs"))
+
+    def test_unsafe_tarball_links(self):
+        outside = os.path.join(self.tmp_dir.name, "outside")
+        os.makedirs(outside)
+        tar_fn = os.path.join(self.tmp_dir.name, "b.tar.gz")
+        with tarfile.open(tar_fn, "w:gz") as tgz:
+            for name, target in [("buildhistory/abs", outside), ("buildhistory/up", "../outside")]:
+                ti = tarfile.TarInfo(name)
+                ti.type = tarfile.SYMTYPE
+                ti.linkname = target
+                tgz.addfile(ti)
+                ti = tarfile.TarInfo(name + "/x")
+                ti.size = 1
+                tgz.addfile(ti, io.BytesIO(b"x"))
+        with open(tar_fn, "rb") as f:
+            baseline.extract_tarball(f.read(), os.path.join(self.tmp_dir.name, "out"))
+        assert [] == os.listdir(outside)
+
+    def test_legacy_is_not_manifest(self):
+        assert not baseline.is_manifest(b"\x1f\x8b\x08\x00")
+        assert not baseline.is_manifest(None)
+
+    def test_cached_selective_extraction(self):
+        files = {
+            "buildhistory/packages/a/liba/latest": b"PV = 1.0\n",
+            "buildhistory/packages/a/liba/binaryaudit/abixml/liba.so.xml": b"<abi-corpus/>",
+            "buildhistory/packages/a/liba/binaryaudit/abixml.duration": b"12.5",
+            "buildhistory/images/qemux86/core-image/files-in-image.txt": b"unused" * 100,
+        }
+        tar_fn = os.path.join(self.tmp_dir.name, "b1.tar.gz")
+        write_tarball(tar_fn, files)
+        with open(tar_fn, "rb") as f:
+            # Legacy baseline, the plain tarball in the blob.
+            self.db_conn.insert_ba_baseline_data("b1", self.prod_id, f.read())
+        baseline.publish_baseline(self.db_conn, "b2", self.prod_id, tar_fn, 4096)
+
+        cache_dir = os.path.join(self.tmp_dir.name, "cache")
+        for build_id in [1, 2]:
+            d = baseline.get_cached_baseline(self.db_conn, build_id, cache_dir)
+            for name, content in files.items():
+                fn = os.path.join(d, name)
+                if baseline.is_needed_member(name):
+                    with open(fn, "rb") as f:
+                        assert content == f.read()
+                else:
+                    assert not os.path.exists(fn)
+
+        fetched = []
+        get_data = self.db_conn.get_ba_baseline_data
+        self.db_conn.get_ba_baseline_data = lambda i: fetched.append(i) or get_data(i)
+        baseline.get_cached_baseline(self.db_conn, 2, cache_dir)
+        assert [] == fetched
+
+    def test_cache_eviction(self):
+        tar_fn = os.path.join(self.tmp_dir.name, "b.tar.gz")
+        write_tarball(tar_fn, {"buildhistory/packages/a/liba/latest": b"PV = 1.0\n"})
+        for build_id in ["b1", "b2"]:
+            with open(tar_fn, "rb") as f:
+                self.db_conn.insert_ba_baseline_data(build_id, self.prod_id, f.read())
+        cache_dir = os.path.join(self.tmp_dir.name, "cache")
+        d1 = baseline.get_cached_baseline(self.db_conn, 1, cache_dir)
+        d2 = baseline.get_cached_baseline(self.db_conn, 2, cache_dir)
+        # Both are in use, neither is evicted.
+        baseline._prune_cache(cache_dir, 0)
+        assert os.path.isdir(d1) and os.path.isdir(d2)
+        baseline.release_cached_baseline(d1)
+        baseline._prune_cache(cache_dir, 0)
+        assert not os.path.exists(d1)
+        assert os.path.isdir(d2)
+        baseline.release_cached_baseline(d2)
+
+    def test_pack(self):
+        files = {
+            "packages/a/liba/latest": b"PV = 1.0\n",
+            "packages/a/liba/binaryaudit/abixml/liba.so.xml": b"<abi-corpus soname='liba.so.1'/>",
+            "packages/a/liba/binaryaudit/abixml.duration": b"12.5",
+            "packages/a/liba/files-in-package.txt": b"unused" * 100,
+            "images/qemux86/core-image/files-in-image.txt": b"unused" * 100,
+            # Stale, replaced by the packed one.
+            abiindex.INDEX_FN: b"{}",
+        }
+        src_dir = os.path.join(self.tmp_dir.name, "src")
+        for name, content in files.items():
+            os.makedirs(os.path.dirname(os.path.join(src_dir, name)), exist_ok=True)
+            with open(os.path.join(src_dir, name), "wb") as f:
+                f.write(content)
+        up = baseline.pack_baseline(self.db_conn, "b1", self.prod_id, src_dir, 16, workers=4)
+        assert up.uploaded_bytes == up.total_bytes
+        # Nothing changed, nothing to upload.
+        up = baseline.pack_baseline(self.db_conn, "b2", self.prod_id, src_dir, 16, workers=4)
+        assert 0 == up.uploaded_bytes
+
+        d = os.path.join(baseline.get_cached_baseline(self.db_conn, 2, os.path.join(self.tmp_dir.name, "cache")),
+                         baseline.BUILDHISTORY_DIR)
+        for name, content in files.items():
+            fn = os.path.join(d, name)
+            if name.startswith("packages/a/liba/binaryaudit") or name.endswith("latest"):
+                with open(fn, "rb") as f:
+                    assert content == f.read()
+            elif abiindex.INDEX_FN != name:
+                assert not os.path.exists(fn)
+        with open(os.path.join(d, abiindex.INDEX_FN)) as f:
+            assert abiindex.INDEX_VERSION == json.load(f)["version"]
+        assert abiindex.build_index(src_dir) == abiindex.get_index(d, persist=True)
@@ -0,0 +1,159 @@
+import io
+import json
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'benchmarks')))
+from binaryaudit import abicheck  # noqa: E402
+from binaryaudit import batch  # noqa: E402
+from binaryaudit import util  # noqa: E402
+import synth  # noqa: E402
+from tests.test_db import DB_CONFIG_KEYS, create_sqlite_db  # noqa: E402
+
+bin_fn = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'bin', 'binaryaudit'))
+
+
+class BatchTestSuite(unittest.TestCase):
+    def setUp(self):
+        util.setup_log()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        d = self.tmp_dir.name
+        self.env = dict(os.environ, HOME=os.path.join(d, "home"), XDG_RUNTIME_DIR=os.path.join(d, "run"),
+                        PATH=synth.write_tools(os.path.join(d, "bin")) + os.pathsep + os.environ["PATH"])
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def run_abi(self, *args, input=None):
+        p = subprocess.run([sys.executable, bin_fn, "abi"] + list(args), env=self.env, cwd=self.tmp_dir.name,
+                           input=input, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        return p.returncode, sorted([json.loads(line) for line in p.stdout.splitlines()], key=lambda r: r["line"])
+
+    def write_pairs(self, count):
+        lines = []
+        for i in range(count):
+            fns = []
+            for side in range(2):
+                fn = "lib{}.{}.xml".format(i, side)
+                with open(os.path.join(self.tmp_dir.name, fn), "w") as f:
+                    f.write(synth.abixml("lib{}.so".format(i), 10, changed=side * (i % 2), seed=i))
+                fns.append(fn)
+            lines.append("\t".join(fns))
+        return "\n".join(lines) + "\n"
+
+    def test_load_manifest(self):
+        items = batch._read_manifest(io.StringIO("# pairs\na b\n\na b\tc d\n"), 2, "m")
+        assert [(2, ["a", "b"]), (4, ["a b", "c d"])] == items
+        with self.assertRaisesRegex(ValueError, "m:1: expected 1 paths, got 2"):
+            batch._read_manifest(io.StringIO("a b\n"), 1, "m")
+
+    def test_compare(self):
+        manifest = self.write_pairs(4) + "missing.xml lib0.1.xml\n"
+        ret, results = self.run_abi("compare", "-j", "2", "--no-daemon", input=manifest)
+        assert 4 == ret
+        assert [0, 4, 0, 4, 1] == [r["ret"] for r in results]
+        assert ["CHANGE"] == results[1]["bits"]
+        assert "lib1.1.xml" == results[1]["cur"]
+        assert "error" in results[4]
+        # A manifest line of the wrong form is a usage error.
+        assert 2 == self.run_abi("compare", "--no-daemon", input="a b c\n")[0]
+
+    def test_serialize(self):
+        d = self.tmp_dir.name
+        with open(os.path.join(d, "libfoo.so.1"), "wb") as f:
+            f.write(synth.elf_stub(synth.abixml("libfoo.so.1", 5)))
+        with open(os.path.join(d, "m.txt"), "w") as f:
+            f.write("libfoo.so.1\nnone\n")
+        ret, results = self.run_abi("serialize", "m.txt", "-o", "out")
+        assert 1 == ret
+        assert "libfoo.so.1" == results[0]["soname"]
+        assert os.path.isfile(os.path.join(d, results[0]["file"]))
+        assert ["ERROR"] == results[1]["bits"]
+        ret, results = self.run_abi("serialize", "m.txt", "-o", "out", "--compress", "zst")
+        assert results[0]["file"].endswith(".xml.zst")
+        with open(os.path.join(d, results[0]["file"]), "rb") as f:
+            assert "libfoo.so.1" == abicheck.get_soname_from_xml(f.read())
+
+    def test_serialize_coordinator(self):
+        d = self.tmp_dir.name
+        for i in range(3):
+            with open(os.path.join(d, "lib{}.so.1".format(i)), "wb") as f:
+                f.write(synth.elf_stub(synth.abixml("lib{}.so.1".format(i), 5)))
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            address = "127.0.0.1:{}".format(s.getsockname()[1])
+        worker = subprocess.Popen([sys.executable, bin_fn, "worker", address, "-j", "2"], env=self.env,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            ret, results = self.run_abi("serialize", "-o", "out", "--coordinator", address,
+                                        input="lib0.so.1\nlib1.so.1\nlib2.so.1\n")
+            # The run is over once the files are written, the worker is told.
+            assert 0 == worker.wait(30)
+        finally:
+            worker.kill()
+            worker.wait()
+        assert 0 == ret
+        assert ["lib0.so.1", "lib1.so.1", "lib2.so.1"] == [r["soname"] for r in results]
+        assert all(os.path.isfile(os.path.join(d, r["file"])) for r in results)
+
+    def start_daemon(self):
+        # The daemon's own tool calls are logged, the client's aren't.
+        env = dict(self.env, BENCH_TOOL_LOG=os.path.join(self.tmp_dir.name, "daemon.log"))
+        # The env file doesn't override what the other tests left in os.environ.
+        for k in DB_CONFIG_KEYS:
+            env.pop(k, None)
+        srv = subprocess.Popen([sys.executable, bin_fn, "serve", "-j", "2"], env=env, cwd=self.tmp_dir.name,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.addCleanup(srv.wait)
+        self.addCleanup(srv.terminate)
+        while not os.path.exists(os.path.join(self.tmp_dir.name, "run", "binaryaudit.sock")):
+            time.sleep(0.05)
+
+    def test_daemon(self):
+        with open(os.path.join(self.tmp_dir.name, "m.txt"), "w") as f:
+            f.write(self.write_pairs(2))
+        self.start_daemon()
+        # The daemon keeps the verdicts of the first batch for the second one.
+        for cached in (False, True):
+            ret, results = self.run_abi("compare", "m.txt")
+            assert 4 == ret
+            assert [cached, cached] == [r["cached"] for r in results]
+
+    def test_daemon_serialize(self):
+        d = self.tmp_dir.name
+        with open(os.path.join(d, "libfoo.so.1"), "wb") as f:
+            f.write(synth.elf_stub(synth.abixml("libfoo.so.1", 5)))
+        self.start_daemon()
+        ret, results = self.run_abi("serialize", "-o", "out", "--compress", "gz", input="libfoo.so.1\nnone\n")
+        assert 1 == ret
+        assert "libfoo.so.1" == results[0]["soname"]
+        assert os.path.join(d, "out") == os.path.dirname(results[0]["file"])
+        assert results[0]["file"].endswith(".xml.gz")
+        assert os.path.isfile(results[0]["file"])
+        assert ["ERROR"] == results[1]["bits"]
+        with open(os.path.join(d, "daemon.log")) as f:
+            assert ["abidw", "abidw"] == f.read().split()
+
+    def test_daemon_db(self):
+        # The configured DB is kept open by the daemon and shares its verdicts.
+        create_sqlite_db(self.tmp_dir.name)
+        with open(os.path.join(self.tmp_dir.name, "m.txt"), "w") as f:
+            f.write(self.write_pairs(2))
+        self.start_daemon()
+        assert 4 == self.run_abi("compare", "m.txt")[0]
+        conn = sqlite3.connect(os.path.join(self.tmp_dir.name, "binaryaudit.sqlite"))
+        try:
+            assert 2 == conn.execute("SELECT COUNT(*) FROM binaryaudit_verdict_tbl").fetchone()[0]
+        finally:
+            conn.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
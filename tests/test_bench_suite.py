@@ -0,0 +1,61 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'benchmarks')))
+import rpmfile  # noqa: E402
+from binaryaudit import abicheck  # noqa: E402
+from binaryaudit import util  # noqa: E402
+import bench_suite  # noqa: E402
+import synth  # noqa: E402
+
+
+class BenchSuiteTestSuite(unittest.TestCase):
+    def setUp(self):
+        util.setup_log()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        # The context points PATH and HOME into the work dir.
+        self.environ = dict(os.environ)
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+        self.tmp_dir.cleanup()
+
+    def test_rpm_set(self):
+        rpm_dir = os.path.join(self.tmp_dir.name, "rpms")
+        changes = synth.rpm_set(rpm_dir, 4, 1024, "1.1", changed=1)
+        assert ["pkg0-1.1-1.x86_64.rpm"] == changes
+        with rpmfile.open(os.path.join(rpm_dir, "pkg0-debuginfo-1.1-1.x86_64.rpm")) as rpm:
+            assert b"pkg0-debuginfo" == rpm.headers.get("name")
+            assert b"pkg0-1.1-1.src.rpm" == rpm.headers.get("sourcerpm")
+            assert ["./usr/lib/debug/usr/lib64/libpkg0.so.1.debug"] == [m.name for m in rpm.getmembers()]
+        json_fn = os.path.join(self.tmp_dir.name, "new.json")
+        # The -doc- packages and the one without a DSO are dropped.
+        assert 12 == abicheck.generate_package_json(rpm_dir, json_fn)
+
+    def test_tool_calls(self):
+        ctx = bench_suite.context(self.tmp_dir.name, 0.05, 0, 1)
+        try:
+            res = bench_suite.run_stage(ctx, "serialize", 1)
+            assert 10 == res["items"]
+            assert {"abidw": 10} == res["calls"]
+            # Only the DSOs of the changed recipes are compared.
+            res = bench_suite.run_stage(ctx, "poky", 1)
+            assert {"abidiff": 4} == res["calls"]
+            assert os.listdir(os.path.join(self.tmp_dir.name, "poky-out"))
+        finally:
+            ctx.close()
+
+    def test_compare(self):
+        base = {"serialize": {"msec": 100, "calls": {"abidw": 10}}}
+        res = {"serialize": {"msec": 110, "calls": {"abidw": 10}}}
+        assert [] == bench_suite.compare(res, base, 0.25)
+        res = {"serialize": {"msec": 130, "calls": {"abidw": 30}}}
+        assert 2 == len(bench_suite.compare(res, base, 0.25))
+
+
+if __name__ == '__main__':
+    unittest.main()
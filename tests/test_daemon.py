@@ -0,0 +1,92 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from binaryaudit import daemon  # noqa: E402
+from binaryaudit import util  # noqa: E402
+
+
+class DaemonTestSuite(unittest.TestCase):
+    def setUp(self):
+        util.setup_log()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "binaryaudit.sock")
+        self.executor = ThreadPoolExecutor(max_workers=2)
+        self.server = daemon.server(self.path, daemon._state(self.executor, []))
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+        self.executor.shutdown()
+        self.tmp_dir.cleanup()
+
+    def test_classify(self):
+        fn = os.path.join(self.tmp_dir.name, "text")
+        with open(fn, "w") as f:
+            f.write("text")
+        client = daemon.connect(self.path)
+        # Several requests over one connection.
+        for i in range(2):
+            events = list(client.request("classify", paths=[fn]))
+            assert [{"event": "result", "path": fn, "type": "not-elf"}, {"event": "done", "count": 1}] == events
+        client.close()
+
+    def test_errors(self):
+        client = daemon.connect(self.path)
+        with self.assertRaisesRegex(daemon.daemon_error, "Bad request"):
+            list(client.request("unknown"))
+        with self.assertRaisesRegex(daemon.daemon_error, "absolute path"):
+            list(client.request("rpm-index", source_dir="rpms", out_filename="out.json"))
+        # The connection is still usable.
+        assert "done" == list(client.request("classify", paths=[]))[-1]["event"]
+        client.close()
+
+    def test_single_instance(self):
+        with self.assertRaisesRegex(daemon.daemon_error, "already listening"):
+            daemon.server(self.path, None)
+        assert daemon.connect(os.path.join(self.tmp_dir.name, "none.sock")) is None
+
+    def test_stale_socket(self):
+        path = os.path.join(self.tmp_dir.name, "stale.sock")
+        srv = daemon.server(path, None)
+        srv.socket.close()
+        # Left behind, nothing listens on it anymore.
+        assert os.path.exists(path)
+        srv = daemon.server(path, None)
+        srv.server_close()
+        assert not os.path.exists(path)
+
+    def test_shutdown(self):
+        client = daemon.connect(self.path)
+        assert [{"event": "done"}] == list(client.request(daemon.OP_SHUTDOWN))
+        client.close()
+        self.thread.join(5)
+        assert not self.thread.is_alive()
+
+    def test_idle_long_request(self):
+        def op_sleep(state, args, emit):
+            time.sleep(args["seconds"])
+            return {}
+        daemon.OPS["sleep"] = op_sleep
+        self.addCleanup(daemon.OPS.pop, "sleep")
+        self.server.watch_idle(0.2)
+        client = daemon.connect(self.path)
+        events = []
+        t = threading.Thread(target=lambda: events.extend(client.request("sleep", seconds=1)))
+        t.start()
+        # Running well past the idle timeout, the daemon waits for it.
+        time.sleep(0.6)
+        assert self.thread.is_alive()
+        t.join()
+        client.close()
+        assert "done" == events[-1]["event"]
+        self.thread.join(5)
+        assert not self.thread.is_alive()
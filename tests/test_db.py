@@ -0,0 +1,115 @@
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+from datetime import datetime
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from binaryaudit import util  # noqa: E402
+from binaryaudit import db  # noqa: E402
+
+data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+DB_CONFIG_KEYS = ["DriverName", "Database", "Server", "User", "Password", "Driver",
+                  "PoolSize", "PoolMaxOverflow", "PoolTimeout", "PoolPrePing", "PoolRecycle"]
+
+
+def create_sqlite_db(tmp_dir):
+    ''' Creates a SQLite database with the binaryaudit schema and a config file pointing to it.
+    '''
+    db_fn = os.path.join(tmp_dir, "binaryaudit.sqlite")
+    with open(os.path.join(data_dir, "db_schema.sql")) as f:
+        schema = f.read()
+    conn = sqlite3.connect(db_fn)
+    conn.executescript(schema)
+    conn.close()
+
+    config_fn = os.path.join(tmp_dir, "db_config")
+    with open(config_fn, "w") as f:
+        f.write("DriverName=sqlite\n")
+        f.write("Database={}\n".format(db_fn))
+    # The env file is read into os.environ, drop what previous tests left.
+    for k in DB_CONFIG_KEYS:
+        os.environ.pop(k, None)
+    return config_fn
+
+
+class DbTestSuite(unittest.TestCase):
+    def setUp(self):
+        util.setup_log()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_conn = db.wrapper(create_sqlite_db(self.tmp_dir.name), util.logger)
+        self.db_conn.initialize_db()
+
+    def tearDown(self):
+        self.db_conn.close()
+        self.tmp_dir.cleanup()
+
+    def test_sessions_released(self):
+        prod_id = self.db_conn.get_product_id("prod", "deriv")
+        self.db_conn.insert_main_transaction("build-1", prod_id)
+        self.db_conn.insert_ba_transaction_details("build-1", prod_id, "libfoo", "1.0", "1.1", 10, "OK", "")
+        self.db_conn.insert_ba_baseline_data("build-1", prod_id, b"data")
+        self.db_conn.update_ba_test_result("build-1", prod_id, db.TRANSACTION_MAIN_RESULT_PASSED)
+
+        st = self.db_conn.get_pool_stats()
+        assert 0 == st["in_use"]
+        assert st["checkouts"] >= 5
+        assert st["checkouts"] == st["checkins"]
+
+    def test_product_id_stable(self):
+        id1 = self.db_conn.get_product_id("prod", "deriv")
+        id2 = self.db_conn.get_product_id("prod", "deriv")
+        id3 = self.db_conn.get_product_id("prod", "other")
+        assert id1 == id2
+        assert id1 != id3
+
+    def test_latest_baseline(self):
+        prod_id = self.db_conn.get_product_id("prod", "deriv")
+        self.db_conn.insert_ba_baseline_data("build-1", prod_id, b"old", datetime(2021, 1, 1))
+        self.db_conn.insert_ba_baseline_data("build-2", prod_id, b"new", datetime(2021, 2, 1))
+        baseline_id, data = self.db_conn.get_ba_latest_baseline(prod_id)
+        assert b"new" == data
+
+    def test_rollback_releases(self):
+        with self.assertRaises(RuntimeError):
+            with self.db_conn._session_scope():
+                raise RuntimeError("boom")
+        assert 0 == self.db_conn.get_pool_stats()["in_use"]
+
+    def test_report_dedup(self):
+        prod_id = self.db_conn.get_product_id("prod", "deriv")
+        report = "Functions changes summary: 1 Removed\n" * 1000
+        for build_id in ["b1", "b2"]:
+            self.db_conn.insert_ba_transaction_details(build_id, prod_id, "libfoo", "1", "2", 10,
+                                                       "INCOMPATIBLE_CHANGE", report)
+        with self.db_conn._session_scope(commit=False) as session:
+            assert 1 == session.query(self.db_conn.binaryaudit_report_tbl).count()
+            stored = session.query(self.db_conn.binaryaudit_report_tbl).one()
+            assert len(stored.Data) < len(report) / 10
+
+        rows = self.db_conn.get_ba_transaction_details("b2", prod_id)
+        assert report == rows[0]["ResultDetails"]
+        rows = self.db_conn.get_ba_transaction_details("b2", prod_id, False)
+        assert db.is_report_ref(rows[0]["ResultDetails"])
+
+    def test_fingerprints(self):
+        prod_id = self.db_conn.get_product_id("prod", "deriv")
+        self.db_conn.apply_ops([("insert_fingerprints", dict(build_id="b1", product_id=prod_id, item_name="libfoo",
+                                                             fingerprints={"libfoo.so.1": "ab" * 32}))])
+        # Recording the same item again replaces the rows.
+        self.db_conn.insert_fingerprints("b1", prod_id, "libfoo", {"libfoo.so.1": "cd" * 32})
+        assert {"libfoo.so.1": "cd" * 32} == self.db_conn.get_fingerprints("b1", prod_id, "libfoo")
+
+    def test_duplicate_chunks(self):
+        self.db_conn.insert_baseline_chunks({"aa": (3, b"abc")})
+        # Another publisher uploads the same chunk along with a new one.
+        self.db_conn.insert_baseline_chunks({"aa": (3, b"abc"), "bb": (3, b"def")})
+        assert [b"abc", b"def"] == list(self.db_conn.iter_baseline_chunks(["aa", "bb"]))
+
+    def test_report_compression(self):
+        for c in [db.REPORT_COMPRESSION_ZLIB, db.REPORT_COMPRESSION_LZMA]:
+            assert "abc" == db.decompress_report(db.compress_report("abc", c), c)
+        with self.assertRaises(ValueError):
+            db.compress_report("abc", "rot13")
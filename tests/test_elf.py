@@ -0,0 +1,58 @@
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from binaryaudit import elf  # noqa: E402
+
+BIN = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "bin", "binaryaudit"))
+
+
+def elf_header(e_type, big_endian=False):
+    ident = elf.ELF_MAGIC + bytes([2, 2 if big_endian else 1, 1]) + b"\0" * 9
+    return ident + e_type.to_bytes(2, "big" if big_endian else "little") + b"\0" * 46
+
+
+class ElfTestSuite(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, name, data):
+        fn = os.path.join(self.tmp_dir.name, name)
+        with open(fn, "wb") as f:
+            f.write(data)
+        return fn
+
+    def test_classify(self):
+        assert "dyn" == elf.classify(self.write("lib.so", elf_header(3)))
+        assert "exec" == elf.classify(self.write("exe", elf_header(2, big_endian=True)))
+        assert "rel" == elf.classify(self.write("obj.o", elf_header(1)))
+        assert "other" == elf.classify(self.write("os", elf_header(0xfe00)))
+        assert elf.NOT_ELF == elf.classify(self.write("text", b"#!/bin/sh\n"))
+        assert elf.UNREADABLE == elf.classify(self.write("short", elf.ELF_MAGIC))
+        assert elf.UNREADABLE == elf.classify(os.path.join(self.tmp_dir.name, "missing"))
+
+    def test_classify_stream(self):
+        lib = self.write("lib.so", elf_header(3))
+        text = self.write("text", b"text")
+        out = io.StringIO()
+        assert 2 == elf.classify_stream(io.StringIO("{}\n\n{}\n".format(lib, text)), out)
+        assert "dyn\t{}\nnot-elf\t{}\n".format(lib, text) == out.getvalue()
+
+    def test_cli_imports(self):
+        # The checks run once per file from the build hooks, keep the heavy modules out.
+        lib = self.write("lib.so", elf_header(3))
+        for args in (["--is-elf", lib], ["elf", lib]):
+            p = subprocess.run([sys.executable, "-X", "importtime", BIN] + args, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE, universal_newlines=True)
+            assert 0 == p.returncode
+            imported = set(ln.split("|")[-1].strip() for ln in p.stderr.splitlines() if ln.startswith("import time:"))
+            for name in ("sqlalchemy", "rpmfile", "binaryaudit.db", "binaryaudit.poky", "binaryaudit.abicheck"):
+                assert name not in imported, name
+        assert "dyn\t{}\n".format(lib) == p.stdout
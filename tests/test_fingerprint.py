@@ -0,0 +1,68 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from binaryaudit import fingerprint  # noqa: E402
+
+CORPUS = """<abi-corpus version="2.1" path="/build/a/liba.so.1" architecture="elf-amd-x86_64" soname="liba.so.1">
+  <elf-function-symbols>
+    <elf-symbol name="f" type="func-type" binding="global-binding"/>
+    <elf-symbol name="g" type="func-type" binding="global-binding"/>
+  </elf-function-symbols>
+  <abi-instr address-size="64" path="a.c" comp-dir-path="/build/a" language="LANG_C99">
+    <type-decl name="int" size-in-bits="32" id="type-id-1"/>
+    <pointer-type-def type-id="type-id-3" size-in-bits="64" id="type-id-2"/>
+    <class-decl name="s" size-in-bits="64" is-struct="yes" filepath="/build/a/a.h" line="3" column="1" id="type-id-3">
+      <data-member access="public" layout-offset-in-bits="0">
+        <var-decl name="next" type-id="type-id-2" filepath="/build/a/a.h" line="4" column="3"/>
+      </data-member>
+    </class-decl>
+    <function-decl name="f" elf-symbol-id="f" filepath="/build/a/a.c" line="1" column="1">
+      <parameter type-id="type-id-2"/>
+      <return type-id="type-id-1"/>
+    </function-decl>
+  </abi-instr>
+</abi-corpus>
+"""
+
+
+class FingerprintTestSuite(unittest.TestCase):
+    def test_renumbered_and_relocated(self):
+        other = CORPUS.replace("type-id-1", "type-id-X").replace("type-id-3", "type-id-1") \
+                      .replace("type-id-X", "type-id-3").replace("/build/a", "/work/b").replace('line="3"', 'line="7"')
+        assert fingerprint.fingerprint(CORPUS) == fingerprint.fingerprint(other)
+
+    def test_reordered_symbols(self):
+        f = '<elf-symbol name="f" type="func-type" binding="global-binding"/>'
+        g = '<elf-symbol name="g" type="func-type" binding="global-binding"/>'
+        other = CORPUS.replace(f, "@@").replace(g, f).replace("@@", g)
+        assert fingerprint.fingerprint(CORPUS) == fingerprint.fingerprint(other.encode("utf-8"))
+
+    def test_abi_change(self):
+        other = CORPUS.replace('name="int" size-in-bits="32"', 'name="long" size-in-bits="64"')
+        assert fingerprint.fingerprint(CORPUS) != fingerprint.fingerprint(other)
+        other = CORPUS.replace('<elf-symbol name="g" type="func-type" binding="global-binding"/>', "")
+        assert fingerprint.fingerprint(CORPUS) != fingerprint.fingerprint(other)
+
+    def test_same_name(self):
+        # Two typedefs named T in different translation units, told apart by what they stand for.
+        corpus = """<abi-corpus soname="libt.so.1">
+  <abi-instr path="a.c">
+    <type-decl name="int" size-in-bits="32" id="type-id-1"/>
+    <typedef-decl name="T" type-id="type-id-1" id="type-id-3"/>
+  </abi-instr>
+  <abi-instr path="b.c">
+    <type-decl name="long" size-in-bits="64" id="type-id-2"/>
+    <typedef-decl name="T" type-id="type-id-2" id="type-id-4"/>
+    <function-decl name="f" elf-symbol-id="f">
+      <parameter type-id="{}"/>
+    </function-decl>
+  </abi-instr>
+</abi-corpus>
+"""
+        assert fingerprint.fingerprint(corpus.format("type-id-3")) != fingerprint.fingerprint(corpus.format("type-id-4"))
+
+    def test_same_abi(self):
+        assert not fingerprint.same_abi(None, None)
+        assert fingerprint.same_abi("ab", "ab")
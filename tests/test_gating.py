@@ -0,0 +1,94 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'benchmarks')))
+from binaryaudit import util  # noqa: E402
+from binaryaudit import db  # noqa: E402
+from binaryaudit import gating  # noqa: E402
+from binaryaudit import scheduler  # noqa: E402
+from tests.test_db import create_sqlite_db  # noqa: E402
+import synth  # noqa: E402
+
+bin_fn = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'bin', 'binaryaudit'))
+
+# Reports the changes as incompatible, and hangs on the packages without
+# one until the fail fast stop terminates it.
+HANGING_ABIPKGDIFF = '''#!/bin/sh
+"{}" "$@" || exit 12
+exec sleep 30
+'''
+
+
+class GatingTestSuite(unittest.TestCase):
+    def test_risk_order(self):
+        hist = scheduler.history()
+        hist.record_failure("flaky")
+        jobs = [scheduler.job(n, ()) for n in ["same", "changed", "flaky", "changed_short"]]
+        for j, e in zip(jobs, [1, 10, 100, 5]):
+            j.estimate = e
+        changed = {"same": False, "changed": True, "flaky": False, "changed_short": True}
+        order = gating.risk_order(hist, changed)
+        assert ["flaky", "changed_short", "changed", "same"] == [j.name for j in order(jobs)]
+
+    def test_dispatch_stops(self):
+        jobs = [scheduler.job(str(i), (i,)) for i in range(10)]
+        report = scheduler.schedule_report(jobs, 1)
+        seen = [r for j, r in scheduler.dispatch(jobs, lambda x: x, 1, report=report,
+                                                 order=lambda js: js, stop=lambda r: gating.is_fatal(r))]
+        assert [0, 1, 2, 3, 4, 5, 6, 7, 8] == seen
+        assert report.aborted
+
+    def test_build_result(self):
+        assert db.TRANSACTION_MAIN_RESULT_ABORTED == gating.get_build_result(True, True)
+        assert db.TRANSACTION_MAIN_RESULT_FAILED == gating.get_build_result(True, False)
+        assert db.TRANSACTION_MAIN_RESULT_PASSED == gating.get_build_result(False, False)
+
+    def test_resume_aborted(self):
+        util.setup_log()
+        with tempfile.TemporaryDirectory() as d:
+            db_conn = db.wrapper(create_sqlite_db(d), util.logger)
+            db_conn.initialize_db()
+            prod_id = db_conn.get_product_id("prod", "deriv")
+
+            assert {} == gating.begin_run(db_conn, "b1", prod_id)
+            db_conn.insert_ba_transaction_details("b1", prod_id, "libfoo", "1", "2", 10, "INCOMPATIBLE_CHANGE", "")
+            db_conn.update_ba_test_result("b1", prod_id, db.TRANSACTION_MAIN_RESULT_ABORTED)
+
+            reuse = gating.begin_run(db_conn, "b1", prod_id)
+            assert ["libfoo"] == list(reuse.keys())
+            assert 8 == gating.get_reused_status(reuse["libfoo"])
+            assert db.TRANSACTION_MAIN_RESULT_PENDING == db_conn.get_main_transaction_result("b1", prod_id)
+            assert {"libfoo": 1} == db_conn.get_item_failure_counts(prod_id)
+            db_conn.close()
+
+    def test_fail_fast_interrupted(self):
+        with tempfile.TemporaryDirectory() as d:
+            rpm_dir = os.path.join(d, "rpms")
+            repo_dir = os.path.join(d, "repo")
+            synth.rpm_set(repo_dir, 2, 1024, "1.0", seed=1)
+            changes = synth.rpm_set(rpm_dir, 2, 1024, "1.1", changed=1, seed=2)
+            changes_fn = os.path.join(d, "changes")
+            with open(changes_fn, "w") as f:
+                f.write("".join(fn + "\n" for fn in changes))
+            tools_dir = synth.write_tools(os.path.join(d, "bin"))
+            hang_dir = os.path.join(d, "hang")
+            os.makedirs(hang_dir)
+            with open(os.path.join(hang_dir, "abipkgdiff"), "w") as f:
+                f.write(HANGING_ABIPKGDIFF.format(os.path.join(tools_dir, "abipkgdiff")))
+            os.chmod(os.path.join(hang_dir, "abipkgdiff"), 0o755)
+            repo = synth.http_repo(repo_dir)
+            env = dict(os.environ, HOME=os.path.join(d, "home"), BENCH_ABI_CHANGES=changes_fn,
+                       BENCH_REPO_DIR=repo_dir, BENCH_REPO_URL=repo.url,
+                       PATH=os.pathsep.join([hang_dir, tools_dir, os.environ["PATH"]]))
+            try:
+                subprocess.run([sys.executable, bin_fn, "mariner", "-i", rpm_dir + "/", "-o", "out", "-j", "2",
+                                "--fail-fast"], env=env, cwd=d, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                               timeout=20)
+            finally:
+                repo.close()
+            # The group terminated by the stop has no report, only the one with the change.
+            assert ["pkg0"] == [fn.split("__")[0] for fn in os.listdir(os.path.join(d, "out"))]
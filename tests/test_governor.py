@@ -0,0 +1,92 @@
+import os
+import resource
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from binaryaudit import governor  # noqa: E402
+from binaryaudit import metrics  # noqa: E402
+from binaryaudit import util  # noqa: E402
+
+
+class GovernorTestSuite(unittest.TestCase):
+    def setUp(self):
+        util.setup_log()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_budget(self):
+        b = governor.budget(100)
+        first = b.acquire(60)
+        started = threading.Event()
+
+        def second():
+            b.release(b.acquire(60))
+            started.set()
+        t = threading.Thread(target=second)
+        t.start()
+        assert not started.wait(0.2)
+        b.release(first)
+        t.join()
+        assert started.is_set()
+        # Too big for the budget, it runs alone.
+        assert 100 == b.acquire(1000)
+
+    def test_predict(self):
+        g = governor.governor(governor.budget(1 << 40), {"abidiff:liba.so.xml": 1 << 30})
+        assert 1 << 30 == g.predict("abidiff:liba.so.xml", [])
+        fn = os.path.join(self.tmp_dir.name, "libb.so.xml")
+        with open(fn, "wb") as f:
+            f.write(b"\0" * (1 << 20))
+        assert g.rss_min == g.predict("abidiff:libb.so.xml", [fn])
+        g.rss_per_byte = 1000
+        assert 1000 << 20 == g.predict("abidiff:libb.so.xml", [fn])
+
+    def test_address_space_limit(self):
+        g = governor.governor(governor.budget(1 << 40))
+        # Set once the child is started, give it a moment.
+        cmd = [sys.executable, "-c", "import resource, time; time.sleep(0.2); "
+               "print(resource.getrlimit(resource.RLIMIT_AS)[0])"]
+        # Off by default.
+        ret, out, err = g.run(cmd, "python", "rlimit", [])
+        assert resource.RLIM_INFINITY == int(out)
+        g.as_factor = 4
+        ret, out, err = g.run(cmd, "python", "rlimit", [])
+        assert 0 == ret
+        assert int(g.rss_min * g.as_factor) == int(out)
+        assert "python:rlimit" in g.drain()
+
+    def test_limited_failure_retry(self):
+        g = governor.governor(governor.budget(1 << 40))
+        g.as_factor = 4
+        # Failing with the error bit under the limit, as a tool failing an allocation.
+        cmd = [sys.executable, "-c", "import resource, sys, time; time.sleep(0.2); "
+               "sys.exit(1 if resource.RLIM_INFINITY != resource.getrlimit(resource.RLIMIT_AS)[0] else 0)"]
+        ret, sout, serr = g.run(cmd, "python", "limited", [])
+        # Retried alone without the limit.
+        assert 0 == ret
+
+    def test_oom_retry(self):
+        marker = os.path.join(self.tmp_dir.name, "marker")
+        # Killed like by the OOM killer on the first run only.
+        cmd = ["sh", "-c", "if [ -e {0} ]; then echo done; else echo partial; touch {0}; kill -9 $$; fi".format(marker)]
+        g = governor.governor(governor.budget(1 << 40))
+        retries = metrics.get_registry().get("binaryaudit_tool_oom_retries", tool="sh") or 0
+        with open(os.path.join(self.tmp_dir.name, "out"), "w+") as f:
+            ret, sout, serr = g.run(cmd, "sh", "marker", [], stdout=f, stderr=None)
+            f.seek(0)
+            assert "done\n" == f.read()
+        assert 0 == ret
+        assert retries + 1 == metrics.get_registry().get("binaryaudit_tool_oom_retries", tool="sh")
+
+    def test_crash_not_retried(self):
+        marker = os.path.join(self.tmp_dir.name, "marker")
+        # Aborting far below its address space limit, it didn't run out of memory.
+        cmd = ["sh", "-c", "if [ -e {0} ]; then echo done; else touch {0}; kill -6 $$; fi".format(marker)]
+        g = governor.governor(governor.budget(1 << 40))
+        ret, sout, serr = g.run(cmd, "sh", "abort", [])
+        assert -6 == ret
@@ -0,0 +1,86 @@
+import os
+import re
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from binaryaudit import metrics  # noqa: E402
+
+try:
+    from prometheus_client.parser import text_string_to_metric_families
+except ImportError:
+    text_string_to_metric_families = None
+
+
+def sample_reg():
+    reg = metrics.registry()
+    reg.inc("binaryaudit_packages", kind="recipe")
+    reg.observe("binaryaudit_tool_duration_seconds", 0.2, tool="abidiff")
+    reg.finish_run()
+    return reg
+
+
+class MetricsTestSuite(unittest.TestCase):
+    def test_render(self):
+        reg = metrics.registry()
+        reg.inc("binaryaudit_packages", kind="recipe")
+        reg.inc("binaryaudit_packages", 2, kind="recipe")
+        reg.observe("binaryaudit_tool_duration_seconds", 0.2, tool="abidiff")
+        reg.observe("binaryaudit_tool_duration_seconds", 1000, tool="abidiff")
+        text = reg.render()
+        assert "# TYPE binaryaudit_packages_total counter" in text
+        assert 'binaryaudit_packages_total{kind="recipe"} 3' in text
+        assert 'binaryaudit_tool_duration_seconds_bucket{tool="abidiff",le="0.1"} 0' in text
+        assert 'binaryaudit_tool_duration_seconds_bucket{tool="abidiff",le="0.25"} 1' in text
+        assert 'binaryaudit_tool_duration_seconds_bucket{tool="abidiff",le="+Inf"} 2' in text
+        assert 'binaryaudit_tool_duration_seconds_count{tool="abidiff"} 2' in text
+        # No OpenMetrics terminator, the textfile collector reads the text format 0.0.4.
+        assert "# EOF" not in text
+
+    def test_text_format(self):
+        # Each sample belongs to a declared family as the text format 0.0.4 names them,
+        # the counters are declared with their _total suffix.
+        types = {}
+        for line in sample_reg().render().splitlines():
+            m = re.match(r"^# TYPE (\S+) (\S+)$", line)
+            if m:
+                types[m.group(1)] = m.group(2)
+            if line.startswith("#"):
+                continue
+            name = re.match(r"^[a-zA-Z_:][a-zA-Z0-9_:]*", line).group(0)
+            if name in types:
+                assert "histogram" != types[name]
+            else:
+                family = re.sub(r"_(bucket|count|sum)$", "", name)
+                assert "histogram" == types.get(family)
+        assert "counter" == types["binaryaudit_packages_total"]
+
+    @unittest.skipUnless(text_string_to_metric_families, "prometheus_client isn't installed")
+    def test_prometheus_parser(self):
+        families = dict((f.name, f) for f in text_string_to_metric_families(sample_reg().render()))
+        assert "counter" == families["binaryaudit_packages"].type
+        assert "histogram" == families["binaryaudit_tool_duration_seconds"].type
+        assert "gauge" == families["binaryaudit_run_duration_seconds"].type
+
+    def test_merge_worker(self):
+        worker = metrics.registry(worker=True)
+        worker.inc("binaryaudit_packages", kind="recipe")
+        worker.observe("binaryaudit_tool_duration_seconds", 0.5, tool="abidiff")
+        parent = metrics.registry()
+        parent.inc("binaryaudit_packages", kind="recipe")
+        parent.merge(worker.drain())
+        parent.merge(worker.drain())
+        assert 2 == parent.get("binaryaudit_packages", kind="recipe")
+        assert 1 == parent.get("binaryaudit_tool_duration_seconds", tool="abidiff").count
+
+    def test_write_textfile(self):
+        reg = metrics.registry()
+        reg.finish_run()
+        with tempfile.TemporaryDirectory() as d:
+            fn = os.path.join(d, "textfile", "binaryaudit.prom")
+            reg.write_textfile(fn)
+            assert ["binaryaudit.prom"] == os.listdir(os.path.dirname(fn))
+            with open(fn) as f:
+                text = f.read()
+        assert 'binaryaudit_peak_rss_bytes{scope="self"}' in text
@@ -0,0 +1,33 @@
+import os
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from binaryaudit import abicheck  # noqa: E402
+from binaryaudit import poky  # noqa: E402
+from binaryaudit import util  # noqa: E402
+
+
+class PokyTestSuite(unittest.TestCase):
+    def setUp(self):
+        util.setup_log()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        poky._dso_slots = None
+        self.tmp_dir.cleanup()
+
+    def test_dso_compare_errors(self):
+        # Compared on borrowed slots too, a comparison raising counts as an error of its pair.
+        poky._dso_slots = threading.Semaphore(2)
+        missing = os.path.join(self.tmp_dir.name, "missing.xml")
+        pairs = [(missing, missing, "a", "b")] * 4
+        results = poky._dso_compare(pairs, []).run()
+        assert [abicheck.DIFF_ERROR] * 4 == [ret for ret, out in results]
+        assert 2 == poky._dso_slots._value
+
+
+if __name__ == '__main__':
+    unittest.main()
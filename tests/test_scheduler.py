@@ -0,0 +1,68 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from binaryaudit import scheduler  # noqa: E402
+
+
+class SchedulerTestSuite(unittest.TestCase):
+    def test_estimate_calibrates_unknown(self):
+        hist = scheduler.history()
+        hist.record("big", 1000)
+        jobs = [scheduler.job("big", (), 100), scheduler.job("new", (), 50)]
+        scheduler.estimate(jobs, hist)
+        assert jobs[0].known
+        assert 1000 == jobs[0].estimate
+        assert not jobs[1].known
+        assert 500 == jobs[1].estimate
+
+    def test_group_estimate(self):
+        hist = scheduler.history()
+        hist.record("a", 10)
+        hist.record("b", 20)
+        jobs = scheduler.estimate([scheduler.job("grp", (), 0, ["a", "b"])], hist)
+        assert 30 == jobs[0].estimate
+
+    def test_lpt_order(self):
+        jobs = [scheduler.job(n, ()) for n in ["a", "b", "c"]]
+        for j, e in zip(jobs, [1, 3, 2]):
+            j.estimate = e
+        assert ["b", "c", "a"] == [j.name for j in scheduler.lpt_order(jobs)]
+
+    def test_predict_makespan(self):
+        assert 10 == scheduler.predict_makespan([10, 5, 5], 2)
+        assert 20 == scheduler.predict_makespan([10, 5, 5], 1)
+        assert 0 == scheduler.predict_makespan([], 4)
+
+    def test_dispatch(self):
+        hist = scheduler.history()
+        jobs = [scheduler.job(str(i), (i,)) for i in range(10)]
+        report = scheduler.schedule_report(jobs, 4)
+        res = dict((j.name, r) for j, r in scheduler.dispatch(jobs, lambda x: x * x, 4, hist, report=report))
+        assert 10 == len(res)
+        assert 81 == res["9"]
+        assert hist.get("9") is not None
+        assert report.actual > 0
+
+    def test_dispatch_ordered(self):
+        jobs = [scheduler.job(str(i), (i,)) for i in range(8)]
+        for j in jobs:
+            j.estimate = int(j.name)
+
+        def fn(x):
+            # The longest estimates finish last.
+            time.sleep(0.005 * x)
+            return x
+        res = [r for j, r in scheduler.dispatch(jobs, fn, 4, ordered=True)]
+        assert [7, 6, 5, 4, 3, 2, 1, 0] == res
+
+    def test_history_cache(self):
+        with tempfile.TemporaryDirectory() as d:
+            fn = os.path.join(d, "sub", "history.json")
+            hist = scheduler.history(fn)
+            hist.record("libfoo", 42)
+            hist.save()
+            assert 42 == scheduler.history(fn).get("libfoo")
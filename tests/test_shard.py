@@ -0,0 +1,119 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'benchmarks')))
+from binaryaudit import util  # noqa: E402
+from binaryaudit import db  # noqa: E402
+from binaryaudit import scheduler  # noqa: E402
+from binaryaudit import shard  # noqa: E402
+from tests.test_db import create_sqlite_db  # noqa: E402
+import synth  # noqa: E402
+
+bin_fn = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'bin', 'binaryaudit'))
+
+
+def record_shard(index, count, jobs, fn, failed=()):
+    sp = shard.spec(index, count)
+    rec = shard.wrap(None, sp, fn)
+    for j in sp.select(jobs):
+        res = "INCOMPATIBLE_CHANGE" if j.name in failed else "OK"
+        rec.insert_ba_transaction_details("b1", 1, j.name, "1.0", "1.1", 10, res, "report of " + j.name)
+    result = db.TRANSACTION_MAIN_RESULT_FAILED if set(sp.names) & set(failed) else db.TRANSACTION_MAIN_RESULT_PASSED
+    rec.update_ba_test_result("b1", 1, result)
+    rec.close()
+    return shard.load_results(fn)
+
+
+class ShardTestSuite(unittest.TestCase):
+    def setUp(self):
+        util.setup_log()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.jobs = [scheduler.job("item{}".format(i), None, 100 * (i + 1)) for i in range(10)]
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_partition(self):
+        hist = scheduler.history()
+        assignment = shard.partition(self.jobs, 3, hist)
+        assert assignment == shard.partition(list(self.jobs), 3, scheduler.history())
+        loads = [sum(j.size for j, s in zip(self.jobs, assignment) if s == i) for i in range(3)]
+        assert 5500 == sum(loads)
+        assert max(loads) - min(loads) <= 100
+        # The durations recorded in the DB outweigh the sizes.
+        for j in self.jobs:
+            hist.durations[j.name] = 10
+        hist.durations["item0"] = 1000
+        assignment = shard.partition(self.jobs, 3, hist)
+        assert ["item0"] == [j.name for j, s in zip(self.jobs, assignment) if s == assignment[0]]
+        # Jobs without cost are spread evenly, too.
+        jobs = [scheduler.job("item{}".format(i), None) for i in range(9)]
+        assert [3, 3, 3] == [shard.partition(jobs, 3, scheduler.history()).count(i) for i in range(3)]
+        # The jobs keep their own estimates.
+        self.jobs[0].estimate = 7
+        shard.partition(self.jobs, 3, hist)
+        assert 7 == self.jobs[0].estimate
+
+    def test_merge(self):
+        fns = [os.path.join(self.tmp_dir.name, "s{}.json".format(i)) for i in (1, 2, 3)]
+        results = [record_shard(i, 3, self.jobs, fns[i - 1], failed=["item4"]) for i in (1, 2, 3)]
+        assert sorted(j.name for j in self.jobs) == sorted(n for r in results for n in r["items"])
+        results = shard.check_results(list(reversed(results)))
+        assert [1, 2, 3] == [r["shard"] for r in results]
+        assert db.TRANSACTION_MAIN_RESULT_FAILED == shard.merge_result(results)
+        assert 8 == shard.merge_status(results, db.TRANSACTION_MAIN_RESULT_FAILED)
+
+        out_dir = os.path.join(self.tmp_dir.name, "out")
+        assert 1 == shard.write_reports(results, out_dir)
+        with open(os.path.join(out_dir, "item4__1.0__1.1.abidiff")) as f:
+            assert "report of item4" == f.read()
+
+        self.assertRaises(shard.merge_error, shard.check_results, results[:2])
+        self.assertRaises(shard.merge_error, shard.check_results, results + results[:1])
+        # A shard planned from another job list.
+        other = record_shard(3, 3, self.jobs[1:], fns[2])
+        self.assertRaises(shard.merge_error, shard.check_results, results[:2] + [other])
+
+    def test_upload(self):
+        fns = [os.path.join(self.tmp_dir.name, "s{}.json".format(i)) for i in (1, 2)]
+        results = shard.check_results([record_shard(i, 2, self.jobs, fns[i - 1]) for i in (1, 2)])
+        db_conn = db.wrapper(create_sqlite_db(self.tmp_dir.name), util.logger)
+        db_conn.initialize_db()
+        try:
+            prod_id = db_conn.get_product_id("prod", "deriv")
+            shard.upload(db_conn, results, shard.merge_result(results), "b1", prod_id)
+            assert db.TRANSACTION_MAIN_RESULT_PASSED == db_conn.get_main_transaction_result("b1", prod_id)
+            assert 10 == len(db_conn.get_ba_transaction_details("b1", prod_id))
+        finally:
+            db_conn.close()
+
+    def test_shard_processes(self):
+        d = self.tmp_dir.name
+        synth.buildhistory(os.path.join(d, "base"), 9, 2, 10)
+        synth.buildhistory(os.path.join(d, "cur"), 9, 2, 10, changed=4)
+        env = dict(os.environ, HOME=os.path.join(d, "home"),
+                   PATH=synth.write_tools(os.path.join(d, "bin")) + os.pathsep + os.environ["PATH"])
+
+        def run(*args):
+            return subprocess.run([sys.executable, bin_fn] + list(args), env=env, cwd=d,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode
+
+        poky = ["poky", "--compare-buildhistory", "--buildhistory-baseline", "base", "--buildhistory-current", "cur"]
+        assert 4 == run(*poky, "-o", "full")
+        procs = [subprocess.Popen([sys.executable, bin_fn] + poky + ["-o", "s{}".format(i), "--shard", "{}/3".format(i)],
+                                  env=env, cwd=d, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                 for i in (1, 2, 3)]
+        for p in procs:
+            p.wait()
+        fns = [os.path.join("s{}".format(i), "binaryaudit-shard-{}-of-3.json".format(i)) for i in (1, 2, 3)]
+        assert 1 == run("merge", *fns[:2])
+        assert 4 == run("merge", *fns, "-o", "merged")
+        assert sorted(os.listdir(os.path.join(d, "full"))) == sorted(os.listdir(os.path.join(d, "merged")))
+
+
+if __name__ == '__main__':
+    unittest.main()
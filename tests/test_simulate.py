@@ -0,0 +1,94 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from binaryaudit import cli  # noqa: E402
+from binaryaudit import simulate  # noqa: E402
+from binaryaudit import trace  # noqa: E402
+
+
+def items(*durations):
+    return [simulate.item(chr(ord("a") + i), usec) for i, usec in enumerate(durations)]
+
+
+class SimulateTestSuite(unittest.TestCase):
+    def test_makespan(self):
+        jobs = items(4, 3, 3, 2, 2, 2)
+        res = simulate.simulate(jobs, 2, "lpt")
+        assert 8 == res["makespan"]
+        assert 8 == res["lower_bound"]
+        assert 1.0 == res["utilization"]
+        # Each job starts as the one before it on the worker ends.
+        assert ["a", "d", "f"] == [p["name"] for p in res["critical_path"]]
+        assert [(0, 4), (4, 6), (6, 8)] == [(p["start"], p["end"]) for p in res["critical_path"]]
+
+        res = simulate.simulate(jobs, 2, "spt")
+        assert 9 == res["makespan"]
+        assert 16 / 18 == res["utilization"]
+
+    def test_memory(self):
+        jobs = [simulate.item("x", 5, rss=600), simulate.item("y", 5, rss=600), simulate.item("z", 1, rss=5000)]
+        res = simulate.simulate(jobs, 2, "fifo", memory=1000)
+        # y waits for the memory x holds, the job larger than the budget runs alone.
+        assert 11 == res["makespan"]
+        assert 5 + 5 == res["memory_wait"]
+        path = res["critical_path"]
+        assert ["x", "y", "z"] == [p["name"] for p in path]
+        assert 5 == path[1]["memory_wait"]
+        assert 5 == simulate.simulate(jobs, 3, "fifo")["makespan"]
+
+    def test_fail_fast(self):
+        jobs = items(1, 1, 1, 1)
+        jobs[1].fatal = True
+        res = simulate.simulate(jobs, 1, "fifo", fail_fast=True)
+        assert res["aborted"]
+        assert 2 == res["completed"]
+        assert 2 == res["makespan"]
+
+    def test_cache_hits(self):
+        jobs = items(*([10] * 100))
+        assert 100 == simulate.simulate(jobs, 10, hit_rate=1, hit_usec=1)["busy"]
+        hits = [j.name for j in jobs if simulate.is_cache_hit(j.name, .5)]
+        assert 0 < len(hits) < 100
+        # The hits at a rate are a subset of the ones at a higher rate.
+        assert set(hits) <= set(j.name for j in jobs if simulate.is_cache_hit(j.name, .8))
+
+    def test_load_trace(self):
+        t = trace.tracer()
+        t.add("liba", "job", 100, 50, {})
+        t.add("abidiff", "tool", 110, 10, {"ret": 12})
+        t.add("libb", "job", 150, 30, {})
+        t.add("abidiff", "tool", 160, 10, {"ret": 4})
+        with tempfile.TemporaryDirectory() as d:
+            fn = os.path.join(d, "trace.json")
+            t.write(fn)
+            with open(fn, "r") as f:
+                assert 4 == len([ev for ev in json.load(f)["traceEvents"] if "X" == ev["ph"]])
+            rec = simulate.load_trace(fn)
+        assert [("liba", 50, True), ("libb", 30, False)] == [(j.name, j.estimate, j.fatal) for j in rec.items]
+        assert 1 == rec.workers
+        assert 80 == rec.makespan
+
+    def test_parse_size(self):
+        assert 8 * 1024 ** 3 == simulate.parse_size("8G")
+        assert 1536 == simulate.parse_size("1.5k")
+        assert 100 == simulate.parse_size("100")
+        self.assertRaises(ValueError, simulate.parse_size, "8 GB")
+
+    def test_worker_counts(self):
+        parse = cli.comma_list(cli.count_arg)
+        assert [1, 4] == parse("1,4")
+        self.assertRaises(argparse.ArgumentTypeError, parse, "2,0")
+        self.assertRaises(argparse.ArgumentTypeError, parse, "x")
+        # Called directly, no workers simulate as one.
+        res = simulate.simulate(items(2, 2), 0)
+        assert 4 == res["makespan"]
+        assert 1.0 == res["utilization"]
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,163 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from binaryaudit import util  # noqa: E402
+from binaryaudit import db  # noqa: E402
+from binaryaudit import spool  # noqa: E402
+from tests.test_db import create_sqlite_db  # noqa: E402
+
+
+class failing_conn:
+    def apply_ops(self, ops):
+        raise ConnectionError("DB is down")
+
+
+class rejecting_conn:
+    ''' Rejects the batches with a failed build, as a DB constraint would.
+    '''
+    def __init__(self):
+        self.applied = []
+
+    def apply_ops(self, ops):
+        if any("bad" == kwargs["build_id"] for op, kwargs in ops):
+            raise ValueError("constraint failed")
+        self.applied.extend(kwargs["build_id"] for op, kwargs in ops)
+
+
+class SpoolTestSuite(unittest.TestCase):
+    def setUp(self):
+        util.setup_log()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.spool_fn = os.path.join(self.tmp_dir.name, "spool.sqlite")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_put_peek_ack(self):
+        sp = spool.spool(self.spool_fn)
+        sp.put("update_ba_test_result", build_id="b1", product_id=1, result="PASSED")
+        sp.put("update_ba_test_result", build_id="b2", product_id=1, result="FAILED")
+        rows = sp.peek()
+        assert 2 == len(rows)
+        assert "b1" == rows[0][2]["build_id"]
+        sp.ack([rows[0][0]])
+        assert 1 == sp.count()
+        sp.close()
+
+        # Durable across reopening.
+        sp = spool.spool(self.spool_fn)
+        assert 1 == sp.count()
+        sp.close()
+
+    def test_unknown_op(self):
+        sp = spool.spool(self.spool_fn)
+        with self.assertRaises(ValueError):
+            sp.put("drop_everything")
+        sp.close()
+
+    def test_outage_keeps_rows(self):
+        sp = spool.spool(self.spool_fn, max_attempts=1)
+        sp.put("update_ba_test_result", build_id="b1", product_id=1, result="PASSED")
+        assert 0 == spool.drain(sp, failing_conn(), retries=1)
+        assert 0 == spool.drain(sp, failing_conn(), retries=1)
+        # An unreachable DB doesn't use up the attempts of the rows.
+        assert 1 == sp.count()
+        assert 0 == sp.dead_count()
+        sp.close()
+
+    def test_claim(self):
+        sp1 = spool.spool(self.spool_fn)
+        sp2 = spool.spool(self.spool_fn)
+        sp1.put("update_ba_test_result", build_id="b1", product_id=1, result="PASSED")
+        rows = sp1.claim()
+        assert 1 == len(rows)
+        # Another uploader of the same spool doesn't get the claimed rows.
+        assert [] == sp2.claim()
+        sp2.release([rows[0][0]])
+        assert [] == sp2.claim()
+        sp1.release([rows[0][0]])
+        assert 1 == len(sp2.claim(lease=-1))
+        # The rows of an expired lease are claimable again.
+        assert 1 == len(sp1.claim())
+        assert [] == sp2.claim()
+        sp1.close()
+        sp2.close()
+
+    def test_dead_letter(self):
+        sp = spool.spool(self.spool_fn, max_attempts=2)
+        for build_id in ("b1", "bad", "b2"):
+            sp.put("update_ba_test_result", build_id=build_id, product_id=1, result="PASSED")
+        conn = rejecting_conn()
+        # The rejected row doesn't hold up the ones around it.
+        assert 2 == spool.drain_batch(sp, conn)
+        assert ["b1", "b2"] == conn.applied
+        assert 1 == sp.count()
+        with self.assertRaises(ValueError):
+            spool.drain_batch(sp, conn)
+        assert 0 == sp.count()
+        assert 1 == sp.dead_count()
+        sp.close()
+
+    def test_lowered_max_attempts(self):
+        sp = spool.spool(self.spool_fn, max_attempts=5)
+        for build_id in ("b1", "bad"):
+            sp.put("update_ba_test_result", build_id=build_id, product_id=1, result="PASSED")
+        rows = sp.claim()
+        sp.nack([row_id for row_id, op, kwargs in rows])
+        sp.close()
+        # Out of attempts now, only the row nacked again goes, to dead_ops.
+        sp = spool.spool(self.spool_fn, max_attempts=1)
+        assert 1 == sp.nack([rows[1][0]])
+        assert 1 == sp.count()
+        assert 1 == sp.dead_count()
+        sp.close()
+
+    def test_db_identity(self):
+        sp1 = spool.spool(self.spool_fn, db_id="sqlite:///a.db")
+        sp2 = spool.spool(self.spool_fn, db_id="sqlite:///b.db")
+        sp1.put("update_ba_test_result", build_id="b1", product_id=1, result="PASSED")
+        # The rows of a DB aren't uploaded into another one.
+        assert [] == sp2.claim()
+        assert 0 == sp2.count()
+        assert 1 == len(sp1.claim())
+        sp1.close()
+        sp2.close()
+
+    def test_result_before_main_row(self):
+        db_conn = db.wrapper(create_sqlite_db(self.tmp_dir.name), util.logger)
+        db_conn.initialize_db()
+        prod_id = db_conn.get_product_id("prod", "deriv")
+        assert "sqlite" in db_conn.get_identity()
+        sp = spool.spool(self.spool_fn, max_attempts=1, db_id=db_conn.get_identity())
+        # Spooled by a run whose main row another uploader holds.
+        sp.put("update_ba_test_result", build_id="b1", product_id=prod_id, result=db.TRANSACTION_MAIN_RESULT_PASSED)
+        with self.assertRaises(db.missing_row_error):
+            spool.drain_batch(sp, db_conn)
+        assert 1 == sp.count()
+        assert 0 == sp.dead_count()
+        db_conn.insert_main_transaction("b1", prod_id, "url", "log")
+        assert 1 == spool.drain_batch(sp, db_conn)
+        sp.close()
+        db_conn.close()
+
+    def test_spooled_wrapper_drain(self):
+        db_conn = db.wrapper(create_sqlite_db(self.tmp_dir.name), util.logger)
+        db_conn.initialize_db()
+        prod_id = db_conn.get_product_id("prod", "deriv")
+
+        conn = spool.wrap(db_conn, self.spool_fn)
+        conn.insert_main_transaction("b1", prod_id, "url", "log")
+        conn.insert_ba_transaction_details("b1", prod_id, "libfoo", "1.0", "1.1", 12.5, "OK", "")
+        conn.update_ba_test_result("b1", prod_id, db.TRANSACTION_MAIN_RESULT_PASSED)
+        conn.close()
+
+        assert 0 == spool.spool(self.spool_fn).count()
+        db_conn.initialize_db()
+        with db_conn._session_scope(commit=False) as session:
+            entry = session.get(db_conn.binaryaudit_transaction_main_tbl, ("b1", prod_id))
+            assert db.TRANSACTION_MAIN_RESULT_PASSED == entry.Result
+            assert 1 == session.query(db_conn.binaryaudit_abi_checker_transaction_details_tbl).count()
+        db_conn.close()
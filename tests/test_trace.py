@@ -0,0 +1,57 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from binaryaudit import trace  # noqa: E402
+from binaryaudit import scheduler  # noqa: E402
+
+
+class TraceTestSuite(unittest.TestCase):
+    def tearDown(self):
+        trace.disable()
+
+    def test_disabled(self):
+        assert trace.span("abidiff") is trace.span("abidw")
+        assert 0 == trace.write("/nonexistent/trace.json")
+
+    def test_write(self):
+        trace.enable()
+        with trace.span("outer", "test", item="liba"):
+            with trace.span("inner", "test") as sp:
+                sp.set(ret=4)
+        with tempfile.TemporaryDirectory() as d:
+            fn = os.path.join(d, "trace.json")
+            assert 2 == trace.write(fn)
+            with open(fn) as f:
+                events = json.load(f)["traceEvents"]
+            # Written again, the events aren't shifted twice.
+            assert 2 == trace.write(fn)
+            with open(fn) as f:
+                assert events == json.load(f)["traceEvents"]
+        spans = dict((e["name"], e) for e in events if "X" == e["ph"])
+        assert {"item": "liba"} == spans["outer"]["args"]
+        assert {"ret": 4} == spans["inner"]["args"]
+        assert spans["outer"]["ts"] <= spans["inner"]["ts"]
+        assert spans["inner"]["dur"] <= spans["outer"]["dur"]
+        assert "thread_name" in [e["name"] for e in events if "M" == e["ph"]]
+
+    def test_worker_events(self):
+        # What a pool worker process hands back with its result.
+        trace.enable(worker=True)
+        with trace.span("abidiff"):
+            pass
+        events = trace.drain_worker()
+        assert ([], {}) == trace.drain_worker()
+        t = trace.enable()
+        assert None is trace.drain_worker()
+        trace.merge(events)
+        assert ["abidiff"] == [e["name"] for e in t.drain()[0]]
+
+    def test_dispatch_spans(self):
+        t = trace.enable()
+        jobs = [scheduler.job(str(i), (i,)) for i in range(4)]
+        list(scheduler.dispatch(jobs, lambda x: x, 2))
+        assert ["0", "1", "2", "3"] == sorted(e["name"] for e in t.drain()[0])
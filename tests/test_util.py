@@ -1,4 +1,5 @@
-import unittest
+import logging
+import unittest
 from binaryaudit import util
 
 
@@ -53,3 +54,23 @@ class UtilTestSuite(unittest.TestCase):
         self.assertTrue(util.is_dso_filename(fn1))
         self.assertTrue(util.is_dso_filename(fn2))
         self.assertFalse(util.is_dso_filename(fn3))
+
+    def test_logger_lazy_args(self):
+        class arg:
+            formatted = 0
+
+            def __str__(self):
+                arg.formatted += 1
+                return "arg"
+
+        logger = util.create_logger("binaryaudit.test_util")
+        logger.debug("disabled %s", arg())
+        assert 0 == arg.formatted
+        logger.setLevel(logging.DEBUG)
+        with self.assertLogs("binaryaudit.test_util", logging.DEBUG) as cm:
+            logger.debug("enabled %s", arg())
+            logger.note("100% done")
+        assert 1 == arg.formatted
+        assert cm.output[0].endswith(":test_logger_lazy_args:{}::enabled arg".format(cm.records[0].lineno))
+        assert "test_logger_lazy_args" == cm.records[0].funcName
+        assert cm.output[1].endswith("100% done")
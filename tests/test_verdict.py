@@ -0,0 +1,62 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from binaryaudit import util  # noqa: E402
+from binaryaudit import db  # noqa: E402
+from binaryaudit import abicheck  # noqa: E402
+from binaryaudit import verdict  # noqa: E402
+from tests.test_db import create_sqlite_db  # noqa: E402
+
+data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+
+class VerdictTestSuite(unittest.TestCase):
+    def setUp(self):
+        util.setup_log()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_conn = db.wrapper(create_sqlite_db(self.tmp_dir.name), util.logger)
+        self.db_conn.initialize_db()
+        self.suppr = [os.path.join(self.tmp_dir.name, "suppr.conf")]
+        with open(self.suppr[0], "w") as f:
+            f.write("[suppress_type]\nname = foo\n")
+
+    def tearDown(self):
+        self.db_conn.close()
+        self.tmp_dir.cleanup()
+
+    def test_shared_between_agents(self):
+        agent1 = verdict.verdict_cache(self.db_conn, self.suppr, "abidiff: 2.0")
+        agent1.publish("a" * 64, "b" * 64, abicheck.DIFF_CHANGE, "Functions changes summary: 1 Added\n")
+        # A fresh process starts with an empty LRU.
+        agent2 = verdict.verdict_cache(self.db_conn, self.suppr, "abidiff: 2.0")
+        assert (abicheck.DIFF_CHANGE, "Functions changes summary: 1 Added\n") == agent2.lookup("a" * 64, "b" * 64)
+        assert 1 == agent2.hits
+        # Another tool version or suppression set doesn't match.
+        assert agent2.lookup("b" * 64, "a" * 64) is None
+        assert verdict.verdict_cache(self.db_conn, self.suppr, "abidiff: 2.1").lookup("a" * 64, "b" * 64) is None
+        assert verdict.verdict_cache(self.db_conn, [], "abidiff: 2.0").lookup("a" * 64, "b" * 64) is None
+
+    def test_errors_not_cached(self):
+        cache = verdict.verdict_cache(self.db_conn, self.suppr, "abidiff: 2.0")
+        cache.publish("a" * 64, "b" * 64, abicheck.DIFF_ERROR, "can't read file")
+        assert cache.lookup("a" * 64, "b" * 64) is None
+
+    def test_lru(self):
+        cache = verdict.verdict_cache(None, self.suppr, "abidiff: 2.0", size=2)
+        for h in ["1", "2", "3"]:
+            cache.publish(h, h, abicheck.DIFF_OK, "")
+        assert cache.lookup("1", "1") is None
+        assert (abicheck.DIFF_OK, "") == cache.lookup("3", "3")
+
+    def test_cached_compare(self):
+        ref = os.path.join(data_dir, "libssl.so.xml")
+        cache = verdict.verdict_cache(self.db_conn, self.suppr, "abidiff: 2.0")
+        ref_hash = verdict._hash_file(ref)
+        cache.publish(ref_hash, ref_hash, abicheck.DIFF_OK, "")
+        # Served from the cache, abidiff doesn't run.
+        ret, out, cmd = verdict.cached_compare(cache, ref, ref, self.suppr)
+        assert abicheck.DIFF_OK == ret
+        assert cmd is None
@@ -0,0 +1,121 @@
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'benchmarks')))
+from binaryaudit import util  # noqa: E402
+from binaryaudit import workqueue  # noqa: E402
+import synth  # noqa: E402
+
+bin_fn = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'bin', 'binaryaudit'))
+
+
+class WorkqueueTestSuite(unittest.TestCase):
+    def setUp(self):
+        util.setup_log()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.coord = None
+
+    def tearDown(self):
+        if self.coord is not None:
+            self.coord.close()
+        self.tmp_dir.cleanup()
+
+    def start(self, **kwargs):
+        self.coord = workqueue.coordinator(("127.0.0.1", 0), **kwargs).start()
+        return self.coord
+
+    def lease(self, conn):
+        for i in range(10):
+            ev = conn.call({"op": "lease", "worker": "test"})
+            if workqueue.EVENT_UNIT == ev["event"]:
+                return ev
+        raise AssertionError("No unit leased")
+
+    def test_parse_address(self):
+        assert ("127.0.0.1", 8000) == workqueue.parse_address(":8000")
+        assert ("::1", 8000) == workqueue.parse_address("[::1]:8000")
+        self.assertRaises(ValueError, workqueue.parse_address, "8000")
+
+    def test_requeue_on_disconnect(self):
+        coord = self.start()
+        fut = coord.submit("compare", ref="/a", cur="/b")
+        conn = workqueue.connect(coord.address)
+        ev = self.lease(conn)
+        assert "compare" == ev["kind"]
+        conn.close()
+        # The unit goes to the next worker.
+        conn = workqueue.connect(coord.address)
+        assert ev["id"] == self.lease(conn)["id"]
+        conn.call({"op": "result", "id": ev["id"], "result": {"ret": 0, "out": "", "usec": 1}})
+        assert 0 == fut.result(5)["ret"]
+        assert 1 == coord.requeued
+        conn.close()
+
+    def test_lease_expiry(self):
+        coord = self.start(lease_time=0.2)
+        fut = coord.submit("compare", ref="/a", cur="/b")
+        first = workqueue.connect(coord.address)
+        ev = self.lease(first)
+        time.sleep(0.6)
+        assert [ev["id"]] == first.call({"op": "heartbeat", "units": [ev["id"]]})["lost"]
+        second = workqueue.connect(coord.address)
+        assert ev["id"] == self.lease(second)["id"]
+        # The late result of the first worker is taken, the second one is dropped.
+        first.call({"op": "result", "id": ev["id"], "result": {"ret": 4, "out": "late", "usec": 1}})
+        second.call({"op": "result", "id": ev["id"], "result": {"ret": 0, "out": "", "usec": 1}})
+        assert "late" == fut.result(5)["out"]
+        first.close()
+        second.close()
+
+    def test_max_attempts(self):
+        coord = self.start(max_attempts=2)
+        fut = coord.submit("serialize", file="/none")
+        conn = workqueue.connect(coord.address)
+        for i in range(2):
+            ev = self.lease(conn)
+            conn.call({"op": "fail", "id": ev["id"], "error": "OSError: no abidw"})
+        self.assertRaisesRegex(workqueue.workqueue_error, "failed 2 times", fut.result, 5)
+        self.assertRaises(ValueError, coord.submit, "unknown")
+        conn.close()
+
+    def test_workers(self):
+        d = self.tmp_dir.name
+        pairs = []
+        for i in range(6):
+            fns = []
+            for side in range(2):
+                fn = os.path.join(d, "lib{}.{}.xml".format(i, side))
+                with open(fn, "w") as f:
+                    f.write(synth.abixml("lib{}.so".format(i), 10, changed=side * (i % 2), seed=i))
+                fns.append(fn)
+            pairs.append(fns)
+        env = dict(os.environ, HOME=os.path.join(d, "home"),
+                   PATH=synth.write_tools(os.path.join(d, "bin")) + os.pathsep + os.environ["PATH"])
+        coord = self.start(lease_time=1)
+        futures = [coord.submit("compare", ref=ref, cur=cur) for ref, cur in pairs]
+        address = "{}:{}".format(*coord.address)
+
+        def worker(latency):
+            return subprocess.Popen([sys.executable, bin_fn, "worker", address], env=dict(env, BENCH_TOOL_LATENCY=latency),
+                                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        # A slow worker dies with a unit leased, the unit is run again by the others.
+        slow = worker("30")
+        while not coord._leased:
+            time.sleep(0.05)
+        slow.kill()
+        slow.wait()
+        workers = [worker("0") for i in range(3)]
+        assert [0, 4, 0, 4, 0, 4] == [f.result(30)["ret"] for f in futures]
+        assert coord.requeued >= 1
+        coord.close()
+        self.coord = None
+        assert [0, 0, 0] == [w.wait(10) for w in workers]
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import fcntl
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'benchmarks')))
+from binaryaudit import util  # noqa: E402
+from binaryaudit import workspace  # noqa: E402
+import synth  # noqa: E402
+
+bin_fn = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'bin', 'binaryaudit'))
+
+
+def dead_pid():
+    p = subprocess.Popen(["true"])
+    p.wait()
+    return p.pid
+
+
+class WorkspaceTestSuite(unittest.TestCase):
+    def setUp(self):
+        util.setup_log()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.tmp_dir.name, "root")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_cleanup(self):
+        with self.assertRaises(SystemExit):
+            with workspace.workspace("run", self.root) as ws:
+                with ws.scratch("a/b c") as d1, ws.scratch("a/b c") as d2:
+                    assert d1 != d2
+                    assert os.path.dirname(d1) == ws.path("jobs")
+                assert not os.path.exists(d1)
+                with open(ws.path("list.json"), "w") as f:
+                    f.write("{}")
+                sys.exit(1)
+        assert [] == os.listdir(self.root)
+
+    def test_prune_stale(self):
+        stale = os.path.join(self.root, "{}{}-run-x".format(workspace.PREFIX, dead_pid()))
+        os.makedirs(stale)
+        other = os.path.join(self.root, "unrelated")
+        os.makedirs(other)
+        kept = workspace.workspace("run", self.root, keep=True)
+        kept.close()
+        live = workspace.workspace("run", self.root)
+        # Only the workspace of the dead run goes, the kept one stays around for inspection.
+        assert not os.path.exists(stale)
+        assert os.path.isdir(other)
+        assert os.path.isdir(kept.root)
+        live.close()
+        assert not os.path.exists(live.root)
+
+    def test_prune_shared_root(self):
+        # A live run of another PID namespace or host: its pid is unknown here, it holds its lock.
+        other = os.path.join(self.root, "{}{}-run-x".format(workspace.PREFIX, dead_pid()))
+        os.makedirs(other)
+        held = os.open(os.path.join(other, workspace.LOCK_FN), os.O_RDONLY | os.O_CREAT)
+        fcntl.flock(held, fcntl.LOCK_EX)
+        fd, tmp_fn = workspace.mkstemp("abixml", ".xml", self.root)
+        assert 0 == workspace.prune_stale(self.root)
+        assert os.path.isdir(other)
+        assert os.path.isfile(tmp_fn)
+        # Both gone once their runs are.
+        os.close(held)
+        os.close(fd)
+        assert 2 == workspace.prune_stale(self.root)
+        assert [] == os.listdir(self.root)
+
+    def test_use(self):
+        with workspace.workspace("run", self.root) as ws:
+            with workspace.use(ws, "other") as used:
+                assert ws is used
+        with workspace.use(None, "other") as used:
+            root = used.root
+            assert os.path.isdir(root)
+        assert not os.path.exists(root)
+
+    def test_concurrent_mariner(self):
+        d = self.tmp_dir.name
+        rpm_dir = os.path.join(d, "rpms")
+        repo_dir = os.path.join(d, "repo")
+        synth.rpm_set(repo_dir, 4, 1024, "1.0", seed=1)
+        changes = synth.rpm_set(rpm_dir, 4, 1024, "1.1", changed=2, seed=2)
+        changes_fn = os.path.join(d, "changes")
+        with open(changes_fn, "w") as f:
+            f.write("".join(fn + "\n" for fn in changes))
+        repo = synth.http_repo(repo_dir)
+        env = dict(os.environ, HOME=os.path.join(d, "home"), BENCH_ABI_CHANGES=changes_fn, BENCH_REPO_DIR=repo_dir,
+                   BENCH_REPO_URL=repo.url,
+                   PATH=synth.write_tools(os.path.join(d, "bin")) + os.pathsep + os.environ["PATH"])
+        try:
+            # Two runs of the same source directory from the same directory, with parallel jobs.
+            procs = [subprocess.Popen([sys.executable, bin_fn, "mariner", "-i", rpm_dir + "/", "-o", "out{}".format(i),
+                                       "-j", "2"], env=env, cwd=d, stdout=subprocess.DEVNULL,
+                                      stderr=subprocess.DEVNULL)
+                     for i in (1, 2)]
+            for p in procs:
+                p.wait()
+        finally:
+            repo.close()
+        assert sorted(os.listdir(os.path.join(d, "out1"))) == sorted(os.listdir(os.path.join(d, "out2")))
+        assert 2 == len(os.listdir(os.path.join(d, "out1")))
+        assert not os.path.exists(os.path.join(rpm_dir, "old"))
+        assert not [fn for fn in os.listdir(d) if fn.endswith(".json")]
+
+
+if __name__ == '__main__':
+    unittest.main()